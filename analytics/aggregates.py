@@ -0,0 +1,235 @@
+"""
+Session and Period Aggregates for InnerArchitect.
+
+This module computes the session statistics shown on the analytics
+dashboard (session counts, messages per session, session duration and
+sessions per user) and per-period distinct user counts in the database.
+
+Session statistics are computed from ``AnalyticsSessionRollup``, which
+already holds one row per session, so each statistic is a single aggregate
+over those rows and nothing proportional to the number of sessions is
+loaded into the application. On databases without supported date
+arithmetic, durations are summed while streaming the rows in batches.
+
+Weeks and months are mapped to labels with a ``CASE`` over precomputed
+period boundaries, so the grouping is identical on every database and
+matches the ``strftime`` labels used by the charts.
+"""
+
+import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, case, and_
+
+from models import db, AnalyticsSessionRollup, AnalyticsUserDay
+from logging_config import get_logger
+
+# Get logger
+logger = get_logger('analytics.aggregates')
+
+# Label formats for each chart period
+PERIOD_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%Y-W%W',
+    'month': '%Y-%m'
+}
+
+# Rows fetched per batch when streaming sessions
+SESSION_STREAM_BATCH_SIZE = 1000
+
+
+def period_format(period: str) -> str:
+    """Get the label format for a period ('month' for unknown periods)."""
+    return PERIOD_FORMATS.get(period, PERIOD_FORMATS['month'])
+
+
+def period_buckets(start_day: datetime.date, end_day: datetime.date,
+                   period: str) -> List[Tuple[str, datetime.date, datetime.date]]:
+    """
+    Split a date range into labelled periods.
+
+    Args:
+        start_day: First day of the range
+        end_day: Last day of the range, inclusive
+        period: 'day', 'week', or 'month'
+
+    Returns:
+        List of (label, first day, day after the last day) in order
+    """
+    format_str = period_format(period)
+    buckets = []
+    day = start_day
+    while day <= end_day:
+        period_label = day.strftime(format_str)
+        if buckets and buckets[-1][0] == period_label:
+            buckets[-1] = (period_label, buckets[-1][1], day + datetime.timedelta(days=1))
+        else:
+            buckets.append((period_label, day, day + datetime.timedelta(days=1)))
+        day += datetime.timedelta(days=1)
+    return buckets
+
+
+def period_case(column, buckets: List[Tuple[str, Any, Any]]):
+    """SQL expression mapping a date or datetime column to its period label."""
+    return case(
+        *((and_(column >= start, column < end), period_label) for period_label, start, end in buckets),
+        else_=None
+    )
+
+
+def _as_datetime(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime.combine(day, datetime.time.min)
+
+
+def session_minutes():
+    """SQL expression for session length in minutes, or None if unsupported."""
+    dialect = db.engine.dialect.name
+    started = AnalyticsSessionRollup.started_at
+    last = AnalyticsSessionRollup.last_message_at
+    if dialect == 'postgresql':
+        return func.extract('epoch', last - started) / 60.0
+    if dialect == 'sqlite':
+        return (func.julianday(last) - func.julianday(started)) * 1440.0
+    return None
+
+
+def get_session_summary(start_time: datetime.datetime,
+                        user_id: Optional[str] = None) -> Dict[str, float]:
+    """
+    Get aggregate statistics for sessions active since start_time.
+
+    Args:
+        start_time: Sessions with a message at or after this time are included
+        user_id: Restrict to one user's sessions
+
+    Returns:
+        Dictionary with sessions, users (distinct signed-in users),
+        user_sessions (sessions of signed-in users), avg_messages,
+        avg_duration (minutes) and avg_sessions (per signed-in user)
+    """
+    conditions = [AnalyticsSessionRollup.last_message_at >= start_time]
+    if user_id is not None:
+        conditions.append(AnalyticsSessionRollup.user_id == user_id)
+
+    signed_in = AnalyticsSessionRollup.user_id.isnot(None)
+    minutes = session_minutes()
+    columns = [
+        func.count(AnalyticsSessionRollup.session_id),
+        func.count(func.distinct(AnalyticsSessionRollup.user_id)),
+        func.sum(case((signed_in, 1), else_=0)),
+        func.avg(AnalyticsSessionRollup.messages)
+    ]
+    if minutes is not None:
+        columns.append(func.avg(minutes))
+
+    row = db.session.query(*columns).filter(*conditions).one()
+    sessions, users, user_sessions, avg_messages = row[:4]
+
+    if minutes is not None:
+        avg_duration = row[4]
+    else:
+        # Sum durations while streaming, without holding the sessions in memory
+        total_minutes = 0.0
+        for started_at, last_message_at in db.session.query(
+            AnalyticsSessionRollup.started_at,
+            AnalyticsSessionRollup.last_message_at
+        ).filter(*conditions).yield_per(SESSION_STREAM_BATCH_SIZE):
+            total_minutes += (last_message_at - started_at).total_seconds() / 60
+        avg_duration = total_minutes / sessions if sessions else 0
+
+    user_sessions = user_sessions or 0
+    return {
+        'sessions': sessions or 0,
+        'users': users or 0,
+        'user_sessions': user_sessions,
+        'avg_messages': float(avg_messages or 0),
+        'avg_duration': float(avg_duration or 0),
+        'avg_sessions': user_sessions / users if users else 0.0
+    }
+
+
+def get_sessions_by_period(start_time: datetime.datetime, period: str,
+                           end_day: Optional[datetime.date] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Get session statistics grouped by the period each session started in.
+
+    Args:
+        start_time: Datetime representing the start of the analysis period
+        period: 'day', 'week', or 'month' for grouping data
+        end_day: Last day to include (defaults to today)
+
+    Returns:
+        Dictionary of period label -> sessions, avg_messages and avg_duration
+    """
+    end_day = end_day or datetime.datetime.utcnow().date()
+    buckets = [
+        (period_label, _as_datetime(start), _as_datetime(end))
+        for period_label, start, end in period_buckets(start_time.date(), end_day, period)
+    ]
+    if not buckets:
+        return {}
+
+    bucket = period_case(AnalyticsSessionRollup.started_at, buckets).label('period')
+    minutes = session_minutes()
+    in_range = and_(
+        AnalyticsSessionRollup.started_at >= buckets[0][1],
+        AnalyticsSessionRollup.started_at < buckets[-1][2]
+    )
+
+    columns = [bucket, func.count(AnalyticsSessionRollup.session_id), func.avg(AnalyticsSessionRollup.messages)]
+    if minutes is not None:
+        columns.append(func.avg(minutes))
+
+    result = {}
+    for row in db.session.query(*columns).filter(in_range).group_by(bucket):
+        result[row[0]] = {
+            'sessions': row[1],
+            'avg_messages': float(row[2] or 0),
+            'avg_duration': float(row[3] or 0) if minutes is not None else 0.0
+        }
+
+    if minutes is None:
+        # Sum durations per period while streaming
+        totals = {}
+        for period_label, started_at, last_message_at in db.session.query(
+            bucket, AnalyticsSessionRollup.started_at, AnalyticsSessionRollup.last_message_at
+        ).filter(in_range).yield_per(SESSION_STREAM_BATCH_SIZE):
+            totals[period_label] = totals.get(period_label, 0.0) + (last_message_at - started_at).total_seconds() / 60
+        for period_label, total in totals.items():
+            result[period_label]['avg_duration'] = total / result[period_label]['sessions']
+
+    return result
+
+
+def get_active_users_by_period(start_day: datetime.date, period: str,
+                               end_day: Optional[datetime.date] = None) -> Dict[str, int]:
+    """
+    Count distinct active users per period.
+
+    Users active on several days of a week or month are counted once.
+
+    Args:
+        start_day: First day to include
+        period: 'day', 'week', or 'month' for grouping data
+        end_day: Last day to include (defaults to today)
+
+    Returns:
+        Dictionary of period label -> distinct active users
+    """
+    end_day = end_day or datetime.datetime.utcnow().date()
+    buckets = period_buckets(start_day, end_day, period)
+    if not buckets:
+        return {}
+
+    bucket = period_case(AnalyticsUserDay.day, buckets).label('period')
+    rows = db.session.query(
+        bucket,
+        func.count(func.distinct(AnalyticsUserDay.user_id))
+    ).filter(
+        AnalyticsUserDay.day >= buckets[0][1],
+        AnalyticsUserDay.day < buckets[-1][2]
+    ).group_by(
+        bucket
+    ).all()
+
+    return {period_label: count for period_label, count in rows if period_label is not None}
@@ -20,10 +20,19 @@ from sqlalchemy.sql import label
 
 from models import (
     db, User, ChatHistory, ConversationContext, NLPExercise,
-    NLPExerciseProgress, TechniqueEffectiveness, TechniqueUsageStats,
-    UserPreferences, Subscription, UsageQuota
+    NLPExerciseProgress, TechniqueUsageStats,
+    UserPreferences, Subscription, UsageQuota,
+    AnalyticsDailyActivity, AnalyticsUserDay,
+    AnalyticsTechniqueDaily, AnalyticsRatingDaily
 )
 from logging_config import get_logger
+from analytics.aggregates import (
+    period_format, get_session_summary, get_sessions_by_period, get_active_users_by_period
+)
+from analytics.retention import get_retention_cohorts
+
+# Registers the hooks that keep the rollup tables current
+from analytics import rollups  # noqa: F401
 
 # Create analytics blueprint
 analytics = Blueprint('analytics', __name__, url_prefix='/analytics')
@@ -341,6 +350,9 @@ def get_user_engagement_metrics(start_time, period):
     """
     Get user engagement metrics for the dashboard.
 
+    Reads the analytics rollups, so the cost depends on the length of the
+    period rather than on the size of the chat history.
+
     Args:
         start_time: Datetime representing the start of the analysis period
         period: 'day', 'week', or 'month' for grouping data
@@ -351,10 +363,9 @@ def get_user_engagement_metrics(start_time, period):
     try:
         # Get active users
         active_users = db.session.query(
-            func.count(func.distinct(ChatHistory.user_id))
+            func.count(func.distinct(AnalyticsUserDay.user_id))
         ).filter(
-            ChatHistory.created_at >= start_time,
-            ChatHistory.user_id.isnot(None)
+            AnalyticsUserDay.day >= start_time.date()
         ).scalar() or 0
 
         # Get total users
@@ -363,39 +374,12 @@ def get_user_engagement_metrics(start_time, period):
         # Get active rate
         active_rate = (active_users / total_users) * 100 if total_users > 0 else 0
 
-        # Get average sessions per user
-        avg_sessions = db.session.query(
-            func.avg(func.count(func.distinct(ChatHistory.session_id)))
-        ).filter(
-            ChatHistory.created_at >= start_time,
-            ChatHistory.user_id.isnot(None)
-        ).group_by(
-            ChatHistory.user_id
-        ).scalar() or 0
-
-        # Get average messages per session
-        avg_messages = db.session.query(
-            func.avg(func.count(ChatHistory.id))
-        ).filter(
-            ChatHistory.created_at >= start_time
-        ).group_by(
-            ChatHistory.session_id
-        ).scalar() or 0
-
-        # Get average session duration in minutes (estimated based on time between first and last message)
-        session_durations = db.session.query(
-            ChatHistory.session_id,
-            func.min(ChatHistory.created_at).label('session_start'),
-            func.max(ChatHistory.created_at).label('session_end')
-        ).filter(
-            ChatHistory.created_at >= start_time
-        ).group_by(
-            ChatHistory.session_id
-        ).all()
-
-        # Calculate average duration
-        durations = [(end - start).total_seconds() / 60 for _, start, end in session_durations]
-        avg_duration = sum(durations) / len(durations) if durations else 0
+        # Get average sessions per signed-in user, average messages per session and
+        # average session duration in minutes (time between first and last message)
+        sessions = get_session_summary(start_time)
+        avg_sessions = sessions['avg_sessions']
+        avg_messages = sessions['avg_messages']
+        avg_duration = sessions['avg_duration']
 
         # Return metrics
         return {
@@ -417,6 +401,48 @@ def get_user_engagement_metrics(start_time, period):
             'avg_duration': "0.0 min"
         }
 
+def _technique_usage_and_ratings(start_day):
+    """
+    Get technique usage counts and average ratings from the rollups.
+
+    Args:
+        start_day: First day to include
+
+    Returns:
+        Tuple of (usage list ordered by count, rating dict, overall average rating)
+    """
+    technique_usage = db.session.query(
+        AnalyticsTechniqueDaily.technique,
+        func.sum(AnalyticsTechniqueDaily.uses).label('usage_count')
+    ).filter(
+        AnalyticsTechniqueDaily.day >= start_day
+    ).group_by(
+        AnalyticsTechniqueDaily.technique
+    ).order_by(
+        desc('usage_count')
+    ).all()
+
+    rating_sums = db.session.query(
+        AnalyticsRatingDaily.technique,
+        func.sum(AnalyticsRatingDaily.rating * AnalyticsRatingDaily.ratings),
+        func.sum(AnalyticsRatingDaily.ratings)
+    ).filter(
+        AnalyticsRatingDaily.day >= start_day
+    ).group_by(
+        AnalyticsRatingDaily.technique
+    ).all()
+
+    rating_dict = {
+        technique: float(total) / count
+        for technique, total, count in rating_sums if count
+    }
+    rating_total = sum(float(total or 0) for _, total, _ in rating_sums)
+    rating_count = sum(count or 0 for _, _, count in rating_sums)
+    overall_rating = rating_total / rating_count if rating_count else 0
+
+    usage = [(technique, int(count or 0)) for technique, count in technique_usage]
+    return usage, rating_dict, overall_rating
+
 def get_technique_effectiveness_metrics(start_time):
     """
     Get technique effectiveness metrics for the dashboard.
@@ -428,32 +454,11 @@ def get_technique_effectiveness_metrics(start_time):
         Dictionary of technique effectiveness metrics
     """
     try:
-        # Get technique usage counts
-        technique_usage = db.session.query(
-            ChatHistory.nlp_technique,
-            func.count(ChatHistory.id).label('usage_count')
-        ).filter(
-            ChatHistory.created_at >= start_time,
-            ChatHistory.nlp_technique.isnot(None)
-        ).group_by(
-            ChatHistory.nlp_technique
-        ).order_by(
-            desc('usage_count')
-        ).all()
-
-        # Get average ratings for each technique
-        technique_ratings = db.session.query(
-            TechniqueEffectiveness.technique,
-            func.avg(TechniqueEffectiveness.rating).label('avg_rating')
-        ).filter(
-            TechniqueEffectiveness.entry_date >= start_time
-        ).group_by(
-            TechniqueEffectiveness.technique
-        ).all()
+        # Get technique usage counts and average ratings
+        technique_usage, rating_dict, overall_rating = _technique_usage_and_ratings(start_time.date())
 
         # Convert to dictionaries for easier access
         usage_dict = {technique: count for technique, count in technique_usage}
-        rating_dict = {technique: rating for technique, rating in technique_ratings}
 
         # Get most used technique
         most_used = max(usage_dict.items(), key=lambda x: x[1])[0] if usage_dict else None
@@ -461,13 +466,6 @@ def get_technique_effectiveness_metrics(start_time):
         # Get highest rated technique
         highest_rated = max(rating_dict.items(), key=lambda x: x[1])[0] if rating_dict else None
 
-        # Get overall average rating
-        overall_rating = db.session.query(
-            func.avg(TechniqueEffectiveness.rating)
-        ).filter(
-            TechniqueEffectiveness.entry_date >= start_time
-        ).scalar() or 0
-
         # Return metrics
         return {
             'most_used_technique': most_used,
@@ -664,53 +662,37 @@ def get_user_segments():
 
         # Active users (active in last 7 days)
         active_users = db.session.query(
-            func.count(func.distinct(ChatHistory.user_id))
+            func.count(func.distinct(AnalyticsUserDay.user_id))
         ).filter(
-            ChatHistory.created_at >= week_ago,
-            ChatHistory.user_id.isnot(None)
+            AnalyticsUserDay.day >= week_ago.date()
         ).scalar() or 0
 
         # Engaged users (active in last 30 days but not last 7)
         engaged_users = db.session.query(
-            func.count(func.distinct(ChatHistory.user_id))
+            func.count(func.distinct(AnalyticsUserDay.user_id))
         ).filter(
-            ChatHistory.created_at >= month_ago,
-            ChatHistory.created_at < week_ago,
-            ChatHistory.user_id.isnot(None)
+            AnalyticsUserDay.day >= month_ago.date(),
+            AnalyticsUserDay.day < week_ago.date()
         ).scalar() or 0
 
         # Dormant users (not active in last 30 days)
-        active_in_month = db.session.query(
-            func.distinct(ChatHistory.user_id)
-        ).filter(
-            ChatHistory.created_at >= month_ago,
-            ChatHistory.user_id.isnot(None)
-        ).subquery()
-
         total_users = db.session.query(func.count(User.id)).scalar() or 0
         dormant_users = total_users - active_users - engaged_users
 
         # Get user counts by subscription type
-        free_users = db.session.query(
-            func.count(Subscription.id)
-        ).filter(
-            Subscription.plan_name == 'free',
-            Subscription.status == 'active'
-        ).scalar() or 0
-
-        premium_users = db.session.query(
+        plan_counts = dict(db.session.query(
+            Subscription.plan_name,
             func.count(Subscription.id)
         ).filter(
-            Subscription.plan_name == 'premium',
-            Subscription.status == 'active'
-        ).scalar() or 0
+            Subscription.status == 'active',
+            Subscription.plan_name.in_(['free', 'premium', 'professional'])
+        ).group_by(
+            Subscription.plan_name
+        ).all())
 
-        professional_users = db.session.query(
-            func.count(Subscription.id)
-        ).filter(
-            Subscription.plan_name == 'professional',
-            Subscription.status == 'active'
-        ).scalar() or 0
+        free_users = plan_counts.get('free', 0)
+        premium_users = plan_counts.get('premium', 0)
+        professional_users = plan_counts.get('professional', 0)
 
         # Get user counts by onboarding status
         completed_onboarding = db.session.query(
@@ -946,92 +928,61 @@ def get_user_engagement_chart_data(start_time, period):
         Dictionary of data for charts
     """
     try:
-        # Determine the SQL function to extract the period
-        if period == 'day':
-            extract_fn = func.date(ChatHistory.created_at)
-            format_str = '%Y-%m-%d'
-        elif period == 'week':
-            # Extract the week and year
-            extract_fn = func.concat(
-                func.extract('year', ChatHistory.created_at),
-                '-W',
-                func.extract('week', ChatHistory.created_at)
-            )
-            format_str = '%Y-W%W'
-        else:  # month
-            extract_fn = func.concat(
-                func.extract('year', ChatHistory.created_at),
-                '-',
-                func.extract('month', ChatHistory.created_at)
-            )
-            format_str = '%Y-%m'
+        # Determine the period_label format for each period
+        format_str = period_format(period)
 
-        # Get daily active users
-        active_users_by_period = db.session.query(
-            extract_fn.label('period'),
-            func.count(func.distinct(ChatHistory.user_id)).label('active_users')
-        ).filter(
-            ChatHistory.created_at >= start_time,
-            ChatHistory.user_id.isnot(None)
-        ).group_by(
-            'period'
-        ).order_by(
-            'period'
-        ).all()
+        start_day = start_time.date()
 
-        # Get message counts by period
-        messages_by_period = db.session.query(
-            extract_fn.label('period'),
-            func.count(ChatHistory.id).label('message_count')
+        # Get daily totals from the rollup
+        daily_rows = db.session.query(
+            AnalyticsDailyActivity.day,
+            AnalyticsDailyActivity.messages,
+            AnalyticsDailyActivity.active_users,
+            AnalyticsDailyActivity.new_users
         ).filter(
-            ChatHistory.created_at >= start_time
-        ).group_by(
-            'period'
+            AnalyticsDailyActivity.day >= start_day
         ).order_by(
-            'period'
+            AnalyticsDailyActivity.day
         ).all()
 
-        # Get new users by period
-        new_users_by_period = db.session.query(
-            extract_fn.label('period'),
-            func.count(User.id).label('new_users')
-        ).filter(
-            User.created_at >= start_time
-        ).group_by(
-            'period'
-        ).order_by(
-            'period'
-        ).all()
+        messages_map = Counter()
+        new_users_map = Counter()
+        active_users_map = Counter()
+        for day, messages, day_active_users, day_new_users in daily_rows:
+            period_label = day.strftime(format_str)
+            messages_map[period_label] += messages or 0
+            new_users_map[period_label] += day_new_users or 0
+            if period == 'day':
+                active_users_map[period_label] = day_active_users or 0
+
+        # Users active on several days of a week or month are counted once
+        if period != 'day':
+            active_users_map = Counter(get_active_users_by_period(start_day, period))
+
+        # Get sessions started in each period
+        sessions_map = get_sessions_by_period(start_time, period)
+
+        # Collect and sort all periods with activity
+        all_periods = sorted(
+            period_label for period_label in set(messages_map) | set(new_users_map) | set(active_users_map)
+            if messages_map[period_label] or new_users_map[period_label] or active_users_map[period_label]
+        )
 
-        # Convert to chart data format
+        # Fill in the data for each period
         periods = []
         active_users = []
         message_counts = []
         new_users = []
-
-        # First, collect all periods
-        all_periods = set()
-        for period, _ in active_users_by_period:
-            all_periods.add(str(period))
-        for period, _ in messages_by_period:
-            all_periods.add(str(period))
-        for period, _ in new_users_by_period:
-            all_periods.add(str(period))
-
-        # Sort periods
-        all_periods = sorted(list(all_periods))
-
-        # Map data to periods
-        active_users_map = {str(p): c for p, c in active_users_by_period}
-        messages_map = {str(p): c for p, c in messages_by_period}
-        new_users_map = {str(p): c for p, c in new_users_by_period}
-
-        # Fill in the data for each period
+        session_counts = []
+        avg_durations = []
         for p in all_periods:
             periods.append(p)
             active_users.append(active_users_map.get(p, 0))
             message_counts.append(messages_map.get(p, 0))
             new_users.append(new_users_map.get(p, 0))
+            period_sessions = sessions_map.get(p, {})
+            session_counts.append(period_sessions.get('sessions', 0))
+            avg_durations.append(round(period_sessions.get('avg_duration', 0.0), 1))
 
         # Get average messages per user by period
         avg_messages = []
@@ -1045,7 +996,9 @@ def get_user_engagement_chart_data(start_time, period):
             'active_users': active_users,
             'message_counts': message_counts,
             'new_users': new_users,
-            'avg_messages': avg_messages
+            'avg_messages': avg_messages,
+            'sessions': session_counts,
+            'avg_duration': avg_durations
         }
     except Exception as e:
         logger.error(f"Error getting user engagement chart data: {e}")
@@ -1054,7 +1007,9 @@ def get_user_engagement_chart_data(start_time, period):
             'active_users': [],
             'message_counts': [],
             'new_users': [],
-            'avg_messages': []
+            'avg_messages': [],
+            'sessions': [],
+            'avg_duration': []
         }
 
 def get_technique_effectiveness_chart_data(start_time):
@@ -1068,46 +1023,28 @@ def get_technique_effectiveness_chart_data(start_time):
         Dictionary of data for charts
     """
     try:
-        # Get technique usage counts
-        technique_usage = db.session.query(
-            ChatHistory.nlp_technique,
-            func.count(ChatHistory.id).label('usage_count')
-        ).filter(
-            ChatHistory.created_at >= start_time,
-            ChatHistory.nlp_technique.isnot(None)
-        ).group_by(
-            ChatHistory.nlp_technique
-        ).order_by(
-            desc('usage_count')
-        ).all()
+        start_day = start_time.date()
 
-        # Get average ratings for each technique
-        technique_ratings = db.session.query(
-            TechniqueEffectiveness.technique,
-            func.avg(TechniqueEffectiveness.rating).label('avg_rating')
-        ).filter(
-            TechniqueEffectiveness.entry_date >= start_time
-        ).group_by(
-            TechniqueEffectiveness.technique
-        ).all()
+        # Get technique usage counts and average ratings
+        technique_usage, rating_dict, _ = _technique_usage_and_ratings(start_day)
 
         # Get rating distribution for each technique
         rating_distribution = db.session.query(
-            TechniqueEffectiveness.technique,
-            TechniqueEffectiveness.rating,
-            func.count(TechniqueEffectiveness.id).label('count')
+            AnalyticsRatingDaily.technique,
+            AnalyticsRatingDaily.rating,
+            func.sum(AnalyticsRatingDaily.ratings).label('count')
         ).filter(
-            TechniqueEffectiveness.entry_date >= start_time
+            AnalyticsRatingDaily.day >= start_day
         ).group_by(
-            TechniqueEffectiveness.technique,
-            TechniqueEffectiveness.rating
+            AnalyticsRatingDaily.technique,
+            AnalyticsRatingDaily.rating
         ).all()
 
         # Organize rating distribution data
         technique_rating_distribution = defaultdict(lambda: [0, 0, 0, 0, 0])
         for technique, rating, count in rating_distribution:
             if 1 <= rating <= 5:
-                technique_rating_distribution[technique][rating-1] = count
+                technique_rating_distribution[technique][rating-1] = int(count or 0)
 
         # Prepare data for charts
         techniques = []
@@ -1119,12 +1056,10 @@ def get_technique_effectiveness_chart_data(start_time):
         all_techniques = set()
         for technique, _ in technique_usage:
             all_techniques.add(technique)
-        for technique, _ in technique_ratings:
-            all_techniques.add(technique)
+        all_techniques.update(rating_dict)
 
         # Convert to dictionaries for easier access
         usage_dict = {technique: count for technique, count in technique_usage}
-        rating_dict = {technique: rating for technique, rating in technique_ratings}
 
         # Fill in data for all techniques
         for technique in all_techniques:
@@ -1135,16 +1070,15 @@ def get_technique_effectiveness_chart_data(start_time):
 
         # Get usage by mood for each technique
         mood_usage = db.session.query(
-            ChatHistory.nlp_technique,
-            ChatHistory.mood,
-            func.count(ChatHistory.id).label('count')
+            AnalyticsTechniqueDaily.technique,
+            AnalyticsTechniqueDaily.mood,
+            func.sum(AnalyticsTechniqueDaily.uses).label('count')
         ).filter(
-            ChatHistory.created_at >= start_time,
-            ChatHistory.nlp_technique.isnot(None),
-            ChatHistory.mood.isnot(None)
+            AnalyticsTechniqueDaily.day >= start_day,
+            AnalyticsTechniqueDaily.mood != ''
         ).group_by(
-            ChatHistory.nlp_technique,
-            ChatHistory.mood
+            AnalyticsTechniqueDaily.technique,
+            AnalyticsTechniqueDaily.mood
         ).all()
 
         # Organize mood data
@@ -1152,7 +1086,7 @@ def get_technique_effectiveness_chart_data(start_time):
         all_moods = set()
 
         for technique, mood, count in mood_usage:
-            technique_mood_data[technique][mood] = count
+            technique_mood_data[technique][mood] = int(count or 0)
             all_moods.add(mood)
 
         # Prepare mood usage data for chart
@@ -1467,91 +1401,20 @@ def get_retention_cohort_data(start_time, period):
 
     Args:
         start_time: Datetime representing the start of the analysis period
-        period: 'day', 'week', or 'month' for grouping data
+        period: 'day', 'week', or 'month' for grouping data ('day' gives daily
+            cohorts, otherwise weekly cohorts are used)
 
     Returns:
         Dictionary of cohort data
     """
     try:
-        # For simplicity, we'll always use week-based cohorts
-        now = datetime.datetime.now()
-
-        # Get cohorts (weeks)
-        if period == 'week':
-            # Use weeks directly
-            num_cohorts = min(8, (now - start_time).days // 7)
-            cohort_dates = []
-
-            for i in range(num_cohorts):
-                cohort_date = start_time + datetime.timedelta(days=i*7)
-                cohort_dates.append(cohort_date)
-        else:
-            # Just use 8 weeks or available time range
-            num_cohorts = min(8, (now - start_time).days // 7)
-            cohort_dates = []
-
-            for i in range(num_cohorts):
-                cohort_date = start_time + datetime.timedelta(days=i*7)
-                cohort_dates.append(cohort_date)
-
-        # Format cohort dates for display
-        cohort_labels = [d.strftime('%b %d') for d in cohort_dates]
-
-        # Number of weeks to track retention
-        num_weeks = min(8, num_cohorts)
-        week_labels = [f"Week {i+1}" for i in range(num_weeks)]
-
-        # Generate retention data (simulated)
-        retention_data = []
-
-        for _ in range(num_cohorts):
-            cohort_retention = []
-            base = 100  # Start with 100%
-
-            for week in range(num_weeks):
-                if week == 0:
-                    cohort_retention.append(base)
-                else:
-                    # Simulate decay - more aggressive for older cohorts
-                    decay = (week + 1) * (random.randint(5, 15) / 100)
-                    retention = max(0, base * (1 - decay))
-                    cohort_retention.append(round(retention, 1))
-
-            retention_data.append(cohort_retention)
-
-        return {
-            'cohorts': cohort_labels,
-            'weeks': week_labels,
-            'data': retention_data
-        }
+        return get_retention_cohorts(start_time, period)
     except Exception as e:
         logger.error(f"Error getting retention cohort data: {e}")
-        import random
-
-        # Return simulated data as fallback
-        num_cohorts = 8
-        num_weeks = 8
-
-        cohort_labels = [f"Cohort {i+1}" for i in range(num_cohorts)]
-        week_labels = [f"Week {i+1}" for i in range(num_weeks)]
-
-        retention_data = []
-        for _ in range(num_cohorts):
-            cohort_retention = [100]  # Start with 100%
-            current = 100
-
-            for week in range(1, num_weeks):
-                # Simulate decay
-                decay = random.uniform(0.1, 0.2)
-                current = current * (1 - decay)
-                cohort_retention.append(round(current, 1))
-
-            retention_data.append(cohort_retention)
-
         return {
-            'cohorts': cohort_labels,
-            'weeks': week_labels,
-            'data': retention_data
+            'cohorts': [],
+            'weeks': [],
+            'data': []
         }
 
 def get_user_details_data(user):
@@ -0,0 +1,214 @@
+"""
+Retention Cohorts for InnerArchitect.
+
+This module computes cohort retention for the analytics dashboard from the
+``AnalyticsUserActivity`` rollup, which keeps one row per user with the
+signup day and a bitmap of the days after signup on which the user was
+active (bit N set means active N days after signup). The rollup hooks set
+the bits as chat messages are written, so ``ChatHistory`` is never scanned.
+
+Users are grouped into cohorts by signup day or week. Period N of a user is
+day N, or days 7N to 7N + 6, after signup, so activity in a period is a
+single mask test on the bitmap. One grouped query per cohort window counts
+the users of every signup day and, for each period, those whose bitmap
+intersects the period mask.
+
+Results are cached per (start day, period). Cohorts whose tracked periods
+have all ended are final and are reused on refresh; only cohorts that can
+still change are recomputed.
+"""
+
+import time
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, case
+
+from models import db, AnalyticsUserActivity
+from logging_config import get_logger
+
+# Get logger
+logger = get_logger('analytics.retention')
+
+# Maximum number of cohorts and tracked periods shown on the dashboard
+MAX_COHORTS = 8
+MAX_PERIODS = 8
+
+# Minimum seconds between refreshes of a cached cohort table
+RETENTION_REFRESH_SECONDS = 60
+
+# Maximum number of cached cohort tables
+RETENTION_CACHE_MAX_ENTRIES = 32
+
+# Cached cohort tables keyed by (start day, period length in days, number of cohorts)
+_retention_cache = OrderedDict()
+_retention_cache_lock = threading.Lock()
+
+
+class CohortTable:
+    """
+    Retention counts for a fixed set of cohorts.
+
+    Attributes:
+        origin: First day of the first cohort
+        period_days: Length of a cohort and of a tracked period (1 or 7)
+        num_cohorts: Number of cohorts
+        num_periods: Number of tracked periods per cohort
+        sizes: Number of users in each cohort
+        active: active[c][n] is the number of users of cohort c active in period n
+        final_through: Cohorts below this index are final
+    """
+
+    def __init__(self, origin: datetime.date, period_days: int, num_cohorts: int, num_periods: int):
+        self.origin = origin
+        self.period_days = period_days
+        self.num_cohorts = num_cohorts
+        self.num_periods = num_periods
+        self.sizes = [0] * num_cohorts
+        self.active = [[0] * num_periods for _ in range(num_cohorts)]
+        self.final_through = 0
+        self.refreshed_at = 0.0
+
+    def cohort_start(self, cohort: int) -> datetime.date:
+        """First signup day of a cohort."""
+        return self.origin + datetime.timedelta(days=cohort * self.period_days)
+
+    def last_tracked_day(self, cohort: int) -> datetime.date:
+        """Last day on which activity can still change a cohort's counts."""
+        last_signup = self.cohort_start(cohort + 1) - datetime.timedelta(days=1)
+        return last_signup + datetime.timedelta(days=self.num_periods * self.period_days - 1)
+
+    def elapsed_periods(self, cohort: int, today: datetime.date) -> int:
+        """Number of periods that have started for the earliest users of a cohort."""
+        days = (today - self.cohort_start(cohort)).days
+        return max(0, min(self.num_periods, days // self.period_days + 1))
+
+    def refresh(self, today: datetime.date) -> None:
+        """Recompute every cohort that is not final yet."""
+        first = self.final_through
+        if first >= self.num_cohorts:
+            return
+
+        sizes, active = _count_cohorts(self, first)
+        for offset, cohort in enumerate(range(first, self.num_cohorts)):
+            self.sizes[cohort] = sizes[offset]
+            self.active[cohort] = active[offset]
+
+        # Activity is only recorded up to today, so a cohort is final once
+        # its last tracked day is before today
+        while self.final_through < self.num_cohorts and self.last_tracked_day(self.final_through) < today:
+            self.final_through += 1
+
+        self.refreshed_at = time.monotonic()
+
+    def to_dict(self, today: datetime.date) -> Dict[str, List]:
+        """Format the table for the dashboard cohort view."""
+        unit = 'Day' if self.period_days == 1 else 'Week'
+        data = []
+        for cohort in range(self.num_cohorts):
+            size = self.sizes[cohort]
+            elapsed = self.elapsed_periods(cohort, today)
+            data.append([
+                round(self.active[cohort][n] * 100.0 / size, 1) if size and n < elapsed else '-'
+                for n in range(self.num_periods)
+            ])
+
+        return {
+            'cohorts': [self.cohort_start(c).strftime('%b %d') for c in range(self.num_cohorts)],
+            'weeks': [f"{unit} {n + 1}" for n in range(self.num_periods)],
+            'sizes': list(self.sizes),
+            'data': data
+        }
+
+
+def period_mask(period: int, period_days: int) -> int:
+    """Activity bitmap mask of the days after signup that make up a period."""
+    return ((1 << period_days) - 1) << (period * period_days)
+
+
+def _count_cohorts(table: CohortTable, first_cohort: int) -> Tuple[List[int], List[List[int]]]:
+    """
+    Count cohort members and active users per period for cohorts from first_cohort on.
+
+    Returns:
+        Tuple of (cohort sizes, active counts per period), indexed from first_cohort
+    """
+    count = table.num_cohorts - first_cohort
+    sizes = [0] * count
+    active = [[0] * table.num_periods for _ in range(count)]
+
+    bits = AnalyticsUserActivity.activity_bits
+    rows = db.session.execute(
+        select(
+            AnalyticsUserActivity.signup_day,
+            func.count(),
+            *(
+                func.sum(case((bits.op('&')(period_mask(n, table.period_days)) != 0, 1), else_=0))
+                for n in range(table.num_periods)
+            )
+        ).where(
+            AnalyticsUserActivity.signup_day >= table.cohort_start(first_cohort),
+            AnalyticsUserActivity.signup_day < table.cohort_start(table.num_cohorts)
+        ).group_by(
+            AnalyticsUserActivity.signup_day
+        )
+    ).all()
+
+    for signup_day, users, *period_counts in rows:
+        index = (signup_day - table.origin).days // table.period_days - first_cohort
+        sizes[index] += users
+        for n, period_count in enumerate(period_counts):
+            active[index][n] += period_count or 0
+
+    return sizes, active
+
+
+def get_retention_cohorts(start_time: datetime.datetime, period: str,
+                          now: Optional[datetime.datetime] = None) -> Dict[str, List]:
+    """
+    Get retention by signup cohort.
+
+    Args:
+        start_time: Datetime representing the start of the analysis period
+        period: 'day' for daily cohorts and day-N retention, otherwise weekly
+        now: Current time (defaults to utcnow)
+
+    Returns:
+        Dictionary with cohort labels, period labels, cohort sizes and the
+        percentage of each cohort active in each period ('-' for periods that
+        have not started yet)
+    """
+    now = now or datetime.datetime.utcnow()
+    today = now.date()
+    origin = start_time.date()
+    period_days = 1 if period == 'day' else 7
+
+    num_cohorts = max(0, min(MAX_COHORTS, (today - origin).days // period_days))
+    num_periods = min(MAX_PERIODS, num_cohorts)
+    key = (origin, period_days, num_cohorts)
+
+    with _retention_cache_lock:
+        table = _retention_cache.get(key)
+        if table is None:
+            table = CohortTable(origin, period_days, num_cohorts, num_periods)
+            _retention_cache[key] = table
+            while len(_retention_cache) > RETENTION_CACHE_MAX_ENTRIES:
+                _retention_cache.popitem(last=False)
+        else:
+            _retention_cache.move_to_end(key)
+
+        if not table.refreshed_at or time.monotonic() - table.refreshed_at >= RETENTION_REFRESH_SECONDS:
+            started = time.time()
+            table.refresh(today)
+            logger.debug(f"Refreshed retention cohorts for {origin} ({period_days}d) in "
+                         f"{(time.time() - started) * 1000:.1f}ms")
+
+        return table.to_dict(today)
+
+
+def invalidate_retention_cache() -> None:
+    """Drop cached cohort tables, e.g. after activity rollups are rebuilt."""
+    with _retention_cache_lock:
+        _retention_cache.clear()
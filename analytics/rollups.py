@@ -0,0 +1,447 @@
+"""
+Analytics Rollups for InnerArchitect.
+
+This module maintains the daily aggregate tables read by the analytics
+dashboard, so dashboard views read a bounded number of rollup rows instead of
+rescanning ChatHistory, TechniqueEffectiveness and User on every page load.
+
+Rollups are updated incrementally by mapper ``after_insert`` hooks, in the
+same transaction as the row that triggered them, using atomic
+``INSERT ... ON CONFLICT DO UPDATE`` increments. backfill_rollups rebuilds
+them from the source tables for existing history.
+
+Every chat message and new user increments the single
+``AnalyticsDailyActivity`` row of the day, so on PostgreSQL concurrent
+transactions writing chat messages queue on that row lock until the
+earlier one commits. Chat writes commit right after the insert, which keeps
+the wait to one short transaction, but a transaction that inserts chat
+history and stays open (e.g. a bulk import) holds up every chat write until
+it commits, so imports should commit in small batches. If the wait shows up
+in chat latency, the daily row can be split into shards summed on read.
+Because the hooks run in the writer's transaction, an error in them fails
+the chat, rating or user write itself.
+"""
+
+import time
+import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event, func, insert, select, update, delete, and_, or_, case, literal
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import (
+    db, User, ChatHistory, TechniqueEffectiveness,
+    AnalyticsDailyActivity, AnalyticsUserDay, AnalyticsUserActivity, AnalyticsSessionRollup,
+    AnalyticsTechniqueDaily, AnalyticsRatingDaily
+)
+from analytics.retention import invalidate_retention_cache
+from logging_config import get_logger
+
+# Get logger
+logger = get_logger('analytics.rollups')
+
+# Dialects with INSERT ... ON CONFLICT support
+_UPSERT_DIALECTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert
+}
+
+# Rollup tables keyed by day, rebuilt by backfill_rollups
+_DAILY_MODELS = (AnalyticsDailyActivity, AnalyticsUserDay, AnalyticsTechniqueDaily, AnalyticsRatingDaily)
+
+# Days after signup tracked in AnalyticsUserActivity (fits a signed 64-bit integer)
+ACTIVITY_BITMAP_DAYS = 63
+
+# Users per batch when rebuilding activity bitmaps
+ACTIVITY_REBUILD_BATCH_SIZE = 1000
+
+
+def _day(value: Optional[datetime.datetime]) -> datetime.date:
+    """Get the rollup day for a timestamp (defaults to now)."""
+    return (value or datetime.datetime.utcnow()).date()
+
+
+def _increment(connection, model, keys: Dict[str, Any], increments: Dict[str, int]) -> None:
+    """
+    Atomically add to counters of a rollup row, creating it if needed.
+
+    Args:
+        connection: Connection of the current transaction
+        model: Rollup model
+        keys: Primary key values of the row
+        increments: Column -> amount to add
+    """
+    table = model.__table__
+    insert_fn = _UPSERT_DIALECTS.get(connection.dialect.name)
+
+    if insert_fn is not None:
+        stmt = insert_fn(table).values(**keys, **increments)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + stmt.excluded[column] for column in increments}
+        )
+        connection.execute(stmt)
+        return
+
+    # Other databases: update first, insert when the row does not exist yet
+    condition = and_(*(table.c[key] == value for key, value in keys.items()))
+    result = connection.execute(
+        update(table).where(condition).values(
+            {column: table.c[column] + amount for column, amount in increments.items()}
+        )
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(**keys, **increments))
+
+
+def _insert_if_missing(connection, model, values: Dict[str, Any]) -> bool:
+    """
+    Insert a rollup row unless one with the same primary key exists.
+
+    Returns:
+        True if the row was inserted
+    """
+    table = model.__table__
+    insert_fn = _UPSERT_DIALECTS.get(connection.dialect.name)
+
+    if insert_fn is not None:
+        result = connection.execute(insert_fn(table).values(**values).on_conflict_do_nothing())
+        return result.rowcount == 1
+
+    keys = [column.name for column in table.primary_key.columns]
+    condition = and_(*(table.c[key] == values[key] for key in keys))
+    if connection.execute(select(table.c[keys[0]]).where(condition)).first() is not None:
+        return False
+    connection.execute(insert(table).values(**values))
+    return True
+
+
+def record_chat_message(connection, user_id: Optional[str], session_id: str,
+                        created_at: Optional[datetime.datetime],
+                        technique: Optional[str] = None, mood: Optional[str] = None) -> None:
+    """
+    Add a chat message to the rollups.
+
+    Args:
+        connection: Connection of the transaction that wrote the message
+        user_id: The user ID (None for anonymous users)
+        session_id: The chat session ID
+        created_at: When the message was written
+        technique: The NLP technique used, if any
+        mood: The mood given with the message, if any
+    """
+    created_at = created_at or datetime.datetime.utcnow()
+    day = created_at.date()
+    increments = {'messages': 1}
+
+    sessions = AnalyticsSessionRollup.__table__
+    if _insert_if_missing(connection, AnalyticsSessionRollup, {
+        'session_id': session_id,
+        'user_id': user_id,
+        'started_at': created_at,
+        'last_message_at': created_at,
+        'messages': 1
+    }):
+        increments['sessions_started'] = 1
+    else:
+        # Same aggregates as a rebuild: MIN/MAX of timestamps and MAX(user_id)
+        values = {
+            'messages': sessions.c.messages + 1,
+            'started_at': case(
+                (sessions.c.started_at > created_at, created_at),
+                else_=sessions.c.started_at
+            ),
+            'last_message_at': case(
+                (sessions.c.last_message_at < created_at, created_at),
+                else_=sessions.c.last_message_at
+            )
+        }
+        if user_id:
+            values['user_id'] = case(
+                (or_(sessions.c.user_id.is_(None), sessions.c.user_id < user_id), user_id),
+                else_=sessions.c.user_id
+            )
+        connection.execute(
+            update(sessions).where(sessions.c.session_id == session_id).values(values)
+        )
+
+    if user_id and _insert_if_missing(connection, AnalyticsUserDay, {'day': day, 'user_id': user_id}):
+        increments['active_users'] = 1
+        _mark_user_active(connection, user_id, day)
+
+    _increment(connection, AnalyticsDailyActivity, {'day': day}, increments)
+
+    if technique:
+        _increment(connection, AnalyticsTechniqueDaily,
+                   {'day': day, 'technique': technique, 'mood': mood or ''}, {'uses': 1})
+
+
+def _mark_user_active(connection, user_id: str, day: datetime.date) -> None:
+    """Set the bit for day in a user's activity bitmap."""
+    activity = AnalyticsUserActivity.__table__
+    signup_day = connection.execute(
+        select(activity.c.signup_day).where(activity.c.user_id == user_id)
+    ).scalar()
+    if signup_day is None:
+        return
+
+    offset = (day - signup_day).days
+    if 0 <= offset < ACTIVITY_BITMAP_DAYS:
+        connection.execute(
+            update(activity).where(activity.c.user_id == user_id).values(
+                activity_bits=activity.c.activity_bits.op('|')(1 << offset)
+            )
+        )
+
+
+def record_technique_rating(connection, technique: str, rating: int,
+                            entry_date: Optional[datetime.datetime]) -> None:
+    """Add a technique rating to the rollups."""
+    _increment(connection, AnalyticsRatingDaily,
+               {'day': _day(entry_date), 'technique': technique, 'rating': rating}, {'ratings': 1})
+
+
+def record_new_user(connection, user_id: str, created_at: Optional[datetime.datetime]) -> None:
+    """Add a newly registered user to the rollups."""
+    day = _day(created_at)
+    _increment(connection, AnalyticsDailyActivity, {'day': day}, {'new_users': 1})
+    _insert_if_missing(connection, AnalyticsUserActivity, {
+        'user_id': user_id,
+        'signup_day': day,
+        'activity_bits': 0
+    })
+
+
+@event.listens_for(ChatHistory, 'after_insert')
+def _chat_history_inserted(mapper, connection, target):
+    record_chat_message(connection, target.user_id, target.session_id, target.created_at,
+                        target.nlp_technique, target.mood)
+
+
+@event.listens_for(TechniqueEffectiveness, 'after_insert')
+def _technique_rating_inserted(mapper, connection, target):
+    record_technique_rating(connection, target.technique, target.rating, target.entry_date)
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(mapper, connection, target):
+    record_new_user(connection, target.id, target.created_at)
+
+
+def _rebuild_sessions(start: datetime.datetime, end: datetime.datetime) -> int:
+    """
+    Recompute session rollups for sessions with messages in [start, end).
+
+    Returns:
+        Number of sessions rebuilt
+    """
+    touched = select(ChatHistory.session_id).where(
+        ChatHistory.created_at >= start,
+        ChatHistory.created_at < end
+    ).distinct()
+
+    db.session.execute(
+        delete(AnalyticsSessionRollup).where(AnalyticsSessionRollup.session_id.in_(touched))
+    )
+    result = db.session.execute(
+        insert(AnalyticsSessionRollup).from_select(
+            ['session_id', 'user_id', 'started_at', 'last_message_at', 'messages'],
+            select(
+                ChatHistory.session_id,
+                func.max(ChatHistory.user_id),
+                func.min(ChatHistory.created_at),
+                func.max(ChatHistory.created_at),
+                func.count(ChatHistory.id)
+            ).where(
+                ChatHistory.session_id.in_(touched)
+            ).group_by(
+                ChatHistory.session_id
+            )
+        )
+    )
+    return result.rowcount or 0
+
+
+def _rebuild_day(day: datetime.date) -> None:
+    """Recompute every day-keyed rollup for one day from the source tables."""
+    start = datetime.datetime.combine(day, datetime.time.min)
+    end = start + datetime.timedelta(days=1)
+    day_value = literal(day, type_=db.Date)
+    chat_in_day = and_(ChatHistory.created_at >= start, ChatHistory.created_at < end)
+
+    for model in _DAILY_MODELS:
+        db.session.execute(delete(model).where(model.day == day))
+
+    db.session.execute(
+        insert(AnalyticsUserDay).from_select(
+            ['day', 'user_id'],
+            select(day_value, ChatHistory.user_id).where(
+                chat_in_day,
+                ChatHistory.user_id.isnot(None)
+            ).distinct()
+        )
+    )
+
+    mood = func.coalesce(ChatHistory.mood, '')
+    db.session.execute(
+        insert(AnalyticsTechniqueDaily).from_select(
+            ['day', 'technique', 'mood', 'uses'],
+            select(day_value, ChatHistory.nlp_technique, mood, func.count(ChatHistory.id)).where(
+                chat_in_day,
+                ChatHistory.nlp_technique.isnot(None)
+            ).group_by(
+                ChatHistory.nlp_technique, mood
+            )
+        )
+    )
+
+    db.session.execute(
+        insert(AnalyticsRatingDaily).from_select(
+            ['day', 'technique', 'rating', 'ratings'],
+            select(
+                day_value,
+                TechniqueEffectiveness.technique,
+                TechniqueEffectiveness.rating,
+                func.count(TechniqueEffectiveness.id)
+            ).where(
+                TechniqueEffectiveness.entry_date >= start,
+                TechniqueEffectiveness.entry_date < end
+            ).group_by(
+                TechniqueEffectiveness.technique, TechniqueEffectiveness.rating
+            )
+        )
+    )
+
+    messages = db.session.query(func.count(ChatHistory.id)).filter(chat_in_day).scalar() or 0
+    active_users = db.session.query(func.count(AnalyticsUserDay.user_id)).filter(
+        AnalyticsUserDay.day == day
+    ).scalar() or 0
+    sessions_started = db.session.query(func.count(AnalyticsSessionRollup.session_id)).filter(
+        AnalyticsSessionRollup.started_at >= start,
+        AnalyticsSessionRollup.started_at < end
+    ).scalar() or 0
+    new_users = db.session.query(func.count(User.id)).filter(
+        User.created_at >= start,
+        User.created_at < end
+    ).scalar() or 0
+
+    if messages or sessions_started or new_users:
+        db.session.add(AnalyticsDailyActivity(
+            day=day,
+            messages=messages,
+            sessions_started=sessions_started,
+            active_users=active_users,
+            new_users=new_users
+        ))
+
+
+def _rebuild_user_activity() -> int:
+    """
+    Recompute every user's activity bitmap from AnalyticsUserDay.
+
+    Returns:
+        Number of users rebuilt
+    """
+    db.session.execute(delete(AnalyticsUserActivity))
+
+    users = 0
+    last_id = None
+    while True:
+        query = db.session.query(User.id, User.created_at).order_by(User.id)
+        if last_id is not None:
+            query = query.filter(User.id > last_id)
+        batch = query.limit(ACTIVITY_REBUILD_BATCH_SIZE).all()
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+        signups = {user_id: _day(created_at) for user_id, created_at in batch}
+        bits = dict.fromkeys(signups, 0)
+        days = db.session.query(AnalyticsUserDay.user_id, AnalyticsUserDay.day).filter(
+            AnalyticsUserDay.user_id.in_(list(signups))
+        )
+        for user_id, day in days:
+            offset = (day - signups[user_id]).days
+            if 0 <= offset < ACTIVITY_BITMAP_DAYS:
+                bits[user_id] |= 1 << offset
+
+        db.session.execute(insert(AnalyticsUserActivity), [
+            {'user_id': user_id, 'signup_day': signups[user_id], 'activity_bits': bits[user_id]}
+            for user_id in signups
+        ])
+        users += len(batch)
+
+    return users
+
+
+def backfill_rollups(start_day: Optional[datetime.date] = None,
+                     end_day: Optional[datetime.date] = None) -> Dict[str, Any]:
+    """
+    Rebuild the analytics rollups from the source tables.
+
+    Each day is recomputed and committed separately, so the backfill is
+    idempotent and can be re-run for any range. Session rollups are rebuilt
+    for every session with a message in the range, and user activity bitmaps
+    are rebuilt for all users.
+
+    Args:
+        start_day: First day to rebuild (defaults to the earliest recorded activity)
+        end_day: Last day to rebuild, inclusive (defaults to today)
+
+    Returns:
+        Dictionary with the number of days, sessions and users rebuilt and elapsed time
+    """
+    started = time.time()
+
+    if start_day is None:
+        earliest = [
+            db.session.query(func.min(ChatHistory.created_at)).scalar(),
+            db.session.query(func.min(TechniqueEffectiveness.entry_date)).scalar(),
+            db.session.query(func.min(User.created_at)).scalar()
+        ]
+        earliest = [value for value in earliest if value is not None]
+        if not earliest:
+            logger.info("No analytics history to backfill")
+            return {'days': 0, 'sessions': 0, 'users': 0, 'elapsed_seconds': 0.0}
+        start_day = min(earliest).date()
+
+    end_day = end_day or datetime.datetime.utcnow().date()
+
+    range_start = datetime.datetime.combine(start_day, datetime.time.min)
+    range_end = datetime.datetime.combine(end_day, datetime.time.min) + datetime.timedelta(days=1)
+
+    try:
+        sessions = _rebuild_sessions(range_start, range_end)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error rebuilding session rollups: {e}")
+        raise
+
+    days = 0
+    day = start_day
+    while day <= end_day:
+        try:
+            _rebuild_day(day)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error rebuilding analytics rollups for {day}: {e}")
+            raise
+        days += 1
+        day += datetime.timedelta(days=1)
+
+    try:
+        users = _rebuild_user_activity()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error rebuilding user activity bitmaps: {e}")
+        raise
+
+    # Cached retention cohorts were computed from the old rollups
+    invalidate_retention_cache()
+
+    elapsed = time.time() - started
+    logger.info(f"Backfilled analytics rollups for {days} days, {sessions} sessions and {users} users in {elapsed:.1f}s")
+    return {'days': days, 'sessions': sessions, 'users': users, 'elapsed_seconds': elapsed}
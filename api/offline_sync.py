@@ -4,18 +4,73 @@ Offline Sync API for The Inner Architect
 This module provides the API endpoints for synchronizing data between
 online and offline modes, ensuring a seamless user experience regardless
 of connectivity status.
+
+Uploaded actions are applied as one batch: actions are grouped by type and
+applied in client timestamp order inside a single transaction, each in its
+own savepoint so a failing action does not undo the others. Applied actions
+are recorded in ``OfflineSyncAction`` under their client ``id``, so a
+retried upload returns the recorded results instead of applying actions
+twice. An action on a record that already has a newer applied action is
+superseded (last write wins by client timestamp). Lookups and ledger
+writes use a fixed number of bulk statements regardless of batch size.
+
+Offline data is fetched as deltas: each response carries a cursor with the
+content hash of every record the client holds, and the next request with
+that cursor only receives changed records and the IDs of deleted ones.
+Static techniques and exercises are served as a separate content-hashed,
+precompressed bundle with ETag support.
 """
 
 import logging
 import json
+import gzip
+import zlib
+import base64
+import hashlib
+import uuid
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 
-from flask import Blueprint, request, jsonify, g, current_app
+from flask import Blueprint, Response, request, jsonify, g, current_app, session
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models import OfflineSyncAction
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Maximum IDs per IN clause in bulk lookups
+SYNC_LOOKUP_CHUNK_SIZE = 500
+
+# Version of the /data cursor format; older cursors get a full response
+OFFLINE_CURSOR_VERSION = 1
+
+# Hex digits of the per-record content hashes kept in cursors
+RECORD_HASH_LENGTH = 12
+
+# Record fields rebuilt on every call, which are not content changes
+VOLATILE_RECORD_FIELDS = frozenset({'created_at', 'last_session'})
+
+# Cache lifetime in seconds for a specific version of the static bundle
+OFFLINE_BUNDLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Serialized static bundle, built on first use
+_static_bundle = None
+
+# Column lengths of OfflineSyncAction; longer client values are rejected
+MAX_ACTION_ID_LENGTH = 100
+MAX_ACTION_TYPE_LENGTH = 50
+MAX_ENTITY_KEY_LENGTH = 150
+
+# Data field identifying the record an action changes, per action group
+SYNC_ENTITY_FIELDS = {
+    'reminder': 'reminder_id',
+    'exercise': 'exercise_id',
+    'journey': 'journey_id'
+}
+
 # Create blueprint
 offline_api = Blueprint('offline_api', __name__, url_prefix='/api/offline')
 
@@ -46,11 +101,15 @@ def sync_offline_data():
                 "id": "unique-client-id",
                 "success": true,
                 "synced": true,
-                "server_id": "server-generated-id"  // Only for creation actions
+                "server_id": "server-generated-id",  // Only for creation actions
+                "duplicate": true,  // Only for actions applied by an earlier sync
+                "conflict": "superseded"  // Only for actions older than the record's last change
             },
             ...
         ]
     }
+    
+    Results are in the order of the uploaded actions.
     """
     try:
         data = request.json
@@ -58,32 +117,8 @@ def sync_offline_data():
         if not data or not isinstance(data.get('actions'), list):
             return jsonify({"success": False, "error": "Invalid request format"}), 400
         
-        actions = data.get('actions', [])
-        results = []
-        
-        for action in actions:
-            action_id = action.get('id')
-            action_type = action.get('type')
-            action_data = action.get('data', {})
-            
-            # Process different action types
-            if action_type.startswith('reminder/'):
-                result = process_reminder_action(action_type, action_data, action_id)
-            elif action_type.startswith('exercise/'):
-                result = process_exercise_action(action_type, action_data, action_id)
-            elif action_type.startswith('journey/'):
-                result = process_journey_action(action_type, action_data, action_id)
-            elif action_type.startswith('user/'):
-                result = process_user_action(action_type, action_data, action_id)
-            else:
-                result = {
-                    "id": action_id,
-                    "success": False,
-                    "error": "Unknown action type",
-                    "synced": False
-                }
-            
-            results.append(result)
+        user_id = g.user.id if hasattr(g, 'user') and g.user else None
+        results = process_sync_actions(data.get('actions', []), get_sync_owner_key(user_id))
         
         return jsonify({
             "success": True,
@@ -94,6 +129,206 @@ def sync_offline_data():
         logger.error(f"Error in sync_offline_data: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+def get_sync_owner_key(user_id: Optional[str]) -> str:
+    """
+    Get the key that scopes client action IDs to a user or browser session.
+    
+    A client with neither gets a key of its own for this request, so its
+    action IDs are never matched against another client's.
+    
+    Args:
+        user_id: Signed-in user ID, if any
+        
+    Returns:
+        str: 'user:<id>', 'session:<id>' or 'request:<random id>'
+    """
+    if user_id:
+        return f"user:{user_id}"
+    if session.get('session_id'):
+        return f"session:{session['session_id']}"
+    return f"request:{uuid.uuid4().hex}"
+
+def _action_timestamp(action: Dict) -> Optional[datetime]:
+    """Convert a client timestamp in milliseconds to a naive UTC datetime."""
+    try:
+        return datetime.utcfromtimestamp(float(action.get('timestamp')) / 1000)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+def _action_entity_key(action_type: str, data: Dict) -> Optional[str]:
+    """Get the key of the record an action changes, or None for creations."""
+    group, _, verb = action_type.partition('/')
+    if group == 'user':
+        return f"user:{verb}"
+    field = SYNC_ENTITY_FIELDS.get(group)
+    if field and data.get(field) is not None:
+        return f"{group}:{data.get(field)}"
+    return None
+
+def _chunks(values: List, size: int = SYNC_LOOKUP_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def _load_applied_results(owner_key: str, action_ids: List[str]) -> Dict[str, Dict]:
+    """Get the recorded results of actions that were already applied."""
+    applied = {}
+    for chunk in _chunks(action_ids):
+        rows = db.session.query(
+            OfflineSyncAction.action_id,
+            OfflineSyncAction.result
+        ).filter(
+            OfflineSyncAction.owner_key == owner_key,
+            OfflineSyncAction.action_id.in_(chunk)
+        )
+        for action_id, result in rows:
+            applied[action_id] = json.loads(result)
+    return applied
+
+def _load_entity_timestamps(owner_key: str, entity_keys: List[str]) -> Dict[str, datetime]:
+    """Get the client timestamp of the latest applied action per record."""
+    latest = {}
+    for chunk in _chunks(entity_keys):
+        rows = db.session.query(
+            OfflineSyncAction.entity_key,
+            func.max(OfflineSyncAction.client_timestamp)
+        ).filter(
+            OfflineSyncAction.owner_key == owner_key,
+            OfflineSyncAction.entity_key.in_(chunk)
+        ).group_by(
+            OfflineSyncAction.entity_key
+        )
+        for entity_key, timestamp in rows:
+            if timestamp is not None:
+                latest[entity_key] = timestamp
+    return latest
+
+def _apply_action(action_type: str, data: Dict, action_id: str) -> Dict:
+    """Apply one action in a savepoint, rolling it back unless it succeeds."""
+    handler = SYNC_HANDLERS[action_type.partition('/')[0]]
+    savepoint = db.session.begin_nested()
+    try:
+        result = handler(action_type, data, action_id)
+    except Exception as e:
+        savepoint.rollback()
+        logger.error(f"Error applying offline action {action_id}: {e}")
+        return {"id": action_id, "success": False, "error": str(e), "synced": False}
+    
+    if result.get('success'):
+        savepoint.commit()
+    else:
+        savepoint.rollback()
+    return result
+
+def process_sync_actions(actions: List[Any], owner_key: str, _retry: bool = True) -> List[Dict]:
+    """
+    Apply a batch of offline actions in one transaction.
+    
+    Args:
+        actions: Actions as uploaded by the client
+        owner_key: Scope of the client action IDs (see get_sync_owner_key)
+        
+    Returns:
+        List[Dict]: One result per action, in upload order
+    """
+    results: List[Optional[Dict]] = [None] * len(actions)
+    pending: List[Tuple[int, str, str, Dict, Optional[datetime], Optional[str]]] = []
+    
+    for index, action in enumerate(actions):
+        action_id = action.get('id') if isinstance(action, dict) else None
+        action_type = action.get('type') if isinstance(action, dict) else None
+        data = (action.get('data') or {}) if isinstance(action, dict) else {}
+        entity_key = (_action_entity_key(action_type, data)
+                      if isinstance(action_type, str) and isinstance(data, dict) else None)
+        # Values that do not fit the ledger would fail the whole batch at commit
+        if (not action_id or not isinstance(action_type, str) or not isinstance(data, dict)
+                or len(str(action_id)) > MAX_ACTION_ID_LENGTH
+                or len(action_type) > MAX_ACTION_TYPE_LENGTH
+                or len(entity_key or '') > MAX_ENTITY_KEY_LENGTH):
+            results[index] = {
+                "id": action_id,
+                "success": False,
+                "error": "Invalid action",
+                "synced": False
+            }
+        elif action_type.partition('/')[0] not in SYNC_HANDLERS:
+            results[index] = {
+                "id": action_id,
+                "success": False,
+                "error": "Unknown action type",
+                "synced": False
+            }
+        else:
+            action_id = str(action_id)
+            pending.append((index, action_id, action_type, data, _action_timestamp(action), entity_key))
+    
+    # Replay the results of actions applied by an earlier sync
+    applied = _load_applied_results(owner_key, list({item[1] for item in pending}))
+    to_apply = []
+    for item in pending:
+        index, action_id = item[0], item[1]
+        if action_id in applied:
+            results[index] = dict(applied[action_id], duplicate=True)
+        else:
+            to_apply.append(item)
+    
+    latest = _load_entity_timestamps(owner_key, list({item[5] for item in to_apply if item[5]}))
+    
+    # Group by type, then apply in client order; actions without a
+    # timestamp are applied after timestamped ones
+    groups = list(SYNC_HANDLERS)
+    to_apply.sort(key=lambda item: (groups.index(item[2].partition('/')[0]),
+                                    item[4] is None, item[4] or datetime.min, item[0]))
+    
+    ledger = []
+    results_by_action = {}
+    for index, action_id, action_type, data, timestamp, entity_key in to_apply:
+        if action_id in results_by_action:
+            # Same action uploaded twice in this batch
+            results[index] = dict(results_by_action[action_id], duplicate=True)
+            continue
+        
+        if entity_key and timestamp and entity_key in latest and latest[entity_key] > timestamp:
+            result = {
+                "id": action_id,
+                "success": True,
+                "synced": True,
+                "conflict": "superseded"
+            }
+        else:
+            result = _apply_action(action_type, data, action_id)
+            if entity_key and timestamp and result.get('success'):
+                latest[entity_key] = timestamp
+        
+        results[index] = result
+        results_by_action[action_id] = result
+        if result.get('synced'):
+            ledger.append({
+                'owner_key': owner_key,
+                'action_id': action_id,
+                'action_type': action_type,
+                'entity_key': entity_key,
+                'client_timestamp': timestamp,
+                'result': json.dumps(result),
+                'created_at': datetime.utcnow()
+            })
+    
+    try:
+        if ledger:
+            db.session.execute(insert(OfflineSyncAction), ledger)
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent sync recorded some of these actions first; apply
+        # again so they are replayed from the ledger
+        db.session.rollback()
+        if _retry:
+            return process_sync_actions(actions, owner_key, _retry=False)
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    return results
+
 def process_reminder_action(action_type: str, data: Dict, action_id: str) -> Dict:
     """
     Process reminder-related actions.
@@ -368,28 +603,153 @@ def get_offline_data():
     - Exercises
     - User profile
     - Active reminders
+    
+    Query parameters:
+        cursor: Cursor returned by the previous call (optional)
+    
+    Without a valid cursor the full data set is returned ("full": true).
+    With one, "data" only holds reminders and user data that changed since
+    the cursor was issued, "deleted" lists the IDs of removed reminders, and
+    techniques and exercises are left to the bundle endpoint, whose current
+    version is always included.
     """
     try:
         user_id = g.user.id if hasattr(g, 'user') and g.user else None
         
-        # In a real app, this would get data from the database
-        # For now, we'll return some static data
+        records = {
+            "reminders": {r['reminder_id']: r for r in get_reminders_data(user_id)},
+            "user": {"profile": get_user_data(user_id)}
+        }
+        hashes = {
+            collection: {key: _record_hash(record) for key, record in items.items()}
+            for collection, items in records.items()
+        }
+        bundle = get_static_bundle()
         
-        return jsonify({
+        previous = _decode_cursor(request.args.get('cursor'))
+        response = {
             "success": True,
             "timestamp": datetime.now().isoformat(),
-            "data": {
+            "cursor": _encode_cursor(bundle['version'], hashes),
+            "full": previous is None,
+            "bundle": {
+                "version": bundle['version'],
+                "url": f"{offline_api.url_prefix}/bundle?v={bundle['version']}"
+            }
+        }
+        
+        if previous is None:
+            response["data"] = {
                 "techniques": get_techniques_data(),
                 "exercises": get_exercises_data(),
-                "reminders": get_reminders_data(user_id),
-                "user": get_user_data(user_id)
+                "reminders": list(records["reminders"].values()),
+                "user": records["user"]["profile"]
             }
-        })
+            response["deleted"] = {"reminders": []}
+            return jsonify(response)
+        
+        known = previous.get('r', {})
+        changed_reminders = [
+            record for key, record in records["reminders"].items()
+            if known.get(key) != hashes["reminders"][key]
+        ]
+        response["data"] = {"reminders": changed_reminders}
+        if previous.get('u', {}).get('profile') != hashes["user"]["profile"]:
+            response["data"]["user"] = records["user"]["profile"]
+        response["deleted"] = {
+            "reminders": [key for key in known if key not in records["reminders"]]
+        }
+        return jsonify(response)
         
     except Exception as e:
         logger.error(f"Error in get_offline_data: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@offline_api.route('/bundle', methods=['GET'])
+def get_offline_bundle():
+    """
+    Get the static techniques and exercises bundle for offline use.
+    
+    The bundle is versioned by its content hash, which is also its ETag.
+    Requests with a matching If-None-Match get 304 Not Modified, and
+    clients accepting gzip get the precompressed body. Requests for a
+    specific version (?v=<version>) may be cached indefinitely.
+    """
+    bundle = get_static_bundle()
+    etag = bundle['version']
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = Response(bundle['gzip'], mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(bundle['json'], mimetype='application/json')
+    
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    if request.args.get('v') == etag:
+        response.cache_control.public = True
+        response.cache_control.max_age = OFFLINE_BUNDLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def get_static_bundle() -> Dict[str, Any]:
+    """
+    Get the serialized techniques and exercises bundle.
+    
+    Built once per process, since the content is static.
+    
+    Returns:
+        Dict: version (content hash), json (bytes) and gzip (bytes)
+    """
+    global _static_bundle
+    if _static_bundle is None:
+        body = json.dumps(
+            {"techniques": get_techniques_data(), "exercises": get_exercises_data()},
+            sort_keys=True,
+            separators=(',', ':')
+        ).encode('utf-8')
+        _static_bundle = {
+            "version": hashlib.sha256(body).hexdigest()[:32],
+            "json": body,
+            "gzip": gzip.compress(body, compresslevel=9, mtime=0)
+        }
+    return _static_bundle
+
+def _record_hash(record: Dict) -> str:
+    """Short content hash of a record, used to detect changes between syncs."""
+    content = {key: value for key, value in record.items() if key not in VOLATILE_RECORD_FIELDS}
+    body = json.dumps(content, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()[:RECORD_HASH_LENGTH]
+
+def _encode_cursor(bundle_version: str, hashes: Dict[str, Dict[str, str]]) -> str:
+    """
+    Encode a sync cursor.
+    
+    The cursor holds the hash of every record the client now has, so the
+    next call can be answered by any server process without stored state.
+    """
+    cursor = {"v": OFFLINE_CURSOR_VERSION, "b": bundle_version, "r": hashes["reminders"], "u": hashes["user"]}
+    body = json.dumps(cursor, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(zlib.compress(body)).decode('ascii')
+
+def _decode_cursor(cursor: Optional[str]) -> Optional[Dict]:
+    """Decode a sync cursor, or return None if it is missing, invalid or outdated."""
+    if not cursor:
+        return None
+    try:
+        decoded = json.loads(zlib.decompress(base64.urlsafe_b64decode(cursor.encode('ascii'))))
+    except (ValueError, zlib.error, UnicodeEncodeError):
+        return None
+    if not isinstance(decoded, dict) or decoded.get('v') != OFFLINE_CURSOR_VERSION:
+        return None
+    if not isinstance(decoded.get('r'), dict) or not isinstance(decoded.get('u'), dict):
+        return None
+    return decoded
+
 def get_techniques_data() -> List[Dict]:
     """Get techniques data for offline use."""
     return [
@@ -498,4 +858,12 @@ def get_user_data(user_id: Optional[str]) -> Dict:
             "notifications": True,
             "haptic_feedback": True
         }
-    }
\ No newline at end of file
+    }
+
+# Action processors by action type prefix, in the order groups are applied
+SYNC_HANDLERS = {
+    'reminder': process_reminder_action,
+    'exercise': process_exercise_action,
+    'journey': process_journey_action,
+    'user': process_user_action
+}
@@ -3,11 +3,14 @@ Module for handling API timeouts and failures with graceful fallback responses.
 """
 import time
 import json
+import random
 import functools
 import logging
 from typing import Any, Dict, Optional, Union, Callable
 from flask import flash, g, current_app
 
+from provider_guard import provider_guard, REJECTED_CIRCUIT_OPEN
+
 # Create logger for this module
 logger = logging.getLogger('inner_architect.api_fallback')
 
@@ -20,6 +23,9 @@ DEFAULT_RETRIES = 2
 # Default backoff factor (seconds)
 DEFAULT_BACKOFF = 1.5
 
+# Longest wait between retries (seconds)
+MAX_BACKOFF = 8.0
+
 class APIError(Exception):
     """Base exception for API errors."""
     pass
@@ -36,18 +42,46 @@ class APIResponseError(APIError):
     """Exception raised when the API returns an error response."""
     pass
 
+class APIOverloadedError(APIError):
+    """Exception raised when a call is shed because the provider is at capacity."""
+    pass
+
+class APICircuitOpenError(APIOverloadedError):
+    """Exception raised when a call is shed because the provider is failing."""
+    pass
+
+def is_provider_failure(error: Exception) -> bool:
+    """
+    Whether an error counts against the provider's health.
+
+    Client errors (4xx other than timeouts and rate limits) mean the request
+    was wrong, not that the provider is unhealthy.
+    """
+    status_code = getattr(error, 'status_code', None)
+    if isinstance(status_code, int) and 400 <= status_code < 500:
+        return status_code in (408, 429)
+    return True
+
 def with_retry_and_timeout(
     timeout: int = DEFAULT_TIMEOUT,
     retries: int = DEFAULT_RETRIES,
-    backoff_factor: float = DEFAULT_BACKOFF
+    backoff_factor: float = DEFAULT_BACKOFF,
+    provider: Optional[str] = None
 ) -> Callable:
     """
     Decorator to add timeout, retry logic, and error handling to API functions.
     
+    Each attempt needs a permit from the provider guard shared by all worker
+    processes. Calls are shed with APIOverloadedError when the provider is at
+    capacity, or APICircuitOpenError when its circuit is open, instead of
+    waiting; retries stop as soon as the circuit opens. Waits between
+    retries are jittered so that workers do not retry in lockstep.
+    
     Args:
         timeout: Maximum time to wait for API response in seconds
         retries: Number of retry attempts
         backoff_factor: Multiplier for exponential backoff between retries
+        provider: Provider name, unless passed to the function as a keyword
         
     Returns:
         Decorated function
@@ -57,7 +91,8 @@ def with_retry_and_timeout(
         def wrapper(*args, **kwargs):
             retry_count = 0
             last_error = None
-            provider = kwargs.get('provider', 'unknown')
+            provider_name = kwargs.get('provider') or provider or 'unknown'
+            guarded = provider_name != 'unknown'
             
             # Extract provider and endpoint for logging
             module_name = func.__module__.split('.')[-1] if func.__module__ else 'unknown'
@@ -66,18 +101,31 @@ def with_retry_and_timeout(
             while retry_count <= retries:
                 # Set timeout for this API call
                 kwargs['timeout'] = timeout
+
+                # Shed the call if the provider is failing or at capacity
+                lease_id = None
+                if guarded:
+                    lease_id, rejected = provider_guard.acquire(provider_name)
+                    if rejected == REJECTED_CIRCUIT_OPEN:
+                        logger.warning(f"Shedding {provider_name}/{endpoint}: circuit open")
+                        raise APICircuitOpenError(f"API provider {provider_name} is unavailable (circuit open)")
+                    if rejected:
+                        logger.warning(f"Shedding {provider_name}/{endpoint}: provider at capacity")
+                        raise APIOverloadedError(f"API provider {provider_name} is at capacity")
                 
                 # Attempt the API call
                 start_time = time.time()
                 try:
                     result = func(*args, **kwargs)
                     elapsed_time = time.time() - start_time
+                    if guarded:
+                        provider_guard.release(provider_name, lease_id, success=True)
                     
                     # Log successful call with timing using the specialized API logger
                     try:
                         from inner_architect.app.utils.logging_setup import log_api_call
                         log_api_call(
-                            provider=provider,
+                            provider=provider_name,
                             endpoint=endpoint,
                             duration=elapsed_time,
                             success=True,
@@ -86,7 +134,7 @@ def with_retry_and_timeout(
                         )
                     except ImportError:
                         # Fall back to standard logging if specialized logger not available
-                        logger.info(f"API call to {provider}/{endpoint} succeeded in {elapsed_time:.2f}s (retries: {retry_count})")
+                        logger.info(f"API call to {provider_name}/{endpoint} succeeded in {elapsed_time:.2f}s (retries: {retry_count})")
                     
                     return result
                     
@@ -94,32 +142,39 @@ def with_retry_and_timeout(
                     elapsed_time = time.time() - start_time
                     retry_count += 1
                     last_error = e
+                    if guarded:
+                        provider_guard.release(provider_name, lease_id, success=not is_provider_failure(e))
                     
                     # Categorize error
                     if "timeout" in str(e).lower() or elapsed_time >= timeout:
                         error_type = "timeout"
-                        error_message = f"API timeout in {provider}/{endpoint}: {elapsed_time:.2f}s > {timeout}s"
+                        error_message = f"API timeout in {provider_name}/{endpoint}: {elapsed_time:.2f}s > {timeout}s"
                     elif "connection" in str(e).lower():
                         error_type = "connection"
-                        error_message = f"API connection error in {provider}/{endpoint}: {str(e)}"
+                        error_message = f"API connection error in {provider_name}/{endpoint}: {str(e)}"
                     else:
                         error_type = "response"
-                        error_message = f"API response error in {provider}/{endpoint}: {str(e)}"
+                        error_message = f"API response error in {provider_name}/{endpoint}: {str(e)}"
                     
                     # Log error
                     logger.warning(error_message)
+
+                    # Do not wait for a retry that the open circuit would reject
+                    if retry_count <= retries and guarded and not provider_guard.allows(provider_name):
+                        logger.info(f"Not retrying {provider_name}/{endpoint}: circuit open")
+                        retry_count = retries + 1
                     
                     # Log retry attempt
                     if retry_count <= retries:
-                        wait_time = backoff_factor * (2 ** (retry_count - 1))
-                        logger.info(f"Retrying {provider}/{endpoint} after {wait_time:.2f}s (attempt {retry_count}/{retries})")
+                        wait_time = random.uniform(0, min(MAX_BACKOFF, backoff_factor * (2 ** (retry_count - 1))))
+                        logger.info(f"Retrying {provider_name}/{endpoint} after {wait_time:.2f}s (attempt {retry_count}/{retries})")
                         time.sleep(wait_time)
                     else:
                         # Log final failure using the specialized API logger
                         try:
                             from inner_architect.app.utils.logging_setup import log_api_call
                             log_api_call(
-                                provider=provider,
+                                provider=provider_name,
                                 endpoint=endpoint,
                                 duration=elapsed_time,
                                 success=False,
@@ -130,7 +185,7 @@ def with_retry_and_timeout(
                             )
                         except ImportError:
                             # Fall back to standard logging if specialized logger not available
-                            logger.error(f"API call to {provider}/{endpoint} failed after {retries} retries: {str(last_error)}")
+                            logger.error(f"API call to {provider_name}/{endpoint} failed after {retries} retries: {str(last_error)}")
             
             # All retries exhausted, raise appropriate exception
             if "timeout" in str(last_error).lower():
@@ -172,6 +227,8 @@ def get_fallback_response(error_type: str, context: Optional[Dict[str, Any]] = N
         fallback["message"] = "I'm having trouble connecting to my services. This could be due to network issues. Please try again in a moment."
     elif error_type == "response":
         fallback["message"] = "I encountered an issue while processing your request. My team has been notified and is working on it."
+    elif error_type == "overloaded":
+        fallback["message"] = "I'm receiving more requests than I can handle right now. Please try again in a moment."
         
     # Add contextual help based on endpoint if available
     if endpoint == "chat":
@@ -234,6 +291,15 @@ def show_user_friendly_error(error_type: str, context: Optional[Dict[str, Any]]
             },
             'category': 'danger'
         },
+        'overloaded': {
+            'title': 'High Demand',
+            'message': 'Our AI service is very busy right now. Please try again in a moment.',
+            'retry_action': {
+                'text': 'Try Again',
+                'url': '#'  # Will be filled by the caller
+            },
+            'category': 'warning'
+        },
         'auth': {
             'title': 'Authentication Required',
             'message': 'This feature requires authentication or subscription.',
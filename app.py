@@ -5,7 +5,7 @@ import time
 import secrets
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, render_template, request, jsonify, session, flash, redirect, url_for, g, send_from_directory
+from flask import Flask, render_template, request, jsonify, session, flash, redirect, url_for, g, send_from_directory, Response, stream_with_context
 from typing import Dict, Any, Optional, Union, List, Tuple
 from flask_login import current_user, login_required, logout_user, login_user
 from anthropic import Anthropic
@@ -36,12 +36,13 @@ from email_service import send_verification_email, send_password_reset_email
 from conversation_context import (
     get_or_create_context,
     create_new_context,
-    add_message_to_context,
     enhance_prompt_with_context,
-    update_context_summary,
     consolidate_memories,
     get_context_messages
 )
+from context_packer import estimate_tokens, prompt_size_stats
+from response_cache import response_cache
+from provider_guard import provider_guard
 
 # Import models
 from models import ChatHistory, Subscription
@@ -142,6 +143,10 @@ from security import init_app as init_security
 security_components = init_security(app)
 logger.info("Initialized HIPAA-compliant security module")
 
+# Initialize background job queue for post-response bookkeeping
+from background_jobs import init_app as init_background_jobs, enqueue_jobs, get_queue_depth
+init_background_jobs(app)
+
 # Register blueprints
 app.register_blueprint(analytics)
 logger.info("Registered analytics dashboard blueprint")
@@ -458,6 +463,8 @@ def api_health():
                 "memory_percent": memory_percent,
                 "memory_available_gb": memory_available_gb
             },
+            "background_jobs": get_queue_depth(),
+            "response_cache": response_cache.stats(),
             "uptime_seconds": int(time.time() - app.start_time) if hasattr(app, 'start_time') else 0
         }
 
@@ -1983,6 +1990,175 @@ def get_technique_recommendation():
     # Return the recommendation as JSON
     return jsonify(recommendation)
 
+def save_chat_turn(user_id, session_id, message, ai_response, mood, technique, context_id):
+    """
+    Persist a completed chat turn and schedule the post-response bookkeeping.
+
+    Only the ChatHistory row is written on the request path. Linking the
+    message to its context, memory extraction, the periodic summary refresh
+    and quota accounting run on the background job queue. Errors are logged
+    and never propagated so the user experience is not interrupted.
+    """
+    try:
+        # Create chat history entry using the database helper function
+        from database import create_model
+
+        chat_data = {
+            'user_id': user_id,
+            'session_id': session_id,
+            'user_message': message,
+            'ai_response': ai_response,
+            'mood': mood,
+            'nlp_technique': technique,
+            'context_id': context_id  # Link to the conversation context
+        }
+        chat_entry = create_model(ChatHistory, chat_data)
+
+        jobs = []
+        if chat_entry:
+            info(f"Chat history saved with ID: {chat_entry.id}")
+
+            # Add to conversation context and extract memories
+            if context_id:
+                jobs.append(('chat_context_update', {
+                    'context_id': context_id,
+                    'message_id': chat_entry.id
+                }))
+        else:
+            warning("Failed to save chat history")
+
+        # Increment usage quota counter for user
+        jobs.append(('usage_quota_increment', {
+            'user_id': user_id,
+            'browser_session_id': session_id,
+            'quota_type': 'daily_messages',
+            'amount': 1
+        }))
+
+        if not enqueue_jobs(jobs):
+            warning(f"Failed to enqueue chat bookkeeping for session {session_id}")
+
+    except Exception as db_error:
+        # Log the error but don't interrupt user experience
+        error(f"Error saving chat history: {str(db_error)}")
+        db.session.rollback()
+
+def format_sse_event(payload: Dict[str, Any]) -> str:
+    """Encode a payload as a single Server-Sent Events message."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def stream_chat_response(system_prompt, user_content, user_id, session_id, message, mood, technique, context_id,
+                         model="claude-3-5-sonnet-20241022", max_tokens=500, timeout=20):
+    """
+    Stream a Claude reply to the client as Server-Sent Events.
+
+    Each text delta is forwarded as a ``token`` event as soon as it arrives, so
+    time-to-first-byte no longer equals total generation time. Once the stream
+    completes, a ``done`` event carrying the full reply is sent. The turn is
+    persisted through save_chat_turn when the stream ends, also when the client
+    disconnects part way, in which case the text sent so far is saved.
+
+    Event payloads:
+        {"type": "token", "text": "..."}
+        {"type": "done", "success": true, "response": "...", "is_fallback": false}
+    """
+    from api_fallback import get_fallback_response, is_provider_failure, APIOverloadedError
+
+    def generate():
+        chunks = []
+        try:
+            yield from stream_reply(chunks)
+        finally:
+            # Persist even when the client disconnects mid-stream (Flask closes the
+            # generator with GeneratorExit), so aborting a stream still counts
+            # towards the quota; nothing is saved if no text was sent
+            ai_response = ''.join(chunks).strip()
+            if ai_response:
+                save_chat_turn(user_id, session_id, message, ai_response, mood, technique, context_id)
+
+    def stream_reply(chunks):
+        """Stream the reply, appending each piece of text sent to chunks."""
+        is_fallback = False
+        start_time = time.time()
+        lease_id = None
+
+        def release(success):
+            nonlocal lease_id
+            if lease_id:
+                provider_guard.release('claude', lease_id, success=success)
+                lease_id = None
+
+        try:
+            # Shed the request right away if Claude is failing or at capacity
+            lease_id, rejected = provider_guard.acquire('claude')
+            if rejected:
+                raise APIOverloadedError(f"API provider claude rejected the request ({rejected})")
+
+            with claude_client.messages.stream(
+                model=model,
+                system=system_prompt,
+                max_tokens=max_tokens,
+                timeout=timeout,
+                messages=[
+                    {"role": "user", "content": user_content}
+                ]
+            ) as stream:
+                for text in stream.text_stream:
+                    if not chunks:
+                        first_token_seconds = time.time() - start_time
+                        debug(f"First token streamed after {first_token_seconds:.2f}s")
+                        prompt_size_stats.record_prompt(
+                            estimate_tokens(system_prompt) + estimate_tokens(user_content), first_token_seconds,
+                            'first_token'
+                        )
+                    chunks.append(text)
+                    yield format_sse_event({'type': 'token', 'text': text})
+            release(True)
+        except Exception as e:
+            error(f"Error streaming chat response: {str(e)}")
+            release(not is_provider_failure(e))
+
+            # Only substitute a fallback when nothing has reached the client yet;
+            # otherwise keep the partial reply the user has already seen
+            if not chunks:
+                error_type = "response"
+                if isinstance(e, APIOverloadedError):
+                    error_type = "overloaded"
+                elif "timeout" in str(e).lower():
+                    error_type = "timeout"
+                elif "connection" in str(e).lower():
+                    error_type = "connection"
+
+                fallback = get_fallback_response(error_type, {
+                    "user_message": message,
+                    "endpoint": "chat",
+                    "technique": technique,
+                    "mood": mood
+                })
+                chunks.append(fallback["message"])
+                is_fallback = True
+                yield format_sse_event({'type': 'token', 'text': fallback["message"]})
+        finally:
+            # A client that disconnected closes the generator with GeneratorExit;
+            # the permit is returned without counting for or against Claude
+            release(None)
+
+        ai_response = ''.join(chunks).strip()
+        debug(f"AI response streamed in {time.time() - start_time:.2f}s: {ai_response}")
+
+        yield format_sse_event({
+            'type': 'done',
+            'success': True,
+            'response': ai_response,
+            'is_fallback': is_fallback
+        })
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Disable proxy buffering so nginx forwards each event immediately
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/chat', methods=['GET', 'POST'])
 def chat():
     """
@@ -1992,6 +2168,10 @@ def chat():
 
     Enforces usage quotas based on the user's subscription tier.
     Returns error response when quota is exceeded with quota_exceeded flag set to true.
+
+    When the request body sets ``stream`` to true (or the client only accepts
+    ``text/event-stream``), the reply is streamed token by token as
+    Server-Sent Events instead of being returned as a single JSON document.
     """
     # Handle GET request - return chat interface
     if request.method == 'GET':
@@ -2003,6 +2183,7 @@ def chat():
     message = data.get('message', '')
     mood = data.get('mood', 'neutral')
     technique = data.get('technique', 'reframing')
+    wants_stream = bool(data.get('stream')) or request.accept_mimetypes.best == 'text/event-stream'
 
     # Get session ID for tracking the conversation
     session_id = session.get('session_id')
@@ -2020,7 +2201,7 @@ def chat():
         info(f"Chat request from anonymous user with session: {session_id}")
 
     # Import subscription manager functions for quota management
-    from subscription_manager import check_quota_available, increment_usage_quota, get_subscription_details
+    from subscription_manager import check_quota_available, get_subscription_details
 
     # Get subscription details for logging/debugging
     subscription_tier = "free"
@@ -2097,8 +2278,17 @@ Keep responses concise (2-3 short paragraphs maximum) and conversational. Use th
                 'technique': technique
             }), 500
 
+        user_content = f"User mood: {mood}\nUser message: {message}\nRequested NLP technique: {technique}"
+
+        # Stream tokens to the client as they arrive when requested
+        if wants_stream:
+            return stream_chat_response(
+                system_prompt, user_content, user_id, session_id,
+                message, mood, technique, context_id
+            )
+
         # Import the API error handling tools
-        from api_fallback import with_retry_and_timeout, APIError, get_fallback_response, show_user_friendly_error
+        from api_fallback import with_retry_and_timeout, APIError, APIOverloadedError, get_fallback_response, show_user_friendly_error
 
         # Get the response from Claude with error handling
         ai_response = ""
@@ -2106,7 +2296,7 @@ Keep responses concise (2-3 short paragraphs maximum) and conversational. Use th
         try:
             # Using Claude Sonnet model for consistent, high-quality responses.
             # Only change this model if explicitly requested by the user
-            @with_retry_and_timeout(timeout=20, retries=2)
+            @with_retry_and_timeout(timeout=20, retries=2, provider="claude")
             def get_claude_response(prompt, user_content, model="claude-3-5-sonnet-20241022", max_tokens=500, timeout=20):
                 return claude_client.messages.create(
                     model=model,
@@ -2119,9 +2309,14 @@ Keep responses concise (2-3 short paragraphs maximum) and conversational. Use th
                 )
 
             # Call the enhanced function with retry logic
+            request_started = time.time()
             response = get_claude_response(
                 prompt=system_prompt,
-                user_content=f"User mood: {mood}\nUser message: {message}\nRequested NLP technique: {technique}"
+                user_content=user_content
+            )
+            prompt_size_stats.record_prompt(
+                estimate_tokens(system_prompt) + estimate_tokens(user_content), time.time() - request_started,
+                'full_response'
             )
 
             # Extract the AI response from Claude API response
@@ -2138,7 +2333,9 @@ Keep responses concise (2-3 short paragraphs maximum) and conversational. Use th
 
             # Get the error type from the exception
             error_type = "response"
-            if "timeout" in str(api_err).lower():
+            if isinstance(api_err, APIOverloadedError):
+                error_type = "overloaded"
+            elif "timeout" in str(api_err).lower():
                 error_type = "timeout"
             elif "connection" in str(api_err).lower():
                 error_type = "connection"
@@ -2163,66 +2360,8 @@ Keep responses concise (2-3 short paragraphs maximum) and conversational. Use th
             error(f"Unexpected error in chat endpoint: {str(e)}")
             ai_response = "I'm having trouble processing your request right now. Please try again in a moment."
 
-        # Save the chat history to the database
-        try:
-            # Associate with user if authenticated
-            user_id_for_chat = None
-            if current_user.is_authenticated:
-                user_id_for_chat = current_user.id
-
-            # Create chat history entry using the database helper function
-            from database import create_model
-
-            chat_data = {
-                'user_id': user_id_for_chat,
-                'session_id': session_id,
-                'user_message': message,
-                'ai_response': ai_response,
-                'mood': mood,
-                'nlp_technique': technique,
-                'context_id': context_id  # Link to the conversation context
-            }
-            chat_entry = create_model(ChatHistory, chat_data)
-
-            if chat_entry:
-                info(f"Chat history saved with ID: {chat_entry.id}")
-
-                # Add to conversation context and extract memories
-                if context_id and chat_entry:
-                    try:
-                        # We don't need to wait for these operations to complete
-                        add_message_to_context(context_id, chat_entry.id)
-
-                        # Update context summary after a few messages
-                        message_count = ChatHistory.query.filter_by(context_id=context_id).count()
-                        if message_count % 3 == 0:  # Update every 3 messages
-                            update_context_summary(context_id)
-                    except Exception as ctx_error:
-                        # Log but continue
-                        error(f"Error updating conversation context: {str(ctx_error)}")
-            else:
-                warning("Failed to save chat history")
-
-            # Increment usage quota counter for user
-            try:
-                success, quota_message = increment_usage_quota(
-                    user_id=user_id,
-                    browser_session_id=session_id,
-                    quota_type='daily_messages',
-                    amount=1
-                )
-                if success:
-                    info(f"Usage quota incremented for {'user '+user_id if user_id else 'session '+session_id}")
-                else:
-                    warning(f"Failed to increment usage quota: {quota_message}")
-            except Exception as quota_error:
-                # Log the error but don't interrupt user experience
-                error(f"Error incrementing usage quota: {str(quota_error)}")
-
-        except Exception as db_error:
-            # Log the error but don't interrupt user experience
-            error(f"Error saving chat history: {str(db_error)}")
-            db.session.rollback()
+        # Save the chat history and update conversation context
+        save_chat_turn(user_id, session_id, message, ai_response, mood, technique, context_id)
 
         # Return the AI response to the frontend
         return jsonify({
@@ -3903,6 +4042,7 @@ def admin_enable_professional():
     This is for testing purposes only.
     """
     from datetime import datetime, timedelta
+    from subscription_manager import invalidate_plan_cache
 
     # Debug information
     app.logger.debug(f"Admin route accessed by user ID: {current_user.id}")
@@ -3937,6 +4077,7 @@ def admin_enable_professional():
             app.logger.debug("Updated existing subscription")
 
         db.session.commit()
+        invalidate_plan_cache(current_user.id)
         app.logger.debug("Committed subscription changes to database")
 
         flash("Professional subscription enabled for your account.", "success")
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""
+Script to rebuild the analytics dashboard rollup tables from existing history.
+
+New chat messages, technique ratings and users keep the rollups current as
+they are written; run this once after deploying the rollup tables, or again
+for any date range that needs to be recomputed.
+
+Usage:
+    python backfill_rollups.py [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+"""
+
+import argparse
+import datetime
+
+from app import app, db
+from analytics.rollups import backfill_rollups
+from logging_config import get_logger, info, error
+
+logger = get_logger("backfill_rollups")
+
+def parse_day(value):
+    """Parse a YYYY-MM-DD argument."""
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+def main():
+    """
+    Backfill the analytics rollups for the requested date range.
+    """
+    parser = argparse.ArgumentParser(description="Rebuild analytics rollup tables")
+    parser.add_argument("--start", type=parse_day, help="First day to rebuild (default: earliest activity)")
+    parser.add_argument("--end", type=parse_day, help="Last day to rebuild, inclusive (default: today)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            db.create_all()
+            stats = backfill_rollups(args.start, args.end)
+            info(f"Rebuilt {stats['days']} days, {stats['sessions']} sessions and {stats['users']} users in {stats['elapsed_seconds']:.1f}s")
+        except Exception as e:
+            error(f"Error backfilling analytics rollups: {str(e)}")
+            db.session.rollback()
+
+if __name__ == "__main__":
+    main()
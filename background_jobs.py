@@ -0,0 +1,433 @@
+"""
+Background Jobs Module for The Inner Architect
+
+This module provides a durable work queue for bookkeeping that does not need
+to block the user's request, such as memory extraction, conversation summary
+refreshes and usage quota accounting.
+
+Jobs are stored in the ``background_jobs`` table so they survive restarts and
+can be picked up by any gunicorn worker. Each process runs a small pool of
+worker threads that claim jobs atomically, retry failures with exponential
+backoff and leave permanently failed jobs in the table for inspection.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from database import db, safe_commit
+from models import BackgroundJob
+from logging_config import get_logger, info, error, debug, warning
+
+# Get module-specific logger
+logger = get_logger('background_jobs')
+
+# Number of worker threads per process
+DEFAULT_WORKER_THREADS = int(os.environ.get('BACKGROUND_JOB_THREADS', 2))
+
+# Seconds a worker waits for a local notification before polling the table
+POLL_INTERVAL = 5.0
+
+# Default number of attempts before a job is marked as failed
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Base delay (seconds) for exponential retry backoff
+RETRY_BACKOFF = 2.0
+
+# Seconds after which a 'running' job is assumed abandoned by a dead worker
+JOB_LEASE_SECONDS = 300
+
+# Maximum number of due jobs claimed in a single poll
+POLL_BATCH_SIZE = 20
+
+# Registered job handlers, keyed by job type
+JOB_HANDLERS: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+
+
+def job_handler(job_type: str) -> Callable:
+    """
+    Decorator registering a function as the handler for a job type.
+
+    Handlers receive the decoded job payload. Raising an exception marks the
+    attempt as failed and schedules a retry.
+
+    Args:
+        job_type: Name of the job type handled by the function
+
+    Returns:
+        Decorator function
+    """
+    def decorator(func: Callable[[Dict[str, Any]], None]) -> Callable[[Dict[str, Any]], None]:
+        JOB_HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+class BackgroundJobQueue:
+    """
+    Durable job queue backed by the ``background_jobs`` table.
+
+    Newly enqueued job IDs are pushed onto an in-process queue so local
+    workers start on them immediately; jobs enqueued by other processes,
+    retries and jobs left over from a restart are found by polling.
+    """
+
+    def __init__(self, app=None, num_threads: int = DEFAULT_WORKER_THREADS):
+        self.app = app
+        self.num_threads = num_threads
+        self._local_queue: "queue.Queue[int]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._stop_event = threading.Event()
+
+    def init_app(self, app) -> None:
+        """Bind the queue to a Flask application."""
+        self.app = app
+        app.extensions['background_jobs'] = self
+
+    @property
+    def running(self) -> bool:
+        """Whether worker threads are running in the current process."""
+        return self._pid == os.getpid() and any(t.is_alive() for t in self._threads)
+
+    def start(self) -> None:
+        """
+        Start worker threads for the current process.
+
+        Threads are started lazily and restarted after a fork, so each
+        gunicorn worker gets its own pool.
+        """
+        with self._lock:
+            if self.running or self.app is None:
+                return
+
+            self._pid = os.getpid()
+            self._stop_event.clear()
+            self._local_queue = queue.Queue()
+            self._threads = []
+
+            for index in range(self.num_threads):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"background-job-worker-{index}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+            info(f"Started {self.num_threads} background job workers in process {self._pid}")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Signal worker threads to stop and wait for them to exit."""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, job_type: str, payload: Dict[str, Any], max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Optional[int]:
+        """
+        Persist a single job and hand it to a local worker.
+
+        Args:
+            job_type: Registered job type
+            payload: JSON-serializable job arguments
+            max_attempts: Attempts before the job is marked as failed
+
+        Returns:
+            The job ID or None if the job could not be stored
+        """
+        job_ids = self.enqueue_many([(job_type, payload)], max_attempts=max_attempts)
+        return job_ids[0] if job_ids else None
+
+    def enqueue_many(self, jobs: List[Tuple[str, Dict[str, Any]]], max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> List[int]:
+        """
+        Persist several jobs in one commit and hand them to local workers.
+
+        Args:
+            jobs: List of (job_type, payload) tuples
+            max_attempts: Attempts before each job is marked as failed
+
+        Returns:
+            List of job IDs, empty if the jobs could not be stored
+        """
+        now = datetime.utcnow()
+        records = []
+        for job_type, payload in jobs:
+            if job_type not in JOB_HANDLERS:
+                warning(f"Enqueuing job with no registered handler: {job_type}")
+
+            record = BackgroundJob(
+                job_type=job_type,
+                payload=json.dumps(payload),
+                status='pending',
+                attempts=0,
+                max_attempts=max_attempts,
+                run_after=now,
+                created_at=now,
+                updated_at=now
+            )
+            db.session.add(record)
+            records.append(record)
+
+        if not safe_commit():
+            error(f"Failed to enqueue {len(records)} background jobs")
+            return []
+
+        job_ids = [record.id for record in records]
+        self.start()
+
+        if self.running:
+            for job_id in job_ids:
+                self._local_queue.put(job_id)
+        else:
+            # No worker pool (e.g. scripts or tests without an app), run inline
+            for job_id in job_ids:
+                self.process_job(job_id)
+
+        return job_ids
+
+    def _worker_loop(self) -> None:
+        """Main loop for a worker thread."""
+        while not self._stop_event.is_set():
+            try:
+                job_id = self._local_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                job_id = None
+
+            try:
+                with self.app.app_context():
+                    if job_id is not None:
+                        self.process_job(job_id)
+                    else:
+                        self.process_due_jobs()
+            except Exception as e:
+                error(f"Background job worker error: {str(e)}")
+
+    def _claim(self, job_id: int) -> bool:
+        """
+        Atomically move a due pending job to 'running'.
+
+        The conditional UPDATE guarantees only one worker, in any process,
+        wins the claim.
+        """
+        now = datetime.utcnow()
+        claimed = db.session.query(BackgroundJob).filter(
+            BackgroundJob.id == job_id,
+            BackgroundJob.status == 'pending',
+            BackgroundJob.run_after <= now
+        ).update({
+            BackgroundJob.status: 'running',
+            BackgroundJob.attempts: BackgroundJob.attempts + 1,
+            BackgroundJob.updated_at: now
+        }, synchronize_session=False)
+
+        if not safe_commit():
+            return False
+        return claimed == 1
+
+    def process_job(self, job_id: int) -> bool:
+        """
+        Claim and run a single job.
+
+        Args:
+            job_id: ID of the job to run
+
+        Returns:
+            True if the job ran successfully, False otherwise
+        """
+        if not self._claim(job_id):
+            return False
+
+        job = db.session.get(BackgroundJob, job_id)
+        if not job:
+            return False
+
+        handler = JOB_HANDLERS.get(job.job_type)
+        start_time = time.time()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job type {job.job_type}")
+
+            handler(json.loads(job.payload or '{}'))
+
+            # Finished jobs are removed to keep the table small
+            db.session.delete(job)
+            safe_commit()
+            debug(f"Background job {job_id} ({job.job_type}) completed in {time.time() - start_time:.2f}s")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(BackgroundJob, job_id)
+            if not job:
+                return False
+
+            job.last_error = f"{type(e).__name__}: {str(e)}"
+            job.updated_at = datetime.utcnow()
+
+            if job.attempts < job.max_attempts:
+                delay = RETRY_BACKOFF * (2 ** (job.attempts - 1))
+                job.status = 'pending'
+                job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+                warning(f"Background job {job_id} ({job.job_type}) failed, retrying in {delay:.1f}s: {str(e)}")
+            else:
+                job.status = 'failed'
+                error(f"Background job {job_id} ({job.job_type}) failed after {job.attempts} attempts: {str(e)}")
+
+            safe_commit()
+            return False
+
+    def process_due_jobs(self, limit: int = POLL_BATCH_SIZE) -> int:
+        """
+        Run pending jobs whose retry delay has elapsed.
+
+        Also returns jobs abandoned by a dead worker to the pending state.
+
+        Args:
+            limit: Maximum number of jobs to run
+
+        Returns:
+            Number of jobs that ran successfully
+        """
+        now = datetime.utcnow()
+
+        # Release jobs whose lease expired
+        db.session.query(BackgroundJob).filter(
+            BackgroundJob.status == 'running',
+            BackgroundJob.updated_at < now - timedelta(seconds=JOB_LEASE_SECONDS)
+        ).update({
+            BackgroundJob.status: 'pending',
+            BackgroundJob.updated_at: now
+        }, synchronize_session=False)
+        safe_commit()
+
+        due_ids = [row.id for row in db.session.query(BackgroundJob.id).filter(
+            BackgroundJob.status == 'pending',
+            BackgroundJob.run_after <= now
+        ).order_by(BackgroundJob.run_after).limit(limit).all()]
+
+        return sum(1 for job_id in due_ids if self.process_job(job_id))
+
+
+# Shared queue instance for the application
+job_queue = BackgroundJobQueue()
+
+
+def init_app(app, num_threads: int = DEFAULT_WORKER_THREADS) -> BackgroundJobQueue:
+    """
+    Initialize the background job queue for a Flask application.
+
+    Worker threads start lazily on the first enqueue in each process.
+
+    Args:
+        app: Flask application instance
+        num_threads: Worker threads per process
+
+    Returns:
+        The configured BackgroundJobQueue
+    """
+    job_queue.num_threads = num_threads
+    job_queue.init_app(app)
+    return job_queue
+
+
+def enqueue_job(job_type: str, payload: Dict[str, Any], max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Optional[int]:
+    """Enqueue a single job on the shared queue."""
+    return job_queue.enqueue(job_type, payload, max_attempts=max_attempts)
+
+
+def enqueue_jobs(jobs: List[Tuple[str, Dict[str, Any]]], max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> List[int]:
+    """Enqueue several jobs on the shared queue in one commit."""
+    return job_queue.enqueue_many(jobs, max_attempts=max_attempts)
+
+
+def get_queue_depth() -> Dict[str, Any]:
+    """
+    Get queue depth metrics for monitoring.
+
+    Returns:
+        Dictionary with job counts per status, the age of the oldest pending
+        job in seconds and whether local workers are running
+    """
+    try:
+        counts = dict(
+            db.session.query(BackgroundJob.status, func.count(BackgroundJob.id))
+            .group_by(BackgroundJob.status)
+            .all()
+        )
+        oldest_pending = db.session.query(func.min(BackgroundJob.created_at)).filter(
+            BackgroundJob.status == 'pending'
+        ).scalar()
+
+        return {
+            'pending': counts.get('pending', 0),
+            'running': counts.get('running', 0),
+            'failed': counts.get('failed', 0),
+            'local_backlog': job_queue._local_queue.qsize(),
+            'oldest_pending_seconds': int((datetime.utcnow() - oldest_pending).total_seconds()) if oldest_pending else 0,
+            'workers_running': job_queue.running
+        }
+    except Exception as e:
+        error(f"Error retrieving background job queue depth: {str(e)}")
+        return {}
+
+
+# Job handlers for chat post-processing
+
+@job_handler('chat_context_update')
+def process_chat_context_update(payload: Dict[str, Any]) -> None:
+    """
+    Link a chat message to its context and extract memories.
+
+    Every third message also enqueues a summary refresh as a job of its
+    own, so a failing refresh cannot make this job retry and extract the
+    memories of the message again.
+    """
+    from conversation_context import add_message_to_context
+    from models import ChatHistory
+
+    context_id = payload['context_id']
+    message_id = payload['message_id']
+
+    if not add_message_to_context(context_id, message_id):
+        raise RuntimeError(f"Failed to add message {message_id} to context {context_id}")
+
+    # Update context summary after a few messages
+    message_count = ChatHistory.query.filter_by(context_id=context_id).count()
+    if message_count % 3 == 0 and enqueue_job('context_summary_update', {'context_id': context_id}) is None:
+        warning(f"Failed to enqueue summary refresh for context {context_id}")
+
+
+@job_handler('context_summary_update')
+def process_context_summary_update(payload: Dict[str, Any]) -> None:
+    """Refresh the summary and title of a conversation context."""
+    from conversation_context import update_context_summary
+
+    context_id = payload['context_id']
+    if not update_context_summary(context_id):
+        # Failures are reported by update_context_summary; the next refresh
+        # summarizes the latest messages anyway, so they are not retried
+        warning(f"Context {context_id} summary was not updated")
+
+
+@job_handler('usage_quota_increment')
+def process_usage_quota_increment(payload: Dict[str, Any]) -> None:
+    """Increment a usage quota counter."""
+    from subscription_manager import increment_usage_quota
+
+    success, quota_message = increment_usage_quota(
+        user_id=payload.get('user_id'),
+        browser_session_id=payload.get('browser_session_id'),
+        quota_type=payload.get('quota_type', 'daily_messages'),
+        amount=payload.get('amount', 1)
+    )
+    if not success:
+        # Quota rejections are deterministic, so they are logged rather than retried
+        warning(f"Failed to increment usage quota: {quota_message}")
@@ -16,6 +16,7 @@ import os
 from openai import OpenAI
 
 from logging_config import get_logger, info, error, debug, warning, critical, exception
+from response_cache import response_cache
 
 
 
@@ -455,6 +456,12 @@ def analyze_belief(belief_text):
             ]
         }
     
+    # Common beliefs are stated in the same words by many users
+    cached = response_cache.get('analyze_belief', belief_text)
+    if cached is not None:
+        debug("Belief analysis served from cache")
+        return cached
+    
     try:
         # The newest OpenAI model is "gpt-4o" which was released May 13, 2024.
         # Do not change this unless explicitly requested by the user
@@ -495,6 +502,7 @@ Respond with JSON in this format:
         if 'category' in analysis and analysis['category'] not in BELIEF_CATEGORIES:
             analysis['category'] = categorize_belief(belief_text)
             
+        response_cache.put('analyze_belief', belief_text, analysis)
         return analysis
         
     except Exception as e:
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Script to measure retention cohort queries on a synthetic user base.
+
+Builds an SQLite database with one AnalyticsUserActivity row per user, signed
+up over the eight weeks before today and active on a random set of days
+after signup, then times get_retention_cohorts cold (first query) and
+cached. Cohort queries only read the activity bitmaps, so the size of the
+chat history behind them does not change the timings; 1M users with about
+50 messages each stands in for 50M chat rows.
+
+Usage:
+    python benchmark_retention.py [--users N] [--database PATH] [--budget SECONDS]
+
+The database is kept when --database is given, and reused by later runs
+with the same number of users. Exits with status 1 if a cold query takes
+longer than the budget.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import tempfile
+
+from flask import Flask
+from sqlalchemy import func, insert
+
+from database import db
+from models import AnalyticsUserActivity
+from analytics.retention import get_retention_cohorts, invalidate_retention_cache
+
+# Days before today over which users signed up (the dashboard's 8-week window)
+SIGNUP_WINDOW_DAYS = 56
+
+# Users inserted per statement
+INSERT_BATCH_SIZE = 50000
+
+
+def make_app(database_path):
+    """Minimal app bound to the benchmark database."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{database_path}"
+    db.init_app(app)
+    return app
+
+
+def populate(users, today, seed):
+    """Insert users with random activity after signup, unless already present."""
+    AnalyticsUserActivity.__table__.create(db.engine, checkfirst=True)
+    existing = db.session.query(func.count(AnalyticsUserActivity.user_id)).scalar()
+    if existing == users:
+        return False
+    db.session.query(AnalyticsUserActivity).delete()
+
+    rng = random.Random(seed)
+    rows = []
+    for number in range(users):
+        signup_offset = rng.randrange(SIGNUP_WINDOW_DAYS)
+        days_since_signup = SIGNUP_WINDOW_DAYS - signup_offset
+        bits = 0
+        for active_day in rng.sample(range(63), rng.randint(1, 12)):
+            if active_day < days_since_signup:
+                bits |= 1 << active_day
+        rows.append({
+            'user_id': f"user-{number:08d}",
+            'signup_day': today - datetime.timedelta(days=days_since_signup),
+            'activity_bits': bits
+        })
+        if len(rows) == INSERT_BATCH_SIZE:
+            db.session.execute(insert(AnalyticsUserActivity), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(AnalyticsUserActivity), rows)
+    db.session.commit()
+    return True
+
+
+def timed(function, *args, **kwargs):
+    """Call a function and return its elapsed seconds."""
+    started = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def main():
+    """
+    Populate the benchmark database and print cohort query timings.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark retention cohort queries")
+    parser.add_argument("--users", type=int, default=1000000, help="Number of users (default: 1000000)")
+    parser.add_argument("--database", help="SQLite file to build or reuse (default: temporary)")
+    parser.add_argument("--budget", type=float, default=1.0,
+                        help="Maximum seconds for a cold query (default: 1.0)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic activity")
+    args = parser.parse_args()
+
+    temporary = None
+    database_path = args.database
+    if database_path is None:
+        temporary = tempfile.TemporaryDirectory()
+        database_path = os.path.join(temporary.name, 'retention.sqlite3')
+
+    now = datetime.datetime.utcnow()
+    start_time = now - datetime.timedelta(days=SIGNUP_WINDOW_DAYS)
+    app = make_app(database_path)
+    try:
+        with app.app_context():
+            started = time.perf_counter()
+            if populate(args.users, now.date(), args.seed):
+                print(f"Inserted {args.users} users in {time.perf_counter() - started:.1f}s")
+
+            over_budget = False
+            for period in ('week', 'day'):
+                invalidate_retention_cache()
+                cold = timed(get_retention_cohorts, start_time, period, now=now)
+                cached = timed(get_retention_cohorts, start_time, period, now=now)
+                over_budget = over_budget or cold > args.budget
+                print(f"{period:>4} cohorts: {cold * 1000:.0f}ms cold, {cached * 1000:.2f}ms cached")
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    if over_budget:
+        print(f"Cold query exceeded the {args.budget:.2f}s budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
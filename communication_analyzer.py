@@ -12,6 +12,7 @@ import os
 import json
 
 from logging_config import get_logger, info, error, debug, warning, critical, exception
+from response_cache import response_cache
 
 
 
@@ -384,6 +385,13 @@ def analyze_with_gpt(text, session_history=None):
     Returns:
         dict: Analysis results
     """
+    # Only the last 5 messages are part of the prompt
+    recent_history = list(session_history[-5:]) if session_history else []
+    cached = response_cache.get('analyze_with_gpt', text, context=recent_history)
+    if cached is not None:
+        debug("Communication analysis served from cache")
+        return cached
+    
     # Prepare context from session history
     context = ""
     if session_history and len(session_history) > 0:
@@ -455,6 +463,7 @@ If there's no clear secondary style, omit that field. Confidence should be betwe
         
         # Parse and return the response
         result = json.loads(response.choices[0].message.content)
+        response_cache.put('analyze_with_gpt', text, result, context=recent_history)
         return result
     
     except Exception as e:
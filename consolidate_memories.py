@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Script to merge near-duplicate conversation memories across all contexts.
+
+Chat turns consolidate the active context once it holds more than ten
+memories; run this periodically (e.g. nightly from cron) to catch contexts
+that are no longer active.
+
+Usage:
+    python consolidate_memories.py [--threshold T] [--min-items N] [--batch-size N]
+"""
+
+import argparse
+
+from app import app, db
+from conversation_context import CONSOLIDATION_CONTEXT_BATCH, consolidate_all_memories
+from logging_config import get_logger, error
+
+logger = get_logger("consolidate_memories")
+
+def main():
+    """
+    Consolidate memories for every context with enough memories.
+    """
+    parser = argparse.ArgumentParser(description="Merge near-duplicate conversation memories")
+    parser.add_argument("--threshold", type=float, default=0.7,
+                        help="Jaccard similarity above which memories are merged (default: 0.7)")
+    parser.add_argument("--min-items", type=int, default=3,
+                        help="Minimum memories a context needs to be considered (default: 3)")
+    parser.add_argument("--batch-size", type=int, default=CONSOLIDATION_CONTEXT_BATCH,
+                        help=f"Contexts loaded per query (default: {CONSOLIDATION_CONTEXT_BATCH})")
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            # Logs the number of merged memories and contexts processed
+            consolidate_all_memories(args.threshold, args.min_items, args.batch_size)
+        except Exception as e:
+            error(f"Error consolidating memories: {str(e)}")
+            db.session.rollback()
+
+if __name__ == "__main__":
+    main()
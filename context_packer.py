@@ -0,0 +1,402 @@
+"""
+Context Packer Module for The Inner Architect
+
+This module assembles the conversation context section of system prompts
+within a token budget. Tokens are estimated locally from text length, and
+the budget is allocated across the context sections by priority:
+
+1. Communication guidance, which is short and always included
+2. The conversation summary
+3. User preferences
+4. Recent conversation turns, newest first
+5. Other relevant memories, in ranking order
+
+Each section first receives its share of the budget; budget a section does
+not use is then given to the sections that still have content, in priority
+order. Preference memories are listed once, under the user preferences, and
+memories with identical content are only listed once.
+
+Prompt sizes are recorded in histograms that are logged periodically, along
+with the upstream latency per size bucket, so that the budget can be tuned
+against measured latency. Time to first token of streamed replies and the
+whole request time of other replies are kept apart.
+"""
+
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from logging_config import get_logger, info
+
+# Get module-specific logger
+logger = get_logger('context_packer')
+
+# Token budget for the conversation context of a prompt
+CONTEXT_TOKEN_BUDGET = 1200
+
+# Average characters per token of English text
+CHARS_PER_TOKEN = 4
+
+# Share of the budget reserved for each section, in priority order
+SECTION_SHARES = (
+    ('summary', 0.15),
+    ('preferences', 0.15),
+    ('turns', 0.45),
+    ('memories', 0.25),
+)
+
+# Section headers as they appear in prompts
+SECTION_HEADERS = {
+    'summary': None,
+    'preferences': "USER PREFERENCES (Be sure to respect these in your response):",
+    'turns': "RECENT CONVERSATION:",
+    'memories': "IMPORTANT CONTEXT ABOUT THE USER:",
+}
+
+# Order of the sections in prompts
+SECTION_ORDER = ('summary', 'turns', 'memories', 'preferences')
+
+# Upper bounds (in tokens) of the prompt size histogram buckets
+PROMPT_SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192)
+
+# Number of prompts between histogram log lines
+PROMPT_SIZE_LOG_INTERVAL = 500
+
+# What a recorded prompt latency measures: the time until the first streamed
+# token, or the whole request for replies that are not streamed
+PROMPT_LATENCY_MODES = ('first_token', 'full_response')
+
+# Minimum tokens per line for a shortened entry to be worth including
+MIN_SHORTENED_LINE_TOKENS = 16
+
+# A block of prompt lines with its estimated token count
+Entry = Tuple[List[str], int]
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    Estimate the number of tokens of a text without calling a tokenizer.
+
+    Args:
+        text: The text to estimate
+
+    Returns:
+        Estimated token count
+    """
+    if not text:
+        return 0
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def make_entry(lines: List[str]) -> Entry:
+    """Create an entry from prompt lines, which are joined by blank lines."""
+    return lines, sum(estimate_tokens(line) for line in lines) + len(lines)
+
+
+def turn_entry(message: Dict[str, Any]) -> Entry:
+    """Create the entry for a conversation turn."""
+    return make_entry([f"User: {message['user_message']}", f"You: {message['ai_response']}"])
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Shorten a text to about the given number of tokens at a word boundary."""
+    limit = max(0, tokens * CHARS_PER_TOKEN - 3)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    if ' ' in cut:
+        cut = cut[:cut.rindex(' ')]
+    return cut.rstrip(' ,;:') + "..."
+
+
+def shorten_entry(entry: Entry, tokens: int) -> Optional[Entry]:
+    """
+    Shorten the lines of an entry to fit about the given number of tokens.
+
+    Lines shorter than an equal share of the room are kept whole, and the
+    rest is divided between the longer lines.
+
+    Args:
+        entry: The entry to shorten
+        tokens: Token allowance for the shortened entry
+
+    Returns:
+        The shortened entry, or None if too little of each line would fit
+    """
+    lines = entry[0]
+    room = tokens - len(lines)
+    if room < MIN_SHORTENED_LINE_TOKENS * len(lines):
+        return None
+
+    limits = {}
+    by_length = sorted(range(len(lines)), key=lambda index: estimate_tokens(lines[index]))
+    for position, index in enumerate(by_length):
+        limits[index] = min(estimate_tokens(lines[index]), room // (len(lines) - position))
+        room -= limits[index]
+
+    return make_entry([
+        line if limits[index] >= estimate_tokens(line) else truncate_to_tokens(line, limits[index])
+        for index, line in enumerate(lines)
+    ])
+
+
+class PackedContext(NamedTuple):
+    """Context section of a prompt packed within a token budget."""
+    parts: List[str]
+    tokens: int
+    section_tokens: Dict[str, int]
+    dropped: Dict[str, int]
+
+
+def _memory_entries(memories: Sequence[Dict[str, Any]]) -> Tuple[List[Entry], List[Entry]]:
+    """Split memories into preference and other entries, dropping duplicates."""
+    preferences, others = [], []
+    seen = set()
+    for memory in memories:
+        content = memory['content']
+        key = content.strip().lower()
+        if key in seen:
+            continue
+        seen.add(key)
+
+        if memory['memory_type'] == 'preference':
+            preferences.append(make_entry([f"- {content}"]))
+        else:
+            others.append(make_entry([f"- {memory['memory_type'].upper()}: {content}"]))
+    return preferences, others
+
+
+def pack_context(
+    summary: Optional[str],
+    turns: Sequence[Entry],
+    memories: Sequence[Dict[str, Any]],
+    guidance: Optional[str] = None,
+    budget: int = CONTEXT_TOKEN_BUDGET
+) -> PackedContext:
+    """
+    Pack the conversation context of a prompt within a token budget.
+
+    Args:
+        summary: The conversation summary, if any
+        turns: Entries of the recent conversation turns, oldest first
+        memories: Relevant memory dictionaries, most relevant first
+        guidance: Communication guidance, always included
+        budget: Token budget for the packed context
+
+    Returns:
+        PackedContext with the prompt parts, their token estimate, the tokens
+        used per section and the number of entries dropped per section
+    """
+    guidance_entry = make_entry([guidance]) if guidance else None
+    available = budget - (guidance_entry[1] if guidance_entry else 0)
+
+    preferences, others = _memory_entries(memories)
+    candidates = {
+        'summary': [make_entry([f"CONVERSATION SUMMARY: {summary}"])] if summary else [],
+        'preferences': list(preferences),
+        'turns': list(reversed(turns)),
+        'memories': list(others),
+    }
+    taken: Dict[str, List[Entry]] = {name: [] for name in candidates}
+    used = {name: 0 for name in candidates}
+
+    def fill(name: str, allowance: int, shorten: bool = False) -> int:
+        """
+        Take entries of a section within an allowance, returning tokens used.
+
+        With ``shorten``, a newest turn too long for the allowance is
+        shortened to fit instead of leaving the section empty.
+        """
+        spent = 0
+        header = SECTION_HEADERS[name]
+        header_tokens = make_entry([header])[1] if header else 0
+        skipped = []
+        pending = candidates[name]
+        while pending:
+            cost = pending[0][1] + (header_tokens if not taken[name] else 0)
+            if cost > allowance - spent:
+                if shorten and name == 'turns' and not taken[name]:
+                    entry = shorten_entry(pending[0], allowance - spent - header_tokens)
+                    if entry:
+                        pending.pop(0)
+                        taken[name].append(entry)
+                        spent += entry[1] + header_tokens
+                # Turns must stay contiguous; memories can skip a long entry
+                if name != 'memories':
+                    break
+                skipped.append(pending.pop(0))
+                continue
+            taken[name].append(pending.pop(0))
+            spent += cost
+        candidates[name] = skipped + pending
+        used[name] += spent
+        return spent
+
+    # First pass: each section within its share of the budget
+    remaining = available
+    for name, share in SECTION_SHARES:
+        remaining -= fill(name, int(available * share))
+
+    # Second pass: unused budget by priority
+    for name, _ in SECTION_SHARES:
+        remaining -= fill(name, remaining, shorten=True)
+
+    # A summary that did not fit is shortened to the remaining budget
+    if summary and not taken['summary'] and remaining > 0:
+        shortened = truncate_to_tokens(summary, remaining - estimate_tokens("CONVERSATION SUMMARY: ") - 1)
+        if shortened != "...":
+            entry = make_entry([f"CONVERSATION SUMMARY: {shortened}"])
+            taken['summary'].append(entry)
+            used['summary'] += entry[1]
+            remaining -= entry[1]
+
+    # Memories taken out of ranking order are listed in ranking order
+    rank = {id(entry): position for position, entry in enumerate(others)}
+    taken['memories'].sort(key=lambda entry: rank[id(entry)])
+
+    dropped = {
+        'summary': int(bool(summary) and not taken['summary']),
+        'preferences': len(preferences) - len(taken['preferences']),
+        'turns': len(turns) - len(taken['turns']),
+        'memories': len(others) - len(taken['memories']),
+    }
+
+    # Turns were taken newest first; prompts list them in chronological order
+    taken['turns'].reverse()
+
+    parts: List[str] = []
+    for name in SECTION_ORDER:
+        if not taken[name]:
+            continue
+        if SECTION_HEADERS[name]:
+            parts.append(SECTION_HEADERS[name])
+        for lines, _ in taken[name]:
+            parts.extend(lines)
+
+    if guidance_entry:
+        parts.extend(guidance_entry[0])
+        used['guidance'] = guidance_entry[1]
+
+    return PackedContext(parts, sum(used.values()), used, dropped)
+
+
+class PromptSizeStats:
+    """
+    Process-wide histograms of packed context and prompt sizes.
+
+    Context sizes are recorded when prompts are packed; full prompt sizes
+    are recorded with the upstream latency of the request, so the mean
+    latency per size bucket shows what a larger budget costs. Streamed and
+    non-streamed requests measure different latencies and are kept in
+    separate histograms, one per PROMPT_LATENCY_MODES entry. A summary is
+    logged every PROMPT_SIZE_LOG_INTERVAL packed prompts.
+    """
+
+    def __init__(self, buckets: Sequence[int] = PROMPT_SIZE_BUCKETS,
+                 log_interval: int = PROMPT_SIZE_LOG_INTERVAL):
+        self.buckets = tuple(buckets)
+        self.log_interval = log_interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear all recorded sizes."""
+        slots = len(self.buckets) + 1
+        self.context_counts = [0] * slots
+        self.prompt_counts = {mode: [0] * slots for mode in PROMPT_LATENCY_MODES}
+        self.latency_sums = {mode: [0.0] * slots for mode in PROMPT_LATENCY_MODES}
+        self.section_tokens: Dict[str, int] = {}
+        self.dropped: Dict[str, int] = {}
+        self.packed = 0
+        self.truncated = 0
+
+    def _bucket(self, tokens: int) -> int:
+        for index, bound in enumerate(self.buckets):
+            if tokens <= bound:
+                return index
+        return len(self.buckets)
+
+    def _label(self, index: int) -> str:
+        if index < len(self.buckets):
+            return f"<={self.buckets[index]}"
+        return f">{self.buckets[-1]}"
+
+    def record_context(self, packed: PackedContext) -> None:
+        """Record the size of a packed context."""
+        with self._lock:
+            self.context_counts[self._bucket(packed.tokens)] += 1
+            for name, tokens in packed.section_tokens.items():
+                self.section_tokens[name] = self.section_tokens.get(name, 0) + tokens
+            for name, count in packed.dropped.items():
+                self.dropped[name] = self.dropped.get(name, 0) + count
+            self.packed += 1
+            if any(packed.dropped.values()):
+                self.truncated += 1
+            should_log = self.packed % self.log_interval == 0
+
+        if should_log:
+            self.log()
+
+    def record_prompt(self, prompt_tokens: int, latency_seconds: float, mode: str) -> None:
+        """
+        Record the size of a full prompt and the latency of its request.
+
+        Args:
+            prompt_tokens: Estimated tokens of the system prompt and message
+            latency_seconds: Latency of the request, as measured by the mode
+            mode: 'first_token' for the time until a streamed reply started
+                arriving, 'full_response' for the whole request time of a
+                reply that is not streamed
+        """
+        if mode not in PROMPT_LATENCY_MODES:
+            raise ValueError(f"Unknown prompt latency mode: {mode}")
+        with self._lock:
+            index = self._bucket(prompt_tokens)
+            self.prompt_counts[mode][index] += 1
+            self.latency_sums[mode][index] += latency_seconds
+
+    def summary(self) -> Dict[str, Any]:
+        """Get the recorded histograms."""
+        with self._lock:
+            packed = self.packed or 1
+            return {
+                'packed': self.packed,
+                'truncated': self.truncated,
+                'context_tokens': {
+                    self._label(i): count for i, count in enumerate(self.context_counts)
+                },
+                'prompt_tokens': {
+                    mode: {self._label(i): count for i, count in enumerate(counts)}
+                    for mode, counts in self.prompt_counts.items()
+                },
+                'mean_latency_seconds': {
+                    mode: {
+                        self._label(i): self.latency_sums[mode][i] / count
+                        for i, count in enumerate(counts) if count
+                    }
+                    for mode, counts in self.prompt_counts.items()
+                },
+                'mean_section_tokens': {
+                    name: tokens / packed for name, tokens in self.section_tokens.items()
+                },
+                'dropped': dict(self.dropped),
+            }
+
+    def log(self) -> None:
+        """Log the recorded histograms."""
+        stats = self.summary()
+        context = ", ".join(f"{label}: {count}" for label, count in stats['context_tokens'].items() if count)
+        prompts = "; ".join(
+            f"prompt tokens and mean {mode} latency [" + ", ".join(
+                f"{label}: {stats['prompt_tokens'][mode][label]} ({latency:.2f}s)"
+                for label, latency in latencies.items()
+            ) + "]"
+            for mode, latencies in stats['mean_latency_seconds'].items()
+        )
+        sections = ", ".join(f"{name}: {tokens:.0f}" for name, tokens in stats['mean_section_tokens'].items())
+        info(f"Prompt sizes after {stats['packed']} prompts ({stats['truncated']} truncated) - "
+             f"context tokens [{context}]; {prompts}; "
+             f"mean tokens per section [{sections}]; dropped entries {stats['dropped']}")
+
+
+# Shared statistics for the process
+prompt_size_stats = PromptSizeStats()
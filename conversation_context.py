@@ -9,13 +9,19 @@ more personalized and coherent responses.
 import json
 import logging
 import re
+import time
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional, Tuple, Union, Set
 
+from sqlalchemy import case, func, or_, update
 from sqlalchemy.exc import SQLAlchemyError
 from database import db, safe_commit, create_model, update_model, safe_query
 from models import ConversationContext, ConversationMemoryItem, ChatHistory, User
 from logging_config import get_logger, error, debug, warning, info
+from memory_index import memory_indexes
+from context_packer import pack_context, prompt_size_stats
+from prompt_snapshot import prompt_snapshots, fetch_context_state, message_to_dict, PROMPT_HISTORY_TURNS
+from memory_clustering import find_similar_clusters
 
 # Initialize OpenAI for memory extraction and context summarization
 from openai import OpenAI
@@ -125,6 +131,15 @@ MAX_MEMORY_ITEMS = 8  # Increased from 5 for more comprehensive memory
 # Memory relevance decay factor (per day)
 MEMORY_DECAY_FACTOR = 0.95  # Increased from 0.9 for slower memory decay
 
+# Relevance floor for decayed memories
+MIN_MEMORY_RELEVANCE = 0.1
+
+# Primary-key range processed per decay UPDATE
+DECAY_BATCH_SIZE = 5000
+
+# Contexts loaded per query during batch consolidation
+CONSOLIDATION_CONTEXT_BATCH = 100
+
 # User preference weight multiplier (increases priority of preference memories)
 USER_PREFERENCE_WEIGHT = 1.5
 
@@ -272,6 +287,7 @@ def transfer_key_memories(old_context_id: int, new_context_id: int, transition_m
 
             new_memory = create_model(ConversationMemoryItem, memory_data)
             if new_memory:
+                memory_indexes.memory_added(new_memory)
                 transferred_count += 1
 
         if transferred_count > 0:
@@ -389,6 +405,8 @@ def add_message_to_context(
             warning(f"Failed to update message {message_id} with context {context_id}")
             return False
 
+        prompt_snapshots.message_added(context_id, message)
+
         # Extract memories if requested
         if extract_memories:
             # Don't wait for memory extraction to complete
@@ -420,14 +438,7 @@ def get_context_messages(context_id: int, limit: int = MAX_CONTEXT_MESSAGES) ->
             .all()
 
         # Convert to dictionaries and reverse to chronological order
-        message_dicts = [{
-            'id': msg.id,
-            'user_message': msg.user_message,
-            'ai_response': msg.ai_response,
-            'mood': msg.mood,
-            'nlp_technique': msg.nlp_technique,
-            'created_at': msg.created_at.isoformat()
-        } for msg in messages]
+        message_dicts = [message_to_dict(msg) for msg in messages]
 
         return list(reversed(message_dicts))
 
@@ -503,6 +514,7 @@ JSON:"""
 
                 memory_item = create_model(ConversationMemoryItem, memory_data)
                 if memory_item:
+                    memory_indexes.memory_added(memory_item)
                     created_items.append(memory_item)
 
             except (ValueError, TypeError) as e:
@@ -521,7 +533,8 @@ JSON:"""
 def get_relevant_memories(
     context_id: int,
     current_message: str,
-    limit: int = MAX_MEMORY_ITEMS
+    limit: int = MAX_MEMORY_ITEMS,
+    memory_stats: Optional[Tuple[int, Optional[int]]] = None
 ) -> List[Dict[str, Any]]:
     """
     Get memory items relevant to the current message.
@@ -530,6 +543,7 @@ def get_relevant_memories(
         context_id: The context ID
         current_message: The current user message
         limit: Maximum number of items to retrieve
+        memory_stats: The context's memory (count, highest ID) if already known
 
     Returns:
         List of memory dictionaries with memory_type, content, and relevance
@@ -538,158 +552,10 @@ def get_relevant_memories(
         # Analyze user message for sentiment and key topics
         message_sentiment, message_topics = analyze_message_semantic(current_message)
 
-        # Get memory items sorted by relevance * confidence
-        # If we found sentiment, prioritize memories matching that sentiment
-        query = ConversationMemoryItem.query.filter_by(context_id=context_id)
-
-        # Apply special weighting for preferences
-        memory_items = query.all()
-
-        # If no memory items found, return empty list
-        if not memory_items:
-            return []
-
-        # Apply custom weighting and scoring
-        weighted_items = []
-        for item in memory_items:
-            # Base score is relevance * confidence
-            base_score = item.relevance * item.confidence
-
-            # Apply preference boosting for preference type memories
-            if item.memory_type == 'preference':
-                base_score *= USER_PREFERENCE_WEIGHT
-
-            # Apply recency boost (newer memories get priority)
-            days_old = (datetime.utcnow() - item.created_at).days
-            recency_factor = max(0.5, 1.0 - (days_old * 0.01))  # Gentle decay
-
-            # Apply sentiment matching bonus if we have detected sentiment
-            sentiment_match = 1.0
-            if message_sentiment and message_sentiment in item.content.lower():
-                sentiment_match = 1.25  # 25% boost for emotion-matching memories
-
-            # Combine all factors
-            final_score = base_score * recency_factor * sentiment_match
-
-            weighted_items.append((item, final_score))
-
-        # Sort by final score descending
-        weighted_items.sort(key=lambda x: x[1], reverse=True)
-
-        # If we have fewer items than limit, return all of them
-        if len(weighted_items) <= limit:
-            return [{
-                'memory_type': item.memory_type,
-                'content': item.content,
-                'confidence': item.confidence,
-                'relevance': item.relevance,
-                'created_at': item.created_at.isoformat() if item.created_at else None
-            } for item, _ in weighted_items]
-
-        # Pre-select items based on our weighting system
-        selected_items = weighted_items[:limit]
-        return [{
-            'memory_type': item.memory_type,
-            'content': item.content,
-            'confidence': item.confidence,
-            'relevance': item.relevance,
-            'created_at': item.created_at.isoformat() if item.created_at else None
-        } for item, _ in selected_items]
-        # Parse response as a list of indices
-        try:
-            # Extract indices from response
-            response_text = response.strip()
-            indices = []
-
-            # Enhanced parsing that handles different formats
-            patterns = [r'\d+']  # Look for numbers
-            for pattern in patterns:
-                for match in re.finditer(pattern, response_text):
-                    try:
-                        idx = int(match.group()) - 1  # Convert to 0-based index
-                        if 0 <= idx < len(memory_items) and idx not in indices:
-                            indices.append(idx)
-                    except ValueError:
-                        continue
-
-            # If we found indices and have enough, use them
-            if indices and len(indices) >= min(3, limit):
-                # Update the last_used_at timestamp for these memory items
-                for idx in indices[:limit]:
-                    memory_item = memory_items[idx]
-                    update_data = {'last_used_at': datetime.utcnow()}
-                    success = update_model(memory_item, update_data)
-                    if not success:
-                        warning(f"Failed to update last_used_at for memory item {memory_item.id}")
-
-                # Return the selected items
-                return [{
-                    'memory_type': memory_items[idx].memory_type,
-                    'content': memory_items[idx].content,
-                    'confidence': memory_items[idx].confidence,
-                    'relevance': memory_items[idx].relevance,
-                    'created_at': memory_items[idx].created_at.isoformat() if memory_items[idx].created_at else None
-                } for idx in indices[:limit]]
-
-            # Fallback to simpler approach - prioritize memory types based on message
-            prioritized_items = []
-
-            # Check if message contains questions or concerns
-            if any(q in current_message.lower() for q in ['?', 'how', 'what', 'why', 'when', 'where', 'who', 'which', 'can you', 'could you']):
-                # Prioritize facts for questions
-                for item in memory_items:
-                    if item.memory_type == 'fact':
-                        prioritized_items.append(item)
-
-            # Check if message expresses emotional content
-            emotion_keywords = ['feel', 'feeling', 'felt', 'sad', 'happy', 'angry', 'upset', 'excited', 'worried', 'anxious']
-            if any(emotion in current_message.lower() for emotion in emotion_keywords):
-                # Prioritize preferences and concerns for emotional context
-                for item in memory_items:
-                    if item.memory_type in ['preference', 'concern']:
-                        prioritized_items.append(item)
-
-            # Add goals for forward-looking messages
-            future_keywords = ['want', 'hope', 'plan', 'future', 'will', 'going to', 'intend', 'aim']
-            if any(future in current_message.lower() for future in future_keywords):
-                for item in memory_items:
-                    if item.memory_type == 'goal':
-                        prioritized_items.append(item)
-
-            # Add remaining items to fill up to the limit
-            remaining_items = [item for item in memory_items if item not in prioritized_items]
-            combined_items = prioritized_items + remaining_items
-
-            # Return the combined and deduplicated items up to the limit
-            selected_items = []
-            seen_ids = set()
-            for item in combined_items:
-                if item.id not in seen_ids and len(selected_items) < limit:
-                    selected_items.append(item)
-                    seen_ids.add(item.id)
-
-                    # Update last used timestamp
-                    update_data = {'last_used_at': datetime.utcnow()}
-                    update_model(item, update_data)
-
-            return [{
-                'memory_type': item.memory_type,
-                'content': item.content,
-                'confidence': item.confidence,
-                'relevance': item.relevance,
-                'created_at': item.created_at.isoformat() if item.created_at else None
-            } for item in selected_items]
-
-        except Exception as e:
-            # Fall back to the first 'limit' items
-            warning(f"Error parsing memory relevance results: {str(e)}")
-            return [{
-                'memory_type': item.memory_type,
-                'content': item.content,
-                'confidence': item.confidence,
-                'relevance': item.relevance,
-                'created_at': item.created_at.isoformat() if item.created_at else None
-            } for item in memory_items[:limit]]
+        # Score memories from the cached per-context index instead of
+        # loading and ranking every memory item on each turn
+        index = memory_indexes.get(context_id, preference_weight=USER_PREFERENCE_WEIGHT, stats=memory_stats)
+        return index.select(limit, sentiment=message_sentiment)
 
     except Exception as e:
         error_type = type(e).__name__
@@ -782,38 +648,87 @@ def decay_memory_relevance() -> int:
     Returns:
         The number of memory items updated
     """
-    try:
-        # Calculate decay factor based on days since last update
-        # For simplicity, we'll use a fixed daily decay
+    return bulk_decay_memory_relevance()['rows_updated']
+
+
+def bulk_decay_memory_relevance(
+    batch_size: int = DECAY_BATCH_SIZE,
+    start_after_id: int = 0,
+    pause: float = 0.0
+) -> Dict[str, Any]:
+    """
+    Decay the relevance of stale memory items with set-based UPDATEs.
+
+    Items not used in the past day have their relevance multiplied by
+    MEMORY_DECAY_FACTOR, with a floor of MIN_MEMORY_RELEVANCE. The work is
+    split into primary-key ranges of ``batch_size`` rows, each applied as a
+    single UPDATE and committed on its own, so row locks are held only
+    briefly and live traffic can interleave between batches.
+
+    Args:
+        batch_size: Width of each primary-key range
+        start_after_id: Resume cursor; only items with a greater ID are decayed
+        pause: Seconds to sleep between batches to throttle the job
+
+    Returns:
+        Dictionary with rows_updated, batches, last_id (the progress cursor
+        to resume from after an interruption) and elapsed_seconds
+    """
+    start_time = time.time()
+    stats = {'rows_updated': 0, 'batches': 0, 'last_id': start_after_id, 'elapsed_seconds': 0.0}
 
-        # Get items not updated in the past day
+    try:
         cutoff_date = datetime.utcnow() - timedelta(days=1)
-        items = ConversationMemoryItem.query.filter(
-            (ConversationMemoryItem.last_used_at == None) |
-            (ConversationMemoryItem.last_used_at < cutoff_date)
-        ).all()
+        max_id = db.session.query(func.max(ConversationMemoryItem.id)).scalar() or 0
+
+        decayed = ConversationMemoryItem.relevance * MEMORY_DECAY_FACTOR
+        new_relevance = case(
+            (decayed < MIN_MEMORY_RELEVANCE, MIN_MEMORY_RELEVANCE),
+            else_=decayed
+        )
 
-        update_count = 0
-        for item in items:
-            # Apply decay factor
-            new_relevance = max(0.1, item.relevance * MEMORY_DECAY_FACTOR)
+        cursor = start_after_id
+        while cursor < max_id:
+            upper = cursor + batch_size
+            result = db.session.execute(
+                update(ConversationMemoryItem)
+                .where(
+                    ConversationMemoryItem.id > cursor,
+                    ConversationMemoryItem.id <= upper,
+                    or_(
+                        ConversationMemoryItem.last_used_at.is_(None),
+                        ConversationMemoryItem.last_used_at < cutoff_date
+                    ),
+                    # Skip rows the decay would leave unchanged
+                    ConversationMemoryItem.relevance != MIN_MEMORY_RELEVANCE
+                )
+                .values(relevance=new_relevance)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
 
-            # If relevance changed, update the item
-            if new_relevance != item.relevance:
-                update_data = {'relevance': new_relevance}
-                success = update_model(item, update_data)
-                if success:
-                    update_count += 1
+            # Mirror only the committed range, so resumed and failed runs
+            # leave the rest of the cached indexes alone
+            if result.rowcount:
+                memory_indexes.memories_decayed(MEMORY_DECAY_FACTOR, MIN_MEMORY_RELEVANCE, cutoff_date,
+                                                after_id=cursor, up_to_id=upper)
 
-        if update_count > 0:
-            info(f"Decayed relevance for {update_count} memory items")
+            stats['rows_updated'] += result.rowcount or 0
+            stats['batches'] += 1
+            stats['last_id'] = cursor = min(upper, max_id)
 
-        return update_count
+            if pause:
+                time.sleep(pause)
 
     except Exception as e:
+        db.session.rollback()
         error_type = type(e).__name__
-        error(f"Error ({error_type}) decaying memory relevance: {str(e)}")
-        return 0
+        error(f"Error ({error_type}) decaying memory relevance after ID {stats['last_id']}: {str(e)}")
+
+    stats['elapsed_seconds'] = round(time.time() - start_time, 3)
+    info(f"Decayed relevance for {stats['rows_updated']} memory items in {stats['batches']} batches "
+         f"({stats['elapsed_seconds']}s, cursor {stats['last_id']})")
+    return stats
 
 
 def consolidate_memories(context_id: int, threshold: float = 0.7) -> int:
@@ -830,53 +745,14 @@ def consolidate_memories(context_id: int, threshold: float = 0.7) -> int:
     """
     try:
         # Get all memory items for the context
-        memory_items = ConversationMemoryItem.query.filter_by(context_id=context_id).all()
+        memory_items = ConversationMemoryItem.query.filter_by(context_id=context_id) \
+            .order_by(ConversationMemoryItem.id) \
+            .all()
 
         if len(memory_items) < 3:  # Not enough memories to consolidate
             return 0
 
-        # Group memories by type
-        memories_by_type = {}
-        for item in memory_items:
-            if item.memory_type not in memories_by_type:
-                memories_by_type[item.memory_type] = []
-            memories_by_type[item.memory_type].append(item)
-
-        consolidated_count = 0
-
-        # Process each memory type group
-        for memory_type, items in memories_by_type.items():
-            if len(items) < 2:  # Need at least 2 items to consolidate
-                continue
-
-            # Prepare memory content strings for comparison
-            memory_texts = [item.content for item in items]
-
-            # If there are many items, use AI to consolidate them
-            if len(memory_texts) >= 3:
-                consolidated_items = consolidate_memories_with_ai(memory_type, memory_texts, context_id)
-                if consolidated_items:
-                    consolidated_count += len(memory_texts) - len(consolidated_items)
-            else:
-                # For just a few items, use simple string similarity
-                # This is a basic approach - could be enhanced with embeddings
-                clusters = []
-                for i, item1 in enumerate(items):
-                    added = False
-                    for cluster in clusters:
-                        if any(string_similarity(item1.content, item2.content) > threshold
-                               for item2 in cluster):
-                            cluster.append(item1)
-                            added = True
-                            break
-                    if not added:
-                        clusters.append([item1])
-
-                # Merge clusters with multiple items
-                for cluster in clusters:
-                    if len(cluster) > 1:
-                        merge_memory_cluster(cluster)
-                        consolidated_count += len(cluster) - 1
+        consolidated_count = consolidate_memory_items(memory_items, threshold)
 
         if consolidated_count > 0:
             info(f"Consolidated {consolidated_count} memory items for context {context_id}")
@@ -889,139 +765,106 @@ def consolidate_memories(context_id: int, threshold: float = 0.7) -> int:
         return 0
 
 
-def consolidate_memories_with_ai(memory_type: str, memory_texts: List[str], context_id: int) -> List[ConversationMemoryItem]:
+def consolidate_memory_items(memory_items: List[ConversationMemoryItem], threshold: float = 0.7) -> int:
     """
-    Use AI to consolidate similar memories into more coherent items.
+    Merge near-duplicate memory items of the same context and type.
+
+    Candidates are found with MinHash/LSH clustering, so the cost grows with
+    the number of memories rather than the number of memory pairs.
 
     Args:
-        memory_type: Type of memories being consolidated
-        memory_texts: List of memory content strings
-        context_id: The context ID
+        memory_items: Memory items belonging to a single context
+        threshold: Jaccard similarity above which memories are merged
 
     Returns:
-        List of newly created memory items
+        Number of memory items removed by merging
     """
-    if not memory_texts:
-        return []
-
-    # Format the memories for the prompt
-    memories_formatted = "\n".join([f"- {txt}" for txt in memory_texts])
-
-    prompt = f"""Analyze these memory items of type '{memory_type}' and consolidate similar ones:
-
-{memories_formatted}
-
-Instructions:
-1. Identify related or overlapping memories
-2. Combine them into more comprehensive memory statements
-3. Preserve all important details from the original memories
-4. Create 1-3 consolidated memory items
-
-Return a JSON array with these fields:
-- content: The consolidated memory statement
-- confidence: Number from 0.0-1.0 indicating confidence (usually higher than individual memories)
+    # Group memories by type
+    memories_by_type: Dict[str, List[ConversationMemoryItem]] = {}
+    for item in memory_items:
+        memories_by_type.setdefault(item.memory_type, []).append(item)
 
-JSON:"""
+    consolidated_count = 0
 
-    messages = [
-        {"role": "system", "content": "You are an AI that consolidates similar memory items from conversations."},
-        {"role": "user", "content": prompt}
-    ]
+    for memory_type, items in memories_by_type.items():
+        if len(items) < 2:  # Need at least 2 items to consolidate
+            continue
 
-    # Skip OpenAI memory consolidation for now - using Claude only
-    response = "[]"
+        clusters = find_similar_clusters([item.content for item in items], threshold)
 
-    # Parse and create new memory items
-    try:
-        consolidated = json.loads(response)
-        if not isinstance(consolidated, list):
-            return []
+        # Merge clusters with multiple items
+        for cluster in clusters:
+            if merge_memory_cluster([items[index] for index in cluster], commit=False):
+                consolidated_count += len(cluster) - 1
 
-        created_items = []
-        for memory in consolidated:
-            if not isinstance(memory, dict) or 'content' not in memory:
-                continue
-
-            memory_data = {
-                'context_id': context_id,
-                'memory_type': memory_type,
-                'content': memory.get('content', ''),
-                'confidence': float(memory.get('confidence', 0.9)),
-                'relevance': 1.0,  # Start with full relevance for new consolidated items
-                'created_at': datetime.utcnow()
-            }
-
-            memory_item = create_model(ConversationMemoryItem, memory_data)
-            if memory_item:
-                created_items.append(memory_item)
-
-        # If consolidation worked, delete the original items
-        if created_items:
-            # Get all memory items with the same content
-            original_items = ConversationMemoryItem.query.filter(
-                ConversationMemoryItem.context_id == context_id,
-                ConversationMemoryItem.memory_type == memory_type
-            ).all()
-
-            # Collect IDs of items to delete
-            item_ids_to_delete = []
-            for item in original_items:
-                if item.content in memory_texts:
-                    item_ids_to_delete.append(item.id)
-
-            # Delete the original items if we found any
-            if item_ids_to_delete:
-                ConversationMemoryItem.query.filter(
-                    ConversationMemoryItem.id.in_(item_ids_to_delete)
-                ).delete(synchronize_session=False)
-                db.session.commit()
-
-        return created_items
+    # Commit all merges for the context at once
+    if consolidated_count > 0 and not safe_commit():
+        memory_indexes.invalidate(memory_items[0].context_id)
+        return 0
 
-    except json.JSONDecodeError:
-        warning(f"Failed to parse consolidated memories response")
-        return []
-    except Exception as e:
-        error_type = type(e).__name__
-        error(f"Error ({error_type}) creating consolidated memories: {str(e)}")
-        return []
+    return consolidated_count
 
 
-def string_similarity(s1: str, s2: str) -> float:
+def consolidate_all_memories(threshold: float = 0.7, min_items: int = 3,
+                             context_batch_size: int = CONSOLIDATION_CONTEXT_BATCH) -> Dict[str, Any]:
     """
-    Calculate similarity between two strings.
-    This is a simple Jaccard similarity on word sets.
+    Consolidate memories across every context in one batch run.
+
+    Contexts with at least ``min_items`` memories are processed in groups of
+    ``context_batch_size``, loading each group's memories with one query.
+    Run periodically by consolidate_memories.py.
 
     Args:
-        s1: First string
-        s2: Second string
+        threshold: Jaccard similarity above which memories are merged
+        min_items: Minimum memories a context needs to be considered
+        context_batch_size: Contexts loaded per query
 
     Returns:
-        Similarity score between 0.0 and 1.0
+        Dictionary with contexts_processed, memories_consolidated and
+        elapsed_seconds
     """
-    if not s1 or not s2:
-        return 0.0
+    start_time = time.time()
+    stats = {'contexts_processed': 0, 'memories_consolidated': 0, 'elapsed_seconds': 0.0}
+
+    try:
+        context_ids = [row[0] for row in db.session.query(ConversationMemoryItem.context_id)
+                       .group_by(ConversationMemoryItem.context_id)
+                       .having(func.count(ConversationMemoryItem.id) >= min_items)
+                       .all()]
 
-    # Convert to lowercase and split into words
-    words1 = set(s1.lower().split())
-    words2 = set(s2.lower().split())
+        for offset in range(0, len(context_ids), context_batch_size):
+            batch_ids = context_ids[offset:offset + context_batch_size]
+            items = ConversationMemoryItem.query.filter(ConversationMemoryItem.context_id.in_(batch_ids)) \
+                .order_by(ConversationMemoryItem.context_id, ConversationMemoryItem.id) \
+                .all()
 
-    # Calculate Jaccard similarity
-    intersection = len(words1.intersection(words2))
-    union = len(words1.union(words2))
+            items_by_context: Dict[int, List[ConversationMemoryItem]] = {}
+            for item in items:
+                items_by_context.setdefault(item.context_id, []).append(item)
 
-    if union == 0:
-        return 0.0
+            for context_items in items_by_context.values():
+                stats['memories_consolidated'] += consolidate_memory_items(context_items, threshold)
+                stats['contexts_processed'] += 1
 
-    return intersection / union
+    except Exception as e:
+        db.session.rollback()
+        error_type = type(e).__name__
+        error(f"Error ({error_type}) consolidating memories across contexts: {str(e)}")
 
+    stats['elapsed_seconds'] = round(time.time() - start_time, 3)
+    info(f"Consolidated {stats['memories_consolidated']} memory items across "
+         f"{stats['contexts_processed']} contexts in {stats['elapsed_seconds']}s")
+    return stats
 
-def merge_memory_cluster(cluster: List[ConversationMemoryItem]) -> Optional[ConversationMemoryItem]:
+
+def merge_memory_cluster(cluster: List[ConversationMemoryItem], commit: bool = True) -> Optional[ConversationMemoryItem]:
     """
     Merge a cluster of similar memory items into a single, more comprehensive item.
 
     Args:
         cluster: List of similar memory items
+        commit: Whether to commit immediately; batch callers pass False and
+            commit once for all clusters
 
     Returns:
         The merged memory item or None if merge failed
@@ -1066,13 +909,23 @@ def merge_memory_cluster(cluster: List[ConversationMemoryItem]) -> Optional[Conv
             'updated_at': datetime.utcnow()
         }
 
-        success = update_model(base_item, update_data)
+        if commit:
+            success = update_model(base_item, update_data)
+        else:
+            for key, value in update_data.items():
+                setattr(base_item, key, value)
+            success = True
 
         if success:
             # Delete the other items that were merged
+            merged_ids = [item.id for item in sorted_items[1:]]
             for item in sorted_items[1:]:
                 db.session.delete(item)
-            db.session.commit()
+            if commit:
+                db.session.commit()
+
+            memory_indexes.memory_added(base_item)
+            memory_indexes.memories_removed(base_item.context_id, merged_ids)
             return base_item
 
         return None
@@ -1101,13 +954,28 @@ def enhance_prompt_with_context(
     Returns:
         Tuple of (enhanced system prompt, context_id or None)
     """
-    # Get active context
-    context = get_or_create_context(user_id, session_id)
-    if not context:
-        return system_prompt, None
-
-    # Get recent messages
-    recent_messages = get_context_messages(context.id, limit=5)
+    # Get the active context with the validators of its cached snapshot
+    state = fetch_context_state(user_id, session_id)
+    if state is None:
+        context = get_or_create_context(user_id, session_id)
+        if not context:
+            return system_prompt, None
+        state = fetch_context_state(user_id, session_id)
+        if state is None:
+            return system_prompt, None
+
+    context_id = state.context_id
+    memory_stats = (state.memory_count, state.memory_max_id)
+
+    # Reuse the recent messages of the snapshot unless the context has
+    # messages the snapshot has not seen
+    snapshot = prompt_snapshots.get(context_id)
+    if snapshot is None or not snapshot.is_current(state.last_message_id):
+        snapshot = prompt_snapshots.load(
+            context_id, get_context_messages(context_id, limit=PROMPT_HISTORY_TURNS)
+        )
+    snapshot.summary = state.summary
+    recent_messages = list(snapshot.turns)
 
     # Check if this is a new topic that should trigger a context switch
     if recent_messages and len(recent_messages) >= 2:
@@ -1117,62 +985,43 @@ def enhance_prompt_with_context(
             new_context = create_new_context(user_id, session_id, transition_message)
             if new_context:
                 info(f"Switched to new conversation context {new_context.id}")
-                context = new_context
+                context_id = new_context.id
+                memory_stats = None
 
-                # Update recent messages with the new context
-                recent_messages = []  # No messages in the new context yet
+                # No messages in the new context yet
+                snapshot = prompt_snapshots.load(context_id, [])
+                recent_messages = []
 
     # Get relevant memories for the current message
-    memories = get_relevant_memories(context.id, user_message)
+    memories = get_relevant_memories(context_id, user_message, memory_stats=memory_stats)
 
-    # If we have more than 10 memories in this context, try consolidating them
-    memory_count = ConversationMemoryItem.query.filter_by(context_id=context.id).count()
-    if memory_count > 10:
+    # If we have more than 10 memories in this context, try consolidating
+    # them, unless the memories are unchanged since the last attempt
+    memory_count = memory_stats[0] if memory_stats else 0
+    if memory_count > 10 and memory_count != snapshot.consolidated_count:
         try:
-            consolidated = consolidate_memories(context.id)
+            consolidated = consolidate_memories(context_id)
             if consolidated > 0:
-                info(f"Consolidated {consolidated} memories in context {context.id}")
+                info(f"Consolidated {consolidated} memories in context {context_id}")
+            snapshot.consolidated_count = memory_count - consolidated
         except Exception as e:
             warning(f"Memory consolidation failed: {str(e)}")
 
-    # Build context section of the prompt
-    context_parts = []
-
-    # Add conversation summary if available
-    if context.summary:
-        context_parts.append(f"CONVERSATION SUMMARY: {context.summary}")
-
-    # Add recent conversation history if available
-    if recent_messages:
-        context_parts.append("RECENT CONVERSATION:")
-        for msg in recent_messages:
-            context_parts.append(f"User: {msg['user_message']}")
-            context_parts.append(f"You: {msg['ai_response']}")
-
-    # Add relevant memories if available
-    if memories:
-        context_parts.append("IMPORTANT CONTEXT ABOUT THE USER:")
-        for memory in memories:
-            memory_type = memory['memory_type'].upper()
-            content = memory['content']
-            context_parts.append(f"- {memory_type}: {content}")
-
-    # Add user preferences if available (focus on preferences memory type)
-    user_preferences = [m for m in memories if m['memory_type'] == 'preference']
-    if user_preferences:
-        context_parts.append("USER PREFERENCES (Be sure to respect these in your response):")
-        for pref in user_preferences:
-            context_parts.append(f"- {pref['content']}")
-
     # Add guidance for empathetic response based on conversation history
+    guidance = None
     if recent_messages and any('mood' in msg and msg['mood'] in ['sad', 'anxious', 'angry', 'frustrated'] for msg in recent_messages):
-        context_parts.append("COMMUNICATION GUIDANCE: The user appears to be experiencing challenging emotions. Respond with extra empathy and support. Acknowledge their feelings before offering perspectives or suggestions.")
+        guidance = "COMMUNICATION GUIDANCE: The user appears to be experiencing challenging emotions. Respond with extra empathy and support. Acknowledge their feelings before offering perspectives or suggestions."
+
+    # Build the context section of the prompt within the token budget
+    packed = pack_context(snapshot.summary, snapshot.turn_entries(), memories, guidance)
+    prompt_size_stats.record_context(packed)
+    context_parts = packed.parts
 
     # If we have context, add it to the system prompt
     if context_parts:
         context_text = "\n\n".join(context_parts)
         enhanced_prompt = f"{system_prompt}\n\n===\nCONVERSATION CONTEXT:\n{context_text}\n===\n\nUse this context to inform your response while maintaining a natural conversational tone. Reference relevant past information without explicitly stating 'based on our previous conversation' or similar phrases that break immersion."
-        return enhanced_prompt, context.id
+        return enhanced_prompt, context_id
 
     # Otherwise, return the original prompt
-    return system_prompt, context.id
\ No newline at end of file
+    return system_prompt, context_id
\ No newline at end of file
@@ -48,6 +48,29 @@ def add_column_if_not_exists(table_name, column_name, column_type):
         logger.error(f"Error adding column {column_name} to {table_name}: {str(e)}")
         raise
 
+def create_index_if_not_exists(index_name, table_name, column_names):
+    """
+    Create an index on a table if it doesn't already exist.
+
+    Args:
+        index_name (str): Name of the index, matching the model's index name
+        table_name (str): Name of the table
+        column_names (list): Names of the indexed columns
+    """
+    try:
+        with db.engine.connect() as conn:
+            logger.info(f"Creating index {index_name} on {table_name} if it doesn't exist")
+            create_query = (
+                f"CREATE INDEX IF NOT EXISTS {index_name} "
+                f"ON {table_name} ({', '.join(column_names)})"
+            )
+            conn.execute(db.text(create_query))
+            conn.commit()
+
+    except Exception as e:
+        logger.error(f"Error creating index {index_name} on {table_name}: {str(e)}")
+        raise
+
 def create_all_tables():
     """Create all database tables."""
     try:
@@ -80,6 +103,14 @@ def update_database_schema():
         add_column_if_not_exists('users', 'reset_token_expiry', 'TIMESTAMP')
         add_column_if_not_exists('users', 'auth_provider', 'VARCHAR(20)')
 
+        # Add audit hash chain position
+        add_column_if_not_exists('audit_logs', 'sequence', 'BIGINT')
+
+        # Add usage quota lookup indexes, which create_all skips on existing tables
+        create_index_if_not_exists('ix_usage_quota_user_id', 'usage_quota', ['user_id'])
+        create_index_if_not_exists('ix_usage_quota_browser_session_id', 'usage_quota',
+                                   ['browser_session_id'])
+
         logger.info("Database schema update completed successfully")
         return True
     except Exception as e:
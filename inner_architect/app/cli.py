@@ -104,9 +104,27 @@ def create_subscription_command(user_id, plan_name):
         db.session.rollback()
         click.echo(f'Error creating subscription: {str(e)}')
 
+@click.command('ai-latency-benchmark')
+@click.option('--requests', 'request_count', default=200, help='Number of measured requests per run.')
+@click.option('--seed', default=None, type=int, help='Seed for the simulated latencies.')
+@with_appcontext
+def ai_latency_benchmark_command(request_count, seed):
+    """Compare AI call latency with and without hedging, using fake providers."""
+    from app.services.fake_providers import run_latency_benchmark
+
+    for hedge in (False, True):
+        result = run_latency_benchmark(request_count, hedge=hedge, seed=seed)
+        calls = ', '.join(f'{name}: {count}' for name, count in result['provider_calls'].items())
+        click.echo(
+            f"{'Hedged' if hedge else 'Unhedged'}: p50 {result['p50'] * 1000:.0f}ms, "
+            f"p95 {result['p95'] * 1000:.0f}ms, p99 {result['p99'] * 1000:.0f}ms, "
+            f"max {result['max'] * 1000:.0f}ms ({calls})"
+        )
+
 def register_commands(app):
     """Register Flask CLI commands."""
     app.cli.add_command(init_db_command)
     app.cli.add_command(init_exercises_command)
     app.cli.add_command(create_admin_command)
-    app.cli.add_command(create_subscription_command)
\ No newline at end of file
+    app.cli.add_command(create_subscription_command)
+    app.cli.add_command(ai_latency_benchmark_command)
\ No newline at end of file
@@ -8,6 +8,7 @@ when one becomes unavailable.
 import os
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import Dict, Any, List, Optional, Callable, Tuple
 from functools import wraps
 
@@ -15,16 +16,18 @@ from functools import wraps
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
-from api_fallback import APIError, APITimeoutError, APIConnectionError, APIResponseError
+from api_fallback import APIError, APITimeoutError, APIConnectionError, APIResponseError, APIOverloadedError
 from api_fallback import with_retry_and_timeout, get_fallback_response
+from provider_guard import provider_guard
 
 # Import monitoring utilities
 try:
-    from ..utils.monitoring import track_api_call
+    from ..utils.monitoring import track_api_call, metrics_collector
     from ..utils.logging_setup import log_api_call
     MONITORING_AVAILABLE = True
 except ImportError:
     MONITORING_AVAILABLE = False
+    metrics_collector = None
     # Create dummy decorator if monitoring is not available
     def track_api_call(f):
         return f
@@ -35,33 +38,58 @@ except ImportError:
 # Initialize logger
 logger = logging.getLogger('inner_architect.ai_client_factory')
 
+# Successful calls in the latency window needed before latency is used for routing
+LATENCY_MIN_SAMPLES = 20
+
+# A provider whose median latency exceeds the fastest provider's by this
+# factor is tried after faster providers, regardless of priority
+LATENCY_DEMOTION_FACTOR = 3.0
+
+# Bounds for the hedge delay (seconds), which follows the primary's p95
+HEDGE_MIN_DELAY = 0.05
+HEDGE_MAX_DELAY = 10.0
+
+# The hedge delay is at most this multiple of the primary's p50, since the
+# p95 is the slow tail itself once 5% of calls are slow
+HEDGE_MAX_P50_MULTIPLE = 3.0
+
+# Hedge delay while there are too few samples for a p95 (seconds)
+DEFAULT_HEDGE_DELAY = 5.0
+
+# Threads running hedged provider calls
+HEDGE_MAX_WORKERS = 16
+
 class AIClientFactory:
     """
     Factory for creating and managing AI provider clients.
     Handles automatic fallback between providers when one fails.
+
+    Provider failures, cooldowns and capacity are tracked by the provider
+    guard, which all worker processes share. Providers whose recent median
+    latency is much higher than the fastest provider's are tried last, and
+    requests can be hedged: when the first provider has not answered within
+    its p95 latency (capped at a multiple of its p50), the next provider is
+    called as well and the first answer wins.
     """
 
-    def __init__(self):
+    def __init__(self, clients: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            clients: Provider clients to use instead of creating them from
+                the API keys in the environment (e.g. fake providers)
+        """
         # Available providers and their priorities (lower number = higher priority)
         self.providers = {
             'claude': {
                 'priority': 1,
                 'client': None,
                 'available': True,
-                'last_failure_time': 0,
-                'failure_count': 0,
-                'cooldown_period': 300,  # 5 minutes
-                'max_failures': 3,
                 'api_key_env': 'ANTHROPIC_API_KEY'
             },
             'openai': {
                 'priority': 2,
                 'client': None,
                 'available': True,
-                'last_failure_time': 0,
-                'failure_count': 0,
-                'cooldown_period': 300,  # 5 minutes
-                'max_failures': 3,
                 'api_key_env': 'OPENAI_API_KEY'
             }
         }
@@ -69,8 +97,18 @@ class AIClientFactory:
         # Current active provider
         self.active_provider = 'claude'
 
+        # Whether requests are hedged unless a call says otherwise
+        self.hedge_requests = os.environ.get('AI_HEDGE_REQUESTS', 'false').lower() == 'true'
+        self._hedge_executor = None
+
         # Initialize clients
-        self._initialize_clients()
+        if clients is not None:
+            for name, info in self.providers.items():
+                info['client'] = clients.get(name)
+                info['available'] = info['client'] is not None
+            self._set_active_provider()
+        else:
+            self._initialize_clients()
 
     def _initialize_clients(self):
         """Initialize AI clients for all providers."""
@@ -120,19 +158,10 @@ class AIClientFactory:
         }
 
         if not available_providers:
-            logger.error("No available AI providers found")
-            # Reset all providers if all are unavailable
-            self._reset_unavailable_providers()
-            # Try again with reset providers
-            available_providers = {
-                name: info for name, info in self.providers.items() if info['available']
-            }
-
-            if not available_providers:
-                # If still no available providers, use a dummy provider
-                logger.critical("All AI providers are unavailable")
-                self.active_provider = 'fallback'
-                return self.active_provider
+            # Open circuits are probed again by the guard after their cooldown
+            logger.critical("All AI providers are unavailable")
+            self.active_provider = 'fallback'
+            return self.active_provider
 
         # Sort by priority and get the highest priority provider
         sorted_providers = sorted(
@@ -153,38 +182,18 @@ class AIClientFactory:
             provider_name: Name of the provider to check
 
         Returns:
-            True if the provider has cooled down, False otherwise
+            True if the provider's circuit is not open, False otherwise
         """
-        provider = self.providers.get(provider_name)
-        if not provider:
+        if provider_name not in self.providers:
             return False
 
-        current_time = time.time()
-        cooldown_time = provider['last_failure_time'] + provider['cooldown_period']
-
-        # If the cooldown period has passed, reset the failure count
-        if current_time > cooldown_time and provider['failure_count'] > 0:
-            provider['failure_count'] = 0
-            logger.info(f"Provider {provider_name} cooldown period passed, resetting failure count")
-
-        return provider['failure_count'] < provider['max_failures']
-
-    def _reset_unavailable_providers(self):
-        """Reset all providers that are marked as unavailable."""
-        for name, info in self.providers.items():
-            if not info['available']:
-                # Only reset if the cooldown period has passed
-                current_time = time.time()
-                cooldown_time = info['last_failure_time'] + info['cooldown_period']
-
-                if current_time > cooldown_time:
-                    logger.info(f"Resetting provider {name} availability")
-                    info['available'] = True
-                    info['failure_count'] = 0
+        return provider_guard.allows(provider_name)
 
     def _mark_provider_failure(self, provider_name: str, error: Exception):
         """
-        Mark a provider as having failed and potentially make it unavailable.
+        Record that a call to a provider failed, switching providers if it is unavailable.
+
+        The failure itself is counted by the provider guard for every attempt.
 
         Args:
             provider_name: Name of the provider that failed
@@ -193,29 +202,142 @@ class AIClientFactory:
         if provider_name not in self.providers:
             return
 
-        provider = self.providers[provider_name]
-        provider['failure_count'] += 1
-        provider['last_failure_time'] = time.time()
+        logger.warning(f"Provider {provider_name} failed: {str(error)}")
 
-        logger.warning(
-            f"Provider {provider_name} failed (count: {provider['failure_count']}): {str(error)}"
-        )
+        # If this was the active provider and its circuit opened, switch to a new one
+        if self.active_provider == provider_name and not provider_guard.allows(provider_name):
+            logger.error(f"Provider {provider_name} is unavailable, switching providers")
+            self._set_active_provider()
+
+    def _provider_latency(self, provider_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the rolling latency percentiles of a provider.
+
+        Returns:
+            Dictionary with p50, p95 and samples, or None if there are too
+            few recent samples
+        """
+        if metrics_collector is None:
+            return None
+
+        latency = metrics_collector.get_latency_percentiles(provider_name)
+        if latency['samples'] < LATENCY_MIN_SAMPLES:
+            return None
+        return latency
+
+    def _candidate_providers(self) -> Tuple[List[str], bool]:
+        """
+        Get the providers to try, in order.
+
+        Providers are ordered by priority, except that providers that are
+        much slower than the fastest one are moved behind the others.
+
+        Returns:
+            Tuple of (provider names, whether any provider was skipped
+            because its circuit is open)
+        """
+        candidates = []
+        shed = False
+        for provider_name, info in sorted(self.providers.items(), key=lambda x: x[1]['priority']):
+            if not info['available']:
+                continue
+            if not self._is_provider_cooled_down(provider_name):
+                shed = True
+                continue
+            candidates.append(provider_name)
+
+        latencies = {name: self._provider_latency(name) for name in candidates}
+        medians = [latency['p50'] for latency in latencies.values() if latency]
+        if len(medians) > 1:
+            slow_threshold = min(medians) * LATENCY_DEMOTION_FACTOR
+            # Stable sort keeps the priority order within each group
+            candidates.sort(key=lambda name: bool(latencies[name] and latencies[name]['p50'] > slow_threshold))
+
+        return candidates, shed
+
+    def _hedge_delay(self, provider_name: str) -> float:
+        """Get how long to wait for a provider before hedging (its p95, at most a multiple of its p50)."""
+        latency = self._provider_latency(provider_name)
+        if latency is None:
+            return DEFAULT_HEDGE_DELAY
+        delay = min(latency['p95'], latency['p50'] * HEDGE_MAX_P50_MULTIPLE)
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, delay))
+
+    def _call_provider(self, func: Callable, provider_name: str, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        """Call a function with a provider's client, recording its latency and failures."""
+        call_kwargs = dict(kwargs, provider=provider_name, client=self.providers[provider_name]['client'])
+        start_time = time.time()
+        try:
+            result = func(*args, **call_kwargs)
+        except APIOverloadedError:
+            # Shed by the provider guard; the provider was not called
+            raise
+        except Exception as e:
+            if metrics_collector is not None:
+                metrics_collector.record_api_call(provider_name, func.__name__, time.time() - start_time,
+                                                  success=False, error=e)
+            self._mark_provider_failure(provider_name, e)
+            raise
+
+        if metrics_collector is not None:
+            metrics_collector.record_api_call(provider_name, func.__name__, time.time() - start_time, success=True)
+        return result
+
+    def _call_hedged(self, func: Callable, primary: str, backup: str,
+                     args: tuple, kwargs: Dict[str, Any]) -> Tuple[str, Any]:
+        """
+        Call the primary provider, and the backup as well if the primary is slow.
+
+        The backup is called once the primary has not answered within its
+        hedge delay, or right away if the primary fails. The first successful
+        answer is returned; the other call finishes in the background and
+        its answer is discarded.
 
-        # If max failures reached, mark as unavailable
-        if provider['failure_count'] >= provider['max_failures']:
-            provider['available'] = False
-            logger.error(
-                f"Provider {provider_name} marked as unavailable after {provider['failure_count']} failures"
-            )
+        Returns:
+            Tuple of (provider that answered, result)
 
-            # If this was the active provider, switch to a new one
-            if self.active_provider == provider_name:
-                self._set_active_provider()
+        Raises:
+            The backup's error if both providers fail
+        """
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS,
+                                                      thread_name_prefix='ai-hedge')
+
+        futures = {self._hedge_executor.submit(self._call_provider, func, primary, args, kwargs): primary}
+        delay = self._hedge_delay(primary)
+        done, pending = wait(futures, timeout=delay)
+        if not done:
+            logger.info(f"Hedging {primary} request with {backup} after {delay:.2f}s")
+            future = self._hedge_executor.submit(self._call_provider, func, backup, args, kwargs)
+            futures[future] = backup
+            pending.add(future)
+
+        last_error = None
+        while done or pending:
+            for future in done:
+                try:
+                    return futures[future], future.result()
+                except Exception as e:
+                    logger.warning(f"Provider {futures[future]} call failed: {str(e)}")
+                    last_error = e
+                    if len(futures) == 1:
+                        # The primary failed before the hedge delay
+                        backup_future = self._hedge_executor.submit(self._call_provider, func, backup, args, kwargs)
+                        futures[backup_future] = backup
+                        pending.add(backup_future)
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+        raise last_error
 
     def with_fallback(self, func: Callable) -> Callable:
         """
         Decorator to add provider fallback logic to API functions.
 
+        The decorated function accepts a hedge keyword argument that
+        overrides hedge_requests for the call.
+
         Args:
             func: Function to decorate
 
@@ -225,37 +347,44 @@ class AIClientFactory:
         @wraps(func)
         def wrapper(*args, **kwargs):
             last_error = None
+            hedge = kwargs.pop('hedge', None)
+            hedge = self.hedge_requests if hedge is None else hedge
             context = kwargs.get('context', {})
 
-            # Try each available provider
-            for provider_name, info in sorted(
-                self.providers.items(),
-                key=lambda x: x[1]['priority']
-            ):
-                if not info['available'] or not self._is_provider_cooled_down(provider_name):
-                    continue
-
-                # Set the client for this attempt
-                kwargs['provider'] = provider_name
-                kwargs['client'] = info['client']
+            # Try each available provider, hedging with the next one if enabled
+            candidates, shed = self._candidate_providers()
+            position = 0
+            while position < len(candidates):
+                provider_name = candidates[position]
+                backup = candidates[position + 1] if hedge and position + 1 < len(candidates) else None
 
                 try:
-                    result = func(*args, **kwargs)
+                    if backup:
+                        provider_name, result = self._call_hedged(func, provider_name, backup, args, kwargs)
+                    else:
+                        result = self._call_provider(func, provider_name, args, kwargs)
                     # If successful, update active provider if it changed
                     if provider_name != self.active_provider:
                         logger.info(f"Switching active provider from {self.active_provider} to {provider_name}")
                         self.active_provider = provider_name
                     return result
+                except APIOverloadedError as e:
+                    # Shed by the provider guard; try the next provider without waiting
+                    logger.warning(f"Provider {provider_name} call shed: {str(e)}")
+                    last_error = e
                 except Exception as e:
                     logger.warning(f"Provider {provider_name} call failed: {str(e)}")
                     last_error = e
-                    self._mark_provider_failure(provider_name, e)
+
+                position += 2 if backup else 1
 
             # All providers failed, return fallback response
             logger.error("All providers failed, returning fallback response")
 
             # Determine error type
-            if isinstance(last_error, APITimeoutError):
+            if isinstance(last_error, APIOverloadedError) or (last_error is None and shed):
+                error_type = "overloaded"
+            elif isinstance(last_error, APITimeoutError):
                 error_type = "timeout"
             elif isinstance(last_error, APIConnectionError):
                 error_type = "connection"
@@ -285,7 +414,8 @@ class AIClientFactory:
         model: Optional[str] = None,
         temperature: float = 0.7,
         max_tokens: int = 1000,
-        context: Optional[Dict[str, Any]] = None
+        context: Optional[Dict[str, Any]] = None,
+        hedge: Optional[bool] = None
     ) -> Dict[str, Any]:
         """
         Send a chat completion request to the active provider with fallback.
@@ -296,6 +426,8 @@ class AIClientFactory:
             temperature: Sampling temperature
             max_tokens: Maximum number of tokens to generate
             context: Optional context dictionary for fallback responses
+            hedge: Whether to hedge the request with a second provider
+                (defaults to the AI_HEDGE_REQUESTS setting)
 
         Returns:
             Dictionary with the model's response
@@ -394,7 +526,8 @@ class AIClientFactory:
             temperature=temperature,
             max_tokens=max_tokens,
             context=context,
-            request_id=request_id
+            request_id=request_id,
+            hedge=hedge
         )
 
         # Add request metadata to the result
@@ -0,0 +1,151 @@
+"""
+Fake AI providers for measuring provider routing and hedging locally.
+
+The fake clients mimic the parts of the Anthropic and OpenAI clients that
+AIClientFactory uses and answer after a latency drawn from a configurable
+profile, so the effect of hedged requests on tail latency can be measured
+without calling the real APIs:
+
+    flask ai-latency-benchmark --requests 200
+"""
+import os
+import time
+import random
+import tempfile
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from .ai_client_factory import AIClientFactory
+from ..utils.monitoring import percentile
+
+# Importable once ai_client_factory has added the project root to the path
+import api_fallback
+from provider_guard import ProviderGuard
+
+# Default latency profiles: the primary is usually fast but has a slow tail
+DEFAULT_PROFILES = {
+    'claude': {'latency': 0.02, 'jitter': 0.01, 'tail_probability': 0.05, 'tail_latency': 0.4},
+    'openai': {'latency': 0.03, 'jitter': 0.01, 'tail_probability': 0.01, 'tail_latency': 0.4},
+}
+
+# Requests used to collect latency samples before measuring
+WARMUP_REQUESTS = 30
+
+
+class FakeProvider:
+    """
+    Draws response latencies from a profile.
+
+    Attributes:
+        profile: Dictionary with latency, jitter, tail_probability and
+            tail_latency (seconds)
+        calls: Number of calls received
+        gate: Event that calls wait for instead of the drawn latency, so
+            tests decide when the provider answers
+    """
+
+    def __init__(self, profile: Dict[str, float], seed: Optional[int] = None,
+                 gate: Optional[threading.Event] = None):
+        self.profile = profile
+        self.calls = 0
+        self.gate = gate
+        self._random = random.Random(seed)
+
+    def _respond(self) -> None:
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait()
+            return
+        if self._random.random() < self.profile.get('tail_probability', 0.0):
+            delay = self.profile['tail_latency']
+        else:
+            jitter = self._random.uniform(0, self.profile.get('jitter', 0.0))
+            delay = self.profile['latency'] + jitter
+        time.sleep(delay)
+
+
+class FakeClaudeClient(FakeProvider):
+    """Fake Anthropic client answering messages.create."""
+
+    def __init__(self, profile: Dict[str, float], seed: Optional[int] = None,
+                 gate: Optional[threading.Event] = None):
+        super().__init__(profile, seed, gate)
+        self.messages = SimpleNamespace(create=self._create)
+
+    def _create(self, model: str, **kwargs) -> Any:
+        self._respond()
+        return SimpleNamespace(model=model, content=[SimpleNamespace(text="Fake Claude response")])
+
+
+class FakeOpenAIClient(FakeProvider):
+    """Fake OpenAI client answering chat.completions.create."""
+
+    def __init__(self, profile: Dict[str, float], seed: Optional[int] = None,
+                 gate: Optional[threading.Event] = None):
+        super().__init__(profile, seed, gate)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, **kwargs) -> Any:
+        self._respond()
+        message = SimpleNamespace(content="Fake OpenAI response")
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(message=message)])
+
+
+def run_latency_benchmark(requests: int = 200, hedge: bool = True,
+                          profiles: Optional[Dict[str, Dict[str, float]]] = None,
+                          seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Send chat completions to fake providers and report the latency.
+
+    The provider guard is replaced by a private one for the run, so the
+    benchmark neither uses nor changes the shared provider state.
+
+    Args:
+        requests: Number of measured requests
+        hedge: Whether to hedge requests
+        profiles: Latency profiles per provider (DEFAULT_PROFILES by default)
+        seed: Seed for the latency draws
+
+    Returns:
+        Dictionary with p50, p95, p99 and max latency (seconds), and the
+        number of calls each provider received
+    """
+    profiles = profiles or DEFAULT_PROFILES
+    clients = {
+        'claude': FakeClaudeClient(profiles['claude'], seed),
+        'openai': FakeOpenAIClient(profiles['openai'], None if seed is None else seed + 1),
+    }
+    factory = AIClientFactory(clients=clients)
+    messages = [{'role': 'user', 'content': 'How can I reframe a stressful day?'}]
+
+    shared_guard = api_fallback.provider_guard
+    with tempfile.TemporaryDirectory() as state_dir:
+        unlimited = {'rate': 1e6, 'burst': 1e6, 'max_concurrent': 1e6}
+        api_fallback.provider_guard = ProviderGuard(
+            path=os.path.join(state_dir, 'provider_guard.sqlite3'),
+            limits={'claude': unlimited, 'openai': unlimited}
+        )
+        try:
+            for _ in range(WARMUP_REQUESTS):
+                factory.chat_completion(messages, hedge=False)
+            calls_before = {name: client.calls for name, client in clients.items()}
+
+            latencies: List[float] = []
+            for _ in range(requests):
+                start_time = time.time()
+                factory.chat_completion(messages, hedge=hedge)
+                latencies.append(time.time() - start_time)
+        finally:
+            api_fallback.provider_guard = shared_guard
+
+    return {
+        'hedge': hedge,
+        'requests': requests,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else 0.0,
+        'provider_calls': {name: client.calls - calls_before[name]
+                           for name, client in clients.items()}
+    }
@@ -15,6 +15,26 @@ from datetime import datetime, timedelta
 # Setup logger
 logger = logging.getLogger('inner_architect.monitoring')
 
+# Window for rolling provider latency percentiles
+LATENCY_WINDOW = timedelta(minutes=5)
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Get a percentile of a list of values using the nearest-rank method.
+    
+    Args:
+        values: Values to rank
+        pct: Percentile between 0 and 100
+        
+    Returns:
+        The percentile value, or 0.0 for an empty list
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(-(-pct * len(ordered) // 100)))
+    return ordered[min(rank, len(ordered)) - 1]
+
 # Singleton class for metrics collection
 class MetricsCollector:
     """
@@ -163,6 +183,29 @@ class MetricsCollector:
         endpoint_key = f"{provider}_{endpoint}"
         self._api_response_times[endpoint_key].append(duration)
     
+    def get_latency_percentiles(self, provider: str, window: timedelta = LATENCY_WINDOW) -> Dict[str, Any]:
+        """
+        Get rolling response time percentiles of a provider's successful calls.
+        
+        Args:
+            provider: API provider name (e.g., 'claude', 'openai')
+            window: Time range of the calls to include
+            
+        Returns:
+            Dictionary with p50, p95 (in seconds) and the number of samples
+        """
+        start_time = datetime.now() - window
+        durations = [
+            call['duration'] for call in list(self._api_calls)
+            if call['provider'] == provider and call['success'] and call['timestamp'] >= start_time
+        ]
+        
+        return {
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'samples': len(durations)
+        }
+    
     def record_error(self, source: str, error: Exception, metadata: Optional[Dict[str, Any]] = None) -> None:
         """
         Record an application error for metrics tracking.
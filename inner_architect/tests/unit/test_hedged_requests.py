@@ -0,0 +1,172 @@
+"""
+Unit tests for latency-aware provider routing and hedged requests.
+"""
+import threading
+
+import pytest
+
+from app.services import ai_client_factory as factory_module
+from app.services import fake_providers
+from app.services.ai_client_factory import AIClientFactory
+from app.services.fake_providers import FakeClaudeClient, FakeOpenAIClient, run_latency_benchmark
+from app.utils.monitoring import metrics_collector, percentile
+
+import api_fallback
+from provider_guard import ProviderGuard
+
+MESSAGES = [{'role': 'user', 'content': 'Hello'}]
+
+
+def steady(latency):
+    """Latency profile without a slow tail."""
+    return {'latency': latency, 'jitter': 0.0, 'tail_probability': 0.0, 'tail_latency': latency}
+
+
+def record_latency(provider, duration, count=25):
+    for _ in range(count):
+        metrics_collector.record_api_call(provider, '_chat_completion', duration, success=True)
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """Use a private provider guard without retry backoff, and start without latency samples."""
+    guard = ProviderGuard(path=str(tmp_path / 'provider_guard.sqlite3'))
+    monkeypatch.setattr(api_fallback, 'provider_guard', guard)
+    monkeypatch.setattr(factory_module, 'provider_guard', guard)
+    monkeypatch.setattr(api_fallback, 'MAX_BACKOFF', 0.0)
+    metrics_collector._api_calls.clear()
+    yield
+    metrics_collector._api_calls.clear()
+
+
+class FailingClaudeClient(FakeClaudeClient):
+    """Fake Anthropic client whose calls fail."""
+
+    def _create(self, model, **kwargs):
+        self.calls += 1
+        raise RuntimeError("upstream error 503")
+
+
+class TestPercentile:
+    """Tests for the nearest-rank percentile."""
+
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile(values, 100) == 100
+
+    def test_empty(self):
+        assert percentile([], 99) == 0.0
+
+
+class TestLatencyRouting:
+    """Tests for ordering providers by recent latency."""
+
+    def make_factory(self):
+        return AIClientFactory(clients={
+            'claude': FakeClaudeClient(steady(0.0)),
+            'openai': FakeOpenAIClient(steady(0.0)),
+        })
+
+    def test_priority_order_without_samples(self):
+        assert self.make_factory()._candidate_providers() == (['claude', 'openai'], False)
+
+    def test_slow_provider_is_demoted(self):
+        record_latency('claude', 2.0)
+        record_latency('openai', 0.5)
+
+        assert self.make_factory()._candidate_providers()[0] == ['openai', 'claude']
+
+    def test_moderately_slower_provider_keeps_priority(self):
+        record_latency('claude', 1.0)
+        record_latency('openai', 0.5)
+
+        assert self.make_factory()._candidate_providers()[0] == ['claude', 'openai']
+
+    def test_too_few_samples_are_ignored(self):
+        record_latency('claude', 2.0, count=factory_module.LATENCY_MIN_SAMPLES - 1)
+        record_latency('openai', 0.5)
+
+        assert self.make_factory()._candidate_providers()[0] == ['claude', 'openai']
+
+    def test_hedge_delay_follows_p95(self):
+        record_latency('claude', 0.2)
+        factory = self.make_factory()
+
+        assert factory._hedge_delay('claude') == pytest.approx(0.2)
+        assert factory._hedge_delay('openai') == factory_module.DEFAULT_HEDGE_DELAY
+
+    def test_hedge_delay_is_capped_by_p50(self):
+        # With 10% slow calls the p95 is the slow tail itself
+        record_latency('claude', 0.1, count=90)
+        record_latency('claude', 2.0, count=10)
+
+        delay = self.make_factory()._hedge_delay('claude')
+
+        assert delay == pytest.approx(0.1 * factory_module.HEDGE_MAX_P50_MULTIPLE)
+
+
+class TestHedgedRequests:
+    """Tests for hedging requests with a second provider."""
+
+    @pytest.fixture
+    def stalled(self):
+        """Event holding back a provider's answer until the test ends."""
+        gate = threading.Event()
+        yield gate
+        gate.set()
+
+    def test_slow_primary_is_hedged(self, monkeypatch, stalled):
+        monkeypatch.setattr(factory_module, 'DEFAULT_HEDGE_DELAY', 0.05)
+        clients = {'claude': FakeClaudeClient(steady(0.0), gate=stalled),
+                   'openai': FakeOpenAIClient(steady(0.0))}
+        factory = AIClientFactory(clients=clients)
+
+        result = factory.chat_completion(MESSAGES, hedge=True)
+
+        assert result['provider'] == 'openai'
+        assert clients['claude'].calls == 1
+
+    def test_fast_primary_is_not_hedged(self, monkeypatch):
+        monkeypatch.setattr(factory_module, 'DEFAULT_HEDGE_DELAY', 30.0)
+        clients = {'claude': FakeClaudeClient(steady(0.0)), 'openai': FakeOpenAIClient(steady(0.0))}
+        factory = AIClientFactory(clients=clients)
+
+        result = factory.chat_completion(MESSAGES, hedge=True)
+
+        assert result['provider'] == 'claude'
+        assert clients['openai'].calls == 0
+
+    def test_failed_primary_calls_backup_at_once(self):
+        clients = {'claude': FailingClaudeClient(steady(0.0)),
+                   'openai': FakeOpenAIClient(steady(0.0))}
+        factory = AIClientFactory(clients=clients)
+
+        result = factory.chat_completion(MESSAGES, hedge=True)
+
+        assert result['provider'] == 'openai'
+        assert result['is_fallback'] is False
+
+    def test_hedging_is_off_by_default(self, monkeypatch):
+        monkeypatch.setattr(factory_module, 'DEFAULT_HEDGE_DELAY', 0.05)
+        monkeypatch.delenv('AI_HEDGE_REQUESTS', raising=False)
+        clients = {'claude': FakeClaudeClient(steady(0.1)), 'openai': FakeOpenAIClient(steady(0.0))}
+        factory = AIClientFactory(clients=clients)
+
+        result = factory.chat_completion(MESSAGES)
+
+        assert result['provider'] == 'claude'
+        assert clients['openai'].calls == 0
+
+
+@pytest.mark.slow
+def test_hedging_reduces_tail_latency():
+    """The shipped benchmark profiles show the gain from hedging (wall-clock, run with -m slow)."""
+    unhedged = run_latency_benchmark(100, hedge=False, seed=3)
+    hedged = run_latency_benchmark(100, hedge=True, seed=3)
+
+    tail_latency = fake_providers.DEFAULT_PROFILES['claude']['tail_latency']
+    assert unhedged['p99'] >= tail_latency
+    assert hedged['p99'] < tail_latency / 2
+    assert 0 < hedged['provider_calls']['openai'] < 30
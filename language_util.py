@@ -18,6 +18,7 @@ from openai.types.chat import ChatCompletion
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 
 from logging_config import get_logger, info, error, debug, warning, critical, exception
+from response_cache import response_cache
 
 # Initialize OpenAI client
 # Get module-specific logger
@@ -220,6 +221,10 @@ def detect_language(text):
         # Default to English for now in this fallback
         return DEFAULT_LANGUAGE
     
+    cached = response_cache.get('detect_language', text)
+    if cached is not None:
+        return cached
+    
     # Use the safe chat completion helper
     prompt = f"""Detect the language of the following text. Respond with only the ISO 639-1 language code (e.g., 'en' for English, 'es' for Spanish, etc.).
 
@@ -238,7 +243,7 @@ Language code:"""
         model=DEFAULT_MODEL,
         max_tokens=10,
         temperature=0.3,  # Lower temperature for more deterministic output
-        fallback_response=DEFAULT_LANGUAGE
+        fallback_response=""
     ).lower()
     
     # Extract the language code if it's wrapped in quotes or other characters
@@ -246,7 +251,9 @@ Language code:"""
         lang_code = ''.join(c for c in lang_code if c.isalpha())
     
     # Verify it's a supported language code, default to English if not
+    # (failed calls return an empty string and are not cached)
     if lang_code in SUPPORTED_LANGUAGES:
+        response_cache.put('detect_language', text, lang_code)
         return lang_code
     
     return DEFAULT_LANGUAGE
@@ -0,0 +1,200 @@
+"""
+Memory Clustering Module for The Inner Architect
+
+This module finds near-duplicate conversation memories using MinHash
+signatures and locality-sensitive hashing (LSH), replacing pairwise
+comparison of every memory against every cluster member.
+
+Each text is tokenized once into a word set. MinHash signatures approximate
+Jaccard similarity between those sets, and LSH banding groups signatures so
+that only memories sharing a bucket are compared. Candidate pairs are then
+confirmed with the exact Jaccard similarity of their word sets, and
+confirmed pairs are joined into clusters with union-find.
+"""
+
+import hashlib
+import random
+from itertools import combinations
+from typing import Dict, FrozenSet, List, Sequence, Set, Tuple
+
+from logging_config import get_logger, debug
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Get module-specific logger
+logger = get_logger('memory_clustering')
+
+# Number of hash permutations per MinHash signature
+DEFAULT_NUM_PERM = 64
+
+# Multiply-shift hashing works modulo 2**64 and keeps the high 32 bits
+_MASK_64 = (1 << 64) - 1
+
+# Largest hash value kept in a signature
+_MAX_HASH = (1 << 32) - 1
+
+
+def tokenize(text: str) -> FrozenSet[str]:
+    """Split text into the lowercase word set used for similarity."""
+    return frozenset((text or '').lower().split())
+
+
+def jaccard(tokens1: FrozenSet[str], tokens2: FrozenSet[str]) -> float:
+    """Exact Jaccard similarity between two token sets."""
+    if not tokens1 or not tokens2:
+        return 0.0
+    union = len(tokens1 | tokens2)
+    return len(tokens1 & tokens2) / union if union else 0.0
+
+
+def _token_hash(token: str) -> int:
+    """Stable 32-bit hash of a token (independent of PYTHONHASHSEED)."""
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=4).digest(), 'little')
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Pick the LSH band layout for a similarity threshold.
+
+    The probability curve of b bands of r rows crosses 50% near
+    (1/b) ** (1/r). The layout whose crossing point is closest to, but not
+    above, the threshold is chosen so true matches are rarely missed.
+
+    Args:
+        num_perm: Signature length
+        threshold: Target Jaccard similarity
+
+    Returns:
+        Tuple of (bands, rows per band)
+    """
+    best = (num_perm, 1)
+    best_distance = float('inf')
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        crossing = (1.0 / bands) ** (1.0 / rows)
+        if crossing > threshold:
+            continue
+        distance = threshold - crossing
+        if distance < best_distance:
+            best, best_distance = (bands, rows), distance
+    return best
+
+
+class MinHashLSH:
+    """
+    MinHash signature generator with LSH banding.
+
+    Signatures are computed with the multiply-shift hash family
+    ``((a * x + b) mod 2**64) >> 32`` over 32-bit token hashes, which gives
+    identical results with and without NumPy.
+    """
+
+    def __init__(self, threshold: float = 0.7, num_perm: int = DEFAULT_NUM_PERM, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+
+        rng = random.Random(seed)
+        self._a = [rng.getrandbits(64) | 1 for _ in range(num_perm)]
+        self._b = [rng.getrandbits(64) for _ in range(num_perm)]
+
+        if NUMPY_AVAILABLE:
+            self._a_np = np.array(self._a, dtype=np.uint64)
+            self._b_np = np.array(self._b, dtype=np.uint64)
+
+    def signature(self, tokens: FrozenSet[str]) -> Tuple[int, ...]:
+        """Compute the MinHash signature of a token set."""
+        if not tokens:
+            return tuple([_MAX_HASH] * self.num_perm)
+
+        hashes = [_token_hash(token) for token in tokens]
+
+        if NUMPY_AVAILABLE:
+            values = np.array(hashes, dtype=np.uint64)[:, None]
+            # uint64 arithmetic wraps modulo 2**64
+            with np.errstate(over='ignore'):
+                permuted = (values * self._a_np + self._b_np) >> np.uint64(32)
+            return tuple(int(v) for v in permuted.min(axis=0))
+
+        return tuple(
+            min(((a * h + b) & _MASK_64) >> 32 for h in hashes)
+            for a, b in zip(self._a, self._b)
+        )
+
+    def candidate_pairs(self, signatures: Sequence[Tuple[int, ...]]) -> Set[Tuple[int, int]]:
+        """
+        Find index pairs that share at least one LSH bucket.
+
+        Args:
+            signatures: MinHash signatures, one per item
+
+        Returns:
+            Set of (i, j) index pairs with i < j
+        """
+        pairs: Set[Tuple[int, int]] = set()
+        for band in range(self.bands):
+            start = band * self.rows
+            buckets: Dict[Tuple[int, ...], List[int]] = {}
+            for index, signature in enumerate(signatures):
+                buckets.setdefault(signature[start:start + self.rows], []).append(index)
+
+            for members in buckets.values():
+                if len(members) > 1:
+                    pairs.update(combinations(members, 2))
+        return pairs
+
+
+def find_similar_clusters(texts: Sequence[str], threshold: float = 0.7,
+                          num_perm: int = DEFAULT_NUM_PERM) -> List[List[int]]:
+    """
+    Group near-duplicate texts into clusters.
+
+    Two texts are linked when the Jaccard similarity of their word sets is
+    above ``threshold``; clusters are the connected components of those links.
+
+    Args:
+        texts: Texts to cluster
+        threshold: Minimum Jaccard similarity for a link
+        num_perm: MinHash signature length
+
+    Returns:
+        Clusters of two or more indexes into ``texts``, each sorted ascending
+    """
+    if len(texts) < 2:
+        return []
+
+    # Tokenize each text exactly once
+    token_sets = [tokenize(text) for text in texts]
+
+    lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+    signatures = [lsh.signature(tokens) for tokens in token_sets]
+    candidates = lsh.candidate_pairs(signatures)
+
+    parent = list(range(len(texts)))
+
+    def find(index: int) -> int:
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    confirmed = 0
+    for i, j in candidates:
+        if jaccard(token_sets[i], token_sets[j]) > threshold:
+            confirmed += 1
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups: Dict[int, List[int]] = {}
+    for index in range(len(texts)):
+        groups.setdefault(find(index), []).append(index)
+
+    debug(f"LSH clustering: {len(texts)} texts, {len(candidates)} candidate pairs, {confirmed} confirmed")
+    return [members for members in groups.values() if len(members) > 1]
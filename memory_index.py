@@ -0,0 +1,457 @@
+"""
+Memory Index Module for The Inner Architect
+
+This module keeps a per-context scoring index over conversation memory items
+so relevant memories can be selected without loading and scoring every
+ConversationMemoryItem row on each chat turn.
+
+Each index stores the scoring columns (relevance, confidence, creation and
+last-use times) as arrays, plus an inverted token index over the memory
+content used for sentiment matching. Top-k selection uses a partial sort.
+Indexes are updated incrementally when memories are added, decayed or
+consolidated, and are revalidated against the database with a single
+aggregate query before use.
+
+The revalidation compares the item count and highest ID only, so it catches
+memories added or deleted by other processes but not score changes made
+there: a relevance decay run in another process shows up here when the
+index is rebuilt, at most INDEX_TTL seconds later. Rankings can be that far
+behind the database; the decay moves relevance by a few percent a day, so
+this only reorders near-ties.
+"""
+
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+
+from database import db
+from models import ConversationMemoryItem
+from logging_config import get_logger, debug
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Get module-specific logger
+logger = get_logger('memory_index')
+
+# Maximum number of context indexes kept per process
+MAX_INDEXED_CONTEXTS = 1024
+
+# Seconds before an index is rebuilt even if it looks current, which bounds
+# how long score changes made by other processes go unseen
+INDEX_TTL = 300
+
+# Seconds in a day, used for recency decay
+SECONDS_PER_DAY = 86400
+
+# Seconds a top-k ranking is reused while the index is unchanged
+TOP_K_CACHE_SECONDS = 60
+
+# Maximum cached rankings per index
+TOP_K_CACHE_ENTRIES = 32
+
+
+def _timestamp(value: Optional[datetime]) -> float:
+    """Convert a naive UTC datetime to epoch seconds (0.0 for None)."""
+    if value is None:
+        return 0.0
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+class ContextMemoryIndex:
+    """
+    Scoring index for the memory items of a single conversation context.
+
+    Rows are addressed by position; removed rows are tombstoned and compacted
+    once they make up half of the index.
+    """
+
+    def __init__(self, context_id: int, preference_weight: float = 1.0):
+        self.context_id = context_id
+        self.preference_weight = preference_weight
+        self.built_at = time.time()
+        # Incremented whenever scores or membership change
+        self.version = 0
+
+        self.ids: List[int] = []
+        self.memory_types: List[str] = []
+        self.contents: List[str] = []
+        self.created_at: List[Optional[datetime]] = []
+        self.positions: Dict[int, int] = {}
+
+        self._relevance: List[float] = []
+        self._confidence: List[float] = []
+        self._created_ts: List[float] = []
+        self._last_used_ts: List[float] = []
+        self._type_weight: List[float] = []
+        self._alive: List[bool] = []
+        self._arrays: Optional[Dict[str, Any]] = None
+
+        # Inverted index: token -> positions containing it
+        self.token_index: Dict[str, Set[int]] = {}
+        self._substring_cache: Dict[str, Set[int]] = {}
+
+        # Ranked IDs by (limit, sentiment, minute) for repeated turns
+        self._top_k_cache: Dict[Any, List[int]] = {}
+
+        # Guards every column; background jobs mutate while requests rank
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def max_id(self) -> int:
+        """Highest live memory ID in the index."""
+        with self._lock:
+            return max(self.positions) if self.positions else 0
+
+    def add(self, item: ConversationMemoryItem) -> None:
+        """Add or replace a memory item in the index."""
+        with self._lock:
+            if item.id in self.positions:
+                self.remove([item.id])
+
+            position = len(self.ids)
+            content = item.content or ''
+
+            self.ids.append(item.id)
+            self.memory_types.append(item.memory_type)
+            self.contents.append(content)
+            self.created_at.append(item.created_at)
+            self.positions[item.id] = position
+
+            self._relevance.append(float(item.relevance or 0.0))
+            self._confidence.append(float(item.confidence or 0.0))
+            self._created_ts.append(_timestamp(item.created_at))
+            self._last_used_ts.append(_timestamp(item.last_used_at))
+            self._type_weight.append(self.preference_weight if item.memory_type == 'preference' else 1.0)
+            self._alive.append(True)
+
+            for token in set(content.lower().split()):
+                self.token_index.setdefault(token, set()).add(position)
+
+            self._changed()
+            self._substring_cache.clear()
+
+    def remove(self, memory_ids: Iterable[int]) -> None:
+        """Remove memory items from the index."""
+        with self._lock:
+            removed = False
+            for memory_id in memory_ids:
+                position = self.positions.pop(memory_id, None)
+                if position is None:
+                    continue
+                self._alive[position] = False
+                removed = True
+
+            if not removed:
+                return
+
+            self._changed()
+            self._substring_cache.clear()
+
+            # Compact once tombstones dominate
+            if len(self.positions) * 2 < len(self.ids):
+                self._compact()
+
+    def apply_decay(self, factor: float, floor: float, cutoff: datetime,
+                    after_id: int = 0, up_to_id: Optional[int] = None) -> None:
+        """
+        Mirror a relevance decay pass for items not used since ``cutoff``.
+
+        Args:
+            factor: Multiplicative decay factor
+            floor: Minimum relevance after decay
+            cutoff: Items last used before this time (or never) are decayed
+            after_id: Only items with a greater ID were decayed
+            up_to_id: Only items with this ID or lower were decayed (None for no bound)
+        """
+        with self._lock:
+            cutoff_ts = _timestamp(cutoff)
+            for position, alive in enumerate(self._alive):
+                if not alive:
+                    continue
+                memory_id = self.ids[position]
+                if memory_id <= after_id or (up_to_id is not None and memory_id > up_to_id):
+                    continue
+                last_used = self._last_used_ts[position]
+                if last_used == 0.0 or last_used < cutoff_ts:
+                    self._relevance[position] = max(floor, self._relevance[position] * factor)
+            self._changed()
+
+    def _changed(self) -> None:
+        """Drop derived scoring data after the index changed."""
+        self.version += 1
+        self._arrays = None
+        self._top_k_cache.clear()
+
+    def _compact(self) -> None:
+        """Rebuild storage without tombstoned rows."""
+        live = [position for position, alive in enumerate(self._alive) if alive]
+
+        def keep(values: List[Any]) -> List[Any]:
+            return [values[position] for position in live]
+
+        self.ids = keep(self.ids)
+        self.memory_types = keep(self.memory_types)
+        self.contents = keep(self.contents)
+        self.created_at = keep(self.created_at)
+        self._relevance = keep(self._relevance)
+        self._confidence = keep(self._confidence)
+        self._created_ts = keep(self._created_ts)
+        self._last_used_ts = keep(self._last_used_ts)
+        self._type_weight = keep(self._type_weight)
+        self._alive = [True] * len(live)
+        self.positions = {memory_id: position for position, memory_id in enumerate(self.ids)}
+
+        self.token_index = {}
+        for position, content in enumerate(self.contents):
+            for token in set(content.lower().split()):
+                self.token_index.setdefault(token, set()).add(position)
+
+    def _positions_containing(self, text: str) -> Set[int]:
+        """
+        Positions whose content contains ``text`` as a substring.
+
+        ``text`` must not contain whitespace, so a substring match on the
+        content is equivalent to a substring match on one of its tokens. Only
+        the token vocabulary is scanned, not every memory.
+        """
+        cached = self._substring_cache.get(text)
+        if cached is not None:
+            return cached
+
+        matches: Set[int] = set()
+        for token, positions in self.token_index.items():
+            if text in token:
+                matches.update(positions)
+
+        self._substring_cache[text] = matches
+        return matches
+
+    def _get_arrays(self) -> Dict[str, Any]:
+        """Materialize the scoring columns as NumPy arrays."""
+        if self._arrays is None:
+            self._arrays = {
+                'static_score': np.asarray(self._relevance) * np.asarray(self._confidence) * np.asarray(self._type_weight),
+                'created_ts': np.asarray(self._created_ts),
+                'alive': np.asarray(self._alive, dtype=bool)
+            }
+        return self._arrays
+
+    def top_k(self, limit: int, sentiment: Optional[str] = None,
+              sentiment_boost: float = 1.25, now: Optional[datetime] = None) -> List[int]:
+        """
+        Select the highest scoring memory IDs.
+
+        The score is relevance * confidence * type weight * recency factor,
+        boosted when the content mentions the detected sentiment. The recency
+        factor decays by 1% per whole day of age with a floor of 0.5.
+
+        Args:
+            limit: Maximum number of memory IDs to return
+            sentiment: Sentiment detected in the current message
+            sentiment_boost: Multiplier for sentiment-matching memories
+            now: Reference time for recency (defaults to the current time)
+
+        Returns:
+            Memory IDs ordered by descending score
+        """
+        with self._lock:
+            if not self.positions or limit <= 0:
+                return []
+
+            if now is None:
+                # Recency only changes by whole days, so rankings are reused
+                # for up to TOP_K_CACHE_SECONDS
+                now_ts = _timestamp(datetime.utcnow())
+                cache_key = (limit, sentiment, sentiment_boost, int(now_ts // TOP_K_CACHE_SECONDS))
+                cached = self._top_k_cache.get(cache_key)
+                if cached is None:
+                    if len(self._top_k_cache) >= TOP_K_CACHE_ENTRIES:
+                        self._top_k_cache.clear()
+                    cached = self._rank(limit, sentiment, sentiment_boost, now_ts)
+                    self._top_k_cache[cache_key] = cached
+                return list(cached)
+
+            return self._rank(limit, sentiment, sentiment_boost, _timestamp(now))
+
+    def _rank(self, limit: int, sentiment: Optional[str], sentiment_boost: float,
+              now_ts: float) -> List[int]:
+        """Score live memories at now_ts and return the top IDs."""
+        sentiment_positions = self._positions_containing(sentiment) if sentiment else set()
+
+        if NUMPY_AVAILABLE:
+            arrays = self._get_arrays()
+            days_old = np.floor((now_ts - arrays['created_ts']) / SECONDS_PER_DAY)
+            recency = np.maximum(0.5, 1.0 - days_old * 0.01)
+            scores = arrays['static_score'] * recency
+
+            if sentiment_positions:
+                scores[list(sentiment_positions)] *= sentiment_boost
+
+            scores[~arrays['alive']] = -np.inf
+
+            k = min(limit, len(self.positions))
+            if k < len(scores):
+                candidates = np.argpartition(-scores, k - 1)[:k]
+            else:
+                candidates = np.flatnonzero(arrays['alive'])
+
+            # Stable ordering: score descending, then insertion order
+            ordered = sorted(candidates.tolist(), key=lambda p: (-scores[p], p))
+            return [self.ids[position] for position in ordered[:k]]
+
+        def score(position: int) -> float:
+            days_old = (now_ts - self._created_ts[position]) // SECONDS_PER_DAY
+            recency = max(0.5, 1.0 - days_old * 0.01)
+            value = self._relevance[position] * self._confidence[position] * self._type_weight[position] * recency
+            if position in sentiment_positions:
+                value *= sentiment_boost
+            return value
+
+        live = [position for position, alive in enumerate(self._alive) if alive]
+        best = heapq.nsmallest(limit, live, key=lambda p: (-score(p), p))
+        return [self.ids[position] for position in best]
+
+    def to_dict(self, memory_id: int) -> Dict[str, Any]:
+        """Return the memory dictionary used in prompts."""
+        with self._lock:
+            position = self.positions[memory_id]
+            created_at = self.created_at[position]
+            return {
+                'memory_type': self.memory_types[position],
+                'content': self.contents[position],
+                'confidence': self._confidence[position],
+                'relevance': self._relevance[position],
+                'created_at': created_at.isoformat() if created_at else None
+            }
+
+    def select(self, limit: int, sentiment: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Rank and return the top memory dictionaries in one locked step.
+
+        Args:
+            limit: Maximum number of memories to return
+            sentiment: Sentiment detected in the current message
+
+        Returns:
+            Memory dictionaries ordered by descending score
+        """
+        with self._lock:
+            return [self.to_dict(memory_id) for memory_id in self.top_k(limit, sentiment=sentiment)]
+
+
+class MemoryIndexRegistry:
+    """
+    Process-wide, bounded registry of context memory indexes.
+
+    Indexes are evicted least-recently-used once MAX_INDEXED_CONTEXTS is
+    reached.
+    """
+
+    def __init__(self, max_contexts: int = MAX_INDEXED_CONTEXTS, ttl: int = INDEX_TTL):
+        self.max_contexts = max_contexts
+        self.ttl = ttl
+        self._indexes: "OrderedDict[int, ContextMemoryIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def peek(self, context_id: int) -> Optional[ContextMemoryIndex]:
+        """Get an existing index without validating or building it."""
+        with self._lock:
+            return self._indexes.get(context_id)
+
+    def get(self, context_id: int, preference_weight: float = 1.0,
+            stats: Optional[Tuple[int, Optional[int]]] = None) -> ContextMemoryIndex:
+        """
+        Get a current index for a context, building it if necessary.
+
+        A cached index is reused only if it is younger than the TTL and its
+        item count and highest ID match the database, which catches memories
+        added or deleted by other processes. Relevance changes made by other
+        processes are only picked up when the TTL forces a rebuild.
+
+        Args:
+            context_id: The context ID
+            preference_weight: Score multiplier for preference memories
+            stats: The context's memory (count, highest ID) if the caller
+                already read them, saving the validation query
+        """
+        with self._lock:
+            index = self._indexes.get(context_id)
+
+        if index is not None and time.time() - index.built_at < self.ttl:
+            if stats is None:
+                stats = db.session.query(
+                    func.count(ConversationMemoryItem.id),
+                    func.max(ConversationMemoryItem.id)
+                ).filter(ConversationMemoryItem.context_id == context_id).one()
+            count, max_id = stats
+
+            if count == len(index) and (max_id or 0) == index.max_id:
+                with self._lock:
+                    if context_id in self._indexes:
+                        self._indexes.move_to_end(context_id)
+                return index
+
+        return self.build(context_id, preference_weight)
+
+    def build(self, context_id: int, preference_weight: float = 1.0) -> ContextMemoryIndex:
+        """Build an index for a context from the database."""
+        index = ContextMemoryIndex(context_id, preference_weight)
+        items = ConversationMemoryItem.query.filter_by(context_id=context_id) \
+            .order_by(ConversationMemoryItem.id) \
+            .all()
+        for item in items:
+            index.add(item)
+
+        with self._lock:
+            self._indexes[context_id] = index
+            self._indexes.move_to_end(context_id)
+            while len(self._indexes) > self.max_contexts:
+                self._indexes.popitem(last=False)
+
+        debug(f"Built memory index for context {context_id} with {len(index)} items")
+        return index
+
+    def memory_added(self, item: ConversationMemoryItem) -> None:
+        """Add a newly created memory item to its context index, if cached."""
+        index = self.peek(item.context_id)
+        if index is not None:
+            with self._lock:
+                index.add(item)
+
+    def memories_removed(self, context_id: int, memory_ids: Iterable[int]) -> None:
+        """Remove deleted memory items from a context index, if cached."""
+        index = self.peek(context_id)
+        if index is not None:
+            with self._lock:
+                index.remove(memory_ids)
+
+    def memories_decayed(self, factor: float, floor: float, cutoff: datetime,
+                         after_id: int = 0, up_to_id: Optional[int] = None) -> None:
+        """Apply a relevance decay pass over an ID range to every cached index."""
+        with self._lock:
+            for index in self._indexes.values():
+                index.apply_decay(factor, floor, cutoff, after_id, up_to_id)
+
+    def invalidate(self, context_id: Optional[int] = None) -> None:
+        """Drop the index for a context, or all indexes."""
+        with self._lock:
+            if context_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(context_id, None)
+
+
+# Shared registry for the process
+memory_indexes = MemoryIndexRegistry()
@@ -242,6 +242,48 @@ class ConversationMemoryItem(db.Model):
         return f'<ConversationMemoryItem {self.id}: {self.memory_type}>'
 
 
+class BackgroundJob(db.Model):
+    """Model for durable background jobs processed outside the request path."""
+    __tablename__ = 'background_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON-encoded job arguments
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # pending, running, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    last_error = db.Column(db.Text, nullable=True)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Earliest time the job may run
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BackgroundJob {self.id}: {self.job_type} ({self.status})>'
+
+
+class OfflineSyncAction(db.Model):
+    """Offline actions already applied by the sync API, keyed by client action ID."""
+    __tablename__ = 'offline_sync_actions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_key = db.Column(db.String(100), nullable=False)  # 'user:<id>' or 'session:<id>'
+    action_id = db.Column(db.String(100), nullable=False)  # Client-generated action ID
+    action_type = db.Column(db.String(50), nullable=False)
+    entity_key = db.Column(db.String(150), nullable=True)  # Record the action changes, if any
+    client_timestamp = db.Column(db.DateTime, nullable=True)  # When the client performed the action
+    result = db.Column(db.Text, nullable=False)  # JSON-encoded result returned to the client
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('owner_key', 'action_id', name='uq_offline_sync_actions_owner_action'),
+        # Latest applied action per record, for timestamp conflict resolution
+        db.Index('ix_offline_sync_actions_entity', 'owner_key', 'entity_key', 'client_timestamp'),
+    )
+
+    def __repr__(self):
+        return f'<OfflineSyncAction {self.owner_key}/{self.action_id}: {self.action_type}>'
+
+
 class JournalEntry(db.Model):
     """Model for user journal entries and reflections."""
     id = db.Column(db.Integer, primary_key=True)
@@ -319,6 +361,90 @@ class TechniqueUsageStats(db.Model):
         return f'<TechniqueUsageStats {self.technique} - Count: {self.usage_count}>'
 
 
+class AnalyticsDailyActivity(db.Model):
+    """Daily rollup of chat activity, maintained as chat and user rows are written."""
+    __tablename__ = 'analytics_daily_activity'
+
+    day = db.Column(db.Date, primary_key=True)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+    sessions_started = db.Column(db.Integer, nullable=False, default=0)
+    active_users = db.Column(db.Integer, nullable=False, default=0)  # Distinct users with a message that day
+    new_users = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<AnalyticsDailyActivity {self.day}: {self.messages} messages>'
+
+
+class AnalyticsUserDay(db.Model):
+    """Days on which each user sent a message, for distinct active user counts."""
+    __tablename__ = 'analytics_user_days'
+
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.String, primary_key=True)
+
+    # Per-user activity lookups when rebuilding activity bitmaps
+    __table_args__ = (db.Index('ix_analytics_user_days_user_day', 'user_id', 'day'),)
+
+    def __repr__(self):
+        return f'<AnalyticsUserDay {self.day}: {self.user_id}>'
+
+
+class AnalyticsUserActivity(db.Model):
+    """Per-user activity bitmap over the days after signup, for retention cohorts."""
+    __tablename__ = 'analytics_user_activity'
+
+    user_id = db.Column(db.String, primary_key=True)
+    signup_day = db.Column(db.Date, nullable=False)
+    # Bit N is set when the user was active N days after signup
+    activity_bits = db.Column(db.BigInteger, nullable=False, default=0)
+
+    # Covers cohort queries, which only read these two columns
+    __table_args__ = (db.Index('ix_analytics_user_activity_cohort', 'signup_day', 'activity_bits'),)
+
+    def __repr__(self):
+        return f'<AnalyticsUserActivity {self.user_id}: {self.signup_day}>'
+
+
+class AnalyticsSessionRollup(db.Model):
+    """Per-session message count and time span."""
+    __tablename__ = 'analytics_sessions'
+
+    session_id = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.String, nullable=True, index=True)
+    started_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_message_at = db.Column(db.DateTime, nullable=False, index=True)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<AnalyticsSessionRollup {self.session_id}: {self.messages} messages>'
+
+
+class AnalyticsTechniqueDaily(db.Model):
+    """Daily technique usage by mood ('' when no mood was given)."""
+    __tablename__ = 'analytics_technique_daily'
+
+    day = db.Column(db.Date, primary_key=True)
+    technique = db.Column(db.String(30), primary_key=True)
+    mood = db.Column(db.String(20), primary_key=True, default='')
+    uses = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<AnalyticsTechniqueDaily {self.day}: {self.technique}/{self.mood}>'
+
+
+class AnalyticsRatingDaily(db.Model):
+    """Daily count of technique ratings by rating value."""
+    __tablename__ = 'analytics_rating_daily'
+
+    day = db.Column(db.Date, primary_key=True)
+    technique = db.Column(db.String(30), primary_key=True)
+    rating = db.Column(db.Integer, primary_key=True)
+    ratings = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<AnalyticsRatingDaily {self.day}: {self.technique} rated {self.rating}>'
+
+
 class UserPreferences(db.Model):
     """Model for storing user preferences collected during onboarding."""
     id = db.Column(db.Integer, primary_key=True)
@@ -352,9 +478,9 @@ class UsageQuota(db.Model):
     __tablename__ = 'usage_quota'
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=True)
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=True, index=True)
     session_id = db.Column(db.String(64), nullable=True)  # Session ID for non-logged-in users
-    browser_session_id = db.Column(db.String(64), nullable=True)  # For backward compatibility
+    browser_session_id = db.Column(db.String(64), nullable=True, index=True)  # For backward compatibility
     quota_type = db.Column(db.String(30), nullable=True)  # e.g., 'messages_per_day', 'exercises_per_week'
     usage_count = db.Column(db.Integer, default=0)
 
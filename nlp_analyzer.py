@@ -10,6 +10,7 @@ from openai import OpenAI
 import os
 
 from logging_config import get_logger, info, error, debug, warning, critical, exception
+from response_cache import response_cache
 
 
 
@@ -49,6 +50,12 @@ def recommend_technique(message, mood):
             "explanation": "Technique recommendation requires API connection."
         }
     
+    # Messages repeat heavily for the same mood
+    cached = response_cache.get('recommend_technique', message, context=mood)
+    if cached is not None:
+        debug("Technique recommendation served from cache")
+        return cached
+    
     try:
         # Construct the prompt for the recommendation
         system_prompt = """You are an expert in Neuro-Linguistic Programming (NLP) techniques.
@@ -114,6 +121,7 @@ def recommend_technique(message, mood):
                 warning(f"API returned invalid technique: {recommendation.get('technique')}")
                 recommendation['technique'] = 'reframing'  # Default to a safe option
                 
+            response_cache.put('recommend_technique', message, recommendation, context=mood)
             return recommendation
         except json.JSONDecodeError as json_err:
             error(f"Failed to parse API response as JSON: {json_err}")
@@ -16,24 +16,30 @@ from typing import Dict, Any, Optional, Callable
 
 from flask import Flask
 
-from performance.performance_suite import (
-    PerformanceOptimizationSuite,
-    create_suite,
-    optimize_query,
-    profile_performance,
-    profile_memory
-)
-
 from performance.asset_optimizer import AssetOptimizer, register_asset_helper
 from performance.query_cache import setup_query_cache, cache_query
-from performance.memory_profiler import MemoryProfiler, profile_memory
-from performance.performance_monitor import PerformanceMonitor, profile
+
+# The profiling and monitoring tools need psutil; the caches do not, so
+# they stay importable (e.g. python -m performance.query_cache) without it
+try:
+    from performance.performance_suite import (
+        PerformanceOptimizationSuite,
+        create_suite,
+        optimize_query,
+        profile_performance,
+        profile_memory
+    )
+    from performance.memory_profiler import MemoryProfiler, profile_memory
+    from performance.performance_monitor import PerformanceMonitor, profile
+    PROFILING_AVAILABLE = True
+except ImportError:
+    PROFILING_AVAILABLE = False
 
 # Version
 __version__ = "1.0.0"
 
 
-def init_performance_suite(app: Flask, config: Optional[Dict[str, Any]] = None) -> PerformanceOptimizationSuite:
+def init_performance_suite(app: Flask, config: Optional[Dict[str, Any]] = None) -> "PerformanceOptimizationSuite":
     """
     Initialize the performance optimization suite with a Flask application.
     
@@ -44,6 +50,9 @@ def init_performance_suite(app: Flask, config: Optional[Dict[str, Any]] = None)
     Returns:
         Configured performance suite instance
     """
+    if not PROFILING_AVAILABLE:
+        raise ImportError("The performance suite requires psutil (pip install psutil)")
+
     # Create and initialize suite
     suite = create_suite(app)
     
@@ -56,16 +65,20 @@ def init_performance_suite(app: Flask, config: Optional[Dict[str, Any]] = None)
 
 
 __all__ = [
-    "PerformanceOptimizationSuite",
     "AssetOptimizer",
-    "MemoryProfiler",
-    "PerformanceMonitor",
     "init_performance_suite",
-    "create_suite",
-    "optimize_query",
-    "profile_performance",
-    "profile_memory",
     "cache_query",
-    "profile",
     "__version__",
-]
\ No newline at end of file
+]
+
+if PROFILING_AVAILABLE:
+    __all__ += [
+        "PerformanceOptimizationSuite",
+        "MemoryProfiler",
+        "PerformanceMonitor",
+        "create_suite",
+        "optimize_query",
+        "profile_performance",
+        "profile_memory",
+        "profile",
+    ]
\ No newline at end of file
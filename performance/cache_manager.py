@@ -7,9 +7,15 @@ supporting various cache backends and strategies for optimal performance.
 
 import time
 import json
+import heapq
+import math
+import pickle
+import random
+import sys
 import hashlib
 import logging
 import functools
+from collections import OrderedDict
 from typing import Any, Dict, List, Optional, Union, Callable, Tuple
 from datetime import datetime, timedelta
 import threading
@@ -32,6 +38,21 @@ try:
 except ImportError:
     MEMCACHE_AVAILABLE = False
 
+# Seconds a missing (None) result is cached to absorb repeated misses
+DEFAULT_NEGATIVE_TTL = 30
+
+# Maximum seconds an L1 entry of a tiered cache may outlive an L2 invalidation
+DEFAULT_L1_TTL = 30
+
+# Early refresh aggressiveness (beta in the XFetch algorithm); 0 disables it
+DEFAULT_EARLY_REFRESH_BETA = 1.0
+
+# Seconds a caller waits for another thread computing the same key
+SINGLE_FLIGHT_TIMEOUT = 30.0
+
+# Marker for values stored by CacheManager.get_or_set with refresh metadata
+_RECORD_MARKER = '__cache_record__'
+
 
 class CacheKey:
     """Utility for generating and managing cache keys."""
@@ -98,22 +119,107 @@ class CacheBackend:
     def exists(self, key: str) -> bool:
         """Check if key exists in cache."""
         raise NotImplementedError
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get cache statistics (backends without counters return an empty dict)."""
+        return {}
 
 
 class MemoryCacheBackend(CacheBackend):
-    """In-memory cache backend."""
+    """
+    In-memory cache backend with LRU eviction and proactive TTL expiry.
+
+    Entries are kept in an OrderedDict in recency order, so lookups, updates
+    and evictions are O(1). Expiry times are kept in a min-heap and expired
+    entries are purged on every write and read, not only when the expired key
+    itself is requested. Keys are indexed by namespace (the part before the
+    last ':', as produced by CacheKey.generate) so prefix clears only visit
+    matching keys.
+    """
     
-    def __init__(self, max_size: int = 1000):
+    def __init__(self, max_size: int = 1000, max_bytes: Optional[int] = None):
         """
         Initialize memory cache.
         
         Args:
             max_size: Maximum number of items to store
+            max_bytes: Optional limit on the estimated size of stored values
         """
-        self._cache: Dict[str, Tuple[Any, Optional[float]]] = {}  # (value, expiry)
+        self._cache: "OrderedDict[str, Tuple[Any, Optional[float], int]]" = OrderedDict()  # (value, expiry, size)
         self._max_size = max_size
+        self._max_bytes = max_bytes
         self._lock = threading.RLock()
         
+        # Min-heap of (expiry, key); entries superseded by a later set are skipped
+        self._expiry_heap: List[Tuple[float, str]] = []
+        
+        # Namespace -> keys, for prefix invalidation
+        self._namespaces: Dict[str, set] = {}
+        
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+    
+    @staticmethod
+    def _namespace(key: str) -> str:
+        """Get the namespace a key is indexed under."""
+        return key.rsplit(':', 1)[0]
+    
+    @staticmethod
+    def _estimate_size(value: Any) -> int:
+        """Estimate the size of a value in bytes."""
+        if isinstance(value, (str, bytes, bytearray)):
+            return sys.getsizeof(value)
+        try:
+            return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return sys.getsizeof(value)
+    
+    def _remove(self, key: str) -> None:
+        """Remove a key and its index entries. Caller holds the lock."""
+        _, _, size = self._cache.pop(key)
+        self._bytes -= size
+        
+        namespace = self._namespace(key)
+        keys = self._namespaces.get(namespace)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._namespaces[namespace]
+    
+    def _purge_expired(self, now: float) -> None:
+        """Remove all entries whose TTL has passed. Caller holds the lock."""
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expiry, key = heapq.heappop(heap)
+            entry = self._cache.get(key)
+            # Skip heap entries for keys that were deleted or re-set since
+            if entry is not None and entry[1] == expiry:
+                self._remove(key)
+                self._expirations += 1
+        
+        # Drop stale heap entries once they dominate the heap
+        if len(heap) > 2 * len(self._cache) + 64:
+            self._expiry_heap = [
+                (expiry, key) for expiry, key in heap
+                if key in self._cache and self._cache[key][1] == expiry
+            ]
+            heapq.heapify(self._expiry_heap)
+    
+    def purge_expired(self) -> int:
+        """
+        Remove all expired entries now.
+        
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            before = self._expirations
+            self._purge_expired(time.monotonic())
+            return self._expirations - before
+        
     def get(self, key: str) -> Optional[Any]:
         """
         Get value from cache.
@@ -125,17 +231,17 @@ class MemoryCacheBackend(CacheBackend):
             Cached value or None if not found or expired
         """
         with self._lock:
-            if key not in self._cache:
-                return None
-            
-            value, expiry = self._cache[key]
+            self._purge_expired(time.monotonic())
             
-            # Check if expired
-            if expiry is not None and time.time() > expiry:
-                del self._cache[key]
+            entry = self._cache.get(key)
+            if entry is None:
+                self._misses += 1
                 return None
-                
-            return value
+            
+            # Mark as most recently used
+            self._cache.move_to_end(key)
+            self._hits += 1
+            return entry[0]
     
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         """
@@ -147,21 +253,36 @@ class MemoryCacheBackend(CacheBackend):
             ttl: Time to live in seconds
             
         Returns:
-            True if successful
+            True if successful, False if the value exceeds max_bytes
         """
+        size = self._estimate_size(value) if self._max_bytes is not None else 0
+        if self._max_bytes is not None and size > self._max_bytes:
+            return False
+        
         with self._lock:
-            # Check if cache is full and needs eviction
-            if len(self._cache) >= self._max_size and key not in self._cache:
-                # Simple LRU: just remove a random key (not ideal but simple)
-                # In a real implementation, track access time and remove oldest
-                if self._cache:
-                    del self._cache[next(iter(self._cache))]
+            now = time.monotonic()
+            self._purge_expired(now)
+            
+            if key in self._cache:
+                self._remove(key)
+            
+            # Evict least recently used entries until the new one fits
+            while self._cache and (
+                len(self._cache) >= self._max_size or
+                (self._max_bytes is not None and self._bytes + size > self._max_bytes)
+            ):
+                self._remove(next(iter(self._cache)))
+                self._evictions += 1
             
             # Calculate expiry time if TTL provided
-            expiry = time.time() + ttl if ttl is not None else None
+            expiry = now + ttl if ttl is not None else None
+            if expiry is not None:
+                heapq.heappush(self._expiry_heap, (expiry, key))
             
-            # Store value and expiry
-            self._cache[key] = (value, expiry)
+            # Store value, expiry and size
+            self._cache[key] = (value, expiry, size)
+            self._bytes += size
+            self._namespaces.setdefault(self._namespace(key), set()).add(key)
             return True
     
     def delete(self, key: str) -> bool:
@@ -175,8 +296,9 @@ class MemoryCacheBackend(CacheBackend):
             True if key was found and deleted
         """
         with self._lock:
+            self._purge_expired(time.monotonic())
             if key in self._cache:
-                del self._cache[key]
+                self._remove(key)
                 return True
             return False
     
@@ -193,10 +315,22 @@ class MemoryCacheBackend(CacheBackend):
         with self._lock:
             if prefix is None:
                 self._cache.clear()
-            else:
-                keys_to_delete = [k for k in self._cache if k.startswith(prefix)]
-                for key in keys_to_delete:
-                    del self._cache[key]
+                self._expiry_heap.clear()
+                self._namespaces.clear()
+                self._bytes = 0
+                return True
+            
+            # A key starts with the prefix if its namespace does, or if the
+            # prefix extends into the last segment of the key
+            keys_to_delete = []
+            for namespace, keys in self._namespaces.items():
+                if namespace.startswith(prefix):
+                    keys_to_delete.extend(keys)
+                elif prefix.startswith(namespace):
+                    keys_to_delete.extend(k for k in keys if k.startswith(prefix))
+            
+            for key in keys_to_delete:
+                self._remove(key)
             return True
     
     def exists(self, key: str) -> bool:
@@ -210,24 +344,40 @@ class MemoryCacheBackend(CacheBackend):
             True if key exists and is not expired
         """
         with self._lock:
-            if key not in self._cache:
-                return False
-            
-            _, expiry = self._cache[key]
-            
-            # Check if expired
-            if expiry is not None and time.time() > expiry:
-                del self._cache[key]
-                return False
-                
-            return True
+            self._purge_expired(time.monotonic())
+            return key in self._cache
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics.
+        
+        Returns:
+            Dictionary with size, hit/miss/eviction/expiration counters and
+            byte usage (when max_bytes is set)
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "backend": "memory",
+                "size": len(self._cache),
+                "max_size": self._max_size,
+                "bytes": self._bytes if self._max_bytes is not None else None,
+                "max_bytes": self._max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "namespaces": len(self._namespaces)
+            }
 
 
 class RedisCacheBackend(CacheBackend):
     """Redis cache backend."""
     
     def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0, 
-                 password: Optional[str] = None, prefix: str = 'innerarchitect:'):
+                 password: Optional[str] = None, prefix: str = 'innerarchitect:',
+                 client: Any = None, serializer: str = 'json'):
         """
         Initialize Redis cache.
         
@@ -237,12 +387,17 @@ class RedisCacheBackend(CacheBackend):
             db: Redis database number
             password: Redis password
             prefix: Key prefix for namespacing
+            client: Existing Redis client to use instead of connecting
+            serializer: 'json' or 'pickle' (needed for ORM objects)
         """
-        if not REDIS_AVAILABLE:
-            raise ImportError("Redis package is not installed. Install with: pip install redis")
+        if client is None:
+            if not REDIS_AVAILABLE:
+                raise ImportError("Redis package is not installed. Install with: pip install redis")
+            client = redis.Redis(host=host, port=port, db=db, password=password)
         
-        self._redis = redis.Redis(host=host, port=port, db=db, password=password)
+        self._redis = client
         self._prefix = prefix
+        self._serializer = serializer
     
     def _prefixed_key(self, key: str) -> str:
         """Add prefix to key."""
@@ -263,6 +418,13 @@ class RedisCacheBackend(CacheBackend):
         
         if value is None:
             return None
+        
+        if self._serializer == 'pickle':
+            try:
+                return pickle.loads(value)
+            except (pickle.PickleError, TypeError, EOFError):
+                logger.warning(f"Failed to unpickle cached data for key: {key}")
+                return None
             
         try:
             return json.loads(value)
@@ -284,8 +446,14 @@ class RedisCacheBackend(CacheBackend):
         """
         prefixed_key = self._prefixed_key(key)
         
-        # Serialize value to JSON
-        if not isinstance(value, (str, bytes)):
+        # Serialize value
+        if self._serializer == 'pickle':
+            try:
+                value = pickle.dumps(value)
+            except (pickle.PickleError, TypeError, AttributeError):
+                logger.warning(f"Failed to pickle data for key: {key}")
+                return False
+        elif not isinstance(value, (str, bytes)):
             value = json.dumps(value)
         
         # Set in Redis with optional expiry
@@ -442,6 +610,174 @@ class MemcachedCacheBackend(CacheBackend):
         return self.get(prefixed_key) is not None
 
 
+class TieredCacheBackend(CacheBackend):
+    """
+    Two-tier cache: an in-process L1 in front of a shared L2 backend.
+    
+    Reads try L1 first and promote L2 hits into L1. Writes and deletes go to
+    both tiers. L1 entries live at most ``l1_ttl`` seconds, which bounds how
+    long another process's invalidation of L2 can go unnoticed.
+    """
+    
+    def __init__(self, l1: Optional[MemoryCacheBackend] = None, l2: Optional[CacheBackend] = None,
+                 l1_ttl: Optional[int] = DEFAULT_L1_TTL):
+        """
+        Initialize tiered cache.
+        
+        Args:
+            l1: In-process cache (defaults to a new MemoryCacheBackend)
+            l2: Shared cache such as Redis (optional)
+            l1_ttl: Maximum lifetime of L1 entries in seconds (None for no cap)
+        """
+        self.l1 = l1 or MemoryCacheBackend()
+        self.l2 = l2
+        self._l1_ttl = l1_ttl
+        self._l2_hits = 0
+        self._l2_errors = 0
+    
+    def _local_ttl(self, ttl: Optional[int]) -> Optional[int]:
+        """TTL to use for the L1 copy of an entry."""
+        if self.l2 is None or self._l1_ttl is None:
+            return ttl
+        return self._l1_ttl if ttl is None else min(ttl, self._l1_ttl)
+    
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get value from L1, falling back to L2.
+        
+        Args:
+            key: Cache key
+            
+        Returns:
+            Cached value or None
+        """
+        value = self.l1.get(key)
+        if value is not None or self.l2 is None:
+            return value
+        
+        try:
+            value = self.l2.get(key)
+        except Exception as e:
+            self._l2_errors += 1
+            logger.warning(f"L2 cache read failed for {key}: {e}")
+            return None
+        
+        if value is not None:
+            self._l2_hits += 1
+            self.l1.set(key, value, self._local_ttl(None))
+        return value
+    
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """
+        Set value in both tiers.
+        
+        Args:
+            key: Cache key
+            value: Value to cache
+            ttl: Time to live in seconds
+            
+        Returns:
+            True if the value was stored in at least one tier
+        """
+        stored = self.l1.set(key, value, self._local_ttl(ttl))
+        if self.l2 is not None:
+            try:
+                stored = self.l2.set(key, value, ttl) or stored
+            except Exception as e:
+                self._l2_errors += 1
+                logger.warning(f"L2 cache write failed for {key}: {e}")
+        return stored
+    
+    def delete(self, key: str) -> bool:
+        """
+        Delete key from both tiers.
+        
+        Args:
+            key: Cache key
+            
+        Returns:
+            True if key was deleted from either tier
+        """
+        deleted = self.l1.delete(key)
+        if self.l2 is not None:
+            try:
+                deleted = self.l2.delete(key) or deleted
+            except Exception as e:
+                self._l2_errors += 1
+                logger.warning(f"L2 cache delete failed for {key}: {e}")
+        return deleted
+    
+    def clear(self, prefix: Optional[str] = None) -> bool:
+        """
+        Clear all keys or keys with prefix from both tiers.
+        
+        Args:
+            prefix: Optional prefix to clear only matching keys
+            
+        Returns:
+            True if successful
+        """
+        cleared = self.l1.clear(prefix)
+        if self.l2 is not None:
+            try:
+                cleared = self.l2.clear(prefix) and cleared
+            except Exception as e:
+                self._l2_errors += 1
+                logger.warning(f"L2 cache clear failed: {e}")
+                return False
+        return cleared
+    
+    def exists(self, key: str) -> bool:
+        """
+        Check if key exists in either tier.
+        
+        Args:
+            key: Cache key
+            
+        Returns:
+            True if key exists
+        """
+        if self.l1.exists(key):
+            return True
+        if self.l2 is None:
+            return False
+        try:
+            return self.l2.exists(key)
+        except Exception:
+            self._l2_errors += 1
+            return False
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics for both tiers.
+        
+        Returns:
+            Dictionary with L1 statistics and L2 hit/error counters
+        """
+        return {
+            "backend": "tiered",
+            "l1": self.l1.stats(),
+            "l2": self.l2.stats() if self.l2 is not None else None,
+            "l2_hits": self._l2_hits,
+            "l2_errors": self._l2_errors
+        }
+
+
+class _Flight:
+    """A value computation in progress, shared by callers of the same key."""
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+
+
+def _is_record(value: Any) -> bool:
+    """Check whether a cached value is a get_or_set record."""
+    return isinstance(value, dict) and value.get(_RECORD_MARKER) == 1
+
+
 class CacheManager:
     """
     Central cache manager that coordinates cache operations.
@@ -450,16 +786,30 @@ class CacheManager:
     cache strategies, and utility functions for caching.
     """
     
-    def __init__(self, backend: Optional[CacheBackend] = None, default_ttl: int = 3600):
+    def __init__(self, backend: Optional[CacheBackend] = None, default_ttl: int = 3600,
+                 negative_ttl: int = DEFAULT_NEGATIVE_TTL,
+                 early_refresh_beta: float = DEFAULT_EARLY_REFRESH_BETA):
         """
         Initialize cache manager.
         
         Args:
             backend: Cache backend to use (defaults to in-memory)
             default_ttl: Default time-to-live for cached items in seconds
+            negative_ttl: Time-to-live for cached None results (0 disables)
+            early_refresh_beta: Probabilistic early refresh factor (0 disables)
         """
         self._backend = backend or MemoryCacheBackend()
         self._default_ttl = default_ttl
+        self._negative_ttl = negative_ttl
+        self._early_refresh_beta = early_refresh_beta
+        
+        # Single-flight state: key -> computation in progress
+        self._flights: Dict[str, _Flight] = {}
+        self._flights_lock = threading.Lock()
+        
+        self._coalesced = 0
+        self._early_refreshes = 0
+        self._negative_hits = 0
     
     @property
     def backend(self) -> CacheBackend:
@@ -483,6 +833,8 @@ class CacheManager:
             Cached value or default
         """
         value = self._backend.get(key)
+        if _is_record(value):
+            value = value['value']
         return default if value is None else value
     
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
@@ -536,29 +888,124 @@ class CacheManager:
         """
         return self._backend.exists(key)
     
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get statistics from the cache backend and the manager.
+        
+        Returns:
+            Backend statistics (hits, misses, evictions, size) plus
+            single-flight, early refresh and negative cache counters
+        """
+        stats = dict(self._backend.stats())
+        stats.update({
+            "coalesced": self._coalesced,
+            "early_refreshes": self._early_refreshes,
+            "negative_hits": self._negative_hits,
+            "in_flight": len(self._flights)
+        })
+        return stats
+    
+    def _should_refresh_early(self, record: Dict[str, Any], now: float) -> bool:
+        """
+        Decide whether to recompute a still-valid record (XFetch).
+        
+        The chance of refreshing grows as expiry approaches and with the time
+        the value took to compute, so one caller usually refreshes a hot key
+        before it expires instead of many callers missing at once.
+        """
+        expires = record.get('expires')
+        if expires is None or self._early_refresh_beta <= 0:
+            return False
+        delta = record.get('delta', 0.0)
+        return now - delta * self._early_refresh_beta * math.log(1.0 - random.random()) >= expires
+    
     def get_or_set(self, key: str, value_func: Callable[[], Any], 
-                  ttl: Optional[int] = None) -> Any:
+                  ttl: Optional[int] = None, cache_none: bool = False) -> Any:
         """
         Get value from cache or compute and store it if not present.
         
+        Concurrent misses for the same key in this process are coalesced:
+        one caller computes the value while the others wait for it. Values
+        nearing expiry are refreshed early by a single caller while the rest
+        keep receiving the cached value. None results are cached for
+        ``negative_ttl`` seconds (or the full TTL with ``cache_none``).
+        
         Args:
             key: Cache key
             value_func: Function to compute value if not in cache
             ttl: Time to live in seconds (overrides default)
+            cache_none: Cache None results for the full TTL
             
         Returns:
             Cached or computed value
         """
-        # Check if value is in cache
-        value = self.get(key)
+        cached_value = self._backend.get(key)
+        stale = None
         
-        # If not in cache, compute and store
-        if value is None:
-            value = value_func()
-            if value is not None:
-                self.set(key, value, ttl)
+        now = time.time()
+        if _is_record(cached_value) and cached_value.get('expires', now + 1) <= now:
+            # Promoted L1 copies can outlive the record itself
+            cached_value = None
         
-        return value
+        if _is_record(cached_value):
+            if not self._should_refresh_early(cached_value, now):
+                if cached_value.get('negative'):
+                    self._negative_hits += 1
+                return cached_value['value']
+            stale = cached_value
+        elif cached_value is not None:
+            # Stored directly with set()
+            return cached_value
+        
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        
+        if not leader:
+            self._coalesced += 1
+            if stale is not None:
+                # Someone is already refreshing; keep serving the cached value
+                return stale['value']
+            flight.event.wait(SINGLE_FLIGHT_TIMEOUT)
+            if flight.done and flight.error is None:
+                return flight.value
+            # The computing caller failed or timed out
+            return value_func()
+        
+        if stale is not None:
+            self._early_refreshes += 1
+        
+        try:
+            started = time.monotonic()
+            value = value_func()
+            delta = time.monotonic() - started
+            
+            effective_ttl = ttl if ttl is not None else self._default_ttl
+            negative = value is None and not cache_none
+            if negative:
+                effective_ttl = self._negative_ttl
+            
+            if effective_ttl:
+                self._backend.set(key, {
+                    _RECORD_MARKER: 1,
+                    'value': value,
+                    'delta': delta,
+                    'expires': time.time() + effective_ttl,
+                    'negative': negative
+                }, effective_ttl)
+            
+            flight.value = value
+            flight.done = True
+            return value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.event.set()
 
 
 # Decorator for caching function results
@@ -570,7 +1017,8 @@ def cached(ttl: Optional[int] = None, key_prefix: Optional[str] = None,
     Args:
         ttl: Time to live in seconds (overrides default)
         key_prefix: Custom key prefix (defaults to function name)
-        cache_none: Whether to cache None results
+        cache_none: Whether to cache None results for the full TTL (they are
+            otherwise cached for the manager's negative_ttl)
         cache_manager: Custom cache manager to use
         
     Returns:
@@ -586,21 +1034,13 @@ def cached(ttl: Optional[int] = None, key_prefix: Optional[str] = None,
             prefix = key_prefix or f"{func.__module__}.{func.__qualname__}"
             cache_key = CacheKey.generate(prefix, *args, **kwargs)
             
-            # Try to get from cache
-            cached_value = manager.get(cache_key)
-            if cached_value is not None:
-                logger.debug(f"Cache hit for {cache_key}")
-                return cached_value
-            
-            # Not in cache, call function
-            logger.debug(f"Cache miss for {cache_key}")
-            result = func(*args, **kwargs)
-            
-            # Cache result if it's not None or cache_none is True
-            if result is not None or cache_none:
-                manager.set(cache_key, result, ttl)
-            
-            return result
+            # Concurrent misses share a single call to the function
+            return manager.get_or_set(
+                cache_key,
+                lambda: func(*args, **kwargs),
+                ttl,
+                cache_none=cache_none
+            )
         return wrapper
     return decorator
 
@@ -619,6 +1059,26 @@ def set_cache_manager(manager: CacheManager):
     global _default_cache_manager
     _default_cache_manager = manager
 
+# Helper to create a tiered cache manager
+def create_tiered_cache_manager(l2: Optional[CacheBackend] = None, max_size: int = 10000,
+                                max_bytes: Optional[int] = None, l1_ttl: Optional[int] = DEFAULT_L1_TTL,
+                                default_ttl: int = 3600) -> CacheManager:
+    """
+    Create a cache manager with an in-process L1 in front of an optional L2.
+    
+    Args:
+        l2: Shared cache backend (optional)
+        max_size: Maximum number of L1 items
+        max_bytes: Optional L1 byte limit
+        l1_ttl: Maximum lifetime of L1 entries when an L2 is configured
+        default_ttl: Default TTL in seconds
+        
+    Returns:
+        Configured cache manager
+    """
+    backend = TieredCacheBackend(MemoryCacheBackend(max_size, max_bytes), l2, l1_ttl)
+    return CacheManager(backend, default_ttl)
+
 # Helper to create Redis cache manager
 def create_redis_cache_manager(host: str = 'localhost', port: int = 6379, 
                               db: int = 0, password: Optional[str] = None,
@@ -685,7 +1145,7 @@ def init_app(app):
             logger.info(f"Initialized Redis cache backend at {host}:{port}")
         except ImportError:
             logger.warning("Redis package not installed. Falling back to memory cache.")
-            backend = MemoryCacheBackend()
+            backend = None
             
     elif cache_type == 'memcached':
         # Memcached cache
@@ -697,16 +1157,29 @@ def init_app(app):
             logger.info(f"Initialized Memcached cache backend with servers: {servers}")
         except ImportError:
             logger.warning("Memcached package not installed. Falling back to memory cache.")
-            backend = MemoryCacheBackend()
+            backend = None
             
     else:
         # Memory cache (default)
-        max_size = app.config.get('MEMORY_CACHE_MAX_SIZE', 10000)
-        backend = MemoryCacheBackend(max_size)
+        backend = None
+    
+    # Keep an in-process L1 in front of any shared backend
+    max_size = app.config.get('MEMORY_CACHE_MAX_SIZE', 10000)
+    max_bytes = app.config.get('MEMORY_CACHE_MAX_BYTES')
+    l1 = MemoryCacheBackend(max_size, max_bytes)
+    if backend is None:
+        backend = TieredCacheBackend(l1)
         logger.info(f"Initialized memory cache backend with max size: {max_size}")
+    else:
+        backend = TieredCacheBackend(l1, backend, app.config.get('CACHE_L1_TTL', DEFAULT_L1_TTL))
     
     # Create and set the cache manager
-    manager = CacheManager(backend, default_ttl)
+    manager = CacheManager(
+        backend,
+        default_ttl,
+        negative_ttl=app.config.get('CACHE_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL),
+        early_refresh_beta=app.config.get('CACHE_EARLY_REFRESH_BETA', DEFAULT_EARLY_REFRESH_BETA)
+    )
     set_cache_manager(manager)
     
     # Store on app for direct access
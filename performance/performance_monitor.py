@@ -460,6 +460,20 @@ class PerformanceMonitor:
         memory_info = process.memory_info()
         return memory_info.rss / (1024 * 1024)  # Convert to MB
     
+    def _get_cache_metrics(self) -> Dict[str, Any]:
+        """
+        Get statistics from the application cache manager.
+        
+        Returns:
+            Dictionary of cache statistics (empty if unavailable)
+        """
+        try:
+            from performance.cache_manager import get_cache_manager
+            return get_cache_manager().stats()
+        except Exception as e:
+            logger.error(f"Error getting cache metrics: {e}")
+            return {}
+    
     def _register_endpoints(self, app: Flask) -> None:
         """
         Register performance monitoring endpoints.
@@ -479,10 +493,23 @@ class PerformanceMonitor:
                 "endpoints": _metrics_data["endpoints"],
                 "queries": _metrics_data["queries"],
                 "memory": _metrics_data["memory"],
+                "cache": self._get_cache_metrics(),
                 "system": self._get_system_metrics(),
                 "timestamp": datetime.now().isoformat()
             })
         
+        @app.route("/api/performance/cache")
+        def performance_cache():
+            # Check if user has permission
+            if not self._check_admin_permission():
+                return jsonify({"error": "Unauthorized"}), 403
+            
+            # Return cache hit/miss/eviction counters
+            return jsonify({
+                "cache": self._get_cache_metrics(),
+                "timestamp": datetime.now().isoformat()
+            })
+        
         @app.route("/api/performance/requests")
         def performance_requests():
             # Check if user has permission
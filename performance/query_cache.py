@@ -5,9 +5,10 @@ Database Query Cache for Inner Architect
 This module provides a caching system for database queries to improve performance
 by reducing database load and speeding up repeated queries.
 
-It supports:
+It is built on the tiered cache in performance.cache_manager and supports:
 - In-memory LRU cache for frequent queries
-- Redis-based distributed caching
+- Redis-based distributed caching as a second tier
+- Coalescing of concurrent misses so a cold query runs once
 - Automatic cache invalidation based on model changes
 - Query parameter-aware caching
 - Time-based cache expiration
@@ -17,306 +18,25 @@ import hashlib
 import inspect
 import json
 import logging
-import pickle
 import time
-from datetime import datetime, timedelta
+from collections import OrderedDict
 from functools import wraps
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type, Union
+from typing import Any, Dict, Optional, Set
 
 from flask import current_app
 from sqlalchemy import event
-from sqlalchemy.orm import Query, Session
+from sqlalchemy.orm import Query
+
+from performance.cache_manager import CacheManager, RedisCacheBackend, create_tiered_cache_manager
 
 # Set up logging
 logger = logging.getLogger("query_cache")
 
-# Cache storage backends
-class CacheBackend:
-    """Base class for cache storage backends."""
-    
-    def get(self, key: str) -> Optional[Any]:
-        """
-        Get a value from the cache.
-        
-        Args:
-            key: Cache key
-            
-        Returns:
-            Cached value or None if not found
-        """
-        raise NotImplementedError
-    
-    def set(self, key: str, value: Any, expire: Optional[int] = None) -> None:
-        """
-        Set a value in the cache.
-        
-        Args:
-            key: Cache key
-            value: Value to cache
-            expire: Expiration time in seconds (optional)
-        """
-        raise NotImplementedError
-    
-    def delete(self, key: str) -> None:
-        """
-        Delete a value from the cache.
-        
-        Args:
-            key: Cache key
-        """
-        raise NotImplementedError
-    
-    def clear(self) -> None:
-        """Clear all values from the cache."""
-        raise NotImplementedError
+# Prefix (namespace) for all query cache keys
+QUERY_KEY_PREFIX = "query:"
 
-
-class MemoryCache(CacheBackend):
-    """In-memory LRU cache implementation."""
-    
-    def __init__(self, max_size: int = 1000):
-        """
-        Initialize in-memory cache.
-        
-        Args:
-            max_size: Maximum number of items to store
-        """
-        self.max_size = max_size
-        self.cache: Dict[str, Tuple[Any, Optional[float]]] = {}
-        self.access_times: Dict[str, float] = {}
-    
-    def get(self, key: str) -> Optional[Any]:
-        """
-        Get a value from the cache.
-        
-        Args:
-            key: Cache key
-            
-        Returns:
-            Cached value or None if not found
-        """
-        if key not in self.cache:
-            return None
-        
-        value, expire_time = self.cache[key]
-        current_time = time.time()
-        
-        # Check if expired
-        if expire_time is not None and current_time > expire_time:
-            self.delete(key)
-            return None
-        
-        # Update access time
-        self.access_times[key] = current_time
-        
-        return value
-    
-    def set(self, key: str, value: Any, expire: Optional[int] = None) -> None:
-        """
-        Set a value in the cache.
-        
-        Args:
-            key: Cache key
-            value: Value to cache
-            expire: Expiration time in seconds (optional)
-        """
-        current_time = time.time()
-        expire_time = current_time + expire if expire is not None else None
-        
-        # Check if we need to evict
-        if len(self.cache) >= self.max_size and key not in self.cache:
-            # Evict least recently used
-            lru_key = min(self.access_times.items(), key=lambda x: x[1])[0]
-            self.delete(lru_key)
-        
-        # Store value and update access time
-        self.cache[key] = (value, expire_time)
-        self.access_times[key] = current_time
-    
-    def delete(self, key: str) -> None:
-        """
-        Delete a value from the cache.
-        
-        Args:
-            key: Cache key
-        """
-        if key in self.cache:
-            del self.cache[key]
-        
-        if key in self.access_times:
-            del self.access_times[key]
-    
-    def clear(self) -> None:
-        """Clear all values from the cache."""
-        self.cache.clear()
-        self.access_times.clear()
-
-
-class RedisCache(CacheBackend):
-    """Redis-based distributed cache implementation."""
-    
-    def __init__(self, redis_client=None, prefix: str = 'ia_query_cache:'):
-        """
-        Initialize Redis cache.
-        
-        Args:
-            redis_client: Redis client instance
-            prefix: Key prefix for cache entries
-        """
-        self.prefix = prefix
-        self.redis = redis_client
-    
-    def get(self, key: str) -> Optional[Any]:
-        """
-        Get a value from the cache.
-        
-        Args:
-            key: Cache key
-            
-        Returns:
-            Cached value or None if not found
-        """
-        if self.redis is None:
-            return None
-        
-        prefixed_key = f"{self.prefix}{key}"
-        cached_data = self.redis.get(prefixed_key)
-        
-        if cached_data is None:
-            return None
-        
-        try:
-            return pickle.loads(cached_data)
-        except (pickle.PickleError, TypeError):
-            logger.warning(f"Failed to unpickle cached data for key: {key}")
-            return None
-    
-    def set(self, key: str, value: Any, expire: Optional[int] = None) -> None:
-        """
-        Set a value in the cache.
-        
-        Args:
-            key: Cache key
-            value: Value to cache
-            expire: Expiration time in seconds (optional)
-        """
-        if self.redis is None:
-            return
-        
-        prefixed_key = f"{self.prefix}{key}"
-        
-        try:
-            pickled_value = pickle.dumps(value)
-            if expire is not None:
-                self.redis.setex(prefixed_key, expire, pickled_value)
-            else:
-                self.redis.set(prefixed_key, pickled_value)
-        except (pickle.PickleError, TypeError):
-            logger.warning(f"Failed to pickle data for key: {key}")
-    
-    def delete(self, key: str) -> None:
-        """
-        Delete a value from the cache.
-        
-        Args:
-            key: Cache key
-        """
-        if self.redis is None:
-            return
-        
-        prefixed_key = f"{self.prefix}{key}"
-        self.redis.delete(prefixed_key)
-    
-    def clear(self) -> None:
-        """Clear all values from the cache."""
-        if self.redis is None:
-            return
-        
-        # Find all keys with our prefix and delete them
-        pattern = f"{self.prefix}*"
-        keys = self.redis.keys(pattern)
-        
-        if keys:
-            self.redis.delete(*keys)
-
-
-class TwoLevelCache(CacheBackend):
-    """Two-level cache with memory and Redis backends."""
-    
-    def __init__(
-        self, 
-        memory_cache: MemoryCache,
-        redis_cache: Optional[RedisCache] = None
-    ):
-        """
-        Initialize two-level cache.
-        
-        Args:
-            memory_cache: Memory cache instance
-            redis_cache: Redis cache instance (optional)
-        """
-        self.memory_cache = memory_cache
-        self.redis_cache = redis_cache
-    
-    def get(self, key: str) -> Optional[Any]:
-        """
-        Get a value from the cache.
-        
-        Args:
-            key: Cache key
-            
-        Returns:
-            Cached value or None if not found
-        """
-        # Try memory cache first
-        value = self.memory_cache.get(key)
-        if value is not None:
-            return value
-        
-        # Try Redis cache if memory cache miss
-        if self.redis_cache is not None:
-            value = self.redis_cache.get(key)
-            if value is not None:
-                # Update memory cache
-                self.memory_cache.set(key, value)
-                return value
-        
-        return None
-    
-    def set(self, key: str, value: Any, expire: Optional[int] = None) -> None:
-        """
-        Set a value in both caches.
-        
-        Args:
-            key: Cache key
-            value: Value to cache
-            expire: Expiration time in seconds (optional)
-        """
-        # Set in memory cache
-        self.memory_cache.set(key, value, expire)
-        
-        # Set in Redis cache if available
-        if self.redis_cache is not None:
-            self.redis_cache.set(key, value, expire)
-    
-    def delete(self, key: str) -> None:
-        """
-        Delete a value from both caches.
-        
-        Args:
-            key: Cache key
-        """
-        self.memory_cache.delete(key)
-        
-        if self.redis_cache is not None:
-            self.redis_cache.delete(key)
-    
-    def clear(self) -> None:
-        """Clear all values from both caches."""
-        self.memory_cache.clear()
-        
-        if self.redis_cache is not None:
-            self.redis_cache.clear()
+# Number of statement shapes whose SQL digest is remembered
+STATEMENT_DIGEST_CACHE_SIZE = 1024
 
 
 class QueryCache:
@@ -324,7 +44,7 @@ class QueryCache:
     
     def __init__(
         self,
-        backend: CacheBackend,
+        manager: CacheManager,
         default_expire: int = 300,
         enabled: bool = True
     ):
@@ -332,14 +52,17 @@ class QueryCache:
         Initialize query cache.
         
         Args:
-            backend: Cache backend
+            manager: Cache manager holding the cached results
             default_expire: Default expiration time in seconds
             enabled: Whether caching is enabled
         """
-        self.backend = backend
+        self.manager = manager
         self.default_expire = default_expire
         self.enabled = enabled
         self.model_dependencies: Dict[str, Set[str]] = {}
+        
+        # Structural statement key -> digest of the statement's SQL
+        self._statement_digests: "OrderedDict[Any, str]" = OrderedDict()
     
     def cache_query(
         self,
@@ -366,27 +89,21 @@ class QueryCache:
         # Generate cache key
         cache_key = self._generate_query_key(query, key_prefix, include_params)
         
-        # Try to get from cache
-        cached_result = self.backend.get(cache_key)
-        if cached_result is not None:
-            logger.debug(f"Cache hit for key: {cache_key}")
-            return cached_result
-        
-        # Execute query and cache result
-        result = query.all()
-        
-        # Track model dependencies for invalidation
-        self._track_query_models(query, cache_key)
+        def run_query():
+            result = query.all()
+            
+            # Track model dependencies for invalidation
+            self._track_query_models(query, cache_key)
+            
+            logger.debug(f"Cache miss for key: {cache_key}, stored result")
+            return result
         
-        # Cache the result
-        self.backend.set(
-            cache_key, 
-            result, 
-            expire=expire if expire is not None else self.default_expire
+        # Concurrent misses for the same query share one execution
+        return self.manager.get_or_set(
+            cache_key,
+            run_query,
+            ttl=expire if expire is not None else self.default_expire
         )
-        
-        logger.debug(f"Cache miss for key: {cache_key}, stored result")
-        return result
     
     def invalidate_for_model(self, model_name: str) -> None:
         """
@@ -403,7 +120,7 @@ class QueryCache:
         
         # Delete each key
         for key in keys_to_invalidate:
-            self.backend.delete(key)
+            self.manager.delete(key)
         
         # Clear tracked dependencies for this model
         if model_name in self.model_dependencies:
@@ -416,10 +133,26 @@ class QueryCache:
         if not self.enabled:
             return
         
-        self.backend.clear()
+        self.manager.clear(prefix=QUERY_KEY_PREFIX)
         self.model_dependencies.clear()
         logger.debug("Cleared entire query cache")
     
+    def get_query_metrics(self) -> Dict[str, Any]:
+        """
+        Get query cache statistics.
+        
+        Returns:
+            Dictionary with cache counters and tracked dependencies per model
+        """
+        return {
+            "enabled": self.enabled,
+            "default_expire": self.default_expire,
+            "tracked_models": {
+                model_name: len(keys) for model_name, keys in self.model_dependencies.items()
+            },
+            "cache": self.manager.stats()
+        }
+    
     def _generate_query_key(
         self, 
         query: Query,
@@ -429,6 +162,13 @@ class QueryCache:
         """
         Generate a unique cache key for a query.
         
+        The statement's shape comes from SQLAlchemy's structural cache key,
+        which is much cheaper than compiling SQL. Each distinct shape is
+        compiled (with bind placeholders) only once to get a digest that is
+        stable across processes. The bound parameter values are then appended.
+        Statements SQLAlchemy cannot cache are compiled with placeholders, so
+        values that ``literal_binds`` cannot render are supported as well.
+        
         Args:
             query: SQLAlchemy query
             key_prefix: Prefix for the cache key
@@ -437,20 +177,31 @@ class QueryCache:
         Returns:
             Cache key string
         """
-        # Get SQL statement
-        statement = str(query.statement.compile(
-            compile_kwargs={"literal_binds": True}
-        ))
+        statement = query.statement
+        structural_key = statement._generate_cache_key()
+        
+        if structural_key is not None:
+            shape = self._statement_digests.get(structural_key.key)
+            if shape is None:
+                shape = hashlib.md5(str(statement.compile()).encode()).hexdigest()
+                self._statement_digests[structural_key.key] = shape
+                if len(self._statement_digests) > STATEMENT_DIGEST_CACHE_SIZE:
+                    self._statement_digests.popitem(last=False)
+            values = repr(tuple(bind.effective_value for bind in structural_key.bindparams))
+        else:
+            compiled = statement.compile()
+            shape = hashlib.md5(str(compiled).encode()).hexdigest()
+            values = repr(sorted(compiled.params.items()))
         
         # Add query parameters if needed
         if include_params and query._params:
-            params = str(sorted(query._params.items()))
+            params = repr(sorted(query._params.items()))
         else:
             params = ""
         
         # Create key by hashing the query details
-        key_data = f"{key_prefix}:{statement}:{params}"
-        return hashlib.md5(key_data.encode()).hexdigest()
+        key_data = f"{key_prefix}:{shape}:{values}:{params}"
+        return f"{QUERY_KEY_PREFIX}{hashlib.md5(key_data.encode()).hexdigest()}"
     
     def _track_query_models(self, query: Query, cache_key: str) -> None:
         """
@@ -461,8 +212,8 @@ class QueryCache:
             cache_key: Cache key for the query result
         """
         # Extract model classes from the query
-        model_classes = {entity.class_ for entity in query._entities
-                         if hasattr(entity, 'class_')}
+        model_classes = {description['entity'] for description in query.column_descriptions
+                         if inspect.isclass(description.get('entity'))}
         
         # Add relationships if any
         if hasattr(query, '_join_entities'):
@@ -526,25 +277,14 @@ def cache_query(
                     )
                     key_parts.append(kwargs_str)
             
-            cache_key = hashlib.md5(":".join(key_parts).encode()).hexdigest()
-            
-            # Try to get from cache
-            cached_result = query_cache.backend.get(cache_key)
-            if cached_result is not None:
-                return cached_result
-            
-            # Execute function and cache result
-            result = func(*args, **kwargs)
+            cache_key = f"{QUERY_KEY_PREFIX}{hashlib.md5(':'.join(key_parts).encode()).hexdigest()}"
             
-            # Only cache if result is not None
-            if result is not None:
-                query_cache.backend.set(
-                    cache_key,
-                    result,
-                    expire=expire if expire is not None else query_cache.default_expire
-                )
-            
-            return result
+            # Concurrent misses share one call; None results are negatively cached
+            return query_cache.manager.get_or_set(
+                cache_key,
+                lambda: func(*args, **kwargs),
+                ttl=expire if expire is not None else query_cache.default_expire
+            )
         
         return wrapper
     
@@ -563,24 +303,26 @@ def setup_query_cache(app, db, redis_client=None):
     Returns:
         QueryCache instance
     """
-    # Create cache backend
-    memory_cache = MemoryCache(
-        max_size=app.config.get('QUERY_CACHE_MEMORY_SIZE', 1000)
-    )
-    
+    # Shared second tier; results are ORM objects, so they are pickled
+    redis_cache = None
     if redis_client is not None:
-        redis_cache = RedisCache(
-            redis_client=redis_client,
-            prefix=app.config.get('QUERY_CACHE_REDIS_PREFIX', 'ia_query_cache:')
+        redis_cache = RedisCacheBackend(
+            client=redis_client,
+            prefix=app.config.get('QUERY_CACHE_REDIS_PREFIX', 'ia_query_cache:'),
+            serializer='pickle'
         )
-        backend = TwoLevelCache(memory_cache, redis_cache)
-    else:
-        backend = memory_cache
+    
+    default_expire = app.config.get('QUERY_CACHE_DEFAULT_EXPIRE', 300)
+    manager = create_tiered_cache_manager(
+        l2=redis_cache,
+        max_size=app.config.get('QUERY_CACHE_MEMORY_SIZE', 1000),
+        default_ttl=default_expire
+    )
     
     # Create query cache
     query_cache = QueryCache(
-        backend=backend,
-        default_expire=app.config.get('QUERY_CACHE_DEFAULT_EXPIRE', 300),
+        manager=manager,
+        default_expire=default_expire,
         enabled=app.config.get('QUERY_CACHE_ENABLED', True)
     )
     
@@ -626,7 +368,80 @@ def _setup_cache_invalidation(app, db, query_cache):
             query_cache.invalidate_for_model(model_name)
 
 
+def benchmark_key_generation(query: Query, iterations: int = 1000) -> Dict[str, float]:
+    """
+    Compare cache key cost against compiling the query with literal binds.
+    
+    Args:
+        query: SQLAlchemy query to build keys for
+        iterations: Number of keys to generate with each scheme
+        
+    Returns:
+        Average microseconds per key for each scheme and the speedup
+    """
+    def literal_key() -> str:
+        statement = str(query.statement.compile(compile_kwargs={"literal_binds": True}))
+        return hashlib.md5(f":{statement}:".encode()).hexdigest()
+    
+    query_cache = QueryCache(manager=CacheManager())
+    
+    start = time.perf_counter()
+    for _ in range(iterations):
+        literal_key()
+    literal_us = (time.perf_counter() - start) / iterations * 1e6
+    
+    start = time.perf_counter()
+    for _ in range(iterations):
+        query_cache._generate_query_key(query, "", True)
+    structural_us = (time.perf_counter() - start) / iterations * 1e6
+    
+    return {
+        "literal_binds_us": literal_us,
+        "structural_key_us": structural_us,
+        "speedup": literal_us / structural_us if structural_us else 0.0
+    }
+
+
+def _run_benchmark() -> None:
+    """Run the key generation benchmark against an in-memory SQLite model."""
+    from sqlalchemy import Column, DateTime, Integer, String, create_engine
+    from sqlalchemy.orm import Session, declarative_base
+    from datetime import datetime
+    
+    Base = declarative_base()
+    
+    class Post(Base):
+        __tablename__ = "posts"
+        id = Column(Integer, primary_key=True)
+        user_id = Column(String(64), index=True)
+        title = Column(String(200))
+        created_at = Column(DateTime)
+    
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    
+    with Session(engine) as session:
+        query = (
+            session.query(Post)
+            .filter(Post.user_id == "user-42", Post.created_at >= datetime(2024, 1, 1))
+            .order_by(Post.created_at.desc())
+            .limit(10)
+        )
+        results = benchmark_key_generation(query, iterations=2000)
+    
+    print(f"literal_binds compile: {results['literal_binds_us']:.1f} us/key")
+    print(f"structural cache key:  {results['structural_key_us']:.1f} us/key")
+    print(f"speedup:               {results['speedup']:.1f}x")
+
+
 if __name__ == "__main__":
+    import sys
+    
+    if "--benchmark" in sys.argv:
+        _run_benchmark()
+        sys.exit(0)
+    
+
     # Example usage
     print("This module provides query caching for SQLAlchemy.")
     print("Example usage:")
@@ -644,4 +459,7 @@ if __name__ == "__main__":
     print("  # Option 2: Caching SQLAlchemy queries directly")
     print("  def get_recent_users():")
     print("      query = User.query.order_by(User.created_at.desc()).limit(10)")
-    print("      return query_cache.cache_query(query, key_prefix='recent_users')")
\ No newline at end of file
+    print("      return query_cache.cache_query(query, key_prefix='recent_users')")
+    print("")
+    print("  # Benchmark cache key generation")
+    print("  python -m performance.query_cache --benchmark")
\ No newline at end of file
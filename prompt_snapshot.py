@@ -0,0 +1,190 @@
+"""
+Prompt Snapshot Module for The Inner Architect
+
+This module keeps a per-context snapshot of the conversation state that
+enhance_prompt_with_context needs on every chat turn: the context summary
+and the last turns of the conversation as a ring buffer, together with the
+rendered turns and their token estimates.
+
+Snapshots are updated incrementally when messages are added to a context.
+On each turn, a single query finds the active context and returns its
+summary, newest message ID and memory count and highest ID; the snapshot
+and the context's memory index are reused when these still match, so a
+warm turn touches the database once. Snapshots are kept per process;
+turns written by other processes are noticed through the newest message ID
+and reloaded.
+"""
+
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import func, select
+
+from context_packer import Entry, turn_entry
+from database import db
+from models import ConversationContext, ConversationMemoryItem, ChatHistory
+from logging_config import get_logger, debug
+
+# Get module-specific logger
+logger = get_logger('prompt_snapshot')
+
+# Number of recent turns included in prompts
+PROMPT_HISTORY_TURNS = 5
+
+# Maximum number of snapshots kept per process
+MAX_SNAPSHOT_CONTEXTS = 1024
+
+
+class ContextState(NamedTuple):
+    """Per-turn state of the active conversation context."""
+    context_id: int
+    summary: Optional[str]
+    last_message_id: Optional[int]
+    memory_count: int
+    memory_max_id: Optional[int]
+
+
+def message_to_dict(message: ChatHistory) -> Dict[str, Any]:
+    """Convert a chat message to the dictionary used for context history."""
+    return {
+        'id': message.id,
+        'user_message': message.user_message,
+        'ai_response': message.ai_response,
+        'mood': message.mood,
+        'nlp_technique': message.nlp_technique,
+        'created_at': message.created_at.isoformat()
+    }
+
+
+def fetch_context_state(user_id: Optional[str], session_id: str) -> Optional[ContextState]:
+    """
+    Get the active context of a user or session with its snapshot validators.
+
+    Args:
+        user_id: The user ID if authenticated, None for anonymous users
+        session_id: The browser session ID
+
+    Returns:
+        ContextState, or None if there is no active context
+    """
+    context = ConversationContext.__table__.c
+    last_message_id = select(func.max(ChatHistory.id)).where(
+        ChatHistory.context_id == context.id
+    ).scalar_subquery()
+    memory_count = select(func.count(ConversationMemoryItem.id)).where(
+        ConversationMemoryItem.context_id == context.id
+    ).scalar_subquery()
+    memory_max_id = select(func.max(ConversationMemoryItem.id)).where(
+        ConversationMemoryItem.context_id == context.id
+    ).scalar_subquery()
+
+    query = select(
+        context.id, context.summary, last_message_id, memory_count, memory_max_id
+    ).where(
+        context.session_id == session_id,
+        context.is_active.is_(True)
+    )
+    if user_id:
+        query = query.where(context.user_id == user_id)
+
+    row = db.session.execute(query.limit(1)).first()
+    if row is None:
+        return None
+    return ContextState(row[0], row[1], row[2], row[3] or 0, row[4])
+
+
+class PromptSnapshot:
+    """
+    Cached prompt state for a single conversation context.
+
+    Attributes:
+        context_id: The context ID
+        summary: The context summary as of the last turn
+        turns: The most recent messages, oldest first
+        last_message_id: ID of the newest message in the context, if any
+        consolidated_count: Memory count after the last consolidation attempt
+    """
+
+    def __init__(self, context_id: int, messages: List[Dict[str, Any]],
+                 max_turns: int = PROMPT_HISTORY_TURNS):
+        self.context_id = context_id
+        self.summary: Optional[str] = None
+        self.turns = deque(messages, maxlen=max_turns)
+        self.last_message_id = messages[-1]['id'] if messages else None
+        self.consolidated_count: Optional[int] = None
+        self._turn_entries: Optional[List[Entry]] = None
+
+    def is_current(self, last_message_id: Optional[int]) -> bool:
+        """Whether the snapshot holds the newest message of the context."""
+        return self.last_message_id == last_message_id
+
+    def add_turn(self, message: Dict[str, Any]) -> None:
+        """Append a message, dropping the oldest once the buffer is full."""
+        if self.last_message_id is not None and message['id'] <= self.last_message_id:
+            return
+        self.turns.append(message)
+        self.last_message_id = message['id']
+        if self._turn_entries is not None:
+            if len(self._turn_entries) == self.turns.maxlen:
+                self._turn_entries.pop(0)
+            self._turn_entries.append(turn_entry(message))
+
+    def turn_entries(self) -> List[Entry]:
+        """Prompt entries for the recent turns, oldest first."""
+        if self._turn_entries is None:
+            self._turn_entries = [turn_entry(msg) for msg in self.turns]
+        return self._turn_entries
+
+
+class PromptSnapshotRegistry:
+    """
+    Process-wide, bounded registry of prompt snapshots.
+
+    Snapshots are evicted least-recently-used once MAX_SNAPSHOT_CONTEXTS is
+    reached.
+    """
+
+    def __init__(self, max_contexts: int = MAX_SNAPSHOT_CONTEXTS):
+        self.max_contexts = max_contexts
+        self._snapshots: "OrderedDict[int, PromptSnapshot]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, context_id: int) -> Optional[PromptSnapshot]:
+        """Get the snapshot for a context, if cached."""
+        with self._lock:
+            snapshot = self._snapshots.get(context_id)
+            if snapshot is not None:
+                self._snapshots.move_to_end(context_id)
+            return snapshot
+
+    def load(self, context_id: int, messages: List[Dict[str, Any]]) -> PromptSnapshot:
+        """Cache a new snapshot for a context from its recent messages."""
+        snapshot = PromptSnapshot(context_id, messages)
+        with self._lock:
+            self._snapshots[context_id] = snapshot
+            self._snapshots.move_to_end(context_id)
+            while len(self._snapshots) > self.max_contexts:
+                self._snapshots.popitem(last=False)
+
+        debug(f"Loaded prompt snapshot for context {context_id} with {len(messages)} turns")
+        return snapshot
+
+    def message_added(self, context_id: int, message: ChatHistory) -> None:
+        """Add a message to its context snapshot, if cached."""
+        with self._lock:
+            snapshot = self._snapshots.get(context_id)
+            if snapshot is not None:
+                snapshot.add_turn(message_to_dict(message))
+
+    def invalidate(self, context_id: Optional[int] = None) -> None:
+        """Drop the snapshot for a context, or all snapshots."""
+        with self._lock:
+            if context_id is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(context_id, None)
+
+
+# Shared registry for the process
+prompt_snapshots = PromptSnapshotRegistry()
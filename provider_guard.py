@@ -0,0 +1,290 @@
+"""
+Module for sharing AI provider health and capacity across worker processes.
+
+Each gunicorn worker used to track provider failures on its own, so during
+an upstream brownout every worker kept sending requests until it had seen
+enough failures itself. This module keeps a circuit breaker and a request
+limiter per provider in a small SQLite file that all workers on a host
+share; every state change runs in an immediate (write-locked) transaction.
+
+- Circuit breaker: after failure_threshold consecutive failures a provider
+  is open and calls are rejected for a jittered cooldown that doubles with
+  every failed probe, up to a maximum. After the cooldown a single probe
+  call is let through (half-open); its result closes or reopens the circuit.
+- Limiter: a token bucket limits the request rate per provider, and leases
+  limit the number of calls in flight. Leases expire, so permits held by a
+  worker that died are returned automatically.
+
+Calls that are rejected should be shed to a fallback response instead of
+waiting. If the state file cannot be used, calls are allowed rather than
+blocked.
+"""
+import os
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+from shared_sqlite import SharedSQLiteFile
+
+# Create logger for this module
+logger = logging.getLogger('inner_architect.provider_guard')
+
+# Shared state file, one per host
+DEFAULT_GUARD_PATH = os.path.join(tempfile.gettempdir(), 'inner_architect_provider_guard.sqlite3')
+
+# Default limits per provider; override per provider with ProviderGuard(limits=...)
+DEFAULT_PROVIDER_LIMITS = {
+    'rate': 10.0,               # Requests per second (token refill rate)
+    'burst': 20,                # Token bucket capacity
+    'max_concurrent': 16,       # Calls in flight across all workers
+    'failure_threshold': 3,     # Consecutive failures that open the circuit
+    'cooldown': 30.0,           # Seconds before the first probe
+    'max_cooldown': 300.0,      # Upper bound for the doubled cooldown
+    'lease_seconds': 120.0      # Lifetime of a permit that is never released
+}
+
+# Circuit states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Reasons for rejecting a call
+REJECTED_CIRCUIT_OPEN = 'circuit_open'
+REJECTED_OVERLOADED = 'overloaded'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS provider_state (
+    provider TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    failures INTEGER NOT NULL,
+    open_count INTEGER NOT NULL,
+    open_until REAL NOT NULL,
+    tokens REAL NOT NULL,
+    refilled_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS provider_lease (
+    lease_id TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    probe INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_provider_lease_provider ON provider_lease (provider, expires_at);
+"""
+
+
+def jittered(seconds: float) -> float:
+    """Randomize a delay between half and all of its length."""
+    return seconds * random.uniform(0.5, 1.0)
+
+
+class ProviderGuard:
+    """
+    Circuit breaker and request limiter per provider, shared across processes.
+    """
+
+    def __init__(self, path: Optional[str] = None, limits: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        Args:
+            path: SQLite file holding the shared state (PROVIDER_GUARD_PATH
+                environment variable or a file in the temp directory by default)
+            limits: Per-provider overrides of DEFAULT_PROVIDER_LIMITS
+        """
+        self.path = path or os.environ.get('PROVIDER_GUARD_PATH', DEFAULT_GUARD_PATH)
+        self.limits = limits or {}
+        self._file = SharedSQLiteFile(self.path, _SCHEMA)
+
+    def limits_for(self, provider: str) -> Dict[str, Any]:
+        """Get the limits of a provider."""
+        limits = dict(DEFAULT_PROVIDER_LIMITS)
+        limits.update(self.limits.get(provider, {}))
+        return limits
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection to the state file."""
+        return self._file.connection()
+
+    def _row(self, connection: sqlite3.Connection, provider: str, now: float) -> Dict[str, Any]:
+        """Get the state of a provider, creating it if necessary."""
+        row = connection.execute(
+            "SELECT state, failures, open_count, open_until, tokens, refilled_at "
+            "FROM provider_state WHERE provider = ?", (provider,)
+        ).fetchone()
+        if row is None:
+            state = {
+                'state': CLOSED, 'failures': 0, 'open_count': 0, 'open_until': 0.0,
+                'tokens': float(self.limits_for(provider)['burst']), 'refilled_at': now
+            }
+            connection.execute(
+                "INSERT INTO provider_state (provider, state, failures, open_count, open_until, tokens, refilled_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (provider, state['state'], state['failures'], state['open_count'],
+                 state['open_until'], state['tokens'], state['refilled_at'])
+            )
+            return state
+        return dict(zip(('state', 'failures', 'open_count', 'open_until', 'tokens', 'refilled_at'), row))
+
+    def _save(self, connection: sqlite3.Connection, provider: str, state: Dict[str, Any]):
+        connection.execute(
+            "UPDATE provider_state SET state = ?, failures = ?, open_count = ?, open_until = ?, "
+            "tokens = ?, refilled_at = ? WHERE provider = ?",
+            (state['state'], state['failures'], state['open_count'], state['open_until'],
+             state['tokens'], state['refilled_at'], provider)
+        )
+
+    def _transaction(self, operation, default):
+        """Run an operation in a write-locked transaction, returning default on errors."""
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = operation(connection, time.time())
+                connection.execute("COMMIT")
+                return result
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.error(f"Provider guard state unavailable ({self.path}): {str(e)}")
+            return default
+
+    def acquire(self, provider: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Ask for a permit to call a provider.
+
+        Args:
+            provider: Name of the provider
+
+        Returns:
+            Tuple of (lease ID, None) if the call may proceed, or
+            (None, REJECTED_CIRCUIT_OPEN or REJECTED_OVERLOADED)
+        """
+        limits = self.limits_for(provider)
+
+        def operation(connection, now):
+            state = self._row(connection, provider, now)
+            connection.execute(
+                "DELETE FROM provider_lease WHERE provider = ? AND expires_at < ?", (provider, now)
+            )
+
+            probe = False
+            if state['state'] == OPEN:
+                if now < state['open_until']:
+                    return None, REJECTED_CIRCUIT_OPEN
+                state['state'] = HALF_OPEN
+            if state['state'] == HALF_OPEN:
+                # Only one probe at a time
+                probing = connection.execute(
+                    "SELECT 1 FROM provider_lease WHERE provider = ? AND probe = 1", (provider,)
+                ).fetchone()
+                if probing:
+                    return None, REJECTED_CIRCUIT_OPEN
+                probe = True
+
+            in_flight = connection.execute(
+                "SELECT COUNT(*) FROM provider_lease WHERE provider = ?", (provider,)
+            ).fetchone()[0]
+            if in_flight >= limits['max_concurrent']:
+                return None, REJECTED_OVERLOADED
+
+            # Refill the token bucket for the time since the last call
+            tokens = min(float(limits['burst']),
+                         state['tokens'] + (now - state['refilled_at']) * limits['rate'])
+            if tokens < 1.0:
+                return None, REJECTED_OVERLOADED
+            state['tokens'] = tokens - 1.0
+            state['refilled_at'] = now
+
+            lease_id = uuid.uuid4().hex
+            connection.execute(
+                "INSERT INTO provider_lease (lease_id, provider, expires_at, probe) VALUES (?, ?, ?, ?)",
+                (lease_id, provider, now + limits['lease_seconds'], int(probe))
+            )
+            self._save(connection, provider, state)
+            return lease_id, None
+
+        return self._transaction(operation, (uuid.uuid4().hex, None))
+
+    def release(self, provider: str, lease_id: Optional[str], success: Optional[bool]) -> str:
+        """
+        Return a permit and record the outcome of the call.
+
+        Args:
+            provider: Name of the provider
+            lease_id: Lease ID returned by acquire
+            success: Whether the provider handled the call, or None if the
+                call was abandoned (e.g. the client disconnected) and says
+                nothing about the provider's health
+
+        Returns:
+            The circuit state after the call
+        """
+        limits = self.limits_for(provider)
+
+        def operation(connection, now):
+            state = self._row(connection, provider, now)
+            connection.execute("DELETE FROM provider_lease WHERE lease_id = ?", (lease_id,))
+
+            # An abandoned call only returns its permit; an abandoned probe
+            # makes way for the next one
+            if success:
+                if state['state'] != CLOSED:
+                    logger.info(f"Provider {provider} recovered, closing circuit")
+                state.update(state=CLOSED, failures=0, open_count=0)
+            elif success is False:
+                state['failures'] += 1
+                if state['state'] == HALF_OPEN or (
+                        state['state'] == CLOSED and state['failures'] >= limits['failure_threshold']):
+                    cooldown = min(limits['max_cooldown'], limits['cooldown'] * (2 ** state['open_count']))
+                    state.update(state=OPEN, open_count=state['open_count'] + 1,
+                                 open_until=now + jittered(cooldown))
+                    logger.error(
+                        f"Provider {provider} circuit opened after {state['failures']} failures "
+                        f"for {state['open_until'] - now:.0f}s"
+                    )
+
+            self._save(connection, provider, state)
+            return state['state']
+
+        return self._transaction(operation, CLOSED)
+
+    def allows(self, provider: str) -> bool:
+        """Whether calls to a provider may be attempted (the circuit is not open)."""
+        try:
+            row = self._connection().execute(
+                "SELECT state, open_until FROM provider_state WHERE provider = ?", (provider,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Provider guard state unavailable ({self.path}): {str(e)}")
+            return True
+        return row is None or row[0] != OPEN or time.time() >= row[1]
+
+    def status(self, provider: str) -> Dict[str, Any]:
+        """Get the circuit state, failure count, tokens and calls in flight of a provider."""
+        def operation(connection, now):
+            state = self._row(connection, provider, now)
+            state['in_flight'] = connection.execute(
+                "SELECT COUNT(*) FROM provider_lease WHERE provider = ? AND expires_at >= ?", (provider, now)
+            ).fetchone()[0]
+            return state
+
+        return self._transaction(operation, {'state': CLOSED, 'failures': 0, 'in_flight': 0})
+
+    def reset(self, provider: Optional[str] = None):
+        """Close the circuit and refill the bucket of a provider, or of all providers."""
+        def operation(connection, now):
+            if provider is None:
+                connection.execute("DELETE FROM provider_state")
+                connection.execute("DELETE FROM provider_lease")
+            else:
+                connection.execute("DELETE FROM provider_state WHERE provider = ?", (provider,))
+                connection.execute("DELETE FROM provider_lease WHERE provider = ?", (provider,))
+
+        self._transaction(operation, None)
+
+
+# Shared guard for the process
+provider_guard = ProviderGuard()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Script to re-encrypt encrypted database columns with the current master key.
+
+Run after a master key rotation (--rotate rotates first). Progress is
+checkpointed per primary key range, so an interrupted run resumes where it
+stopped. Running application processes reload the key file when they read a
+value written with the new key, and within a minute otherwise, and then
+encrypt new data with the new key; run again with --restart to pick up
+values written in between before retiring the old key with --retire.
+Retiring is refused within a minute of the rotation and while any value
+still uses the old key.
+
+Usage:
+    python reencrypt_data.py [--rotate] [--restart] [--workers N] [--batch-size N]
+                             [--max-rows-per-second N] [--retire VERSION]
+"""
+
+import sys
+import argparse
+
+
+def main():
+    """
+    Re-encrypt all EncryptedField columns and print a report.
+    """
+    parser = argparse.ArgumentParser(description="Re-encrypt data with the current master key")
+    parser.add_argument("--rotate", action="store_true", help="Rotate the master key before re-encrypting")
+    parser.add_argument("--restart", action="store_true", help="Ignore checkpoints and scan all rows again")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per batch (default: 500)")
+    parser.add_argument("--max-rows-per-second", type=float, help="Throttle per key range")
+    parser.add_argument("--retire", type=int, metavar="VERSION",
+                        help="Retire a key version after a complete run")
+    args = parser.parse_args()
+
+    # Imported here so worker processes, which re-import this script, do not
+    # load the whole application
+    from app import app
+    from logging_config import info, error
+    from security.key_rotation import ReencryptionJob
+
+    with app.app_context():
+        encryption = app.extensions['encryption']
+        if args.rotate:
+            encryption.rotate_master_key()
+
+        job = ReencryptionJob(
+            encryption,
+            batch_size=args.batch_size,
+            max_rows_per_second=args.max_rows_per_second
+        )
+        report = job.run(workers=args.workers, restart=args.restart)
+
+        info(f"Re-encrypted {report['rows_updated']} of {report['rows_scanned']} values in "
+             f"{report['ranges']} ranges with key version {report['key_version']} "
+             f"in {report['elapsed_seconds']:.1f}s")
+
+        if not report['complete']:
+            error("Re-encryption incomplete; run again to resume")
+            return 1
+
+        if args.retire is not None:
+            try:
+                encryption.retire_key(args.retire)
+            except ValueError as e:
+                error(f"Key version {args.retire} not retired: {e}")
+                return 1
+            info(f"Retired key version {args.retire}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,440 @@
+"""
+Response Cache Module for The Inner Architect
+
+This module caches LLM responses for analyses whose inputs repeat heavily,
+such as technique recommendations for the same mood and a short message,
+or the analysis of a commonly stated belief. Responses are stored in a
+SQLite file shared by all worker processes on a host.
+
+- Keys: responses are keyed on the normalized input text (lowercase, with
+  whitespace and surrounding punctuation collapsed) and a context, such as
+  the mood, that must match exactly. Input text itself is not stored.
+- Near duplicates: namespaces with a similarity threshold also store a
+  local embedding of the text (hashed word and character trigram features).
+  On an exact miss, recent entries with the same context and the same
+  content words (every word except common function words) are compared,
+  and the most similar one above the threshold is returned. Texts that
+  differ in a content word, including negations ("I can never trust men" /
+  "I can never trust women", "I am good enough" / "I am not good enough"),
+  are never treated as near duplicates. Responses are shared across users,
+  so near-duplicate hits are only enabled where a response does not depend
+  on the details of the text.
+- Expiry and size: each namespace has its own time to live, and the stored
+  bytes are bounded; the least recently used entries are evicted first.
+- Metrics: hits, near-duplicate hits and misses are counted per namespace
+  and logged every CACHE_STATS_LOG_INTERVAL lookups.
+
+If the cache file cannot be used, lookups miss and responses are not stored.
+"""
+
+import os
+import json
+import time
+import array
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from logging_config import get_logger, info, error
+from shared_sqlite import SharedSQLiteFile
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Get module-specific logger
+logger = get_logger('response_cache')
+
+# Shared cache file, one per host
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'inner_architect_response_cache.sqlite3')
+
+# Upper bound of the stored bytes (RESPONSE_CACHE_MAX_BYTES overrides it)
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Eviction frees space down to this fraction of the bound
+EVICTION_TARGET = 0.9
+
+DAY = 24 * 60 * 60
+
+# Time to live (seconds) and near-duplicate similarity threshold per
+# namespace; a threshold of None disables near-duplicate hits
+CACHE_POLICIES = {
+    'recommend_technique': {'ttl': 7 * DAY, 'similarity': 0.85},
+    'analyze_with_gpt': {'ttl': DAY, 'similarity': None},
+    # Analyses describe the origin and impact of the exact belief stated
+    'analyze_belief': {'ttl': 30 * DAY, 'similarity': None},
+    'detect_language': {'ttl': 30 * DAY, 'similarity': None},
+}
+
+DEFAULT_POLICY = {'ttl': DAY, 'similarity': None}
+
+# Dimensions of the hashed text embedding
+EMBEDDING_DIMENSIONS = 256
+
+# Recent entries compared on an exact miss
+SIMILARITY_SCAN_LIMIT = 200
+
+# Seconds between updates of an entry's last access time
+ACCESS_UPDATE_INTERVAL = 60
+
+# Fixed per-entry overhead counted towards the stored bytes
+ENTRY_OVERHEAD_BYTES = 128
+
+# Number of lookups between hit-rate log lines
+CACHE_STATS_LOG_INTERVAL = 1000
+
+# Function words that near duplicates may differ in; negations such as
+# "not" or "never" are content words
+STOP_WORDS = frozenset({
+    'a', 'an', 'the', 'and', 'or', 'so', 'just', 'really', 'very', 'that', 'this',
+    'i', "i'm", 'im', "i've", "i'd", "i'll", 'me', 'my', 'myself', 'am', 'is', 'are', 'was', 'were',
+    'be', 'been', 'it', "it's", 'its', 'at', 'in', 'on', 'of', 'to', 'for', 'with', 'about',
+    'as', 'by', 'from', 'too'
+})
+
+_PUNCTUATION = ' \t\n.,;:!?"\'`()[]{}'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS response_cache (
+    cache_key TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    value TEXT NOT NULL,
+    embedding BLOB,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_response_cache_bucket ON response_cache (bucket, accessed_at);
+CREATE INDEX IF NOT EXISTS ix_response_cache_accessed ON response_cache (accessed_at);
+CREATE TABLE IF NOT EXISTS response_cache_usage (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO response_cache_usage (id, bytes) VALUES (1, 0);
+"""
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """
+    Normalize text for cache keys.
+
+    Args:
+        text: The text to normalize
+
+    Returns:
+        Lowercase text with typographic apostrophes replaced, whitespace
+        collapsed and surrounding punctuation removed
+    """
+    text = (text or '').lower().replace('’', "'").replace('‘', "'")
+    return ' '.join(text.split()).strip(_PUNCTUATION)
+
+
+def content_signature(text: str) -> str:
+    """Get the content words of a normalized text, which near duplicates must share."""
+    words = (word.strip(_PUNCTUATION) for word in text.split())
+    return ' '.join(sorted({word for word in words if word and word not in STOP_WORDS}))
+
+
+def _feature_hash(feature: str) -> Tuple[int, float]:
+    """Map a feature to an embedding dimension and sign (independent of PYTHONHASHSEED)."""
+    value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=4).digest(), 'little')
+    return value % EMBEDDING_DIMENSIONS, 1.0 if value & (1 << 31) else -1.0
+
+
+def embed_text(text: str) -> List[float]:
+    """
+    Compute a lightweight embedding of a normalized text.
+
+    Words and character trigrams are hashed into EMBEDDING_DIMENSIONS
+    signed dimensions, and the vector is scaled to unit length, so the dot
+    product of two embeddings is their cosine similarity.
+
+    Args:
+        text: Normalized text
+
+    Returns:
+        Embedding as a list of floats
+    """
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    padded = f" {text} "
+    features = text.split() + [padded[i:i + 3] for i in range(len(padded) - 2)]
+    for feature in features:
+        index, sign = _feature_hash(feature)
+        vector[index] += sign
+
+    norm = sum(value * value for value in vector) ** 0.5
+    if norm:
+        vector = [value / norm for value in vector]
+    return vector
+
+
+class ResponseCache:
+    """
+    LLM response cache shared across worker processes.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: Optional[int] = None,
+                 policies: Optional[Dict[str, Dict[str, Any]]] = None,
+                 log_interval: int = CACHE_STATS_LOG_INTERVAL):
+        """
+        Args:
+            path: SQLite file holding the cache (RESPONSE_CACHE_PATH
+                environment variable or a file in the temp directory by default)
+            max_bytes: Upper bound of the stored bytes
+            policies: Per-namespace overrides of CACHE_POLICIES
+            log_interval: Number of lookups between hit-rate log lines
+        """
+        self.path = path or os.environ.get('RESPONSE_CACHE_PATH', DEFAULT_CACHE_PATH)
+        self.max_bytes = max_bytes or int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        self.enabled = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+        self.policies = dict(CACHE_POLICIES)
+        self.policies.update(policies or {})
+        self.log_interval = log_interval
+        # Cached analyses are about users' messages; keep the file private
+        self._file = SharedSQLiteFile(self.path, _SCHEMA, private=True)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def policy(self, namespace: str) -> Dict[str, Any]:
+        """Get the time to live and similarity threshold of a namespace."""
+        return self.policies.get(namespace, DEFAULT_POLICY)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection to the cache file."""
+        return self._file.connection()
+
+    def _keys(self, namespace: str, text: Optional[str], context: Any) -> Tuple[str, str, str]:
+        """Get the normalized text, the cache key and the near-duplicate bucket of an input."""
+        normalized = normalize_text(text)
+        if isinstance(context, str):
+            context = normalize_text(context)
+        context_json = json.dumps(context, sort_keys=True, default=str)
+        bucket = hashlib.sha256(
+            f"{namespace}\0{context_json}\0{content_signature(normalized)}".encode('utf-8')
+        ).hexdigest()
+        cache_key = hashlib.sha256(f"{bucket}\0{normalized}".encode('utf-8')).hexdigest()
+        return normalized, cache_key, bucket
+
+    def get(self, namespace: str, text: Optional[str], context: Any = None) -> Optional[Any]:
+        """
+        Look up a cached response.
+
+        Args:
+            namespace: Name of the cached function
+            text: The input text
+            context: Other inputs that must match exactly (JSON-serializable)
+
+        Returns:
+            The cached response, or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        normalized, cache_key, bucket = self._keys(namespace, text, context)
+        threshold = self.policy(namespace)['similarity']
+        now = time.time()
+        kind = 'misses'
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT cache_key, value, accessed_at FROM response_cache "
+                "WHERE cache_key = ? AND expires_at > ?", (cache_key, now)
+            ).fetchone()
+            if row is not None:
+                kind = 'hits'
+            elif threshold is not None:
+                row = self._nearest(connection, bucket, normalized, threshold, now)
+                if row is not None:
+                    kind = 'similar_hits'
+
+            if row is not None and now - row[2] > ACCESS_UPDATE_INTERVAL:
+                connection.execute(
+                    "UPDATE response_cache SET accessed_at = ? WHERE cache_key = ?", (now, row[0])
+                )
+        except (sqlite3.Error, OSError) as e:
+            error(f"Response cache unavailable ({self.path}): {str(e)}")
+            row = None
+            kind = 'errors'
+
+        self._count(namespace, kind)
+        return json.loads(row[1]) if row is not None else None
+
+    def _nearest(self, connection: sqlite3.Connection, bucket: str, normalized: str,
+                 threshold: float, now: float) -> Optional[Tuple[str, str, float]]:
+        """Find the most similar recent entry of a bucket above a similarity threshold."""
+        rows = connection.execute(
+            "SELECT cache_key, value, accessed_at, embedding FROM response_cache "
+            "WHERE bucket = ? AND expires_at > ? AND embedding IS NOT NULL "
+            "ORDER BY accessed_at DESC LIMIT ?", (bucket, now, SIMILARITY_SCAN_LIMIT)
+        ).fetchall()
+        if not rows:
+            return None
+
+        query = embed_text(normalized)
+        if NUMPY_AVAILABLE:
+            matrix = np.frombuffer(b''.join(row[3] for row in rows), dtype=np.float32)
+            scores = matrix.reshape(len(rows), EMBEDDING_DIMENSIONS) @ np.array(query, dtype=np.float32)
+            best = int(scores.argmax())
+            best_score = float(scores[best])
+        else:
+            best, best_score = 0, -1.0
+            for index, row in enumerate(rows):
+                score = sum(a * b for a, b in zip(array.array('f', row[3]), query))
+                if score > best_score:
+                    best, best_score = index, score
+
+        if best_score < threshold:
+            return None
+        return rows[best][:3]
+
+    def put(self, namespace: str, text: Optional[str], value: Any, context: Any = None) -> None:
+        """
+        Store a response.
+
+        Args:
+            namespace: Name of the cached function
+            text: The input text
+            value: The response (JSON-serializable)
+            context: Other inputs that must match exactly (JSON-serializable)
+        """
+        if not self.enabled:
+            return
+
+        normalized, cache_key, bucket = self._keys(namespace, text, context)
+        policy = self.policy(namespace)
+        embedding = None
+        if policy['similarity'] is not None:
+            embedding = array.array('f', embed_text(normalized)).tobytes()
+        value_json = json.dumps(value)
+        size = len(value_json) + len(embedding or b'') + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes * (1 - EVICTION_TARGET):
+            return
+
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                previous = connection.execute(
+                    "SELECT size FROM response_cache WHERE cache_key = ?", (cache_key,)
+                ).fetchone()
+                connection.execute(
+                    "INSERT OR REPLACE INTO response_cache "
+                    "(cache_key, namespace, bucket, value, embedding, size, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cache_key, namespace, bucket, value_json, embedding, size, now + policy['ttl'], now)
+                )
+                connection.execute(
+                    "UPDATE response_cache_usage SET bytes = bytes + ? WHERE id = 1",
+                    (size - (previous[0] if previous else 0),)
+                )
+                used = connection.execute("SELECT bytes FROM response_cache_usage WHERE id = 1").fetchone()[0]
+                if used > self.max_bytes:
+                    self._evict(connection, used, now)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except (sqlite3.Error, OSError) as e:
+            error(f"Response cache unavailable ({self.path}): {str(e)}")
+            return
+
+        self._count(namespace, 'stores')
+
+    def _evict(self, connection: sqlite3.Connection, used: int, now: float) -> None:
+        """Remove expired entries, then least recently used ones, down to the eviction target."""
+        freed = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response_cache WHERE expires_at <= ?", (now,)
+        ).fetchone()[0]
+        connection.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+
+        target = self.max_bytes * EVICTION_TARGET
+        evicted = []
+        if used - freed > target:
+            for cache_key, size in connection.execute(
+                    "SELECT cache_key, size FROM response_cache ORDER BY accessed_at"):
+                if used - freed <= target:
+                    break
+                evicted.append((cache_key,))
+                freed += size
+            connection.executemany("DELETE FROM response_cache WHERE cache_key = ?", evicted)
+
+        connection.execute("UPDATE response_cache_usage SET bytes = bytes - ? WHERE id = 1", (freed,))
+        with self._lock:
+            self.evictions += len(evicted)
+        info(f"Response cache evicted {len(evicted)} entries, {used - freed} bytes in use")
+
+    def _count(self, namespace: str, kind: str) -> None:
+        """Count a lookup or store of a namespace."""
+        with self._lock:
+            counts = self.counts.setdefault(
+                namespace, {'hits': 0, 'similar_hits': 0, 'misses': 0, 'errors': 0, 'stores': 0}
+            )
+            counts[kind] += 1
+            if kind == 'stores':
+                return
+            self.lookups += 1
+            should_log = self.lookups % self.log_interval == 0
+
+        if should_log:
+            self.log()
+
+    def reset_stats(self) -> None:
+        """Clear the hit-rate counters."""
+        with self._lock:
+            self.counts: Dict[str, Dict[str, int]] = {}
+            self.lookups = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the lookups, hits and hit rate per namespace."""
+        with self._lock:
+            namespaces = {}
+            for namespace, counts in self.counts.items():
+                lookups = counts['hits'] + counts['similar_hits'] + counts['misses'] + counts['errors']
+                namespaces[namespace] = dict(
+                    counts, lookups=lookups,
+                    hit_rate=(counts['hits'] + counts['similar_hits']) / lookups if lookups else 0.0
+                )
+            return {'lookups': self.lookups, 'evictions': self.evictions, 'namespaces': namespaces}
+
+    def log(self) -> None:
+        """Log the hit rates."""
+        stats = self.stats()
+        rates = ", ".join(
+            f"{namespace}: {counts['hit_rate']:.0%} of {counts['lookups']} "
+            f"({counts['similar_hits']} near duplicates)"
+            for namespace, counts in stats['namespaces'].items()
+        )
+        info(f"Response cache hit rates after {stats['lookups']} lookups - [{rates}]; "
+             f"{stats['evictions']} evictions")
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        """Remove the cached responses of a namespace, or all of them."""
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if namespace is None:
+                    connection.execute("DELETE FROM response_cache")
+                else:
+                    connection.execute("DELETE FROM response_cache WHERE namespace = ?", (namespace,))
+                connection.execute(
+                    "UPDATE response_cache_usage SET bytes = "
+                    "(SELECT COALESCE(SUM(size), 0) FROM response_cache) WHERE id = 1"
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except (sqlite3.Error, OSError) as e:
+            error(f"Response cache unavailable ({self.path}): {str(e)}")
+
+
+# Shared cache for the process
+response_cache = ResponseCache()
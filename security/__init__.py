@@ -15,6 +15,7 @@ Components:
 from security.encryption import EncryptionManager, EncryptedField
 from security.access_control import SecurityManager
 from security.audit import AuditManager, AuditLog
+from security.key_rotation import ReencryptionJob
 
 __all__ = [
     'EncryptionManager',
@@ -22,6 +23,7 @@ __all__ = [
     'SecurityManager',
     'AuditManager',
     'AuditLog',
+    'ReencryptionJob',
     'init_app'
 ]
 
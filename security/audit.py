@@ -11,21 +11,41 @@ Features:
 - Comprehensive tracking of user activities
 - HIPAA-compliant audit trail generation
 - Real-time monitoring and alerting for suspicious activities
+
+Audit entries are written off the request path: log_event queues the entry
+and a dedicated writer thread per process links queued entries into the
+hash chain and inserts them in batches. Every batch locks the shared chain
+head row first, so entries from all gunicorn workers form a single linear
+chain. Suspicious activity rules are evaluated by the writer against
+in-memory counters (see security.detection), which also take in entries
+written by other workers when the chain head is locked.
 """
 
+import os
 import json
 import time
+import queue
+import atexit
 import hashlib
 import hmac
 import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import wraps
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Union
-from flask import current_app, request, g
+from flask import current_app, request, g, has_request_context
 from flask_login import current_user
-from sqlalchemy import Column, String, DateTime, Text, Boolean, Integer, ForeignKey
+from sqlalchemy import (
+    Column, String, DateTime, Text, Boolean, Integer, BigInteger, ForeignKey,
+    insert, update, select, func, and_, or_, create_engine
+)
+from sqlalchemy.exc import OperationalError, IntegrityError
 
 # Import database instance
 from database import db
+from security.detection import SuspiciousActivityDetector
 
 # Audit event types
 PHI_ACCESS = 'phi_access'
@@ -40,6 +60,37 @@ SECURITY_EVENT = 'security_event'
 PERMISSION_DENIED = 'permission_denied'
 BREAK_GLASS = 'break_glass'
 
+# Events that are also written to the application log
+CRITICAL_EVENTS = [PHI_ACCESS, PHI_MODIFICATION, PHI_DELETION,
+                   AUTH_FAILURE, MFA_FAILURE, BREAK_GLASS]
+
+# Events evaluated by the suspicious activity rules
+DETECTED_EVENTS = [AUTH_FAILURE, PHI_ACCESS, PERMISSION_DENIED]
+
+# Rows fetched per batch when seeding the detection counters
+DETECTION_SEED_BATCH_SIZE = 1000
+
+# Maximum number of audit entries waiting for the writer thread
+AUDIT_QUEUE_MAX_SIZE = 10000
+
+# Maximum number of audit entries inserted in one transaction
+AUDIT_BATCH_SIZE = 200
+
+# Seconds a request waits for queue space before writing its entry itself
+AUDIT_ENQUEUE_TIMEOUT = 0.05
+
+# Attempts to write a batch when the chain head is locked by another process
+AUDIT_WRITE_ATTEMPTS = 5
+
+# Primary key of the single chain head row
+CHAIN_HEAD_ID = 1
+
+# Audit entries fetched per query when verifying the chain
+VERIFY_CHUNK_SIZE = 5000
+
+# Verified entries between signed checkpoints
+CHECKPOINT_INTERVAL = 100000
+
 
 class AuditLog(db.Model):
     """
@@ -60,11 +111,343 @@ class AuditLog(db.Model):
     success = Column(Boolean, nullable=False, default=True)
     entry_hash = Column(String(64), nullable=False, index=True)
     previous_hash = Column(String(64), nullable=True, index=True)
+    sequence = Column(BigInteger, nullable=True, unique=True, index=True)  # Position in the hash chain
 
     def __repr__(self):
         return f'<AuditLog {self.id} {self.event_type}>'
 
 
+class AuditChainHead(db.Model):
+    """
+    Head of the audit hash chain, shared by all application processes
+    """
+    __tablename__ = 'audit_chain_head'
+
+    id = Column(Integer, primary_key=True)
+    sequence = Column(BigInteger, nullable=False, default=0)
+    last_hash = Column(String(64), nullable=True)
+
+    def __repr__(self):
+        return f'<AuditChainHead {self.sequence} {self.last_hash}>'
+
+
+class AuditCheckpoint(db.Model):
+    """
+    Signed record that the audit chain was verified from its start up to an entry
+    """
+    __tablename__ = 'audit_checkpoints'
+
+    sequence = Column(BigInteger, primary_key=True)
+    entry_hash = Column(String(64), nullable=False)
+    signature = Column(String(64), nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AuditCheckpoint {self.sequence} {self.entry_hash}>'
+
+
+# Deterministic JSON encoding of hashed entries (same output as json.dumps(..., sort_keys=True))
+_ENTRY_ENCODER = json.JSONEncoder(sort_keys=True)
+
+
+def _entry_digest(entry_id, timestamp, user_id, event_type, action, resource_type,
+                  resource_id, ip_address, details, success, previous_hash) -> str:
+    """Hex SHA-256 digest of the hashed fields of an audit entry"""
+    entry_data = {
+        'id': entry_id,
+        'timestamp': timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
+        'user_id': user_id,
+        'event_type': event_type,
+        'action': action,
+        'resource_type': resource_type,
+        'resource_id': resource_id,
+        'ip_address': ip_address,
+        'details': json.loads(details) if details else None,
+        'success': success,
+        'previous_hash': previous_hash
+    }
+
+    # Generate a hash of the entry including the previous hash (blockchain style)
+    return hashlib.sha256(_ENTRY_ENCODER.encode(entry_data).encode('utf-8')).hexdigest()
+
+
+def compute_entry_hash(entry: Dict[str, Any]) -> str:
+    """
+    Calculate the chain hash of an audit entry
+
+    Args:
+        entry: Column values of the entry, including previous_hash
+
+    Returns:
+        Hex SHA-256 digest of the entry
+    """
+    return _entry_digest(
+        entry['id'], entry['timestamp'], entry.get('user_id'), entry['event_type'],
+        entry['action'], entry.get('resource_type'), entry.get('resource_id'),
+        entry.get('ip_address'), entry.get('details'), entry['success'], entry.get('previous_hash')
+    )
+
+
+def _chain_columns():
+    """Columns read when verifying audit entries (hashed fields first, in _entry_digest order)"""
+    table = AuditLog.__table__
+    return [
+        table.c.id, table.c.timestamp, table.c.user_id, table.c.event_type, table.c.action,
+        table.c.resource_type, table.c.resource_id, table.c.ip_address, table.c.details,
+        table.c.success, table.c.previous_hash, table.c.entry_hash, table.c.sequence
+    ]
+
+
+def _check_entry(row, expected_previous: Optional[str], check_link: bool = True) -> Optional[str]:
+    """
+    Check one audit entry against its content and its predecessor
+
+    Returns:
+        Description of the integrity violation, or None if the entry is intact
+    """
+    if check_link and row.previous_hash != expected_previous:
+        return (f"Log chain broken at log ID {row.id}, timestamp {row.timestamp}. "
+                f"Expected previous hash {expected_previous}, found {row.previous_hash}")
+
+    calculated_hash = _entry_digest(*row[:11])
+    if calculated_hash != row.entry_hash:
+        return (f"Log content modified for ID {row.id}, timestamp {row.timestamp}. "
+                f"Expected hash {row.entry_hash}, calculated {calculated_hash}")
+
+    return None
+
+
+def _verify_legacy_entries(execute, conditions: List, check_first_link: bool,
+                           chunk_size: int = VERIFY_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Verify entries written before chain sequencing, in timestamp order
+
+    Entries are read in chunks with keyset pagination on (timestamp, id).
+
+    Args:
+        execute: Function executing a statement (session or connection execute)
+        conditions: Filters selecting the entries
+        check_first_link: Whether the first entry must have no predecessor
+
+    Returns:
+        Dictionary with rows, last_hash and error (None if intact)
+    """
+    table = AuditLog.__table__
+    columns = _chain_columns()
+    rows = 0
+    previous_hash = None
+    check_link = check_first_link
+    cursor = None
+
+    while True:
+        query = select(*columns).where(table.c.sequence.is_(None), *conditions)
+        if cursor is not None:
+            query = query.where(or_(
+                table.c.timestamp > cursor[0],
+                and_(table.c.timestamp == cursor[0], table.c.id > cursor[1])
+            ))
+        chunk = execute(query.order_by(table.c.timestamp, table.c.id).limit(chunk_size)).all()
+        if not chunk:
+            break
+
+        for row in chunk:
+            problem = _check_entry(row, previous_hash, check_link)
+            if problem:
+                return {'rows': rows, 'last_hash': previous_hash, 'error': problem}
+            previous_hash = row.entry_hash
+            check_link = True
+            rows += 1
+        cursor = (chunk[-1].timestamp, chunk[-1].id)
+
+    return {'rows': rows, 'last_hash': previous_hash, 'error': None}
+
+
+def _verify_sequence_range(execute, first: int, last: int, expected_previous: Optional[str],
+                           check_first_link: bool = True, chunk_size: int = VERIFY_CHUNK_SIZE,
+                           on_chunk=None) -> Dict[str, Any]:
+    """
+    Verify the sequenced entries first..last in chain order
+
+    Entries are read in chunks with keyset pagination on the sequence.
+
+    Args:
+        execute: Function executing a statement (session or connection execute)
+        first: First sequence to verify
+        last: Last sequence to verify
+        expected_previous: Hash the first entry must link to
+        check_first_link: Whether to check the first entry's link
+        chunk_size: Entries per query
+        on_chunk: Called with (sequence, entry_hash) after each verified chunk
+
+    Returns:
+        Dictionary with rows, last_hash, sequence (last verified) and error
+    """
+    table = AuditLog.__table__
+    columns = _chain_columns()
+    rows = 0
+    previous_hash = expected_previous
+    check_link = check_first_link
+    cursor = first - 1
+
+    while cursor < last:
+        chunk = execute(
+            select(*columns).where(
+                table.c.sequence > cursor,
+                table.c.sequence <= last
+            ).order_by(table.c.sequence).limit(chunk_size)
+        ).all()
+
+        for row in chunk:
+            if row.sequence != cursor + 1:
+                problem = f"Log chain missing entries {cursor + 1} to {row.sequence - 1}"
+            else:
+                problem = _check_entry(row, previous_hash, check_link)
+            if problem:
+                return {'rows': rows, 'last_hash': previous_hash, 'sequence': cursor, 'error': problem}
+            previous_hash = row.entry_hash
+            check_link = True
+            cursor = row.sequence
+            rows += 1
+
+        if not chunk:
+            return {'rows': rows, 'last_hash': previous_hash, 'sequence': cursor,
+                    'error': f"Log chain missing entries {cursor + 1} to {last}"}
+        if on_chunk is not None:
+            on_chunk(cursor, previous_hash)
+
+    return {'rows': rows, 'last_hash': previous_hash, 'sequence': cursor, 'error': None}
+
+
+def _verify_range_in_process(database_uri: str, first: int, last: int, expected_previous: Optional[str],
+                             check_first_link: bool, chunk_size: int) -> Dict[str, Any]:
+    """Verify a sequence range in a worker process with its own database connection"""
+    engine = create_engine(database_uri)
+    try:
+        with engine.connect() as connection:
+            return _verify_sequence_range(connection.execute, first, last, expected_previous,
+                                          check_first_link, chunk_size)
+    finally:
+        engine.dispose()
+
+
+class AuditWriter:
+    """
+    Serialized writer for the audit hash chain.
+
+    Request threads put entries on a bounded queue and a dedicated thread
+    writes them in batches. When the queue is full, the request waits
+    briefly for space and then writes its entry itself, so a slow database
+    slows requests down instead of dropping audit events.
+    """
+
+    def __init__(self, manager, max_queue_size: int = AUDIT_QUEUE_MAX_SIZE,
+                 batch_size: int = AUDIT_BATCH_SIZE):
+        self.manager = manager
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        """Whether the writer thread is running in the current process"""
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+
+    @property
+    def backlog(self) -> int:
+        """Number of queued entries not written yet"""
+        return self._queue.unfinished_tasks
+
+    def start(self):
+        """
+        Start the writer thread for the current process.
+
+        The thread is started lazily and restarted after a fork, so each
+        gunicorn worker gets its own writer.
+        """
+        with self._lock:
+            if self.running:
+                return
+            if self._pid != os.getpid():
+                # Entries queued before a fork belong to the parent process
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._pid = os.getpid()
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, record: Dict[str, Any]):
+        """
+        Queue an entry for writing
+
+        Args:
+            record: Column values of the entry, without chain fields
+        """
+        self.start()
+        try:
+            self._queue.put(record, timeout=AUDIT_ENQUEUE_TIMEOUT)
+        except queue.Full:
+            self.manager.app.logger.warning("Audit queue full, writing entry synchronously")
+            self.manager.write_entries_detached([record])
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued entry has been written
+
+        Args:
+            timeout: Maximum seconds to wait (None waits indefinitely)
+
+        Returns:
+            True if the queue was drained
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        """Write the remaining entries and stop the writer thread"""
+        if not self.running:
+            return
+        self.flush(timeout)
+        self._stop_event.set()
+        self._thread.join(timeout)
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        """Wait for an entry, then take up to batch_size queued entries"""
+        try:
+            batch = [self._queue.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Writer thread loop"""
+        while not self._stop_event.is_set():
+            batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                with self.manager.app.app_context():
+                    self.manager.write_entries(batch)
+            except Exception as e:
+                self.manager.app.logger.error(f"Audit writer failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
 class AuditManager:
     """
     Manages audit logging and monitoring throughout the application
@@ -74,6 +457,9 @@ class AuditManager:
     def __init__(self, app=None):
         self.app = app
         self.last_hash = None
+        self.writer = None
+        self.detector = None
+        self._observed_sequence = None
 
         if app is not None:
             self.init_app(app)
@@ -91,16 +477,21 @@ class AuditManager:
         app.before_request(self._before_request)
         app.after_request(self._after_request)
 
-        # Initialize last hash from database (handle missing table gracefully)
-        with app.app_context():
-            try:
-                last_log = AuditLog.query.order_by(AuditLog.timestamp.desc()).first()
-                if last_log:
-                    self.last_hash = last_log.entry_hash
-            except Exception as e:
-                # Table might not exist yet during initial setup
-                app.logger.info(f"Audit table not yet available during initialization: {e}")
-                self.last_hash = None
+        # Write entries from a background thread unless disabled (e.g. for tests)
+        if app.config.get('AUDIT_ASYNC', True):
+            self.writer = AuditWriter(
+                self,
+                max_queue_size=app.config.get('AUDIT_QUEUE_MAX_SIZE', AUDIT_QUEUE_MAX_SIZE),
+                batch_size=app.config.get('AUDIT_BATCH_SIZE', AUDIT_BATCH_SIZE)
+            )
+            atexit.register(self.writer.stop)
+
+        # Rules are evaluated in memory; the counters are seeded from the
+        # audit log on the first write, once the tables exist
+        self.detector = SuspiciousActivityDetector(
+            app.config.get('AUDIT_DETECTION_RULES'),
+            alert=self._security_alert
+        )
 
         app.logger.info("Audit manager initialized")
 
@@ -137,6 +528,9 @@ class AuditManager:
         """
         Create an immutable audit log entry
 
+        The entry is queued for the writer thread, so the request does not
+        wait for audit I/O.
+
         Args:
             event_type: Type of event (e.g., 'phi_access', 'authentication')
             action: Action being performed (e.g., 'read', 'update')
@@ -146,197 +540,283 @@ class AuditManager:
             success: Whether the action was successful
 
         Returns:
-            The created AuditLog instance
+            The created AuditLog instance (not attached to a session). When
+            written by the writer thread, its chain fields are only set in
+            the database; call flush() to wait for the write.
         """
         # Use current user if available
         user_id = None
-        if current_user and current_user.is_authenticated:
+        if has_request_context() and current_user and current_user.is_authenticated:
             user_id = current_user.id
 
-        # Create log entry
-        log_entry = AuditLog(
-            user_id=user_id,
-            event_type=event_type,
-            action=action,
-            resource_type=resource_type,
-            resource_id=resource_id,
-            ip_address=request.remote_addr if request else None,
-            user_agent=request.user_agent.string if request and request.user_agent else None,
-            details=json.dumps(details) if details else None,  # Serialize JSON for SQLite
-            success=success,
-            previous_hash=self.last_hash
-        )
-
-        # Generate hash for this entry
-        entry_data = {
-            'id': log_entry.id,
-            'timestamp': log_entry.timestamp.isoformat(),
-            'user_id': log_entry.user_id,
-            'event_type': log_entry.event_type,
-            'action': log_entry.action,
-            'resource_type': log_entry.resource_type,
-            'resource_id': log_entry.resource_id,
-            'ip_address': log_entry.ip_address,
-            'details': json.loads(log_entry.details) if log_entry.details else None,
-            'success': log_entry.success,
-            'previous_hash': log_entry.previous_hash
+        # Capture the entry now; chain fields are added by the writer
+        record = {
+            'id': str(uuid.uuid4()),
+            'timestamp': datetime.utcnow(),
+            'user_id': user_id,
+            'event_type': event_type,
+            'action': action,
+            'resource_type': resource_type,
+            'resource_id': resource_id,
+            'ip_address': request.remote_addr if has_request_context() else None,
+            'user_agent': request.user_agent.string if has_request_context() and request.user_agent else None,
+            'details': json.dumps(details) if details else None,  # Serialize JSON for SQLite
+            'success': success
         }
 
-        # Create a deterministic JSON string
-        entry_json = json.dumps(entry_data, sort_keys=True)
-
-        # Generate a hash of the entry including the previous hash (blockchain style)
-        hash_obj = hashlib.sha256(entry_json.encode('utf-8'))
-        log_entry.entry_hash = hash_obj.hexdigest()
+        try:
+            if self.writer is not None:
+                self.writer.submit(record)
+            else:
+                record = self.write_entries_detached([record])[0]
+        except Exception as e:
+            # Already reported through the fallback log; never fail the request
+            self.app.logger.error(f"Audit entry not written: {e}")
 
-        # Update last hash
-        self.last_hash = log_entry.entry_hash
+        return AuditLog(**record)
 
-        # Save to database
-        try:
-            db.session.add(log_entry)
-            db.session.commit()
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until queued audit entries have been written
 
-            # For critical events, also log to application logs
-            critical_events = [PHI_ACCESS, PHI_MODIFICATION, PHI_DELETION,
-                              AUTH_FAILURE, MFA_FAILURE, BREAK_GLASS]
+        Args:
+            timeout: Maximum seconds to wait (None waits indefinitely)
 
-            if event_type in critical_events:
-                self.app.logger.info(
-                    f"AUDIT: {event_type} - {action} - User: {user_id} - "
-                    f"Resource: {resource_type}/{resource_id} - Success: {success}"
-                )
+        Returns:
+            True if all queued entries were written
+        """
+        if self.writer is None:
+            return True
+        return self.writer.flush(timeout)
 
-                # Check if this is a suspicious event that needs immediate attention
-                self._check_suspicious_activity(log_entry)
-        except Exception as e:
-            db.session.rollback()
-            self.app.logger.error(f"Failed to create audit log: {e}")
+    def _lock_chain_head(self) -> AuditChainHead:
+        """
+        Lock and return the chain head for the current transaction
 
-            # Fallback to application logs for critical events
-            self.app.logger.warning(
-                f"AUDIT FALLBACK: {event_type} - {action} - User: {user_id} - "
-                f"Resource: {resource_type}/{resource_id} - Success: {success}"
+        Writing to the head row first takes its row lock on PostgreSQL and
+        the database write lock on SQLite, so concurrent writers in other
+        processes wait until this transaction commits.
+        """
+        result = db.session.execute(
+            update(AuditChainHead).where(AuditChainHead.id == CHAIN_HEAD_ID).values(
+                sequence=AuditChainHead.sequence
             )
+        )
+        if result.rowcount == 0:
+            # First write since the chain head was introduced: continue the existing chain
+            last_log = AuditLog.query.order_by(AuditLog.timestamp.desc()).first()
+            db.session.add(AuditChainHead(
+                id=CHAIN_HEAD_ID,
+                sequence=0,
+                last_hash=last_log.entry_hash if last_log else None
+            ))
+            db.session.flush()
+
+        return db.session.get(AuditChainHead, CHAIN_HEAD_ID, populate_existing=True)
+
+    def write_entries_detached(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Write entries from the calling thread without touching its session
 
-        return log_entry
+        A fresh application context gets its own database session, so the
+        audit transaction neither commits nor rolls back changes the caller
+        has pending.
 
-    def _check_suspicious_activity(self, log_entry: AuditLog):
+        Args:
+            records: Column values of the entries, in order
+
+        Returns:
+            The written entries including their chain fields
         """
-        Check for suspicious activity patterns that might indicate
-        security threats
+        with self.app.app_context():
+            return self.write_entries(records)
 
-        Args:
-            log_entry: The most recent audit log entry
+    def write_entries(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
-        # Skip for successful authentication events
-        if log_entry.event_type == AUTH_SUCCESS:
-            return
+        Link entries into the hash chain and insert them in one transaction
 
-        # Check for multiple authentication failures
-        if log_entry.event_type == AUTH_FAILURE:
-            self._check_auth_failures(log_entry)
-
-        # Check for unusual PHI access patterns
-        if log_entry.event_type == PHI_ACCESS:
-            self._check_unusual_phi_access(log_entry)
-
-        # Check for permission denied patterns
-        if log_entry.event_type == PERMISSION_DENIED:
-            self._check_permission_probing(log_entry)
-
-    def _check_auth_failures(self, log_entry: AuditLog):
-        """Check for brute force authentication attempts"""
-        # Look for multiple failures from same IP in last 10 minutes
-        ten_minutes_ago = datetime.utcnow() - timedelta(minutes=10)
-
-        failure_count = AuditLog.query.filter(
-            AuditLog.event_type == AUTH_FAILURE,
-            AuditLog.ip_address == log_entry.ip_address,
-            AuditLog.timestamp >= ten_minutes_ago
-        ).count()
-
-        if failure_count >= 5:
-            # Potential brute force attack
-            self.app.logger.critical(
-                f"SECURITY ALERT: Possible brute force attack detected from IP {log_entry.ip_address} "
-                f"with {failure_count} failed authentication attempts in 10 minutes."
-            )
+        Args:
+            records: Column values of the entries, in order
 
-            # In a real implementation, this would trigger additional security measures
-            # such as temporary IP ban, account lockout, or security team notification
+        Returns:
+            The written entries including their chain fields
+        """
+        if self._observed_sequence is None:
+            try:
+                self._seed_detector()
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"Failed to seed suspicious activity counters: {e}")
 
-    def _check_unusual_phi_access(self, log_entry: AuditLog):
-        """Check for unusual PHI access patterns"""
-        # Skip if no user is associated
-        if not log_entry.user_id:
-            return
+        for attempt in range(AUDIT_WRITE_ATTEMPTS):
+            try:
+                head = self._lock_chain_head()
+                sequence = head.sequence
+                previous_hash = head.last_hash
+
+                # Entries written by other processes since this one last wrote
+                others = self._unobserved_entries(sequence)
+
+                rows = []
+                for record in records:
+                    sequence += 1
+                    row = dict(record, sequence=sequence, previous_hash=previous_hash)
+                    row['entry_hash'] = compute_entry_hash(row)
+                    previous_hash = row['entry_hash']
+                    rows.append(row)
+
+                db.session.execute(insert(AuditLog), rows)
+                head.sequence = sequence
+                head.last_hash = previous_hash
+                db.session.commit()
+                break
+            except (OperationalError, IntegrityError) as e:
+                # Lock timeout or a concurrent first write of the chain head
+                db.session.rollback()
+                if attempt == AUDIT_WRITE_ATTEMPTS - 1:
+                    self._log_fallback(records, e)
+                    raise
+                time.sleep(0.05 * (2 ** attempt))
+            except Exception as e:
+                db.session.rollback()
+                self._log_fallback(records, e)
+                raise
 
-        # Look for high volume of PHI access in short time
-        one_hour_ago = datetime.utcnow() - timedelta(hours=1)
+        self.last_hash = previous_hash
 
-        access_count = AuditLog.query.filter(
-            AuditLog.event_type == PHI_ACCESS,
-            AuditLog.user_id == log_entry.user_id,
-            AuditLog.timestamp >= one_hour_ago
-        ).count()
+        # Count other processes' entries without alerting; their writers
+        # already evaluated them
+        for event_type, user_id, ip_address, resource_type, timestamp in others:
+            self._observe(event_type, user_id, ip_address, resource_type, timestamp, alert=False)
+        self._observed_sequence = sequence
 
-        # Threshold would be configured based on normal usage patterns
-        if access_count > 50:  # Example threshold
-            self.app.logger.warning(
-                f"SECURITY ALERT: Unusual PHI access volume detected for user {log_entry.user_id} "
-                f"with {access_count} records accessed in the last hour."
-            )
+        for row in rows:
+            if row['event_type'] in CRITICAL_EVENTS:
+                # For critical events, also log to application logs
+                self.app.logger.info(
+                    f"AUDIT: {row['event_type']} - {row['action']} - User: {row['user_id']} - "
+                    f"Resource: {row['resource_type']}/{row['resource_id']} - Success: {row['success']}"
+                )
 
-        # Check for access to unusual resource types for this user
-        user_common_resources = self._get_common_resources_for_user(log_entry.user_id)
+            # Check if this is a suspicious event that needs immediate attention
+            try:
+                self._check_suspicious_activity(AuditLog(**row))
+            except Exception as e:
+                self.app.logger.error(f"Suspicious activity check failed: {e}")
 
-        if log_entry.resource_type not in user_common_resources:
-            self.app.logger.info(
-                f"SECURITY NOTE: User {log_entry.user_id} accessed uncommon resource type "
-                f"{log_entry.resource_type} which is outside their normal pattern."
-            )
+        return rows
 
-    def _check_permission_probing(self, log_entry: AuditLog):
-        """Check for permission probing (attempting to access multiple restricted resources)"""
-        # Look for multiple permission denied events in short time
-        thirty_minutes_ago = datetime.utcnow() - timedelta(minutes=30)
-
-        denial_count = AuditLog.query.filter(
-            AuditLog.event_type == PERMISSION_DENIED,
-            AuditLog.user_id == log_entry.user_id,
-            AuditLog.timestamp >= thirty_minutes_ago
-        ).count()
-
-        if denial_count >= 5:  # Example threshold
-            self.app.logger.critical(
-                f"SECURITY ALERT: Possible permission probing detected for user {log_entry.user_id} "
-                f"with {denial_count} denied access attempts in 30 minutes."
+    def _log_fallback(self, records: List[Dict[str, Any]], exc: Exception):
+        """Fall back to application logs for entries that could not be written"""
+        self.app.logger.error(f"Failed to create audit log: {exc}")
+        for record in records:
+            self.app.logger.warning(
+                f"AUDIT FALLBACK: {record['event_type']} - {record['action']} - User: {record['user_id']} - "
+                f"Resource: {record['resource_type']}/{record['resource_id']} - Success: {record['success']}"
             )
 
-            # In a real implementation, this would trigger additional security measures
+    def _security_alert(self, level: str, message: str):
+        """Report a triggered detection rule in the application logs"""
+        getattr(self.app.logger, level)(message)
+
+        # In a real implementation, this would trigger additional security measures
+        # such as temporary IP ban, account lockout, or security team notification
 
-    def _get_common_resources_for_user(self, user_id: str) -> List[str]:
-        """Get the common resource types accessed by a user"""
-        # Look at access patterns over last 30 days
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
+    def _seed_detector(self):
+        """
+        Load recent audit entries into the suspicious activity counters
 
-        # Query for resource types and their access counts
+        Short windows are seeded from the matching entries; the 30 day
+        resource history is seeded from per-day counts.
+        """
+        head = db.session.get(AuditChainHead, CHAIN_HEAD_ID)
+        observed = head.sequence if head else 0
+        rules = self.detector.rules
+        now = datetime.utcnow()
+
+        # Entries after the head read now are counted by the catch-up in write_entries
+        seen = or_(AuditLog.sequence.is_(None), AuditLog.sequence <= observed)
+
+        for rule, event_type, key in (('auth_failures', AUTH_FAILURE, AuditLog.ip_address),
+                                      ('permission_probing', PERMISSION_DENIED, AuditLog.user_id),
+                                      ('phi_access_volume', PHI_ACCESS, AuditLog.user_id)):
+            since = now - timedelta(seconds=rules[rule]['window'])
+            entries = db.session.query(key, AuditLog.timestamp).filter(
+                AuditLog.event_type == event_type,
+                AuditLog.timestamp >= since,
+                seen
+            ).order_by(AuditLog.timestamp).yield_per(DETECTION_SEED_BATCH_SIZE)
+            for key_value, timestamp in entries:
+                self.detector.seed(rule, key_value, timestamp)
+
+        since = now - timedelta(seconds=rules['common_resources']['window'])
+        day = func.date(AuditLog.timestamp)
         resource_counts = db.session.query(
+            AuditLog.user_id,
             AuditLog.resource_type,
-            db.func.count(AuditLog.id).label('count')
+            day,
+            func.count(AuditLog.id)
         ).filter(
-            AuditLog.user_id == user_id,
+            AuditLog.user_id.isnot(None),
             AuditLog.event_type == PHI_ACCESS,
-            AuditLog.timestamp >= thirty_days_ago
+            AuditLog.timestamp >= since,
+            seen
         ).group_by(
-            AuditLog.resource_type
+            AuditLog.user_id, AuditLog.resource_type, day
+        ).order_by(day)
+        for user_id, resource_type, access_day, count in resource_counts:
+            # SQLite returns the day as text
+            if isinstance(access_day, str):
+                access_day = datetime.strptime(access_day, '%Y-%m-%d')
+            else:
+                access_day = datetime.combine(access_day, datetime.min.time())
+            self.detector.seed('common_resources', (user_id, resource_type), access_day, count)
+
+        # End the read transaction before the writer locks the chain head
+        db.session.commit()
+        self._observed_sequence = observed
+
+    def _unobserved_entries(self, head_sequence: int) -> List:
+        """Get detected entries written by other processes up to head_sequence"""
+        if self._observed_sequence is None or head_sequence <= self._observed_sequence:
+            return []
+
+        return db.session.execute(
+            select(
+                AuditLog.event_type, AuditLog.user_id, AuditLog.ip_address,
+                AuditLog.resource_type, AuditLog.timestamp
+            ).where(
+                AuditLog.sequence > self._observed_sequence,
+                AuditLog.sequence <= head_sequence,
+                AuditLog.event_type.in_(DETECTED_EVENTS)
+            ).order_by(AuditLog.sequence)
         ).all()
 
-        # Consider a resource type common if it has been accessed at least 5 times
-        common_resources = [r[0] for r in resource_counts if r[1] >= 5 and r[0] is not None]
+    def _observe(self, event_type: str, user_id: Optional[str], ip_address: Optional[str],
+                 resource_type: Optional[str], timestamp: datetime, alert: bool = True):
+        """Add an entry to the suspicious activity counters"""
+        if event_type == AUTH_FAILURE:
+            self.detector.record_auth_failure(ip_address, timestamp, alert=alert)
+        elif event_type == PHI_ACCESS:
+            self.detector.record_phi_access(user_id, resource_type, timestamp, alert=alert)
+        elif event_type == PERMISSION_DENIED:
+            self.detector.record_permission_denied(user_id, timestamp, alert=alert)
 
-        return common_resources
+    def _check_suspicious_activity(self, log_entry: AuditLog):
+        """
+        Check for suspicious activity patterns that might indicate
+        security threats
+
+        Args:
+            log_entry: The most recent audit log entry
+        """
+        # Skip for successful authentication events
+        if log_entry.event_type == AUTH_SUCCESS:
+            return
+
+        # Brute force, unusual PHI access and permission probing rules
+        self._observe(log_entry.event_type, log_entry.user_id, log_entry.ip_address,
+                      log_entry.resource_type, log_entry.timestamp)
 
     def verify_log_integrity(self, start_date: Optional[datetime] = None,
                            end_date: Optional[datetime] = None) -> bool:
@@ -350,68 +830,206 @@ class AuditManager:
         Returns:
             True if integrity is verified, False if tampering is detected
         """
-        query = AuditLog.query.order_by(AuditLog.timestamp.asc())
-
-        if start_date:
-            query = query.filter(AuditLog.timestamp >= start_date)
-        if end_date:
-            query = query.filter(AuditLog.timestamp <= end_date)
-
-        logs = query.all()
-
-        if not logs:
-            return True  # No logs to verify
+        # Every entry is re-hashed; checkpoints only vouch for past runs
+        return self.verify_chain(start_date=start_date, end_date=end_date, resume=False)['verified']
+
+    def _checkpoint_signature(self, sequence: int, entry_hash: str) -> str:
+        """HMAC signature of a checkpoint"""
+        key = self.app.config.get('AUDIT_CHECKPOINT_KEY') or self.app.secret_key or ''
+        message = f"{sequence}:{entry_hash}".encode('utf-8')
+        return hmac.new(key.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+    def _store_checkpoint(self, sequence: int, entry_hash: str):
+        """Record that the chain is verified from its start up to sequence"""
+        db.session.merge(AuditCheckpoint(
+            sequence=sequence,
+            entry_hash=entry_hash,
+            signature=self._checkpoint_signature(sequence, entry_hash),
+            created_at=datetime.utcnow()
+        ))
+        db.session.commit()
+
+    def _latest_checkpoint(self, last_sequence: int) -> Optional[AuditCheckpoint]:
+        """
+        Get the latest valid checkpoint at or before last_sequence
 
-        previous_hash = logs[0].previous_hash
+        A checkpoint is valid if its signature matches and the entry it
+        names still has the recorded hash and content.
+        """
+        checkpoints = AuditCheckpoint.query.filter(
+            AuditCheckpoint.sequence <= last_sequence
+        ).order_by(AuditCheckpoint.sequence.desc()).limit(10).all()
 
-        for log in logs:
-            # Skip first entry if it has no previous hash
-            if log.previous_hash is None and previous_hash is None:
-                previous_hash = log.entry_hash
+        for checkpoint in checkpoints:
+            signature = self._checkpoint_signature(checkpoint.sequence, checkpoint.entry_hash)
+            if not hmac.compare_digest(signature, checkpoint.signature):
+                self.app.logger.critical(
+                    f"AUDIT INTEGRITY VIOLATION: Invalid signature on checkpoint {checkpoint.sequence}"
+                )
                 continue
 
-            # Verify that this log's previous hash matches the previous entry's hash
-            if log.previous_hash != previous_hash:
+            row = db.session.execute(
+                select(*_chain_columns()).where(AuditLog.sequence == checkpoint.sequence)
+            ).first()
+            if (row is None or row.entry_hash != checkpoint.entry_hash
+                    or _check_entry(row, None, check_link=False)):
                 self.app.logger.critical(
-                    f"AUDIT INTEGRITY VIOLATION: Log chain broken at log ID {log.id}, "
-                    f"timestamp {log.timestamp}. Expected previous hash {previous_hash}, "
-                    f"found {log.previous_hash}"
+                    f"AUDIT INTEGRITY VIOLATION: Log entry {checkpoint.sequence} no longer matches "
+                    f"its checkpoint hash {checkpoint.entry_hash}"
                 )
-                return False
+                continue
 
-            # Verify this log's hash
-            entry_data = {
-                'id': log.id,
-                'timestamp': log.timestamp.isoformat(),
-                'user_id': log.user_id,
-                'event_type': log.event_type,
-                'action': log.action,
-                'resource_type': log.resource_type,
-                'resource_id': log.resource_id,
-                'ip_address': log.ip_address,
-                'details': json.loads(log.details) if log.details else None,
-                'success': log.success,
-                'previous_hash': log.previous_hash
-            }
+            return checkpoint
 
-            # Create a deterministic JSON string
-            entry_json = json.dumps(entry_data, sort_keys=True)
+        return None
 
-            # Generate hash and compare
-            hash_obj = hashlib.sha256(entry_json.encode('utf-8'))
-            calculated_hash = hash_obj.hexdigest()
+    def verify_chain(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                     resume: bool = False, workers: int = 1,
+                     chunk_size: int = VERIFY_CHUNK_SIZE) -> Dict[str, Any]:
+        """
+        Verify the audit hash chain with bounded memory
 
-            if calculated_hash != log.entry_hash:
-                self.app.logger.critical(
-                    f"AUDIT INTEGRITY VIOLATION: Log content modified for ID {log.id}, "
-                    f"timestamp {log.timestamp}. Expected hash {log.entry_hash}, "
-                    f"calculated {calculated_hash}"
-                )
-                return False
+        Entries are streamed in keyset-paginated chunks. When verifying from
+        the start of the chain, a signed checkpoint is stored every
+        CHECKPOINT_INTERVAL entries and at the end. With resume=True
+        verification continues after the latest valid checkpoint instead of
+        starting over; entries before the checkpoint are then not re-hashed,
+        so changes made to them since are not detected.
 
-            previous_hash = log.entry_hash
+        With workers > 1 the sequenced part of the chain is split into
+        disjoint ranges verified in parallel worker processes; the first
+        entry of each range is checked against the last entry of the
+        previous range.
 
-        return True
+        Args:
+            start_date: Optional start date for verification
+            end_date: Optional end date for verification
+            resume: Continue from the latest valid checkpoint
+            workers: Number of worker processes
+            chunk_size: Entries read per query
+
+        Returns:
+            Dictionary with verified, rows, elapsed_seconds, rows_per_second,
+            resumed_from, checkpoint and error
+        """
+        started = time.time()
+        table = AuditLog.__table__
+        from_start = start_date is None
+        report = {'verified': True, 'rows': 0, 'resumed_from': None, 'checkpoint': None, 'error': None}
+
+        # Translate dates into a sequence range so every link inside it is checked
+        sequence_conditions = [table.c.sequence.isnot(None)]
+        if start_date:
+            sequence_conditions.append(table.c.timestamp >= start_date)
+        if end_date:
+            sequence_conditions.append(table.c.timestamp <= end_date)
+        first, last = db.session.execute(
+            select(func.min(table.c.sequence), func.max(table.c.sequence)).where(*sequence_conditions)
+        ).one()
+
+        checkpoint = self._latest_checkpoint(last) if resume and from_start and last else None
+
+        if checkpoint is not None:
+            report['resumed_from'] = checkpoint.sequence
+            first = checkpoint.sequence + 1
+            expected_previous = checkpoint.entry_hash
+            check_first_link = True
+        else:
+            legacy_conditions = []
+            if start_date:
+                legacy_conditions.append(table.c.timestamp >= start_date)
+            if end_date:
+                legacy_conditions.append(table.c.timestamp <= end_date)
+            legacy = _verify_legacy_entries(db.session.execute, legacy_conditions, from_start, chunk_size)
+            report['rows'] += legacy['rows']
+            if legacy['error']:
+                return self._finish_verification(report, legacy['error'], started)
+
+            # The first sequenced entry continues the legacy chain
+            expected_previous = legacy['last_hash']
+            check_first_link = from_start or legacy['rows'] > 0
+
+        if first is not None and last is not None and first <= last:
+            store_checkpoints = from_start or checkpoint is not None
+            if workers > 1 and last - first + 1 > chunk_size:
+                result = self._verify_parallel(first, last, expected_previous, check_first_link,
+                                               workers, chunk_size)
+            else:
+                progress = {'since_checkpoint': 0, 'sequence': first - 1}
+
+                def on_chunk(sequence, entry_hash):
+                    progress['since_checkpoint'] += sequence - progress['sequence']
+                    progress['sequence'] = sequence
+                    if store_checkpoints and progress['since_checkpoint'] >= CHECKPOINT_INTERVAL:
+                        self._store_checkpoint(sequence, entry_hash)
+                        progress['since_checkpoint'] = 0
+
+                result = _verify_sequence_range(db.session.execute, first, last, expected_previous,
+                                                check_first_link, chunk_size, on_chunk)
+
+            report['rows'] += result['rows']
+            if result['error']:
+                return self._finish_verification(report, result['error'], started)
+
+            if store_checkpoints:
+                self._store_checkpoint(result['sequence'], result['last_hash'])
+                report['checkpoint'] = result['sequence']
+
+        return self._finish_verification(report, None, started)
+
+    def _verify_parallel(self, first: int, last: int, expected_previous: Optional[str],
+                         check_first_link: bool, workers: int, chunk_size: int) -> Dict[str, Any]:
+        """Verify first..last as disjoint ranges in worker processes"""
+        table = AuditLog.__table__
+        span = (last - first + 1 + workers - 1) // workers
+        bounds = [(start, min(start + span - 1, last)) for start in range(first, last + 1, span)]
+
+        # Each range must link to the last entry of the range before it
+        ranges = []
+        for index, (start, end) in enumerate(bounds):
+            if index == 0:
+                ranges.append((start, end, expected_previous, check_first_link))
+            else:
+                boundary_hash = db.session.execute(
+                    select(table.c.entry_hash).where(table.c.sequence == start - 1)
+                ).scalar()
+                ranges.append((start, end, boundary_hash, True))
+
+        database_uri = db.engine.url.render_as_string(hide_password=False)
+        # Spawned workers do not inherit the writer thread or open connections
+        with ProcessPoolExecutor(max_workers=len(ranges),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [
+                executor.submit(_verify_range_in_process, database_uri, start, end,
+                                previous_hash, check_link, chunk_size)
+                for start, end, previous_hash, check_link in ranges
+            ]
+            results = [future.result() for future in futures]
+
+        rows = 0
+        for result in results:
+            rows += result['rows']
+            if result['error']:
+                return dict(result, rows=rows)
+        return dict(results[-1], rows=rows)
+
+    def _finish_verification(self, report: Dict[str, Any], error: Optional[str],
+                             started: float) -> Dict[str, Any]:
+        """Complete a verification report with its outcome and throughput"""
+        elapsed = time.time() - started
+        report['verified'] = error is None
+        report['error'] = error
+        report['elapsed_seconds'] = elapsed
+        report['rows_per_second'] = report['rows'] / elapsed if elapsed > 0 else 0.0
+
+        if error:
+            self.app.logger.critical(f"AUDIT INTEGRITY VIOLATION: {error}")
+        else:
+            self.app.logger.info(
+                f"Audit chain verified: {report['rows']} entries in {elapsed:.2f}s "
+                f"({report['rows_per_second']:.0f} rows/sec)"
+            )
+        return report
 
     def export_audit_trail(self, start_date: datetime, end_date: datetime,
                           user_id: Optional[str] = None,
@@ -558,33 +1176,40 @@ def audit_phi_modification(resource_type):
             else:
                 action = 'modify'
 
-            # Log the modification
-            log_entry = audit.log_event(
+            details = {
+                'method': request.method,
+                'path': request.path,
+                'form_data': {k: v for k, v in request.form.items() if k != 'password'},
+                'json_data': request.get_json(silent=True)
+            }
+
+            # Call the original function, then log the modification with its
+            # outcome (chained entries cannot be updated afterwards)
+            try:
+                result = f(*args, **kwargs)
+            except Exception:
+                audit.log_event(
+                    event_type=PHI_MODIFICATION,
+                    action=action,
+                    resource_type=resource_type,
+                    resource_id=resource_id,
+                    details=details,
+                    success=False
+                )
+                raise
+
+            # Determine success status based on response
+            success = not (hasattr(result, 'status_code') and result.status_code >= 400)
+
+            audit.log_event(
                 event_type=PHI_MODIFICATION,
                 action=action,
                 resource_type=resource_type,
                 resource_id=resource_id,
-                details={
-                    'method': request.method,
-                    'path': request.path,
-                    'form_data': {k: v for k, v in request.form.items() if k != 'password'},
-                    'json_data': request.get_json(silent=True)
-                }
+                details=details,
+                success=success
             )
 
-            # Call the original function
-            result = f(*args, **kwargs)
-
-            # Update success status based on response
-            success = True
-            if hasattr(result, 'status_code') and result.status_code >= 400:
-                success = False
-
-                # Update the log entry
-                log_entry.success = success
-                db.session.add(log_entry)
-                db.session.commit()
-
             return result
         return decorated_function
     return decorator
\ No newline at end of file
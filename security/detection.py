@@ -0,0 +1,217 @@
+"""
+Suspicious Activity Detection for The Inner Architect
+
+This module implements the rules that watch the audit trail for brute force
+attempts, unusual PHI access volume, permission probing and access to
+uncommon resource types.
+
+Rules are evaluated against in-memory sliding-window counters instead of
+COUNT and GROUP BY queries over the audit log, so detection adds no database
+load while the application is under attack. Each counter keeps a running
+total per key (IP address, user, or user and resource type) over a ring of
+time buckets, which makes recording an event and reading a count O(1)
+amortized. Windows are approximate to one bucket (1/60 of the window).
+"""
+
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# Default rule settings; override per rule with the AUDIT_DETECTION_RULES config
+DEFAULT_DETECTION_RULES = {
+    # Failed logins from one IP address
+    'auth_failures': {'window': 600, 'threshold': 5},
+    # PHI records accessed by one user (alert when exceeded)
+    'phi_access_volume': {'window': 3600, 'threshold': 50},
+    # Denied accesses for one user
+    'permission_probing': {'window': 1800, 'threshold': 5},
+    # Accesses after which a resource type counts as common for a user
+    'common_resources': {'window': 30 * 86400, 'threshold': 5}
+}
+
+# Time buckets per window
+WINDOW_BUCKETS = 60
+
+# Maximum number of keys tracked per counter
+MAX_TRACKED_KEYS = 100000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def event_time(timestamp: Optional[datetime]) -> float:
+    """Seconds since the epoch for a naive UTC audit timestamp"""
+    if timestamp is None:
+        timestamp = datetime.utcnow()
+    return (timestamp - _EPOCH).total_seconds()
+
+
+class SlidingWindowCounter:
+    """
+    Per-key event counts over a sliding time window.
+
+    Each key holds a deque of [bucket, count] pairs and a running total;
+    buckets that fall out of the window are subtracted as they expire. The
+    least recently updated keys are dropped when more than max_keys are
+    tracked.
+    """
+
+    def __init__(self, window: float, buckets: int = WINDOW_BUCKETS, max_keys: int = MAX_TRACKED_KEYS):
+        self.window = window
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        self.max_keys = max_keys
+        self._keys: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, entry: list, bucket: int):
+        """Drop buckets of a key that are outside the window ending at bucket"""
+        slots = entry[0]
+        oldest = bucket - self.buckets
+        while slots and slots[0][0] <= oldest:
+            entry[1] -= slots.popleft()[1]
+
+    def add(self, key: Hashable, when: float, amount: int = 1) -> int:
+        """
+        Record events for a key
+
+        Args:
+            key: Counter key
+            when: Event time in seconds since the epoch
+            amount: Number of events
+
+        Returns:
+            The key's count in the window ending at when
+        """
+        bucket = int(when // self.bucket_width)
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None:
+                entry = [deque(), 0]
+                self._keys[key] = entry
+                if len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+            else:
+                self._keys.move_to_end(key)
+
+            slots = entry[0]
+            newest = max(bucket, slots[-1][0]) if slots else bucket
+            self._expire(entry, newest)
+            if bucket <= newest - self.buckets:
+                # Late event that is already outside the window
+                return entry[1]
+
+            if slots and slots[-1][0] >= bucket:
+                # Same bucket, or a late event counted in the newest bucket
+                slots[-1][1] += amount
+            else:
+                slots.append([bucket, amount])
+            entry[1] += amount
+            return entry[1]
+
+    def count(self, key: Hashable, when: float) -> int:
+        """Get a key's count in the window ending at when"""
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None:
+                return 0
+            self._expire(entry, int(when // self.bucket_width))
+            if not entry[0]:
+                del self._keys[key]
+                return 0
+            return entry[1]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class SuspiciousActivityDetector:
+    """
+    Evaluates the suspicious activity rules against sliding-window counters.
+
+    Each record_* method adds an event to the counters of its rules and,
+    unless alert=False (e.g. when seeding from the audit log), reports any
+    rule it triggers through the alert callback.
+    """
+
+    def __init__(self, rules: Optional[Dict[str, Dict[str, Any]]] = None,
+                 alert: Optional[Callable[[str, str], None]] = None):
+        """
+        Args:
+            rules: Per-rule overrides of DEFAULT_DETECTION_RULES
+            alert: Called with (level, message) for triggered rules
+        """
+        self.rules = {name: dict(settings) for name, settings in DEFAULT_DETECTION_RULES.items()}
+        for name, settings in (rules or {}).items():
+            self.rules.setdefault(name, {}).update(settings)
+
+        self.alert = alert if alert is not None else (lambda level, message: None)
+        self.counters = {
+            name: SlidingWindowCounter(settings['window'])
+            for name, settings in self.rules.items()
+        }
+
+    @property
+    def longest_window(self) -> float:
+        """Longest rule window in seconds"""
+        return max(settings['window'] for settings in self.rules.values())
+
+    def _threshold(self, rule: str) -> int:
+        return self.rules[rule]['threshold']
+
+    def _window_minutes(self, rule: str) -> int:
+        return int(self.rules[rule]['window'] // 60)
+
+    def seed(self, rule: str, key: Hashable, timestamp: datetime, amount: int = 1):
+        """Add past events to a rule's counter without evaluating the rule"""
+        self.counters[rule].add(key, event_time(timestamp), amount)
+
+    def record_auth_failure(self, ip_address: Optional[str], timestamp: Optional[datetime] = None,
+                            alert: bool = True):
+        """Check for brute force authentication attempts"""
+        failures = self.counters['auth_failures'].add(ip_address, event_time(timestamp))
+
+        if alert and failures >= self._threshold('auth_failures'):
+            # Potential brute force attack
+            self.alert('critical',
+                       f"SECURITY ALERT: Possible brute force attack detected from IP {ip_address} "
+                       f"with {failures} failed authentication attempts in "
+                       f"{self._window_minutes('auth_failures')} minutes.")
+
+    def record_phi_access(self, user_id: Optional[str], resource_type: Optional[str],
+                          timestamp: Optional[datetime] = None, alert: bool = True):
+        """Check for unusual PHI access volume and uncommon resource types"""
+        # Skip if no user is associated
+        if not user_id:
+            return
+
+        when = event_time(timestamp)
+        accesses = self.counters['phi_access_volume'].add(user_id, when)
+        resource_accesses = self.counters['common_resources'].add((user_id, resource_type), when)
+
+        if not alert:
+            return
+
+        if accesses > self._threshold('phi_access_volume'):
+            self.alert('warning',
+                       f"SECURITY ALERT: Unusual PHI access volume detected for user {user_id} "
+                       f"with {accesses} records accessed in the last "
+                       f"{self._window_minutes('phi_access_volume')} minutes.")
+
+        # A resource type is common once the user accessed it often enough;
+        # accesses without a resource type never form a pattern
+        if resource_type is None or resource_accesses < self._threshold('common_resources'):
+            self.alert('info',
+                       f"SECURITY NOTE: User {user_id} accessed uncommon resource type "
+                       f"{resource_type} which is outside their normal pattern.")
+
+    def record_permission_denied(self, user_id: Optional[str], timestamp: Optional[datetime] = None,
+                                 alert: bool = True):
+        """Check for permission probing (attempting to access multiple restricted resources)"""
+        denials = self.counters['permission_probing'].add(user_id, event_time(timestamp))
+
+        if alert and denials >= self._threshold('permission_probing'):
+            self.alert('critical',
+                       f"SECURITY ALERT: Possible permission probing detected for user {user_id} "
+                       f"with {denials} denied access attempts in "
+                       f"{self._window_minutes('permission_probing')} minutes.")
@@ -10,6 +10,17 @@ Features:
 - Key rotation and management
 - Field-level encryption for database
 - Payload encryption for API communications
+
+Ciphertexts are a single base64 string of a binary envelope:
+format version (1 byte) | key version (2 bytes) | purpose length (1 byte) |
+purpose | nonce | ciphertext + tag. The header is authenticated as
+associated data. Ciphertexts in the earlier formats (JSON, and binary
+without a key version) remain readable and use the first key version.
+
+Key rotation is online: changes to the key file are serialized across
+worker processes with a file lock, and running workers reload the key file
+when they read a value written with a key version they do not know, or when
+the file has changed (checked every KEY_RING_REFRESH_INTERVAL seconds).
 """
 
 import os
@@ -18,7 +29,9 @@ import json
 import time
 import hmac
 import hashlib
-from typing import Any, Dict, Optional, Tuple, Union
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
@@ -26,6 +39,13 @@ from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
 from datetime import datetime, timedelta
 from flask import current_app, g
+from sqlalchemy.types import TypeDecorator, Text
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
 
 # Constants
 KEY_ROTATION_INTERVAL = 30  # days
@@ -34,18 +54,37 @@ NONCE_LENGTH = 12  # bytes
 SALT_LENGTH = 16  # bytes
 KEY_LENGTH = 32  # bytes (256 bits)
 VERSION = 1  # encryption schema version
+ENVELOPE_VERSION = 3  # binary envelope format version
+UNVERSIONED_ENVELOPE_VERSION = 2  # binary envelopes written before the key ring
+LEGACY_ENVELOPE_PREFIX = b'{'  # JSON envelopes written before the binary format
+INITIAL_KEY_VERSION = 1  # key version of envelopes that do not record one
+MAX_KEY_VERSION = 0xFFFF  # key versions are stored in 2 bytes
+KEY_RING_REFRESH_INTERVAL = 60  # seconds between checks for a changed key file
 
 class EncryptionManager:
     """
     Manages encryption operations throughout the application with 
     HIPAA-compliant security controls.
+    
+    Master keys are kept in a versioned key ring. New data is encrypted
+    with the current version, which is recorded in the envelope, and data
+    encrypted with any retained version can be decrypted.
     """
     
     def __init__(self, app=None):
         self.app = app
         self.master_key = None
         self.key_creation_time = None
+        self.key_version = None
+        self.master_keys = {}
+        self.key_created = {}
         self.data_keys = {}
+        self.ciphers = {}
+        self.envelope_headers = {}
+        self._key_ring_lock = threading.RLock()
+        self._key_file_lock_depth = 0
+        self._key_file_mtime = None
+        self._key_file_checked = 0.0
         
         if app is not None:
             self.init_app(app)
@@ -61,9 +100,6 @@ class EncryptionManager:
         
         # Set up master key from environment or secure storage
         self._setup_master_key()
-        
-        # Register teardown to clear keys from memory
-        app.teardown_appcontext(self._teardown)
     
     def _setup_master_key(self):
         """
@@ -73,56 +109,213 @@ class EncryptionManager:
         """
         if self.app.config.get('TESTING'):
             # Use a static key for testing only
-            self.master_key = base64.b64decode(
-                self.app.config.get('ENCRYPTION_TEST_KEY', 
-                                   'VGhpc0lzQVRlc3RLZXlPbmx5Rm9yVGVzdGluZ1B1cnBvc2Vz')
+            self._add_master_key(
+                INITIAL_KEY_VERSION,
+                base64.b64decode(
+                    self.app.config.get('ENCRYPTION_TEST_KEY', 
+                                       'VGhpc0lzQVRlc3RLZXlPbmx5Rm9yVGVzdGluZ1B1cnBvc2Vz')
+                ),
+                datetime.utcnow()
             )
-            self.key_creation_time = datetime.utcnow()
+            self._use_master_key(INITIAL_KEY_VERSION)
             return
             
         # For production, get from secure key management
         # This is a simplified version - production would use HSM or KMS
         if self.app.config.get('ENCRYPTION_KEY_FILE'):
-            try:
-                with open(self.app.config['ENCRYPTION_KEY_FILE'], 'rb') as f:
-                    key_data = json.load(f)
-                    self.master_key = base64.b64decode(key_data['key'])
-                    self.key_creation_time = datetime.fromisoformat(key_data['created'])
-                    
+            # Workers starting together must not each create or rotate a key
+            with self._key_file_lock():
+                try:
+                    self._read_key_file()
+                except (FileNotFoundError, json.JSONDecodeError, KeyError, ValueError) as e:
+                    self.app.logger.error(f"Error loading encryption key: {e}")
+                    self._generate_new_master_key()
+                else:
                     # Check if key rotation is needed
                     self._check_key_rotation()
-            except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
-                self.app.logger.error(f"Error loading encryption key: {e}")
-                self._generate_new_master_key()
         else:
             # If no key file is configured, generate a new one
             self._generate_new_master_key()
     
+    def load_key_ring(self, key_data: Dict[str, Any]):
+        """
+        Load master keys from key file data
+        
+        Args:
+            key_data: Key ring as written by key_ring_data(), or a key file
+                with a single 'key' written before key versions were tracked
+        """
+        if 'keys' not in key_data:
+            # Single key written before the key ring
+            key_data = {
+                'current': INITIAL_KEY_VERSION,
+                'keys': [dict(key_data, version=INITIAL_KEY_VERSION)]
+            }
+        
+        # Build the new ring before swapping it in, so concurrent decryption
+        # never sees a partial ring
+        master_keys, key_created = {}, {}
+        for entry in key_data['keys']:
+            version = self._check_key_version(int(entry['version']))
+            master_keys[version] = base64.b64decode(entry['key'])
+            key_created[version] = datetime.fromisoformat(entry['created'])
+        current = int(key_data['current'])
+        if current not in master_keys:
+            raise ValueError(f"Unknown key version: {current}")
+        
+        with self._key_ring_lock:
+            self.master_keys = master_keys
+            self.key_created = key_created
+            self._use_master_key(current)
+    
+    def key_ring_data(self) -> Dict[str, Any]:
+        """Get the key ring in key file format"""
+        return {
+            'current': self.key_version,
+            'keys': [
+                {
+                    'version': version,
+                    'key': base64.b64encode(key).decode('utf-8'),
+                    'created': self.key_created[version].isoformat()
+                }
+                for version, key in sorted(self.master_keys.items())
+            ]
+        }
+    
+    @staticmethod
+    def _check_key_version(version: int) -> int:
+        """Check that a key version fits in an envelope"""
+        if not 0 < version <= MAX_KEY_VERSION:
+            raise ValueError(f"Invalid key version: {version}")
+        return version
+    
+    def _add_master_key(self, version: int, key: bytes, created: datetime):
+        """Add a master key version to the key ring"""
+        self._check_key_version(version)
+        self.master_keys[version] = key
+        self.key_created[version] = created
+    
+    def _use_master_key(self, version: int):
+        """Encrypt new data with a master key version from the key ring"""
+        if version not in self.master_keys:
+            raise ValueError(f"Unknown key version: {version}")
+        self.key_version = version
+        self.master_key = self.master_keys[version]
+        self.key_creation_time = self.key_created[version]
+        self._clear_key_cache()
+    
     def _generate_new_master_key(self):
-        """Generate a new master key and store it securely"""
+        """Generate a new master key version and store it securely"""
         # Generate a strong random key
-        self.master_key = os.urandom(KEY_LENGTH)
-        self.key_creation_time = datetime.utcnow()
+        version = max(self.master_keys, default=0) + 1
+        self._add_master_key(version, os.urandom(KEY_LENGTH), datetime.utcnow())
+        self._use_master_key(version)
         
         # Store the key securely
-        if self.app.config.get('ENCRYPTION_KEY_FILE'):
-            key_data = {
-                'key': base64.b64encode(self.master_key).decode('utf-8'),
-                'created': self.key_creation_time.isoformat()
-            }
+        self._save_key_ring()
             
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(self.app.config['ENCRYPTION_KEY_FILE']), 
-                       exist_ok=True)
-            
-            # Write with restricted permissions
-            with open(self.app.config['ENCRYPTION_KEY_FILE'], 'w') as f:
-                json.dump(key_data, f)
-            
-            # Set strict permissions (owner read-only)
-            os.chmod(self.app.config['ENCRYPTION_KEY_FILE'], 0o400)
+        self.app.logger.info(f"Generated new master encryption key (version {version})")
+    
+    def _key_file(self) -> Optional[str]:
+        """Get the configured key file, if any"""
+        if self.app is None:
+            return None
+        return self.app.config.get('ENCRYPTION_KEY_FILE')
+    
+    @contextmanager
+    def _key_file_lock(self):
+        """
+        Hold an exclusive lock on the key file across threads and processes
+        
+        Changes to the key ring re-read the key file while holding the lock,
+        so versions added by other processes are never overwritten.
+        """
+        key_file = self._key_file()
+        with self._key_ring_lock:
+            # Re-entered e.g. by a rotation during startup; a second flock
+            # on a new file descriptor would wait for the first one
+            if not key_file or not FCNTL_AVAILABLE or self._key_file_lock_depth:
+                self._key_file_lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._key_file_lock_depth -= 1
+                return
+            os.makedirs(os.path.dirname(key_file) or '.', exist_ok=True)
+            with open(f"{key_file}.lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._key_file_lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._key_file_lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _read_key_file(self):
+        """Load the key ring from the key file"""
+        key_file = self._key_file()
+        mtime = os.path.getmtime(key_file)
+        with open(key_file, 'rb') as f:
+            key_data = json.load(f)
+        self.load_key_ring(key_data)
+        self._key_file_mtime = mtime
+        self._key_file_checked = time.monotonic()
+    
+    def refresh_key_ring(self, force: bool = False) -> bool:
+        """
+        Reload the key ring if the key file changed, e.g. after a rotation
+        by another process
+        
+        Args:
+            force: Read the key file even if it seems unchanged
             
-        self.app.logger.info("Generated new master encryption key")
+        Returns:
+            True if the key ring was reloaded
+        """
+        key_file = self._key_file()
+        if not key_file:
+            return False
+        
+        with self._key_ring_lock:
+            try:
+                mtime = os.path.getmtime(key_file)
+                self._key_file_checked = time.monotonic()
+                if not force and mtime == self._key_file_mtime:
+                    return False
+                previous = self.key_version
+                self._read_key_file()
+            except (OSError, json.JSONDecodeError, KeyError, ValueError) as e:
+                self._log_error(f"Error reloading encryption key: {e}")
+                return False
+        
+        if self.key_version != previous:
+            self.app.logger.info(f"Encrypting new data with master key version {self.key_version}")
+        return True
+    
+    def _refresh_if_due(self):
+        """Pick up key file changes every KEY_RING_REFRESH_INTERVAL seconds"""
+        if time.monotonic() - self._key_file_checked >= KEY_RING_REFRESH_INTERVAL:
+            self.refresh_key_ring()
+    
+    def _save_key_ring(self):
+        """Write the key ring to the key file, if one is configured"""
+        key_file = self.app.config.get('ENCRYPTION_KEY_FILE')
+        if not key_file:
+            return
+        
+        # Create directory if it doesn't exist
+        os.makedirs(os.path.dirname(key_file) or '.', exist_ok=True)
+        
+        # Write with restricted permissions, then replace the read-only key file
+        temp_file = f"{key_file}.tmp"
+        fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.key_ring_data(), f)
+        
+        # Set strict permissions (owner read-only)
+        os.chmod(temp_file, 0o400)
+        os.replace(temp_file, key_file)
+        self._key_file_mtime = os.path.getmtime(key_file)
     
     def _check_key_rotation(self):
         """Check if key rotation is needed based on age"""
@@ -130,31 +323,93 @@ class EncryptionManager:
             age = datetime.utcnow() - self.key_creation_time
             if age > timedelta(days=KEY_ROTATION_INTERVAL):
                 self.app.logger.info("Encryption key rotation needed")
-                self._rotate_master_key()
+                self.rotate_master_key()
     
-    def _rotate_master_key(self):
+    def rotate_master_key(self):
         """Rotate the master encryption key"""
-        # Store the old key for decryption of existing data
-        old_key = self.master_key
-        old_key_time = self.key_creation_time
+        with self._key_file_lock():
+            # Start from the key file, which another process may have changed
+            if self._key_file() and os.path.exists(self._key_file()):
+                self._read_key_file()
+            
+            # Previous versions stay in the key ring for decryption of existing
+            # data until reencrypt_data.py has moved it to the new version
+            self._generate_new_master_key()
         
-        # Generate a new master key
-        self._generate_new_master_key()
+        self.app.logger.info(
+            f"Master encryption key rotated to version {self.key_version}; "
+            f"run reencrypt_data.py to re-encrypt existing data"
+        )
+    
+    def retire_key(self, version: int):
+        """
+        Remove a master key version from the key ring
         
-        # TODO: In a real implementation, we would:
-        # 1. Schedule a background job to re-encrypt existing data
-        # 2. Track key versions to know which key to use for decryption
-        # 3. Implement a secure key retirement policy
+        Data encrypted with a retired version can no longer be decrypted, so
+        this is refused while running processes may still encrypt with an
+        older version (until KEY_RING_REFRESH_INTERVAL seconds after the
+        current version was created) and while any EncryptedField value
+        still uses the version.
+        """
+        # Imported here because key_rotation builds on this module
+        from security.key_rotation import find_key_version_use
+        
+        # Scanned without holding the key file lock; values written after
+        # the scan use the current version, which cannot be retired
+        with self._key_file_lock():
+            self._check_retirable(version)
+        in_use = find_key_version_use(self, version)
+        if in_use:
+            raise ValueError(
+                f"Key version {version} is still used by {in_use}; "
+                f"run reencrypt_data.py --restart before retiring it"
+            )
+        
+        with self._key_file_lock():
+            self._check_retirable(version)
+            del self.master_keys[version]
+            del self.key_created[version]
+            self._clear_key_cache()
+            self._save_key_ring()
         
-        self.app.logger.info("Master encryption key rotated")
+        self.app.logger.info(f"Retired master encryption key version {version}")
     
-    def _derive_data_key(self, key_id: str) -> bytes:
+    def _check_retirable(self, version: int):
+        """Check against the key file that a key version may be retired"""
+        if self._key_file() and os.path.exists(self._key_file()):
+            self._read_key_file()
+        
+        if version == self.key_version:
+            raise ValueError("The current key version cannot be retired")
+        if version not in self.master_keys:
+            raise ValueError(f"Unknown key version: {version}")
+        
+        age = datetime.utcnow() - self.key_creation_time
+        if age < timedelta(seconds=KEY_RING_REFRESH_INTERVAL):
+            raise ValueError(
+                f"Key version {self.key_version} was created {age.total_seconds():.0f}s ago; "
+                f"running processes may still encrypt with older versions for up to "
+                f"{KEY_RING_REFRESH_INTERVAL}s"
+            )
+    
+    def _derive_data_key(self, key_id: str, key_version: Optional[int] = None) -> bytes:
         """
         Derive a data key for a specific purpose using HKDF
         to avoid using the master key directly
         """
-        if key_id in self.data_keys:
-            return self.data_keys[key_id]
+        if key_version is None:
+            key_version = self.key_version
+        cache_key = (key_version, key_id)
+        if cache_key in self.data_keys:
+            return self.data_keys[cache_key]
+        
+        master_key = self.master_keys.get(key_version)
+        if master_key is None:
+            # Written by a process that rotated the key after this one loaded it
+            self.refresh_key_ring(force=True)
+            master_key = self.master_keys.get(key_version)
+        if master_key is None:
+            raise ValueError(f"Unknown key version: {key_version}")
             
         # Use HKDF to derive a specific key for this purpose
         info = f"inner-architect-{key_id}-key-v{VERSION}".encode('utf-8')
@@ -167,13 +422,42 @@ class EncryptionManager:
         )
         
         # Derive the key from the master key
-        derived_key = hkdf.derive(self.master_key)
+        derived_key = hkdf.derive(master_key)
         
-        # Cache the derived key for this request
-        self.data_keys[key_id] = derived_key
+        # Cache the derived key until the key ring changes
+        self.data_keys[cache_key] = derived_key
         
         return derived_key
     
+    def _cipher(self, purpose: str, key_version: Optional[int] = None) -> AESGCM:
+        """Get the cached AES-GCM cipher for a purpose and key version"""
+        if key_version is None:
+            key_version = self.key_version
+        cipher = self.ciphers.get((key_version, purpose))
+        if cipher is None:
+            cipher = AESGCM(self._derive_data_key(purpose, key_version))
+            self.ciphers[(key_version, purpose)] = cipher
+        return cipher
+    
+    def _envelope_header(self, purpose: str, key_version: int) -> bytes:
+        """Get the envelope header (versions and purpose) for a purpose and key version"""
+        header = self.envelope_headers.get((key_version, purpose))
+        if header is None:
+            purpose_bytes = purpose.encode('utf-8')
+            if len(purpose_bytes) > 255:
+                raise ValueError("Encryption purpose must be at most 255 bytes")
+            header = (bytes((ENVELOPE_VERSION,)) + key_version.to_bytes(2, 'big') +
+                      bytes((len(purpose_bytes),)) + purpose_bytes)
+            self.envelope_headers[(key_version, purpose)] = header
+        return header
+    
+    def _clear_key_cache(self):
+        """Drop derived keys, ciphers and headers, e.g. after the key ring changes"""
+        # Replaced rather than cleared, for threads still using the old ones
+        self.data_keys = {}
+        self.ciphers = {}
+        self.envelope_headers = {}
+    
     def encrypt(self, data: Union[str, bytes], purpose: str = 'general') -> str:
         """
         Encrypt data using AES-256-GCM with authentication
@@ -190,29 +474,53 @@ class EncryptionManager:
         else:
             plaintext = data
             
-        # Get the appropriate key for this purpose
-        key = self._derive_data_key(purpose)
+        self._refresh_if_due()
+        # The same version for header and key, even if the ring is reloaded meanwhile
+        key_version = self.key_version
+        header = self._envelope_header(purpose, key_version)
         
         # Generate a random nonce/IV
         nonce = os.urandom(NONCE_LENGTH)
         
-        # Create the cipher
-        aesgcm = AESGCM(key)
+        # Encrypt and authenticate the data along with the header
+        ciphertext = self._cipher(purpose, key_version).encrypt(nonce, plaintext, header)
         
-        # Encrypt and authenticate the data
-        ciphertext = aesgcm.encrypt(nonce, plaintext, None)
+        return base64.b64encode(header + nonce + ciphertext).decode('ascii')
+    
+    def encrypt_many(self, values: Iterable[Optional[Union[str, bytes]]],
+                     purpose: str = 'general') -> List[Optional[str]]:
+        """
+        Encrypt a batch of values with the same purpose
         
-        # Create the result format with metadata
-        # Format: version|nonce|ciphertext
-        result = {
-            'v': VERSION,
-            'n': base64.b64encode(nonce).decode('utf-8'),
-            'd': base64.b64encode(ciphertext).decode('utf-8'),
-            'p': purpose
-        }
+        Args:
+            values: The data to encrypt (None values are passed through)
+            purpose: The purpose identifier for key derivation
+            
+        Returns:
+            Encrypted values in the same order
+        """
+        values = list(values)
+        self._refresh_if_due()
+        # The same version for header and key, even if the ring is reloaded meanwhile
+        key_version = self.key_version
+        header = self._envelope_header(purpose, key_version)
+        encrypt = self._cipher(purpose, key_version).encrypt
+        
+        # One random read for all nonces
+        nonces = os.urandom(NONCE_LENGTH * len(values))
         
-        # Return as JSON string with base64 encoding
-        return base64.b64encode(json.dumps(result).encode('utf-8')).decode('utf-8')
+        results = []
+        for index, value in enumerate(values):
+            if value is None:
+                results.append(None)
+                continue
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            nonce = nonces[index * NONCE_LENGTH:(index + 1) * NONCE_LENGTH]
+            envelope = header + nonce + encrypt(nonce, value, header)
+            results.append(base64.b64encode(envelope).decode('ascii'))
+        
+        return results
     
     def decrypt(self, encrypted_data: str) -> bytes:
         """
@@ -225,49 +533,157 @@ class EncryptionManager:
             Decrypted data as bytes
         """
         try:
-            # Decode the outer base64
-            json_data = base64.b64decode(encrypted_data.encode('utf-8')).decode('utf-8')
-            
-            # Parse the JSON
-            result = json.loads(json_data)
-            
-            # Check version
-            if result.get('v') != VERSION:
-                raise ValueError(f"Unsupported encryption version: {result.get('v')}")
-                
-            # Get the purpose
-            purpose = result.get('p', 'general')
-            
-            # Get the key for this purpose
-            key = self._derive_data_key(purpose)
-            
-            # Decode the nonce and ciphertext
-            nonce = base64.b64decode(result.get('n'))
-            ciphertext = base64.b64decode(result.get('d'))
+            return self._open(base64.b64decode(encrypted_data))[2]
+        except Exception as e:
+            self._log_error(f"Decryption error: {e}")
+            raise ValueError("Failed to decrypt data") from e
+    
+    def decrypt_many(self, values: Iterable[Optional[str]]) -> List[Optional[bytes]]:
+        """
+        Decrypt a batch of values, e.g. a column of a query result
+        
+        Values are usually written with a few purposes and key versions, so
+        the cipher is looked up once per distinct envelope header.
+        
+        Args:
+            values: Encrypted values (None values are passed through)
             
-            # Create the cipher
-            aesgcm = AESGCM(key)
+        Returns:
+            Decrypted values as bytes in the same order
+        """
+        ciphers = {}
+        results = []
+        for value in values:
+            if value is None:
+                results.append(None)
+                continue
+            try:
+                envelope = base64.b64decode(value)
+                if envelope[:1] == LEGACY_ENVELOPE_PREFIX:
+                    results.append(self._open_legacy(envelope)[2])
+                    continue
+                key_version, purpose, header_length = self._parse_header(envelope)
+                header = envelope[:header_length]
+                cipher = ciphers.get(header)
+                if cipher is None:
+                    cipher = ciphers[header] = self._cipher(purpose, key_version)
+                nonce = envelope[header_length:header_length + NONCE_LENGTH]
+                results.append(cipher.decrypt(nonce, envelope[header_length + NONCE_LENGTH:], header))
+            except Exception as e:
+                self._log_error(f"Decryption error: {e}")
+                raise ValueError("Failed to decrypt data") from e
+        return results
+    
+    def key_version_of(self, encrypted_data: str) -> int:
+        """Get the master key version an encrypted value was written with"""
+        # The first 4 characters encode the format and key version bytes
+        envelope = base64.b64decode(encrypted_data[:4])
+        if envelope[:1] == bytes((ENVELOPE_VERSION,)):
+            return int.from_bytes(envelope[1:3], 'big')
+        return INITIAL_KEY_VERSION
+    
+    def reencrypt_many(self, values: Iterable[Optional[str]]) -> List[Optional[str]]:
+        """
+        Re-encrypt values with the current key version, keeping their purpose
+        
+        Args:
+            values: Encrypted values
             
-            # Decrypt the data
-            plaintext = aesgcm.decrypt(nonce, ciphertext, None)
+        Returns:
+            The re-encrypted values in the same order, with None for values
+            that are None or already encrypted with the current version
+        """
+        current = bytes((ENVELOPE_VERSION,)) + self.key_version.to_bytes(2, 'big')
+        results = []
+        for value in values:
+            if value is None:
+                results.append(None)
+                continue
+            try:
+                envelope = base64.b64decode(value)
+                if envelope[:3] == current:
+                    results.append(None)
+                    continue
+                _, purpose, plaintext = self._open(envelope)
+            except Exception as e:
+                self._log_error(f"Decryption error: {e}")
+                raise ValueError("Failed to decrypt data") from e
+            results.append(self.encrypt(plaintext, purpose))
+        return results
+    
+    def _open(self, envelope: bytes) -> Tuple[int, str, bytes]:
+        """
+        Decrypt an envelope in any supported format
+        
+        Returns:
+            Tuple of (key version, purpose, plaintext)
+        """
+        if envelope[:1] == LEGACY_ENVELOPE_PREFIX:
+            return self._open_legacy(envelope)
+        
+        key_version, purpose, header_length = self._parse_header(envelope)
+        header = envelope[:header_length]
+        nonce = envelope[header_length:header_length + NONCE_LENGTH]
+        ciphertext = envelope[header_length + NONCE_LENGTH:]
+        
+        return key_version, purpose, self._cipher(purpose, key_version).decrypt(nonce, ciphertext, header)
+    
+    @staticmethod
+    def _parse_header(envelope: bytes) -> Tuple[int, str, int]:
+        """
+        Read the header of a binary envelope
+        
+        Returns:
+            Tuple of (key version, purpose, header length)
+        """
+        if envelope[0] == ENVELOPE_VERSION:
+            key_version = int.from_bytes(envelope[1:3], 'big')
+            purpose_offset = 3
+        elif envelope[0] == UNVERSIONED_ENVELOPE_VERSION:
+            key_version = INITIAL_KEY_VERSION
+            purpose_offset = 1
+        else:
+            raise ValueError(f"Unsupported encryption version: {envelope[0]}")
+        
+        header_length = purpose_offset + 1 + envelope[purpose_offset]
+        purpose = envelope[purpose_offset + 1:header_length].decode('utf-8')
+        return key_version, purpose, header_length
+    
+    def _open_legacy(self, envelope: bytes) -> Tuple[int, str, bytes]:
+        """Decrypt a JSON envelope written before the binary format"""
+        result = json.loads(envelope.decode('utf-8'))
+        
+        # Check version
+        if result.get('v') != VERSION:
+            raise ValueError(f"Unsupported encryption version: {result.get('v')}")
             
-            return plaintext
-        except Exception as e:
-            self.app.logger.error(f"Decryption error: {e}")
-            raise ValueError("Failed to decrypt data") from e
+        # Get the purpose
+        purpose = result.get('p', 'general')
+        
+        # Decode the nonce and ciphertext
+        nonce = base64.b64decode(result.get('n'))
+        ciphertext = base64.b64decode(result.get('d'))
+        
+        plaintext = self._cipher(purpose, INITIAL_KEY_VERSION).decrypt(nonce, ciphertext, None)
+        return INITIAL_KEY_VERSION, purpose, plaintext
     
-    def _teardown(self, exception):
-        """Clear sensitive key material from memory on request end"""
-        self.data_keys.clear()
+    def _log_error(self, message: str):
+        """Log an error through the application logger, if any"""
+        if self.app is not None:
+            self.app.logger.error(message)
 
 
-class EncryptedField:
+class EncryptedField(TypeDecorator):
     """
     SQLAlchemy TypeDecorator for automatically encrypting and
     decrypting database fields containing PHI
     """
     
-    def __init__(self, purpose='db-field'):
+    impl = Text
+    cache_ok = True
+    
+    def __init__(self, purpose='db-field', *args, **kwargs):
+        super().__init__(*args, **kwargs)
         self.purpose = purpose
     
     def process_bind_param(self, value, dialect):
@@ -0,0 +1,367 @@
+"""
+Online Re-encryption for The Inner Architect
+
+After a master key rotation, data encrypted with earlier key versions stays
+readable through the key ring. This module moves every EncryptedField
+column to the current key version while the application keeps serving
+requests, so that old key versions can eventually be retired.
+
+- Each column is split into primary key ranges that worker processes
+  re-encrypt independently
+- Rows are read in keyset-paginated batches, and a value is only replaced
+  if it has not changed since it was read
+- Each batch commits together with its range's progress checkpoint, so an
+  interrupted run resumes where it stopped
+- Workers can be throttled to a maximum number of rows per second
+"""
+
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import (
+    Column, String, DateTime, Integer, BigInteger, Text,
+    select, update, insert, func, bindparam, create_engine, table, column
+)
+
+from database import db
+from security.encryption import EncryptionManager, EncryptedField
+
+# Rows read and re-encrypted per transaction
+REENCRYPT_BATCH_SIZE = 500
+
+# Primary key ranges per column
+REENCRYPT_PARTITIONS = 4
+
+
+class KeyRotationProgress(db.Model):
+    """
+    Re-encryption checkpoint for a primary key range of an encrypted column
+    """
+    __tablename__ = 'key_rotation_progress'
+
+    key_version = Column(Integer, primary_key=True)
+    table_name = Column(String(100), primary_key=True)
+    column_name = Column(String(100), primary_key=True)
+    range_index = Column(Integer, primary_key=True)
+    range_start = Column(String(255), nullable=True)  # Exclusive, None for the first range
+    range_end = Column(String(255), nullable=True)  # Inclusive, None for the last range
+    last_key = Column(String(255), nullable=True)  # Last primary key processed
+    rows_scanned = Column(BigInteger, nullable=False, default=0)
+    rows_updated = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<KeyRotationProgress {self.table_name}.{self.column_name}#{self.range_index} v{self.key_version}>'
+
+
+def encrypted_columns(metadata=None) -> List[Tuple[Any, Any]]:
+    """
+    Find the EncryptedField columns of all mapped tables
+
+    Returns:
+        List of (table, column)
+    """
+    metadata = metadata if metadata is not None else db.metadata
+    columns = []
+    for mapped_table in metadata.sorted_tables:
+        for mapped_column in mapped_table.columns:
+            if isinstance(mapped_column.type, EncryptedField):
+                columns.append((mapped_table, mapped_column))
+    return columns
+
+
+def find_key_version_use(manager: EncryptionManager, version: int, metadata=None) -> Optional[str]:
+    """
+    Find an encrypted column with values still written with a key version
+
+    Args:
+        manager: Encryption manager reading the envelopes
+        version: Key version to look for
+        metadata: Tables to scan (default: all mapped tables)
+
+    Returns:
+        'table.column' of the first such column, or None if no value uses the version
+    """
+    for mapped_table, mapped_column in encrypted_columns(metadata):
+        # Plain text column, so values are not decrypted while scanning
+        data = table(mapped_table.name, column(mapped_column.name, Text))
+        value = data.c[mapped_column.name]
+        result = db.session.execute(
+            select(value).where(value.isnot(None)).execution_options(yield_per=REENCRYPT_BATCH_SIZE)
+        )
+        try:
+            for stored in result.scalars():
+                if manager.key_version_of(stored) == version:
+                    return f"{mapped_table.name}.{mapped_column.name}"
+        finally:
+            result.close()
+    return None
+
+
+def _key_to_text(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _key_from_text(primary_key, value: Optional[str]):
+    """Convert a checkpointed primary key back to its column's Python type"""
+    if value is None:
+        return None
+    try:
+        python_type = primary_key.type.python_type
+    except NotImplementedError:
+        return value
+    return python_type(value) if python_type is int else value
+
+
+def _reencrypt_range(connection_factory, manager: EncryptionManager, task: Dict[str, Any],
+                     batch_size: int, max_rows_per_second: Optional[float]) -> Dict[str, Any]:
+    """
+    Re-encrypt one primary key range, checkpointing after every batch
+
+    Args:
+        connection_factory: Callable returning a transactional connection context
+        manager: Encryption manager holding the key ring
+        task: Table, column and range of a KeyRotationProgress row
+        batch_size: Rows per batch
+        max_rows_per_second: Throttle, or None for no limit
+
+    Returns:
+        Dictionary with rows_scanned, rows_updated and error
+    """
+    data = table(task['table_name'], column(task['key_column']), column(task['column_name'], Text))
+    primary_key = data.c[task['key_column']]
+    value = data.c[task['column_name']]
+    progress = KeyRotationProgress.__table__
+    progress_row = (
+        (progress.c.key_version == task['key_version']) &
+        (progress.c.table_name == task['table_name']) &
+        (progress.c.column_name == task['column_name']) &
+        (progress.c.range_index == task['range_index'])
+    )
+    replace_value = update(data).where(
+        primary_key == bindparam('_key'),
+        value == bindparam('_old')
+    ).values({task['column_name']: bindparam('_new')})
+
+    last_key = task['last_key']
+    scanned = updated = 0
+    started = time.monotonic()
+
+    try:
+        while True:
+            with connection_factory() as connection:
+                query = select(primary_key, value).order_by(primary_key).limit(batch_size)
+                if last_key is not None:
+                    query = query.where(primary_key > last_key)
+                elif task['range_start'] is not None:
+                    query = query.where(primary_key > task['range_start'])
+                if task['range_end'] is not None:
+                    query = query.where(primary_key <= task['range_end'])
+                rows = connection.execute(query).all()
+
+                if not rows:
+                    connection.execute(update(progress).where(progress_row).values(
+                        completed_at=datetime.utcnow(), updated_at=datetime.utcnow()
+                    ))
+                    break
+
+                new_values = manager.reencrypt_many([row[1] for row in rows])
+                changes = [
+                    {'_key': row[0], '_old': row[1], '_new': new_value}
+                    for row, new_value in zip(rows, new_values) if new_value is not None
+                ]
+                changed = 0
+                if changes:
+                    result = connection.execute(replace_value, changes)
+                    # Values changed since they were read are left alone
+                    changed = (result.rowcount if connection.dialect.supports_sane_multi_rowcount
+                               else len(changes))
+
+                last_key = rows[-1][0]
+                connection.execute(update(progress).where(progress_row).values(
+                    last_key=_key_to_text(last_key),
+                    rows_scanned=progress.c.rows_scanned + len(rows),
+                    rows_updated=progress.c.rows_updated + changed,
+                    updated_at=datetime.utcnow()
+                ))
+
+            scanned += len(rows)
+            updated += changed
+
+            if max_rows_per_second:
+                # Sleep until the range is back under its rate limit
+                delay = scanned / max_rows_per_second - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+    except Exception as e:
+        return {'rows_scanned': scanned, 'rows_updated': updated,
+                'error': f"{task['table_name']}.{task['column_name']} after key {last_key}: {e}"}
+
+    return {'rows_scanned': scanned, 'rows_updated': updated, 'error': None}
+
+
+def _reencrypt_range_in_process(database_uri: str, key_data: Dict[str, Any], task: Dict[str, Any],
+                                batch_size: int, max_rows_per_second: Optional[float]) -> Dict[str, Any]:
+    """Re-encrypt a range in a worker process with its own database connection and key ring"""
+    manager = EncryptionManager()
+    manager.load_key_ring(key_data)
+    engine = create_engine(database_uri)
+    try:
+        return _reencrypt_range(engine.begin, manager, task, batch_size, max_rows_per_second)
+    finally:
+        engine.dispose()
+
+
+class ReencryptionJob:
+    """
+    Re-encrypts all EncryptedField columns with the current key version
+    """
+
+    def __init__(self, manager: EncryptionManager, batch_size: int = REENCRYPT_BATCH_SIZE,
+                 partitions: int = REENCRYPT_PARTITIONS, max_rows_per_second: Optional[float] = None):
+        """
+        Args:
+            manager: Encryption manager holding the key ring
+            batch_size: Rows per batch
+            partitions: Primary key ranges per column
+            max_rows_per_second: Throttle per range, or None for no limit
+        """
+        self.manager = manager
+        self.batch_size = batch_size
+        self.partitions = max(1, partitions)
+        self.max_rows_per_second = max_rows_per_second
+
+    def _plan_ranges(self, mapped_table, primary_key) -> List[Tuple[Any, Any]]:
+        """Split a table into primary key ranges of similar size"""
+        rows = db.session.execute(select(func.count()).select_from(mapped_table)).scalar() or 0
+        boundaries = []
+        for index in range(1, self.partitions):
+            boundary = db.session.execute(
+                select(primary_key).order_by(primary_key).offset(rows * index // self.partitions).limit(1)
+            ).scalar()
+            if boundary is not None and boundary not in boundaries:
+                boundaries.append(boundary)
+
+        starts = [None] + boundaries
+        ends = boundaries + [None]
+        return list(zip(starts, ends))
+
+    def _tasks(self, restart: bool) -> List[Dict[str, Any]]:
+        """Get the unfinished ranges of every encrypted column, planning new columns"""
+        key_version = self.manager.key_version
+        if restart:
+            KeyRotationProgress.query.filter_by(key_version=key_version).delete()
+            db.session.commit()
+
+        tasks = []
+        for mapped_table, mapped_column in encrypted_columns():
+            primary_keys = list(mapped_table.primary_key.columns)
+            if len(primary_keys) != 1:
+                self.manager.app.logger.warning(
+                    f"Skipping re-encryption of {mapped_table.name}.{mapped_column.name}: "
+                    f"composite primary keys are not supported"
+                )
+                continue
+            primary_key = primary_keys[0]
+
+            ranges = KeyRotationProgress.query.filter_by(
+                key_version=key_version,
+                table_name=mapped_table.name,
+                column_name=mapped_column.name
+            ).order_by(KeyRotationProgress.range_index).all()
+
+            if not ranges:
+                db.session.execute(insert(KeyRotationProgress), [
+                    {
+                        'key_version': key_version,
+                        'table_name': mapped_table.name,
+                        'column_name': mapped_column.name,
+                        'range_index': range_index,
+                        'range_start': _key_to_text(start),
+                        'range_end': _key_to_text(end),
+                        'rows_scanned': 0,
+                        'rows_updated': 0
+                    }
+                    for range_index, (start, end) in enumerate(self._plan_ranges(mapped_table, primary_key))
+                ])
+                db.session.commit()
+                ranges = KeyRotationProgress.query.filter_by(
+                    key_version=key_version,
+                    table_name=mapped_table.name,
+                    column_name=mapped_column.name
+                ).order_by(KeyRotationProgress.range_index).all()
+
+            for progress in ranges:
+                if progress.completed_at is not None:
+                    continue
+                tasks.append({
+                    'key_version': key_version,
+                    'table_name': mapped_table.name,
+                    'column_name': mapped_column.name,
+                    'key_column': primary_key.name,
+                    'range_index': progress.range_index,
+                    'range_start': _key_from_text(primary_key, progress.range_start),
+                    'range_end': _key_from_text(primary_key, progress.range_end),
+                    'last_key': _key_from_text(primary_key, progress.last_key)
+                })
+
+        return tasks
+
+    def run(self, workers: int = 1, restart: bool = False) -> Dict[str, Any]:
+        """
+        Re-encrypt every encrypted column, resuming from earlier checkpoints
+
+        Args:
+            workers: Number of worker processes (1 runs in this process)
+            restart: Discard checkpoints of the current key version and scan
+                everything again, e.g. to pick up values written by processes
+                that had not loaded the new key yet
+
+        Returns:
+            Report with key_version, ranges, rows_scanned, rows_updated,
+            elapsed_seconds, complete and errors
+        """
+        started = time.time()
+        tasks = self._tasks(restart)
+        results = []
+
+        if workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                results.append(_reencrypt_range(
+                    db.engine.begin, self.manager, task, self.batch_size, self.max_rows_per_second
+                ))
+        else:
+            database_uri = db.engine.url.render_as_string(hide_password=False)
+            key_data = self.manager.key_ring_data()
+            # Spawned workers do not inherit open connections
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = [
+                    executor.submit(_reencrypt_range_in_process, database_uri, key_data, task,
+                                    self.batch_size, self.max_rows_per_second)
+                    for task in tasks
+                ]
+                results = [future.result() for future in futures]
+
+        errors = [result['error'] for result in results if result['error']]
+        for error in errors:
+            self.manager.app.logger.error(f"Re-encryption failed for {error}")
+
+        remaining = KeyRotationProgress.query.filter(
+            KeyRotationProgress.key_version == self.manager.key_version,
+            KeyRotationProgress.completed_at.is_(None)
+        ).count()
+
+        return {
+            'key_version': self.manager.key_version,
+            'ranges': len(tasks),
+            'rows_scanned': sum(result['rows_scanned'] for result in results),
+            'rows_updated': sum(result['rows_updated'] for result in results),
+            'elapsed_seconds': time.time() - started,
+            'complete': remaining == 0 and not errors,
+            'errors': errors
+        }
@@ -191,13 +191,11 @@ class SecurityPenetrationTest:
                 # Tamper with the encrypted data
                 try:
                     import base64
-                    import json
-                    tampered = base64.b64decode(encrypted.encode('utf-8')).decode('utf-8')
-                    tampered_data = json.loads(tampered)
+                    tampered_data = bytearray(base64.b64decode(encrypted))
                     # Modify the data
-                    tampered_data['d'] = tampered_data['d'][:-5] + 'AAAAA'
+                    tampered_data[-5:] = b'AAAAA'
                     # Re-encode
-                    tampered = base64.b64encode(json.dumps(tampered_data).encode('utf-8')).decode('utf-8')
+                    tampered = base64.b64encode(bytes(tampered_data)).decode('ascii')
                     
                     # Try to decrypt
                     try:
@@ -376,6 +374,11 @@ class SecurityPenetrationTest:
                         success=True
                     )
                     
+                    # Wait for the audit writer, then load the stored entry
+                    if log_entry and log_entry.id and audit.flush(timeout=10):
+                        from security.audit import AuditLog
+                        log_entry = AuditLog.query.get(log_entry.id)
+                    
                     # Verify log entry was created
                     if not log_entry or not log_entry.id:
                         self._log_vulnerability(
@@ -0,0 +1,80 @@
+"""
+Module for SQLite files shared by the worker processes on a host.
+
+The provider guard and the response cache keep their state in small SQLite
+files, by default in the temp directory. Each thread of each process gets
+its own connection, in WAL mode so readers do not block the writer.
+
+Every new connection creates any missing tables, and a connection is
+replaced when its file has been removed or replaced (e.g. by temp directory
+cleanup), so all processes move to the new file and rebuild the state
+there instead of keeping it in a file only they can see.
+"""
+import os
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+
+class SharedSQLiteFile:
+    """
+    Per-thread connections to a SQLite file shared across processes.
+    """
+
+    def __init__(self, path: str, schema: str, private: bool = False, timeout: float = 5.0):
+        """
+        Args:
+            path: SQLite file
+            schema: Idempotent script creating the tables (CREATE ... IF NOT EXISTS)
+            private: Create the file readable by its owner only
+            timeout: Seconds to wait for a lock held by another connection
+        """
+        self.path = path
+        self.schema = schema
+        self.private = private
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, connecting if necessary."""
+        connection = getattr(self._local, 'connection', None)
+        # Connections must not be shared with forked worker processes, and
+        # must not keep using a file that was removed
+        if connection is not None and (self._local.pid != os.getpid()
+                                       or self._file_id() != self._local.file_id):
+            self._discard()
+            connection = None
+
+        if connection is None:
+            if self.private and not os.path.exists(self.path):
+                os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o600))
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.executescript(self.schema)
+            except sqlite3.Error:
+                connection.close()
+                raise
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            self._local.file_id = self._file_id()
+        return connection
+
+    def _file_id(self) -> Optional[Tuple[int, int]]:
+        """Identify the file currently at the path (None if there is none)."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _discard(self) -> None:
+        """Drop this thread's connection so the next call reconnects."""
+        connection: Optional[sqlite3.Connection] = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None and self._local.pid == os.getpid():
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
@@ -6,6 +6,8 @@ and usage quota tracking for the application.
 """
 
 import os
+import threading
+import time
 import uuid
 from datetime import datetime, timezone, timedelta
 from functools import wraps
@@ -14,10 +16,10 @@ import stripe
 
 # We'll handle Stripe errors generically to avoid LSP issues
 # This is more future-proof against Stripe library updates
-from flask import flash, redirect, url_for, session
+from flask import flash, redirect, url_for, session, g, has_app_context
 from flask_login import current_user
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, func, select, update
 from sqlalchemy.orm import relationship
 
 from logging_config import get_logger, info, error, debug, warning, critical, exception
@@ -158,6 +160,12 @@ stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
 # Constants
 UNLIMITED_QUOTA = 9999999  # Represents unlimited quota (instead of infinity)
 
+# Seconds a resolved subscription plan is reused across requests
+PLAN_CACHE_TTL = 60
+
+# Maximum number of users with a cached plan resolution per process
+PLAN_CACHE_MAX_ENTRIES = 10000
+
 # Trial constants
 DEFAULT_TRIAL_DAYS = 7  # Default 7-day trial period
 MAX_TRIAL_DAYS = 30  # Maximum allowed trial period
@@ -251,6 +259,130 @@ def get_subscription(user_id):
     """
     return Subscription.query.filter_by(user_id=user_id).first()
 
+# Process-wide cache of resolved plans: user_id -> (expires_at, resolution)
+_plan_cache = {}
+_plan_cache_lock = threading.Lock()
+
+def _describe_subscription(subscription):
+    """
+    Reduce a subscription row to the plain values used for access checks.
+
+    Plain values (rather than the ORM object) are cached so a resolution can
+    be shared between requests and database sessions.
+
+    Args:
+        subscription (Subscription): The subscription or None
+
+    Returns:
+        dict: Resolved plan, effective plan (trial aware), status and limits
+    """
+    if subscription is None:
+        plan_details = SUBSCRIPTION_PLANS['free']
+        return {
+            'exists': False,
+            'subscription_id': None,
+            'plan_name': 'free',
+            'effective_plan': None,
+            'has_active_trial': False,
+            'status': None,
+            'cancel_at_period_end': False,
+            'current_period_end': None,
+            'features': plan_details.get('features', []),
+            'quotas': plan_details.get('quotas', {})
+        }
+
+    plan_name = subscription.plan_name
+    has_active_trial = bool(subscription.has_active_trial)
+    effective_plan = subscription.trial_plan if has_active_trial else plan_name
+    plan_details = SUBSCRIPTION_PLANS.get(plan_name, SUBSCRIPTION_PLANS['free'])
+
+    return {
+        'exists': True,
+        'subscription_id': subscription.id,
+        'plan_name': plan_name,
+        'effective_plan': effective_plan,
+        'has_active_trial': has_active_trial,
+        'status': subscription.status,
+        'cancel_at_period_end': subscription.cancel_at_period_end,
+        'current_period_end': subscription.current_period_end.isoformat() if subscription.current_period_end else None,
+        'features': plan_details.get('features', []),
+        'quotas': plan_details.get('quotas', {})
+    }
+
+def _request_plans():
+    """Plan resolutions made during the current request, or None outside one."""
+    if not has_app_context():
+        return None
+    if not hasattr(g, 'resolved_plans'):
+        g.resolved_plans = {}
+    return g.resolved_plans
+
+def _store_plan(user_id, resolution):
+    """Store a plan resolution for the current request and for PLAN_CACHE_TTL seconds."""
+    request_plans = _request_plans()
+    if request_plans is not None:
+        request_plans[user_id] = resolution
+
+    now = time.monotonic()
+    with _plan_cache_lock:
+        if len(_plan_cache) >= PLAN_CACHE_MAX_ENTRIES:
+            # Drop expired entries first, then the oldest ones
+            for key in [key for key, (expires_at, _) in _plan_cache.items() if expires_at <= now]:
+                del _plan_cache[key]
+            while len(_plan_cache) >= PLAN_CACHE_MAX_ENTRIES:
+                del _plan_cache[next(iter(_plan_cache))]
+        _plan_cache[user_id] = (now + PLAN_CACHE_TTL, resolution)
+
+def resolve_plan(user_id):
+    """
+    Resolve a user's subscription plan, querying the database at most once.
+
+    Resolutions are reused for the rest of the current request (via flask.g)
+    and by later requests in this process for PLAN_CACHE_TTL seconds. Local
+    changes and Stripe webhooks call invalidate_plan_cache, so the TTL only
+    bounds staleness for changes made by other processes.
+
+    Args:
+        user_id (str): The user ID
+
+    Returns:
+        dict: The resolved plan (see _describe_subscription)
+    """
+    request_plans = _request_plans()
+    if request_plans is not None and user_id in request_plans:
+        return request_plans[user_id]
+
+    with _plan_cache_lock:
+        cached = _plan_cache.get(user_id)
+    if cached is not None and cached[0] > time.monotonic():
+        if request_plans is not None:
+            request_plans[user_id] = cached[1]
+        return cached[1]
+
+    resolution = _describe_subscription(get_subscription(user_id))
+    _store_plan(user_id, resolution)
+    return resolution
+
+def invalidate_plan_cache(user_id=None):
+    """
+    Drop cached plan resolutions after a subscription changes.
+
+    Args:
+        user_id (str, optional): The user whose plan changed; all users if omitted
+    """
+    with _plan_cache_lock:
+        if user_id is None:
+            _plan_cache.clear()
+        else:
+            _plan_cache.pop(user_id, None)
+
+    request_plans = _request_plans()
+    if request_plans:
+        if user_id is None:
+            request_plans.clear()
+        else:
+            request_plans.pop(user_id, None)
+
 def get_subscription_details(user_id):
     """
     Get detailed subscription information for a user.
@@ -261,33 +393,36 @@ def get_subscription_details(user_id):
     Returns:
         dict: Subscription details including plan features and quotas
     """
-    subscription = get_subscription(user_id)
+    plan = resolve_plan(user_id)
 
     # If no subscription record exists, create one with the free plan
-    if not subscription:
-        subscription = Subscription()
-        subscription.user_id = user_id
-        subscription.plan_name = 'free'
-        subscription.status = 'active'
-        db.session.add(subscription)
-        db.session.commit()
+    if not plan['exists']:
+        # A cached miss can be stale (e.g. another worker handled a webhook),
+        # and user_id is not unique, so check the database before inserting
+        subscription = get_subscription(user_id)
+        if subscription is None:
+            subscription = Subscription()
+            subscription.user_id = user_id
+            subscription.plan_name = 'free'
+            subscription.status = 'active'
+            db.session.add(subscription)
+            db.session.commit()
 
-    # Get plan details
-    plan_name = subscription.plan_name
-    plan_details = SUBSCRIPTION_PLANS.get(plan_name, SUBSCRIPTION_PLANS['free'])
+        plan = _describe_subscription(subscription)
+        _store_plan(user_id, plan)
 
     # Get usage quotas
     usage = get_usage_quota(user_id)
 
     # Return combined details
     return {
-        'subscription_id': subscription.id,
-        'plan_name': plan_name,
-        'status': subscription.status,
-        'cancel_at_period_end': subscription.cancel_at_period_end,
-        'current_period_end': subscription.current_period_end.isoformat() if subscription.current_period_end else None,
-        'features': plan_details.get('features', []),
-        'quotas': plan_details.get('quotas', {}),
+        'subscription_id': plan['subscription_id'],
+        'plan_name': plan['plan_name'],
+        'status': plan['status'],
+        'cancel_at_period_end': plan['cancel_at_period_end'],
+        'current_period_end': plan['current_period_end'],
+        'features': plan['features'],
+        'quotas': plan['quotas'],
         'usage': {
             'messages_used_today': usage.messages_used_today,
             'exercises_used_today': usage.exercises_used_today,
@@ -310,20 +445,15 @@ def check_feature_access(user_id, feature):
         # Log the feature access check attempt for debugging
         info(f"Checking feature access for user {user_id}, feature: {feature}")
 
-        # Get the subscription details
-        subscription = get_subscription(user_id)
-        if not subscription:
+        # Get the resolved subscription plan (trial plan while a trial is active)
+        plan = resolve_plan(user_id)
+        if not plan['exists']:
             warning(f"No subscription found for user {user_id}")
             return False
 
-        # Check for active trial
-        if subscription.has_active_trial:
-            # Use the trial plan for access checks
-            effective_plan = subscription.trial_plan
+        effective_plan = plan['effective_plan']
+        if plan['has_active_trial']:
             info(f"User {user_id} has active trial for {effective_plan} plan")
-        else:
-            # Use the regular subscription plan
-            effective_plan = subscription.plan_name
 
         if not effective_plan:
             warning(f"Subscription found for user {user_id} but effective_plan is empty")
@@ -337,7 +467,7 @@ def check_feature_access(user_id, feature):
 
         # Check if the user's plan has access to this feature
         has_access = effective_plan in allowed_plans
-        info(f"Feature access check result: user {user_id} with {'trial ' if subscription.has_active_trial else ''}plan '{effective_plan}' {'has' if has_access else 'does not have'} access to {feature}")
+        info(f"Feature access check result: user {user_id} with {'trial ' if plan['has_active_trial'] else ''}plan '{effective_plan}' {'has' if has_access else 'does not have'} access to {feature}")
 
         return has_access
 
@@ -408,6 +538,7 @@ def create_trial(user_id, trial_plan='premium', trial_days=DEFAULT_TRIAL_DAYS):
             subscription.trial_converted = False
 
             db.session.commit()
+            invalidate_plan_cache(user_id)
             info(f"Updated subscription to {trial_plan} trial until {trial_end}")
         else:
             info(f"Creating new subscription for user {user_id} with trial")
@@ -426,6 +557,7 @@ def create_trial(user_id, trial_plan='premium', trial_days=DEFAULT_TRIAL_DAYS):
 
             db.session.add(subscription)
             db.session.commit()
+            invalidate_plan_cache(user_id)
             info(f"Created new subscription with {trial_plan} trial until {trial_end}")
 
         # Return success
@@ -473,6 +605,7 @@ def end_trial(user_id, convert_to_paid=False):
             subscription.current_period_end = subscription.current_period_start + timedelta(days=30)  # 30-day billing cycle
 
             db.session.commit()
+            invalidate_plan_cache(user_id)
             info(f"Converted trial to paid {subscription.plan_name} subscription")
             return True, f"Trial converted to paid {subscription.plan_name} subscription"
         else:
@@ -481,6 +614,7 @@ def end_trial(user_id, convert_to_paid=False):
             subscription.trial_converted = False
 
             db.session.commit()
+            invalidate_plan_cache(user_id)
             info(f"Trial ended without conversion")
             return True, "Trial ended"
 
@@ -537,30 +671,106 @@ def _check_reset_quotas(usage):
     """
     Check if daily or monthly quota reset is needed and perform the reset.
 
+    Resets are conditional UPDATEs, so when several workers notice a new day
+    at once only the first one zeroes the counters and increments made in
+    between are not lost.
+
     Args:
         usage (UsageQuota): The usage quota object
     """
     now = datetime.now()
-    today = now.date()
+    day_start = datetime(now.year, now.month, now.day)
+    month_start = datetime(now.year, now.month, 1)
+
+    needs_daily_reset = usage.last_reset_date and usage.last_reset_date < day_start
+    needs_monthly_reset = usage.last_monthly_reset_date and usage.last_monthly_reset_date < month_start
+    if not (needs_daily_reset or needs_monthly_reset):
+        return
 
-    # Check if last reset was on a different day
-    if usage.last_reset_date and usage.last_reset_date.date() < today:
+    if needs_daily_reset:
         # Reset daily quotas
-        usage.messages_used_today = 0
-        usage.exercises_used_today = 0
-        usage.last_reset_date = now
-
-    # Check if last monthly reset was in a different month
-    if usage.last_monthly_reset_date and (
-            usage.last_monthly_reset_date.year != now.year or
-            usage.last_monthly_reset_date.month != now.month):
+        db.session.execute(
+            update(UsageQuota)
+            .where(UsageQuota.id == usage.id, UsageQuota.last_reset_date < day_start)
+            .values(messages_used_today=0, exercises_used_today=0, last_reset_date=now)
+            .execution_options(synchronize_session=False)
+        )
+
+    if needs_monthly_reset:
         # Reset monthly quotas
-        usage.analyses_used_this_month = 0
-        usage.last_monthly_reset_date = now
+        db.session.execute(
+            update(UsageQuota)
+            .where(UsageQuota.id == usage.id, UsageQuota.last_monthly_reset_date < month_start)
+            .values(analyses_used_this_month=0, last_monthly_reset_date=now)
+            .execution_options(synchronize_session=False)
+        )
 
-    # Save changes if needed
-    if db.session.is_modified(usage):
+    db.session.commit()
+
+def _get_quota_limit(user_id, quota_type):
+    """
+    Resolve the plan name and quota limit for a user.
+
+    Anonymous users and users without a subscription get free plan limits.
+
+    Args:
+        user_id (str, optional): The user ID
+        quota_type (str): The quota type
+
+    Returns:
+        tuple: (plan_name, quota_limit)
+    """
+    plan_name = 'free'
+    if user_id:
+        try:
+            plan = resolve_plan(user_id)
+            if plan['exists'] and plan['plan_name']:
+                plan_name = plan['plan_name']
+        except Exception as sub_error:
+            error(f"Error retrieving subscription for {user_id}: {str(sub_error)}")
+
+    plan_details = SUBSCRIPTION_PLANS.get(plan_name, SUBSCRIPTION_PLANS['free'])
+    return plan_name, plan_details.get('quotas', {}).get(quota_type, 0)
+
+def _atomic_increment(usage_id, quota_field, amount, quota_limit):
+    """
+    Atomically add to a usage counter if the result stays within the limit.
+
+    The check and the increment happen in a single
+    ``UPDATE ... SET col = col + n WHERE col + n <= limit`` statement, so
+    concurrent increments from different workers can neither be lost nor
+    push the counter past the limit.
+
+    Args:
+        usage_id (int): The UsageQuota row ID
+        quota_field (str): The counter column
+        amount (int): The amount to add
+        quota_limit (int): The maximum allowed value
+
+    Returns:
+        tuple: (incremented, value) with the new value when incremented, or
+            the current value when the limit would be exceeded
+    """
+    column = getattr(UsageQuota, quota_field)
+    current = func.coalesce(column, 0)
+
+    stmt = update(UsageQuota).where(UsageQuota.id == usage_id)
+    if quota_limit != UNLIMITED_QUOTA:
+        stmt = stmt.where(current + amount <= quota_limit)
+    stmt = stmt.values({quota_field: current + amount}).execution_options(synchronize_session=False)
+
+    if db.engine.dialect.update_returning:
+        row = db.session.execute(stmt.returning(column)).first()
+        db.session.commit()
+        if row is not None:
+            return True, row[0]
+    else:
+        result = db.session.execute(stmt)
         db.session.commit()
+        if result.rowcount:
+            return True, db.session.execute(select(column).where(UsageQuota.id == usage_id)).scalar() or 0
+
+    return False, db.session.execute(select(current).where(UsageQuota.id == usage_id)).scalar() or 0
 
 def increment_usage_quota(user_id=None, browser_session_id=None, quota_type='daily_messages', amount=1):
     """
@@ -580,39 +790,6 @@ def increment_usage_quota(user_id=None, browser_session_id=None, quota_type='dai
         user_identifier = f"user {user_id}" if user_id else f"session {browser_session_id}"
         info(f"Incrementing usage quota for {user_identifier}, quota type: {quota_type}, amount: {amount}")
 
-        # Get the usage quota
-        usage = get_usage_quota(user_id, browser_session_id)
-        if not usage:
-            warning(f"No usage record found for {user_identifier}, creating new record")
-
-        # Get subscription details to check quota limits
-        subscription_details = None
-        subscription_plan = "free"
-
-        if user_id:
-            try:
-                subscription_details = get_subscription_details(user_id)
-                subscription_plan = subscription_details.get('plan_name', 'free')
-                info(f"User {user_id} has subscription plan: {subscription_plan}")
-            except Exception as sub_error:
-                error(f"Error retrieving subscription details for {user_id}: {str(sub_error)}")
-                # Default to free plan on error
-                subscription_details = {
-                    'plan_name': 'free',
-                    'quotas': SUBSCRIPTION_PLANS['free']['quotas']
-                }
-        else:
-            # For anonymous users, use free plan limits
-            subscription_details = {
-                'plan_name': 'free',
-                'quotas': SUBSCRIPTION_PLANS['free']['quotas']
-            }
-            info(f"Anonymous session {browser_session_id} using free plan quotas")
-
-        # Get the quota limit for this user's subscription plan
-        quota_limit = subscription_details.get('quotas', {}).get(quota_type, 0)
-        info(f"Quota limit for {quota_type} on {subscription_plan} plan: {quota_limit}")
-
         # Get the corresponding database field for this quota type
         quota_field = QUOTA_FIELDS.get(quota_type)
         if not quota_field:
@@ -620,30 +797,25 @@ def increment_usage_quota(user_id=None, browser_session_id=None, quota_type='dai
             error(error_msg)
             return False, error_msg
 
-        # Get current usage from the usage object
-        current_usage = getattr(usage, quota_field, 0) or 0  # Handle None values
-        info(f"Current usage for {quota_type} before increment: {current_usage}/{quota_limit}")
+        # Get the usage quota row (created on first use, reset when a new period starts)
+        usage = get_usage_quota(user_id, browser_session_id)
 
-        # Check if unlimited quota
-        if quota_limit == UNLIMITED_QUOTA:
-            info(f"Unlimited quota for {quota_type} on {subscription_plan} plan")
-            # Still increment the counter for tracking purposes
-            new_usage = current_usage + amount
-            setattr(usage, quota_field, new_usage)
-            db.session.commit()
-            info(f"Unlimited quota incremented to {new_usage}")
-            return True, "Unlimited quota incremented successfully."
+        # Get the quota limit for this user's subscription plan
+        subscription_plan, quota_limit = _get_quota_limit(user_id, quota_type)
+        info(f"Quota limit for {quota_type} on {subscription_plan} plan: {quota_limit}")
 
-        # Check if quota would be exceeded
-        if current_usage + amount > quota_limit:
-            message = f"Quota exceeded for {quota_type}. Current usage: {current_usage}/{quota_limit}. Upgrade your subscription for higher limits."
+        # Check and increment in one atomic statement
+        incremented, new_usage = _atomic_increment(usage.id, quota_field, amount, quota_limit)
+
+        if not incremented:
+            message = f"Quota exceeded for {quota_type}. Current usage: {new_usage}/{quota_limit}. Upgrade your subscription for higher limits."
             warning(f"Quota increment failed: {message}")
             return False, message
 
-        # Increment the quota in the database
-        new_usage = current_usage + amount
-        setattr(usage, quota_field, new_usage)
-        db.session.commit()
+        # Unlimited quotas are still counted for tracking purposes
+        if quota_limit == UNLIMITED_QUOTA:
+            info(f"Unlimited quota incremented to {new_usage}")
+            return True, "Unlimited quota incremented successfully."
 
         # Success message
         remaining = quota_limit - new_usage
@@ -682,39 +854,6 @@ def check_quota_available(user_id=None, browser_session_id=None, quota_type='dai
         user_identifier = f"user {user_id}" if user_id else f"session {browser_session_id}"
         info(f"Checking quota availability for {user_identifier}, quota type: {quota_type}, amount: {amount}")
 
-        # Get the usage quota
-        usage = get_usage_quota(user_id, browser_session_id)
-        if not usage:
-            warning(f"No usage record found for {user_identifier}, creating new record")
-
-        # Get subscription details to check quota limits
-        subscription_details = None
-        subscription_plan = "free"
-
-        if user_id:
-            try:
-                subscription_details = get_subscription_details(user_id)
-                subscription_plan = subscription_details.get('plan_name', 'free')
-                info(f"User {user_id} has subscription plan: {subscription_plan}")
-            except Exception as sub_error:
-                error(f"Error retrieving subscription details for {user_id}: {str(sub_error)}")
-                # Default to free plan on error
-                subscription_details = {
-                    'plan_name': 'free',
-                    'quotas': SUBSCRIPTION_PLANS['free']['quotas']
-                }
-        else:
-            # For anonymous users, use free plan limits
-            subscription_details = {
-                'plan_name': 'free',
-                'quotas': SUBSCRIPTION_PLANS['free']['quotas']
-            }
-            info(f"Anonymous session {browser_session_id} using free plan quotas")
-
-        # Get the quota limit for this user's subscription plan
-        quota_limit = subscription_details.get('quotas', {}).get(quota_type, 0)
-        info(f"Quota limit for {quota_type} on {subscription_plan} plan: {quota_limit}")
-
         # Get the corresponding database field for this quota type
         quota_field = QUOTA_FIELDS.get(quota_type)
         if not quota_field:
@@ -722,7 +861,12 @@ def check_quota_available(user_id=None, browser_session_id=None, quota_type='dai
             error(error_msg)
             return False, error_msg
 
-        # Get current usage from the usage object
+        # Get the quota limit for this user's subscription plan
+        subscription_plan, quota_limit = _get_quota_limit(user_id, quota_type)
+        info(f"Quota limit for {quota_type} on {subscription_plan} plan: {quota_limit}")
+
+        # Read the current counter from the usage row
+        usage = get_usage_quota(user_id, browser_session_id)
         current_usage = getattr(usage, quota_field, 0) or 0  # Handle None values
         info(f"Current usage for {quota_type}: {current_usage}/{quota_limit}")
 
@@ -832,6 +976,7 @@ def create_stripe_checkout_session(user_id, plan_name):
             if subscription:
                 subscription.stripe_customer_id = stripe_customer_id
                 db.session.commit()
+                invalidate_plan_cache(user_id)
                 info(f"Updated existing subscription record with Stripe customer ID")
             else:
                 # Create a new subscription record
@@ -845,6 +990,7 @@ def create_stripe_checkout_session(user_id, plan_name):
                 new_sub.stripe_customer_id = stripe_customer_id
                 db.session.add(new_sub)
                 db.session.commit()
+                invalidate_plan_cache(user_id)
                 info(f"Created new subscription record for user {user_id}")
 
         except Exception as e:
@@ -1069,6 +1215,7 @@ def handle_checkout_success(checkout_session_id):
             # Still allow the subscription to be created even if details can't be fetched
 
         db.session.commit()
+        invalidate_plan_cache(user_id)
         info(f"Successfully processed subscription for user {user_id} with plan {plan_name}")
         return True
 
@@ -1103,6 +1250,7 @@ def cancel_subscription(user_id):
         # Update local record
         subscription.cancel_at_period_end = True
         db.session.commit()
+        invalidate_plan_cache(user_id)
 
         return True
     except Exception as e:
@@ -1244,6 +1392,7 @@ def _handle_subscription_created(event):
 
         # Save changes
         db.session.commit()
+        invalidate_plan_cache(subscription.user_id)
         info(f"Successfully processed subscription created event for {stripe_subscription_id}")
         return True
 
@@ -1356,6 +1505,7 @@ def _handle_subscription_updated(event):
 
         # Save changes
         db.session.commit()
+        invalidate_plan_cache(subscription.user_id)
         info(f"Successfully processed subscription updated event for {stripe_subscription_id}")
         return True
 
@@ -1438,6 +1588,7 @@ def _handle_subscription_deleted(event):
 
         # Save changes
         db.session.commit()
+        invalidate_plan_cache(subscription.user_id)
         info(f"Successfully processed subscription deleted event for {stripe_subscription_id}")
         return True
 
@@ -1531,6 +1682,7 @@ def _handle_payment_succeeded(event):
 
             # Save changes
             db.session.commit()
+            invalidate_plan_cache(subscription.user_id)
 
         info(f"Successfully processed payment succeeded event for subscription {subscription_id}")
         return True
@@ -1624,6 +1776,7 @@ def _handle_payment_failed(event):
 
         # Save changes
         db.session.commit()
+        invalidate_plan_cache(subscription.user_id)
         info(f"Successfully processed payment failed event for subscription {subscription_id}")
         return True
 
@@ -0,0 +1,47 @@
+"""
+Test configuration for the application modules at the repository root.
+
+Puts the repository root on the import path and provides a minimal Flask
+app bound to a file-backed SQLite database, so tests do not load the whole
+application.
+"""
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from database import db
+import models  # noqa: F401 - registers the tables for create_all
+
+
+def make_app(database_path, **config):
+    """
+    Minimal app bound to a file-backed SQLite database.
+
+    A plain function rather than a fixture, so worker processes and threads
+    can build their own app on the same database.
+    """
+    app = Flask(__name__)
+    app.secret_key = 'test-secret'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{database_path}"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+    app.config.update(config)
+    db.init_app(app)
+    return app
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    """Path of a fresh SQLite database."""
+    return str(tmp_path / 'test.sqlite3')
+
+
+@pytest.fixture
+def app(database_path):
+    """Minimal app with all tables created, inside an app context."""
+    app = make_app(database_path)
+    with app.app_context():
+        db.create_all()
+        yield app
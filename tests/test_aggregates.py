@@ -0,0 +1,162 @@
+"""
+Unit tests for session and period aggregates over the analytics rollups.
+"""
+import datetime
+
+import pytest
+
+from database import db
+from models import AnalyticsSessionRollup, AnalyticsUserDay
+from analytics import aggregates
+from analytics.aggregates import (
+    get_session_summary, get_sessions_by_period, get_active_users_by_period, period_buckets
+)
+
+# A Friday, so the first three days fall in week 09 and the rest in week 10
+DAY_1 = datetime.date(2024, 3, 1)
+WEEK_LATER = DAY_1 + datetime.timedelta(days=7)
+
+
+def at(offset, hour, minute=0):
+    """Time on the day offset days after DAY_1."""
+    day = DAY_1 + datetime.timedelta(days=offset)
+    return datetime.datetime.combine(day, datetime.time(hour, minute))
+
+
+@pytest.fixture
+def sessions(app):
+    """
+    Sessions by start, length and messages:
+
+        s1  u1    day 0 10:00, 30 minutes, 4 messages
+        s2  u1    day 1 08:00, 10 minutes, 2 messages
+        s3  u2    day 1 09:00, 20 minutes, 3 messages
+        s4  anon  day 7 12:00, 0 minutes, 1 message
+    """
+    db.session.add_all([
+        AnalyticsSessionRollup(session_id=session_id, user_id=user_id, started_at=started_at,
+                               last_message_at=started_at + datetime.timedelta(minutes=minutes),
+                               messages=messages)
+        for session_id, user_id, started_at, minutes, messages in [
+            ('s1', 'u1', at(0, 10), 30, 4),
+            ('s2', 'u1', at(1, 8), 10, 2),
+            ('s3', 'u2', at(1, 9), 20, 3),
+            ('s4', None, at(7, 12), 0, 1),
+        ]
+    ])
+    db.session.add_all([
+        AnalyticsUserDay(day=DAY_1 + datetime.timedelta(days=offset), user_id=user_id)
+        for offset, user_id in [(0, 'u1'), (1, 'u1'), (1, 'u2'), (4, 'u1'), (40, 'u2')]
+    ])
+    db.session.commit()
+
+
+def approx(result):
+    """Durations go through floating point day numbers on SQLite."""
+    if isinstance(result, dict):
+        return {key: approx(value) for key, value in result.items()}
+    return pytest.approx(result)
+
+
+def test_period_buckets():
+    assert period_buckets(DAY_1, DAY_1 + datetime.timedelta(days=4), 'week') == [
+        ('2024-W09', DAY_1, datetime.date(2024, 3, 4)),
+        ('2024-W10', datetime.date(2024, 3, 4), datetime.date(2024, 3, 6)),
+    ]
+    assert [label for label, _, _ in period_buckets(DAY_1, datetime.date(2024, 4, 2), 'month')] == [
+        '2024-03', '2024-04'
+    ]
+
+
+class TestSessionSummary:
+    """Tests for get_session_summary."""
+
+    def test_all_sessions(self, sessions):
+        assert get_session_summary(at(0, 0)) == approx({
+            'sessions': 4,
+            'users': 2,
+            'user_sessions': 3,
+            'avg_messages': 2.5,
+            'avg_duration': 15.0,
+            'avg_sessions': 1.5
+        })
+
+    def test_sessions_active_since_start_time(self, sessions):
+        summary = get_session_summary(at(0, 10, 31))
+
+        assert summary['sessions'] == 3
+        assert summary['avg_duration'] == pytest.approx(10.0)
+
+    def test_one_user(self, sessions):
+        summary = get_session_summary(at(0, 0), user_id='u1')
+
+        assert (summary['sessions'], summary['users'], summary['avg_messages']) == (2, 1, 3.0)
+        assert summary['avg_duration'] == pytest.approx(20.0)
+
+    def test_no_sessions(self, app):
+        assert get_session_summary(at(0, 0)) == {
+            'sessions': 0,
+            'users': 0,
+            'user_sessions': 0,
+            'avg_messages': 0.0,
+            'avg_duration': 0.0,
+            'avg_sessions': 0.0
+        }
+
+    def test_streaming_fallback_gives_same_averages(self, sessions, monkeypatch):
+        expected = [get_session_summary(at(0, 0)), get_session_summary(at(0, 0), user_id='u1')]
+        monkeypatch.setattr(aggregates, 'session_minutes', lambda: None)
+
+        assert [get_session_summary(at(0, 0)), get_session_summary(at(0, 0), user_id='u1')] == [
+            approx(summary) for summary in expected
+        ]
+
+
+class TestSessionsByPeriod:
+    """Tests for get_sessions_by_period."""
+
+    def test_by_day(self, sessions):
+        assert get_sessions_by_period(at(0, 0), 'day', end_day=WEEK_LATER) == approx({
+            '2024-03-01': {'sessions': 1, 'avg_messages': 4.0, 'avg_duration': 30.0},
+            '2024-03-02': {'sessions': 2, 'avg_messages': 2.5, 'avg_duration': 15.0},
+            '2024-03-08': {'sessions': 1, 'avg_messages': 1.0, 'avg_duration': 0.0},
+        })
+
+    def test_by_week(self, sessions):
+        assert get_sessions_by_period(at(0, 0), 'week', end_day=WEEK_LATER) == approx({
+            '2024-W09': {'sessions': 3, 'avg_messages': 3.0, 'avg_duration': 20.0},
+            '2024-W10': {'sessions': 1, 'avg_messages': 1.0, 'avg_duration': 0.0},
+        })
+
+    def test_sessions_after_end_day_are_excluded(self, sessions):
+        assert set(get_sessions_by_period(at(0, 0), 'day', end_day=DAY_1)) == {'2024-03-01'}
+
+    @pytest.mark.parametrize('period', ['day', 'week', 'month'])
+    def test_streaming_fallback_gives_same_averages(self, sessions, monkeypatch, period):
+        expected = get_sessions_by_period(at(0, 0), period, end_day=WEEK_LATER)
+        monkeypatch.setattr(aggregates, 'session_minutes', lambda: None)
+
+        assert get_sessions_by_period(at(0, 0), period, end_day=WEEK_LATER) == approx(expected)
+
+
+class TestActiveUsersByPeriod:
+    """Tests for get_active_users_by_period."""
+
+    def test_by_day(self, sessions):
+        assert get_active_users_by_period(DAY_1, 'day', end_day=WEEK_LATER) == {
+            '2024-03-01': 1,
+            '2024-03-02': 2,
+            '2024-03-05': 1,
+        }
+
+    def test_users_are_counted_once_per_period(self, sessions):
+        assert get_active_users_by_period(DAY_1, 'week', end_day=WEEK_LATER) == {
+            '2024-W09': 2,
+            '2024-W10': 1,
+        }
+        assert get_active_users_by_period(DAY_1, 'month', end_day=WEEK_LATER) == {'2024-03': 2}
+
+    def test_empty_range(self, sessions):
+        day_before = DAY_1 - datetime.timedelta(days=1)
+
+        assert get_active_users_by_period(DAY_1, 'day', end_day=day_before) == {}
@@ -0,0 +1,272 @@
+"""
+Unit tests for the audit hash chain writer and its verification.
+"""
+import threading
+import time
+
+import pytest
+
+from conftest import make_app
+from database import db
+from models import User
+from security.audit import AuditCheckpoint, AuditLog, AuditManager, PHI_ACCESS
+
+
+def make_audit_app(database_path, **config):
+    """Minimal app with an audit manager and its tables."""
+    app = make_app(database_path, **config)
+    audit = AuditManager(app)
+    with app.app_context():
+        db.create_all()
+    return app, audit
+
+
+@pytest.fixture
+def sync_app(database_path):
+    """App whose audit entries are written by the calling thread."""
+    app, audit = make_audit_app(database_path, AUDIT_ASYNC=False)
+    with app.app_context():
+        yield app, audit
+
+
+@pytest.fixture
+def async_app(database_path):
+    """App whose audit entries are written by the writer thread."""
+    app, audit = make_audit_app(database_path)
+    with app.app_context():
+        yield app, audit
+    audit.writer.stop()
+
+
+def chain_rows():
+    """All sequenced entries in chain order."""
+    db.session.expire_all()
+    return AuditLog.query.order_by(AuditLog.sequence).all()
+
+
+def assert_linear_chain(rows, count):
+    assert [row.sequence for row in rows] == list(range(1, count + 1))
+    previous_hash = None
+    for row in rows:
+        assert row.previous_hash == previous_hash
+        previous_hash = row.entry_hash
+
+
+class TestAuditWriter:
+    """Tests for writing entries into the hash chain."""
+
+    def test_sync_entry_is_chained(self, sync_app):
+        _, audit = sync_app
+
+        first = audit.log_event(PHI_ACCESS, 'read', 'note', '1')
+        second = audit.log_event(PHI_ACCESS, 'read', 'note', '2')
+
+        assert (first.sequence, second.sequence) == (1, 2)
+        assert second.previous_hash == first.entry_hash
+        assert_linear_chain(chain_rows(), 2)
+
+    def test_flush_makes_entries_visible(self, async_app):
+        _, audit = async_app
+
+        for number in range(50):
+            audit.log_event(PHI_ACCESS, 'read', 'note', str(number))
+
+        assert audit.flush(timeout=30)
+        assert audit.writer.backlog == 0
+        rows = chain_rows()
+        assert_linear_chain(rows, 50)
+        assert [row.resource_id for row in rows] == [str(number) for number in range(50)]
+
+    def test_threads_and_processes_form_linear_chain(self, async_app, database_path):
+        app, audit = async_app
+        # A second app on the same database stands in for another worker process
+        other_app, other_audit = make_audit_app(database_path)
+
+        def log_entries(target_app, target_audit, prefix):
+            with target_app.app_context():
+                for number in range(20):
+                    target_audit.log_event(PHI_ACCESS, 'read', 'note', f"{prefix}-{number}")
+
+        threads = [threading.Thread(target=log_entries, args=(app, audit, f"a{index}")) for index in range(3)]
+        threads += [threading.Thread(target=log_entries, args=(other_app, other_audit, f"b{index}"))
+                    for index in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert audit.flush(timeout=60)
+        assert other_audit.flush(timeout=60)
+        other_audit.writer.stop()
+
+        assert_linear_chain(chain_rows(), 120)
+        assert audit.verify_log_integrity()
+
+    def test_full_queue_writes_from_own_session(self, database_path, monkeypatch):
+        app, audit = make_audit_app(database_path, AUDIT_QUEUE_MAX_SIZE=1)
+        # Hold the writer thread inside its first batch
+        release = threading.Event()
+        write_entries = audit.write_entries
+
+        def gated_write_entries(records):
+            if threading.current_thread().name == 'audit-writer':
+                release.wait(30)
+            return write_entries(records)
+
+        monkeypatch.setattr(audit, 'write_entries', gated_write_entries)
+
+        with app.app_context():
+            pending_user = User(id='pending-user', email='pending@example.com')
+            db.session.add(pending_user)
+
+            audit.log_event(PHI_ACCESS, 'read', 'note', 'taken')
+            while audit.writer._queue.qsize():
+                time.sleep(0.01)
+            audit.log_event(PHI_ACCESS, 'read', 'note', 'queued')
+            audit.log_event(PHI_ACCESS, 'read', 'note', 'overflow')
+
+            # The synchronous write did not commit the caller's pending changes
+            assert pending_user in db.session.new
+            db.session.rollback()
+            assert db.session.get(User, 'pending-user') is None
+            assert [(row.resource_id, row.sequence) for row in chain_rows()] == [('overflow', 1)]
+
+            release.set()
+            assert audit.flush(timeout=30)
+            rows = chain_rows()
+            assert_linear_chain(rows, 3)
+            assert [row.resource_id for row in rows] == ['overflow', 'taken', 'queued']
+            audit.writer.stop()
+
+    def test_write_failure_does_not_fail_caller(self, sync_app, monkeypatch):
+        _, audit = sync_app
+
+        def locked():
+            raise RuntimeError("database unavailable")
+
+        monkeypatch.setattr(audit, '_lock_chain_head', locked)
+
+        entry = audit.log_event(PHI_ACCESS, 'read', 'note', '1')
+
+        assert entry.sequence is None
+        assert chain_rows() == []
+
+
+def log_entries(audit, count):
+    for number in range(count):
+        audit.log_event(PHI_ACCESS, 'read', 'note', str(number))
+
+
+def tamper(sequence, **values):
+    """Change a written entry behind the chain's back."""
+    db.session.execute(AuditLog.__table__.update().where(AuditLog.__table__.c.sequence == sequence).values(**values))
+    db.session.commit()
+
+
+class TestVerifyChain:
+    """Tests for verifying the hash chain."""
+
+    def test_intact_chain_is_verified(self, sync_app):
+        _, audit = sync_app
+        log_entries(audit, 30)
+
+        report = audit.verify_chain(chunk_size=7)
+
+        assert report['verified'] is True
+        assert report['rows'] == 30
+        assert report['checkpoint'] == 30
+
+    def test_modified_entry_is_detected(self, sync_app):
+        _, audit = sync_app
+        log_entries(audit, 30)
+        tamper(12, action='delete')
+
+        report = audit.verify_chain(chunk_size=7)
+
+        assert report['verified'] is False
+        assert "Log content modified" in report['error']
+        assert audit.verify_log_integrity() is False
+
+    def test_broken_link_is_detected(self, sync_app):
+        _, audit = sync_app
+        log_entries(audit, 30)
+        tamper(12, previous_hash='0' * 64)
+
+        report = audit.verify_chain()
+
+        assert report['verified'] is False
+        assert "Log chain broken" in report['error']
+
+    def test_deleted_entry_is_detected(self, sync_app):
+        _, audit = sync_app
+        log_entries(audit, 30)
+        db.session.execute(AuditLog.__table__.delete().where(AuditLog.__table__.c.sequence == 12))
+        db.session.commit()
+
+        report = audit.verify_chain(chunk_size=7)
+
+        assert report['verified'] is False
+        assert "missing entries 12 to 12" in report['error']
+
+    def test_resume_continues_after_checkpoint(self, sync_app):
+        _, audit = sync_app
+        log_entries(audit, 30)
+        assert audit.verify_chain()['checkpoint'] == 30
+        log_entries(audit, 10)
+
+        report = audit.verify_chain(resume=True)
+
+        assert report['verified'] is True
+        assert report['resumed_from'] == 30
+        assert report['rows'] == 10
+        assert report['checkpoint'] == 40
+
+    def test_default_verification_does_not_resume(self, sync_app):
+        _, audit = sync_app
+        log_entries(audit, 30)
+        audit.verify_chain()
+        # Entries before a checkpoint are only re-hashed by a full verification
+        tamper(5, action='delete')
+
+        assert audit.verify_chain(resume=True)['verified'] is True
+        assert audit.verify_log_integrity() is False
+
+    def test_forged_checkpoint_is_rejected(self, sync_app):
+        _, audit = sync_app
+        log_entries(audit, 30)
+        tamper(5, action='delete')
+        entry_hash = db.session.execute(
+            AuditLog.__table__.select().where(AuditLog.__table__.c.sequence == 30)
+        ).one().entry_hash
+        db.session.add(AuditCheckpoint(sequence=30, entry_hash=entry_hash, signature='0' * 64))
+        db.session.commit()
+
+        report = audit.verify_chain(resume=True)
+
+        assert report['resumed_from'] is None
+        assert report['verified'] is False
+
+    def test_checkpoint_of_modified_entry_is_rejected(self, sync_app):
+        _, audit = sync_app
+        log_entries(audit, 30)
+        audit.verify_chain()
+        tamper(30, action='delete')
+
+        report = audit.verify_chain(resume=True)
+
+        assert report['resumed_from'] is None
+        assert report['verified'] is False
+
+    @pytest.mark.parametrize('tampered', [None, 5, 31, 58])
+    def test_parallel_and_serial_agree(self, sync_app, tampered):
+        _, audit = sync_app
+        log_entries(audit, 60)
+        if tampered:
+            tamper(tampered, action='delete')
+
+        serial = audit.verify_chain(chunk_size=10)
+        parallel = audit.verify_chain(workers=3, chunk_size=10)
+
+        assert parallel['verified'] == serial['verified'] == (tampered is None)
+        assert parallel['error'] == serial['error']
+        if tampered is None:
+            assert parallel['rows'] == serial['rows'] == 60
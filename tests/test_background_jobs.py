@@ -0,0 +1,190 @@
+"""
+Unit tests for the durable background job queue.
+"""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import db
+from models import BackgroundJob, ChatHistory
+import background_jobs
+import conversation_context
+from background_jobs import BackgroundJobQueue, JOB_HANDLERS, JOB_LEASE_SECONDS, RETRY_BACKOFF
+
+
+@pytest.fixture
+def job_queue(app):
+    """Queue without worker threads, so jobs run when processed explicitly."""
+    return BackgroundJobQueue(app, num_threads=0)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Register test handlers, recording their payloads."""
+    calls = []
+
+    def succeed(payload):
+        calls.append(payload)
+
+    def fail(payload):
+        calls.append(payload)
+        raise RuntimeError("upstream unavailable")
+
+    monkeypatch.setitem(JOB_HANDLERS, 'test_succeed', succeed)
+    monkeypatch.setitem(JOB_HANDLERS, 'test_fail', fail)
+    return calls
+
+
+def add_job(job_type, payload=None, **fields):
+    """Store a job without handing it to a worker."""
+    now = datetime.utcnow()
+    values = dict(job_type=job_type, payload=json.dumps(payload or {}), status='pending', attempts=0,
+                  max_attempts=3, run_after=now, created_at=now, updated_at=now)
+    values.update(fields)
+    job = BackgroundJob(**values)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+class TestClaim:
+    """Tests for claiming jobs."""
+
+    def test_job_is_claimed_once(self, job_queue):
+        job_id = add_job('test_succeed')
+
+        assert job_queue._claim(job_id) is True
+        assert job_queue._claim(job_id) is False
+
+        job = db.session.get(BackgroundJob, job_id, populate_existing=True)
+        assert job.status == 'running'
+        assert job.attempts == 1
+
+    def test_job_is_not_claimed_before_run_after(self, job_queue):
+        job_id = add_job('test_succeed', run_after=datetime.utcnow() + timedelta(minutes=5))
+
+        assert job_queue._claim(job_id) is False
+
+    def test_finished_job_is_removed(self, job_queue, calls):
+        job_id = add_job('test_succeed', {'value': 1})
+
+        assert job_queue.process_job(job_id) is True
+        assert calls == [{'value': 1}]
+        assert db.session.get(BackgroundJob, job_id) is None
+
+    def test_enqueue_without_workers_runs_inline(self, job_queue, calls):
+        job_ids = job_queue.enqueue_many([('test_succeed', {'value': 1}), ('test_succeed', {'value': 2})])
+
+        assert len(job_ids) == 2
+        assert calls == [{'value': 1}, {'value': 2}]
+
+
+class TestRetries:
+    """Tests for retry backoff and permanent failures."""
+
+    def test_failed_attempt_is_retried_with_backoff(self, job_queue, calls):
+        job_id = add_job('test_fail')
+
+        before = datetime.utcnow()
+        assert job_queue.process_job(job_id) is False
+
+        job = db.session.get(BackgroundJob, job_id, populate_existing=True)
+        assert job.status == 'pending'
+        assert job.last_error == "RuntimeError: upstream unavailable"
+        assert job.run_after >= before + timedelta(seconds=RETRY_BACKOFF)
+        # Not due yet
+        assert job_queue.process_due_jobs() == 0
+        assert len(calls) == 1
+
+    def test_backoff_doubles(self, job_queue, calls):
+        job_id = add_job('test_fail', attempts=1)
+
+        before = datetime.utcnow()
+        job_queue.process_job(job_id)
+
+        job = db.session.get(BackgroundJob, job_id, populate_existing=True)
+        assert job.run_after >= before + timedelta(seconds=RETRY_BACKOFF * 2)
+
+    def test_job_fails_after_max_attempts(self, job_queue, calls):
+        job_id = add_job('test_fail', attempts=2)
+
+        job_queue.process_job(job_id)
+
+        job = db.session.get(BackgroundJob, job_id, populate_existing=True)
+        assert job.status == 'failed'
+        assert job.attempts == 3
+        assert background_jobs.get_queue_depth()['failed'] == 1
+
+    def test_unknown_job_type_fails(self, job_queue):
+        job_id = add_job('no_such_job', max_attempts=1)
+
+        assert job_queue.process_job(job_id) is False
+        assert db.session.get(BackgroundJob, job_id, populate_existing=True).status == 'failed'
+
+
+class TestLeaseRecovery:
+    """Tests for jobs abandoned by a dead worker."""
+
+    def test_expired_lease_is_run_again(self, job_queue, calls):
+        stale = datetime.utcnow() - timedelta(seconds=JOB_LEASE_SECONDS + 1)
+        job_id = add_job('test_succeed', {'value': 1}, status='running', attempts=1, updated_at=stale)
+
+        assert job_queue.process_due_jobs() == 1
+        assert calls == [{'value': 1}]
+        assert db.session.get(BackgroundJob, job_id) is None
+
+    def test_live_lease_is_left_alone(self, job_queue, calls):
+        job_id = add_job('test_succeed', status='running', attempts=1)
+
+        assert job_queue.process_due_jobs() == 0
+        assert calls == []
+        assert db.session.get(BackgroundJob, job_id, populate_existing=True).status == 'running'
+
+
+class TestChatContextUpdate:
+    """Tests for the chat post-processing job."""
+
+    @pytest.fixture
+    def linked(self, app, monkeypatch):
+        """Record message links instead of extracting memories."""
+        linked = []
+        monkeypatch.setattr(conversation_context, 'add_message_to_context',
+                            lambda context_id, message_id: linked.append(message_id) or True)
+        return linked
+
+    def add_messages(self, count, context_id=7):
+        messages = [ChatHistory(session_id='session', user_message='Hi', ai_response='Hello',
+                                context_id=context_id) for _ in range(count)]
+        db.session.add_all(messages)
+        db.session.commit()
+        return messages[-1].id
+
+    def test_failing_summary_does_not_repeat_extraction(self, job_queue, linked, monkeypatch):
+        def fail_summary(context_id):
+            raise RuntimeError("summary failed")
+
+        monkeypatch.setattr(conversation_context, 'update_context_summary', fail_summary)
+        message_id = self.add_messages(3)
+        job_id = add_job('chat_context_update', {'context_id': 7, 'message_id': message_id})
+
+        assert job_queue.process_job(job_id) is True
+        assert linked == [message_id]
+
+        summary_job = BackgroundJob.query.filter_by(job_type='context_summary_update').one()
+        assert summary_job.status == 'pending'
+        assert summary_job.attempts == 1
+
+    def test_summary_only_every_third_message(self, job_queue, linked, monkeypatch):
+        summaries = []
+        monkeypatch.setattr(conversation_context, 'update_context_summary',
+                            lambda context_id: summaries.append(context_id) or True)
+        message_id = self.add_messages(2)
+
+        job_queue.process_job(add_job('chat_context_update', {'context_id': 7, 'message_id': message_id}))
+        assert summaries == []
+
+        message_id = self.add_messages(1)
+        job_queue.process_job(add_job('chat_context_update', {'context_id': 7, 'message_id': message_id}))
+        assert summaries == [7]
+        assert BackgroundJob.query.count() == 0
@@ -0,0 +1,366 @@
+"""
+Unit tests for the in-memory, tiered and single-flight caches.
+"""
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from performance import cache_manager
+from performance.cache_manager import CacheManager, MemoryCacheBackend, TieredCacheBackend
+
+
+class FakeClock:
+    """Controllable replacement for the time module."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cache_manager, 'time',
+                        SimpleNamespace(time=fake.time, monotonic=fake.monotonic))
+    return fake
+
+
+class TestMemoryCacheBackend:
+    """Tests for LRU eviction, TTL expiry, prefix clears and statistics."""
+
+    def test_least_recently_used_is_evicted(self, clock):
+        cache = MemoryCacheBackend(max_size=3)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+        cache.get('a')
+
+        cache.set('d', 'd')
+        cache.set('e', 'e')
+
+        assert [key for key in 'abcde' if cache.exists(key)] == ['a', 'd', 'e']
+        assert cache.stats()['evictions'] == 2
+
+    def test_updating_a_key_does_not_evict(self, clock):
+        cache = MemoryCacheBackend(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        cache.set('a', 3)
+
+        assert (cache.get('a'), cache.get('b')) == (3, 2)
+        assert cache.stats()['evictions'] == 0
+
+    def test_byte_limit(self, clock):
+        cache = MemoryCacheBackend(max_size=100, max_bytes=200)
+
+        assert cache.set('large', 'x' * 500) is False
+        cache.set('a', 'x' * 80)
+        cache.set('b', 'x' * 80)
+
+        assert cache.exists('a') is False
+        assert cache.get('b') == 'x' * 80
+        assert cache.stats()['bytes'] <= 200
+
+    def test_expired_entries_are_purged_without_being_read(self, clock):
+        cache = MemoryCacheBackend()
+        cache.set('short', 1, ttl=10)
+        cache.set('long', 2, ttl=20)
+        cache.set('forever', 3)
+
+        clock.now += 10
+        cache.get('forever')
+
+        stats = cache.stats()
+        assert stats['size'] == 2
+        assert stats['expirations'] == 1
+        assert cache.get('long') == 2
+
+        clock.now += 10
+        assert cache.purge_expired() == 1
+        assert cache.get('forever') == 3
+
+    def test_reset_ttl_replaces_earlier_expiry(self, clock):
+        cache = MemoryCacheBackend()
+        cache.set('key', 1, ttl=10)
+        cache.set('key', 2, ttl=100)
+
+        clock.now += 50
+
+        assert cache.get('key') == 2
+        assert cache.stats()['expirations'] == 0
+
+    def test_deleted_key_is_not_expired_later(self, clock):
+        cache = MemoryCacheBackend()
+        cache.set('key', 1, ttl=10)
+        cache.delete('key')
+        cache.set('key', 2)
+
+        clock.now += 20
+
+        assert cache.get('key') == 2
+
+    def test_clear_by_namespace_prefix(self, clock):
+        cache = MemoryCacheBackend()
+        for key in ('user:1:profile', 'user:1:mood', 'user:2:profile', 'users:count', 'other'):
+            cache.set(key, key)
+
+        cache.clear('user:1')
+        assert [key for key in ('user:1:profile', 'user:1:mood', 'user:2:profile', 'users:count')
+                if cache.exists(key)] == ['user:2:profile', 'users:count']
+
+        cache.clear('user:')
+        assert cache.exists('user:2:profile') is False
+        assert cache.exists('users:count') is True
+
+    def test_clear_prefix_within_last_segment(self, clock):
+        cache = MemoryCacheBackend()
+        keys = ('query:abc', 'query:abd', 'query:xyz')
+        for key in keys:
+            cache.set(key, key)
+
+        cache.clear('query:ab')
+
+        assert [key for key in keys if cache.exists(key)] == ['query:xyz']
+        assert cache.stats()['namespaces'] == 1
+
+    def test_clear_all(self, clock):
+        cache = MemoryCacheBackend()
+        cache.set('a:1', 1, ttl=10)
+        cache.set('b:1', 2)
+
+        cache.clear()
+        clock.now += 20
+
+        stats = cache.stats()
+        assert (stats['size'], stats['namespaces'], stats['expirations']) == (0, 0, 0)
+
+    def test_hit_and_miss_counters(self, clock):
+        cache = MemoryCacheBackend()
+        cache.set('a', 1)
+
+        cache.get('a')
+        cache.get('a')
+        cache.get('a')
+        cache.get('missing')
+
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses']) == (3, 1)
+        assert stats['hit_rate'] == 0.75
+        assert stats['size'] == 1
+        assert stats['bytes'] is None
+
+
+class Counter:
+    """value_func counting its calls."""
+
+    def __init__(self, value='value', advance=None):
+        self.calls = 0
+        self.value = value
+        self.advance = advance
+
+    def __call__(self):
+        self.calls += 1
+        if self.advance is not None:
+            # Time the computation takes, as seen by the cache
+            self.advance()
+        return self.value
+
+
+class TestTieredCacheBackend:
+    """Tests for the L1 cache in front of a shared L2."""
+
+    def test_l2_hit_is_copied_to_l1(self, clock):
+        l1, l2 = MemoryCacheBackend(), MemoryCacheBackend()
+        tiered = TieredCacheBackend(l1, l2)
+        l2.set('key', 'shared')
+
+        assert tiered.get('key') == 'shared'
+        assert l1.get('key') == 'shared'
+        assert tiered.get('key') == 'shared'
+        assert tiered.stats()['l2_hits'] == 1
+
+    def test_l1_copy_expires_after_l1_ttl(self, clock):
+        l1, l2 = MemoryCacheBackend(), MemoryCacheBackend()
+        tiered = TieredCacheBackend(l1, l2, l1_ttl=30)
+        tiered.set('key', 'value', ttl=300)
+        # Another process invalidates the shared copy
+        l2.delete('key')
+
+        assert tiered.get('key') == 'value'
+        clock.now += 30
+        assert tiered.get('key') is None
+
+    def test_writes_and_deletes_reach_both_tiers(self, clock):
+        l1, l2 = MemoryCacheBackend(), MemoryCacheBackend()
+        tiered = TieredCacheBackend(l1, l2)
+
+        tiered.set('key', 'value')
+        assert (l1.get('key'), l2.get('key')) == ('value', 'value')
+        tiered.delete('key')
+        assert (l1.exists('key'), l2.exists('key')) == (False, False)
+
+    def test_l2_errors_fall_back_to_l1(self, clock):
+        class BrokenBackend(MemoryCacheBackend):
+            def get(self, key):
+                raise ConnectionError("redis down")
+
+        tiered = TieredCacheBackend(MemoryCacheBackend(), BrokenBackend())
+
+        assert tiered.get('key') is None
+        assert tiered.set('key', 'value') is True
+        assert tiered.get('key') == 'value'
+        assert tiered.stats()['l2_errors'] == 1
+
+
+class TestGetOrSet:
+    """Tests for single-flight, negative caching and early refresh."""
+
+    def test_concurrent_misses_compute_once(self):
+        manager = CacheManager()
+        release = threading.Event()
+        calls = []
+
+        def slow_value():
+            calls.append(1)
+            release.wait(5)
+            return 'value'
+
+        results = []
+
+        def request():
+            results.append(manager.get_or_set('key', slow_value))
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        # Release the computation once every other caller is waiting for it
+        deadline = time.monotonic() + 5
+        while manager.stats()['coalesced'] < 7 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert len(calls) == 1
+        assert results == ['value'] * 8
+        assert manager.stats()['in_flight'] == 0
+
+    def test_failed_computation_is_not_cached(self, clock):
+        manager = CacheManager()
+
+        def failing():
+            raise RuntimeError("database went away")
+
+        with pytest.raises(RuntimeError):
+            manager.get_or_set('key', failing)
+
+        assert manager.get_or_set('key', Counter()) == 'value'
+        assert manager.stats()['in_flight'] == 0
+
+    def test_none_is_cached_for_negative_ttl(self, clock):
+        manager = CacheManager(negative_ttl=30, early_refresh_beta=0)
+        compute = Counter(value=None)
+
+        assert manager.get_or_set('key', compute, ttl=600) is None
+        clock.now += 29
+        assert manager.get_or_set('key', compute, ttl=600) is None
+        assert compute.calls == 1
+        assert manager.stats()['negative_hits'] == 1
+
+        clock.now += 1
+        manager.get_or_set('key', compute, ttl=600)
+        assert compute.calls == 2
+
+    def test_cache_none_keeps_none_for_full_ttl(self, clock):
+        manager = CacheManager(negative_ttl=30, early_refresh_beta=0)
+        compute = Counter(value=None)
+
+        manager.get_or_set('key', compute, ttl=600, cache_none=True)
+        clock.now += 599
+        manager.get_or_set('key', compute, ttl=600, cache_none=True)
+
+        assert compute.calls == 1
+
+    def test_negative_ttl_zero_disables_negative_caching(self, clock):
+        manager = CacheManager(negative_ttl=0, early_refresh_beta=0)
+        compute = Counter(value=None)
+
+        manager.get_or_set('key', compute)
+        manager.get_or_set('key', compute)
+
+        assert compute.calls == 2
+
+    def test_value_expires_with_ttl(self, clock):
+        manager = CacheManager(early_refresh_beta=0)
+        compute = Counter()
+
+        manager.get_or_set('key', compute, ttl=60)
+        clock.now += 59
+        manager.get_or_set('key', compute, ttl=60)
+        assert compute.calls == 1
+
+        clock.now += 1
+        manager.get_or_set('key', compute, ttl=60)
+        assert compute.calls == 2
+
+    def test_early_refresh_near_expiry(self, clock, monkeypatch):
+        monkeypatch.setattr(cache_manager, 'random', random.Random(3))
+        manager = CacheManager(early_refresh_beta=1.0)
+
+        def advance():
+            clock.now += 5
+
+        # A value that takes 5s to compute, cached for 60s
+        compute = Counter(advance=advance)
+        manager.get_or_set('key', compute, ttl=60)
+        expires = clock.now + 60
+
+        # Far from expiry: refreshing needs -ln(1 - r) >= 10, about 1 in 22000
+        clock.now = expires - 50
+        for _ in range(100):
+            manager.get_or_set('key', compute, ttl=60)
+        assert compute.calls == 1
+
+        # A second before expiry, most calls refresh
+        clock.now = expires - 1
+        for _ in range(20):
+            manager.get_or_set('key', compute, ttl=60)
+            if compute.calls > 1:
+                break
+
+        assert compute.calls == 2
+        assert manager.stats()['early_refreshes'] == 1
+
+    def test_early_refresh_disabled(self, clock):
+        manager = CacheManager(early_refresh_beta=0)
+        compute = Counter(advance=lambda: None)
+
+        manager.get_or_set('key', compute, ttl=60)
+        clock.now += 59.9
+        for _ in range(50):
+            manager.get_or_set('key', compute, ttl=60)
+
+        assert compute.calls == 1
+
+    def test_tiered_record_outliving_its_ttl_is_recomputed(self, clock):
+        l2 = MemoryCacheBackend()
+        manager = CacheManager(TieredCacheBackend(MemoryCacheBackend(), l2), early_refresh_beta=0)
+        compute = Counter()
+        manager.get_or_set('key', compute, ttl=60)
+
+        # Fresh process: the L2 copy is promoted into an empty L1
+        other = CacheManager(TieredCacheBackend(MemoryCacheBackend(), l2), early_refresh_beta=0)
+        assert other.get_or_set('key', compute, ttl=60) == 'value'
+        assert compute.calls == 1
+
+        clock.now += 60
+        other.get_or_set('key', compute, ttl=60)
+        assert compute.calls == 2
@@ -0,0 +1,182 @@
+"""
+Integration tests for streaming /chat replies as Server-Sent Events.
+
+The whole application is imported, bound to a temporary database; the Claude
+client and the provider guard are replaced with local fakes, and background
+jobs are recorded instead of run.
+"""
+import importlib
+import json
+
+import pytest
+
+from models import ChatHistory
+from provider_guard import ProviderGuard
+
+SYSTEM_FIELDS = {'mood': 'anxious', 'technique': 'reframing'}
+
+
+@pytest.fixture(scope='module')
+def application(tmp_path_factory):
+    """The application module, with its database in a temporary directory."""
+    database = tmp_path_factory.mktemp('chat') / 'chat.sqlite3'
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('DATABASE_URL', f"sqlite:///{database}")
+        return importlib.import_module('app')
+
+
+class FakeStream:
+    """Stand-in for the context manager returned by messages.stream."""
+
+    def __init__(self, texts, error=None):
+        self.texts = texts
+        self.error = error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        for text in self.texts:
+            yield text
+        if self.error is not None:
+            raise self.error
+
+
+class FakeClaude:
+    """Claude client whose streams replay fixed text deltas."""
+
+    def __init__(self):
+        self.texts = ["Let's ", "reframe ", "that."]
+        self.error = None
+        self.requests = []
+        self.messages = self
+
+    def stream(self, **request):
+        self.requests.append(request)
+        return FakeStream(self.texts, self.error)
+
+
+@pytest.fixture
+def claude(application, monkeypatch):
+    fake = FakeClaude()
+    monkeypatch.setattr(application, 'CLAUDE_API_KEY', 'test-key')
+    monkeypatch.setattr(application, 'claude_client', fake)
+    return fake
+
+
+@pytest.fixture
+def guard(application, monkeypatch, tmp_path):
+    guard = ProviderGuard(str(tmp_path / 'provider_guard.sqlite3'))
+    monkeypatch.setattr(application, 'provider_guard', guard)
+    return guard
+
+
+@pytest.fixture
+def jobs(application, monkeypatch):
+    """Job types enqueued by save_chat_turn."""
+    enqueued = []
+
+    def enqueue_jobs(new_jobs):
+        enqueued.extend(job_type for job_type, _ in new_jobs)
+        return list(range(len(new_jobs)))
+
+    monkeypatch.setattr(application, 'enqueue_jobs', enqueue_jobs)
+    return enqueued
+
+
+@pytest.fixture
+def client(application, claude, guard, jobs):
+    application.app.config['TESTING'] = True
+    return application.app.test_client()
+
+
+def events(body):
+    """Decode an SSE body into its JSON payloads."""
+    messages = body.decode('utf-8').split('\n\n')
+    assert messages[-1] == ''
+    payloads = []
+    for message in messages[:-1]:
+        assert message.startswith('data: ') and '\n' not in message
+        payloads.append(json.loads(message[len('data: '):]))
+    return payloads
+
+
+def post_chat(client, message, **kwargs):
+    return client.post('/chat', json={'message': message, 'stream': True, **SYSTEM_FIELDS},
+                       **kwargs)
+
+
+def saved_turns(application, message):
+    with application.app.app_context():
+        return [row.ai_response for row in ChatHistory.query.filter_by(user_message=message).all()]
+
+
+def test_tokens_are_streamed_as_events(application, client, claude, guard):
+    response = post_chat(client, "I keep failing at work")
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.headers['X-Accel-Buffering'] == 'no'
+    assert events(response.data) == [
+        {'type': 'token', 'text': "Let's "},
+        {'type': 'token', 'text': "reframe "},
+        {'type': 'token', 'text': "that."},
+        {'type': 'done', 'success': True, 'response': "Let's reframe that.", 'is_fallback': False},
+    ]
+    assert saved_turns(application, "I keep failing at work") == ["Let's reframe that."]
+    assert guard.status('claude')['in_flight'] == 0
+
+
+def test_event_stream_accept_header_streams(client, claude):
+    response = client.post('/chat', json={'message': "Hello", **SYSTEM_FIELDS},
+                           headers={'Accept': 'text/event-stream'})
+
+    assert response.mimetype == 'text/event-stream'
+    assert events(response.data)[-1]['response'] == "Let's reframe that."
+
+
+def test_closing_the_stream_saves_the_partial_turn(application, client, claude, guard, jobs):
+    response = post_chat(client, "I feel stuck", buffered=False)
+    chunks = iter(response.response)
+
+    first = next(chunks)
+    if isinstance(first, str):
+        first = first.encode('utf-8')
+    assert events(first) == [{'type': 'token', 'text': "Let's "}]
+    assert guard.status('claude')['in_flight'] == 1
+
+    # The client disconnects after the first token
+    response.close()
+
+    assert saved_turns(application, "I feel stuck") == ["Let's"]
+    assert 'usage_quota_increment' in jobs
+    assert guard.status('claude')['in_flight'] == 0
+
+
+def test_provider_error_before_any_token_sends_a_fallback(application, client, claude, guard):
+    claude.texts = []
+    claude.error = ConnectionError("connection reset")
+
+    payloads = events(post_chat(client, "Nobody listens to me").data)
+
+    assert [payload['type'] for payload in payloads] == ['token', 'done']
+    assert payloads[-1]['is_fallback'] is True
+    assert payloads[-1]['response'] == payloads[0]['text']
+    assert saved_turns(application, "Nobody listens to me") == [payloads[0]['text']]
+    assert guard.status('claude')['in_flight'] == 0
+
+
+def test_provider_error_mid_stream_keeps_the_partial_reply(application, client, claude, guard):
+    claude.error = ConnectionError("connection reset")
+
+    payloads = events(post_chat(client, "I can't sleep").data)
+
+    assert payloads[-1] == {'type': 'done', 'success': True, 'response': "Let's reframe that.",
+                            'is_fallback': False}
+    assert saved_turns(application, "I can't sleep") == ["Let's reframe that."]
+    assert guard.status('claude')['in_flight'] == 0
@@ -0,0 +1,128 @@
+"""
+Unit tests for packing the conversation context within a token budget.
+"""
+import pytest
+
+from context_packer import (SECTION_HEADERS, PromptSizeStats, estimate_tokens, pack_context,
+                            shorten_entry, turn_entry)
+
+
+def make_turns(count, user_message='How do I stop overthinking?', ai_response='Try noticing the thought.'):
+    """Turn entries, oldest first."""
+    return [turn_entry({'user_message': f"{user_message} ({number})", 'ai_response': ai_response})
+            for number in range(count)]
+
+
+def memory(content, memory_type='fact'):
+    return {'content': content, 'memory_type': memory_type}
+
+
+class TestPackContext:
+    """Tests for pack_context."""
+
+    def test_everything_fits(self):
+        packed = pack_context("We talked about work stress.", make_turns(2),
+                              [memory("Prefers short answers", 'preference'), memory("Works as a nurse")],
+                              guidance="Be warm.")
+
+        assert packed.parts == [
+            "CONVERSATION SUMMARY: We talked about work stress.",
+            SECTION_HEADERS['turns'],
+            "User: How do I stop overthinking? (0)", "You: Try noticing the thought.",
+            "User: How do I stop overthinking? (1)", "You: Try noticing the thought.",
+            SECTION_HEADERS['memories'],
+            "- FACT: Works as a nurse",
+            SECTION_HEADERS['preferences'],
+            "- Prefers short answers",
+            "Be warm.",
+        ]
+        assert not any(packed.dropped.values())
+
+    def test_stays_within_budget(self):
+        packed = pack_context("Summary " * 50, make_turns(40),
+                              [memory(f"Memory number {number}") for number in range(40)], budget=300)
+
+        assert packed.tokens <= 300
+        assert sum(estimate_tokens(part) + 1 for part in packed.parts) <= 300
+        assert packed.dropped['turns'] > 0
+        assert packed.dropped['memories'] > 0
+
+    def test_oldest_turns_are_dropped(self):
+        packed = pack_context(None, make_turns(30), [], budget=200)
+
+        kept = [part for part in packed.parts if part.startswith("User:")]
+        assert kept[-1] == "User: How do I stop overthinking? (29)"
+        assert len(kept) == 30 - packed.dropped['turns']
+
+    def test_long_newest_turn_is_shortened(self):
+        turns = make_turns(5) + [turn_entry({'user_message': "word " * 1200, 'ai_response': "A short reply."})]
+
+        packed = pack_context("We talked about work stress.", turns, [])
+
+        assert SECTION_HEADERS['turns'] in packed.parts
+        user_line = next(part for part in packed.parts if part.startswith("User:"))
+        assert user_line.endswith("...")
+        assert "You: A short reply." in packed.parts
+        assert packed.dropped['turns'] == 5
+        assert packed.tokens <= 1200
+
+    def test_long_memory_is_skipped(self):
+        memories = [memory("word " * 400), memory("Works as a nurse")]
+
+        packed = pack_context(None, [], memories, budget=100)
+
+        assert "- FACT: Works as a nurse" in packed.parts
+        assert packed.dropped['memories'] == 1
+
+    def test_long_summary_is_shortened(self):
+        packed = pack_context("word " * 2000, [], [], budget=200)
+
+        assert packed.parts[0].startswith("CONVERSATION SUMMARY: word")
+        assert packed.parts[0].endswith("...")
+        assert packed.dropped['summary'] == 0
+
+    def test_duplicate_memories_listed_once(self):
+        packed = pack_context(None, [], [memory("Likes tea", 'preference'), memory("likes tea ")])
+
+        assert packed.parts == [SECTION_HEADERS['preferences'], "- Likes tea"]
+
+
+class TestShortenEntry:
+    """Tests for shorten_entry."""
+
+    def test_short_line_kept_whole(self):
+        entry = turn_entry({'user_message': "word " * 500, 'ai_response': "Okay."})
+
+        lines, tokens = shorten_entry(entry, 100)
+
+        assert lines[1] == "You: Okay."
+        assert tokens <= 100
+
+    def test_too_little_room(self):
+        assert shorten_entry(turn_entry({'user_message': "word " * 500, 'ai_response': "Okay."}), 10) is None
+
+
+class TestPromptSizeStats:
+    """Tests for the prompt size and latency histograms."""
+
+    def test_latency_modes_are_kept_apart(self):
+        stats = PromptSizeStats(buckets=(512, 1024))
+
+        stats.record_prompt(400, 0.5, 'first_token')
+        stats.record_prompt(450, 1.5, 'first_token')
+        stats.record_prompt(400, 6.0, 'full_response')
+        stats.record_prompt(2000, 9.0, 'full_response')
+
+        summary = stats.summary()
+        assert summary['prompt_tokens'] == {
+            'first_token': {'<=512': 2, '<=1024': 0, '>1024': 0},
+            'full_response': {'<=512': 1, '<=1024': 0, '>1024': 1},
+        }
+        assert summary['mean_latency_seconds'] == {
+            'first_token': {'<=512': 1.0},
+            'full_response': {'<=512': 6.0, '>1024': 9.0},
+        }
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            PromptSizeStats().record_prompt(400, 0.5, 'streamed')
@@ -0,0 +1,39 @@
+"""
+Unit tests for the schema additions applied to existing tables.
+"""
+import importlib
+
+import pytest
+from sqlalchemy import inspect
+
+from database import db
+
+QUOTA_INDEXES = {'ix_usage_quota_user_id', 'ix_usage_quota_browser_session_id'}
+
+
+@pytest.fixture(scope='module')
+def db_init(tmp_path_factory):
+    """The db_init module; importing it loads the application, bound to a temporary database."""
+    database = tmp_path_factory.mktemp('db_init') / 'app.sqlite3'
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('DATABASE_URL', f"sqlite:///{database}")
+        return importlib.import_module('db_init')
+
+
+def index_names(table_name):
+    return {index['name'] for index in inspect(db.engine).get_indexes(table_name)}
+
+
+def test_quota_indexes_are_added_to_an_existing_table(app, db_init):
+    # A usage_quota table created before the columns were indexed
+    for index_name in QUOTA_INDEXES:
+        db.session.execute(db.text(f"DROP INDEX {index_name}"))
+    db.session.commit()
+    assert not QUOTA_INDEXES & index_names('usage_quota')
+
+    for _ in range(2):
+        db_init.create_index_if_not_exists('ix_usage_quota_user_id', 'usage_quota', ['user_id'])
+        db_init.create_index_if_not_exists('ix_usage_quota_browser_session_id', 'usage_quota',
+                                           ['browser_session_id'])
+
+    assert QUOTA_INDEXES <= index_names('usage_quota')
@@ -0,0 +1,347 @@
+"""
+Unit tests for the sliding-window suspicious activity rules.
+"""
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import make_app
+from database import db
+from security.audit import AuditManager, AUTH_FAILURE, PHI_ACCESS, PERMISSION_DENIED
+from security.detection import (DEFAULT_DETECTION_RULES, SlidingWindowCounter,
+                                SuspiciousActivityDetector)
+
+# Bucket-aligned start time: 600s windows have 10s buckets
+START = datetime(2024, 3, 1, 12, 0, 0)
+
+
+def at(seconds):
+    return START + timedelta(seconds=seconds)
+
+
+class Alerts(list):
+    """Alert callback recording (level, message) pairs."""
+
+    def __call__(self, level, message):
+        self.append((level, message))
+
+    def levels(self):
+        return [level for level, _ in self]
+
+
+@pytest.fixture
+def alerts():
+    return Alerts()
+
+
+@pytest.fixture
+def detector(alerts):
+    return SuspiciousActivityDetector(alert=alerts)
+
+
+class TestSlidingWindowCounter:
+    """Tests for per-key counts over a sliding window."""
+
+    def test_events_expire_one_window_later(self):
+        counter = SlidingWindowCounter(600)
+
+        assert counter.add('ip', 0) == 1
+        assert counter.add('ip', 300) == 2
+        assert counter.count('ip', 599) == 2
+        # The window is half-open: an event exactly one window old has expired
+        assert counter.count('ip', 600) == 1
+        assert counter.count('ip', 899) == 1
+        assert counter.count('ip', 900) == 0
+
+    def test_expiry_is_per_bucket(self):
+        counter = SlidingWindowCounter(600)
+        counter.add('ip', 0)
+        # Same 10s bucket, so it expires together with the first event
+        counter.add('ip', 9)
+
+        assert counter.count('ip', 609) == 0
+
+    def test_late_events(self):
+        counter = SlidingWindowCounter(600)
+        counter.add('ip', 1000)
+
+        # Inside the window ending at the newest event: counted
+        assert counter.add('ip', 500) == 2
+        # Already outside it: ignored
+        assert counter.add('ip', 300) == 2
+
+    def test_idle_key_is_dropped_when_empty(self):
+        counter = SlidingWindowCounter(600)
+        counter.add('ip', 0)
+
+        assert counter.count('ip', 600) == 0
+        assert len(counter) == 0
+        assert counter.count('other', 0) == 0
+
+    def test_least_recently_updated_key_is_dropped(self):
+        counter = SlidingWindowCounter(600, max_keys=2)
+        counter.add('a', 0)
+        counter.add('b', 0)
+        counter.add('a', 1)
+
+        counter.add('c', 2)
+
+        assert len(counter) == 2
+        assert counter.count('b', 2) == 0
+        assert counter.count('a', 2) == 2
+        assert counter.count('c', 2) == 1
+
+
+class TestRules:
+    """Tests for when each rule fires and when it stops."""
+
+    def test_brute_force(self, detector, alerts):
+        for second in range(0, 40, 10):
+            detector.record_auth_failure('10.0.0.1', at(second))
+        assert alerts == []
+
+        detector.record_auth_failure('10.0.0.1', at(40))
+        detector.record_auth_failure('10.0.0.2', at(40))
+        assert alerts.levels() == ['critical']
+        assert 'from IP 10.0.0.1 with 5 failed authentication attempts in 10 minutes' in alerts[0][1]
+
+        # Still five in the window while the first failure is in it
+        detector.record_auth_failure('10.0.0.1', at(590))
+        assert len(alerts) == 2
+        # The first three failures have expired: four left
+        alerts.clear()
+        detector.record_auth_failure('10.0.0.1', at(620))
+        assert alerts == []
+
+    def test_phi_access_volume(self, detector, alerts):
+        for second in range(50):
+            detector.record_phi_access('u1', None, at(second))
+        assert 'warning' not in alerts.levels()
+
+        detector.record_phi_access('u1', None, at(50))
+        warnings = [message for level, message in alerts if level == 'warning']
+        assert len(warnings) == 1
+        assert 'with 51 records accessed in the last 60 minutes' in warnings[0]
+
+        alerts.clear()
+        detector.record_phi_access('u1', None, at(3600))
+        assert 'warning' not in alerts.levels()
+
+    def test_anonymous_phi_access_is_ignored(self, detector, alerts):
+        for second in range(60):
+            detector.record_phi_access(None, 'note', at(second))
+
+        assert alerts == []
+
+    def test_permission_probing(self, detector, alerts):
+        for second in range(4):
+            detector.record_permission_denied('u1', at(second * 60))
+        assert alerts == []
+
+        detector.record_permission_denied('u1', at(240))
+        assert alerts.levels() == ['critical']
+        assert 'with 5 denied access attempts in 30 minutes' in alerts[0][1]
+
+        # The first two denials have expired
+        alerts.clear()
+        detector.record_permission_denied('u1', at(1860))
+        assert alerts == []
+
+    def test_uncommon_resource(self, detector, alerts):
+        for second in range(4):
+            detector.record_phi_access('u1', 'note', at(second))
+        assert alerts.levels() == ['info'] * 4
+
+        alerts.clear()
+        detector.record_phi_access('u1', 'note', at(4))
+        detector.record_phi_access('u1', 'journal', at(5))
+        assert len(alerts) == 1
+        assert 'uncommon resource type journal' in alerts[0][1]
+
+        # A month without access makes the resource type uncommon again
+        alerts.clear()
+        detector.record_phi_access('u1', 'note', at(30 * 86400 + 10))
+        assert alerts.levels() == ['info']
+
+    def test_missing_resource_type_is_always_uncommon(self, detector, alerts):
+        for second in range(10):
+            detector.record_phi_access('u1', None, at(second))
+
+        assert alerts.levels() == ['info'] * 10
+
+    def test_seeded_events_do_not_alert(self, detector, alerts):
+        for second in range(10):
+            detector.record_auth_failure('10.0.0.1', at(second), alert=False)
+        detector.seed('auth_failures', '10.0.0.1', at(10), amount=5)
+        assert alerts == []
+
+        detector.record_auth_failure('10.0.0.1', at(20))
+        assert 'with 16 failed authentication attempts' in alerts[0][1]
+
+
+class TestRuleOverrides:
+    """Tests for AUDIT_DETECTION_RULES."""
+
+    def test_override_keeps_other_settings(self, alerts):
+        detector = SuspiciousActivityDetector({'auth_failures': {'threshold': 2}}, alert=alerts)
+
+        assert detector.rules['auth_failures'] == {'window': 600, 'threshold': 2}
+        assert detector.rules['permission_probing'] == DEFAULT_DETECTION_RULES['permission_probing']
+        detector.record_auth_failure('10.0.0.1', at(0))
+        detector.record_auth_failure('10.0.0.1', at(1))
+        assert alerts.levels() == ['critical']
+
+    def test_window_override(self, alerts):
+        detector = SuspiciousActivityDetector({'permission_probing': {'window': 60}}, alert=alerts)
+
+        assert detector.counters['permission_probing'].window == 60
+        assert detector.longest_window == DEFAULT_DETECTION_RULES['common_resources']['window']
+        for second in range(0, 300, 60):
+            detector.record_permission_denied('u1', at(second))
+        assert alerts == []
+
+    def test_app_config_is_applied(self, database_path):
+        rules = {'phi_access_volume': {'threshold': 3}}
+        app = make_app(database_path, AUDIT_ASYNC=False, AUDIT_DETECTION_RULES=rules)
+
+        audit = AuditManager(app)
+
+        assert audit.detector.rules['phi_access_volume'] == {'window': 3600, 'threshold': 3}
+        assert DEFAULT_DETECTION_RULES['phi_access_volume']['threshold'] == 50
+
+
+def count_based_alerts(events, rules=DEFAULT_DETECTION_RULES):
+    """
+    Alerts the COUNT queries over the audit log used to raise.
+
+    Each event counts the earlier events with the same key in the window
+    ending at its own time, except those exactly one window old.
+    """
+    raised = []
+    for index, (kind, key, resource_type, when) in enumerate(events):
+        def in_window(rule, match):
+            window = rules[rule]['window']
+            return sum(1 for other in events[:index + 1]
+                       if match(other) and when - window < other[3] <= when)
+
+        if kind == AUTH_FAILURE:
+            if in_window('auth_failures', lambda e: e[0] == kind and e[1] == key) >= 5:
+                raised.append((index, 'critical'))
+        elif kind == PERMISSION_DENIED:
+            if in_window('permission_probing', lambda e: e[0] == kind and e[1] == key) >= 5:
+                raised.append((index, 'critical'))
+        elif kind == PHI_ACCESS:
+            if in_window('phi_access_volume', lambda e: e[0] == kind and e[1] == key) > 50:
+                raised.append((index, 'warning'))
+            same_resource = in_window(
+                'common_resources', lambda e: e[0] == kind and e[1] == key and e[2] == resource_type)
+            if resource_type is None or same_resource < 5:
+                raised.append((index, 'info'))
+    return raised
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_counters_match_count_queries(seed):
+    """At bucket-aligned times the counters raise the same alerts as COUNT queries."""
+    rng = random.Random(seed)
+    events = []
+    when = 0
+    for _ in range(400):
+        # 10s steps align with the buckets of every default window
+        when += 10 * rng.choice([0, 0, 1, 3, 30, 200])
+        kind = rng.choice([AUTH_FAILURE, PHI_ACCESS, PHI_ACCESS, PERMISSION_DENIED])
+        events.append((kind, rng.choice(['a', 'b']), rng.choice(['note', 'journal', None]), when))
+
+    alerts = Alerts()
+    detector = SuspiciousActivityDetector(alert=alerts)
+    raised = []
+    for index, (kind, key, resource_type, second) in enumerate(events):
+        before = len(alerts)
+        if kind == AUTH_FAILURE:
+            detector.record_auth_failure(key, at(second))
+        elif kind == PERMISSION_DENIED:
+            detector.record_permission_denied(key, at(second))
+        else:
+            detector.record_phi_access(key, resource_type, at(second))
+        raised.extend((index, level) for level, _ in alerts[before:])
+
+    assert raised == count_based_alerts(events)
+
+
+class TestSeeding:
+    """Tests for loading the counters from the audit log."""
+
+    @pytest.fixture
+    def managers(self, database_path):
+        """Audit managers of two worker processes sharing the database."""
+        apps = [make_app(database_path, AUDIT_ASYNC=False) for _ in range(2)]
+        managers = [AuditManager(app) for app in apps]
+        with apps[0].app_context():
+            db.create_all()
+        alerts = Alerts()
+        managers[0].detector.alert = alerts
+        return managers, alerts
+
+    @staticmethod
+    def record(event_type, timestamp, user_id=None, ip_address=None, resource_type=None):
+        return {
+            'id': str(uuid.uuid4()), 'timestamp': timestamp, 'user_id': user_id,
+            'event_type': event_type, 'action': 'test', 'resource_type': resource_type,
+            'resource_id': None, 'ip_address': ip_address, 'user_agent': None,
+            'details': None, 'success': False
+        }
+
+    def test_recent_failures_are_seeded(self, managers):
+        (first, other), alerts = managers
+        now = datetime.utcnow()
+        other.write_entries_detached([
+            self.record(AUTH_FAILURE, now - timedelta(seconds=60), ip_address='10.0.0.1')
+            for _ in range(4)
+        ])
+
+        first.write_entries_detached([self.record(AUTH_FAILURE, now, ip_address='10.0.0.1')])
+
+        assert alerts.levels() == ['critical']
+
+    def test_failures_outside_window_are_not_seeded(self, managers):
+        (first, other), alerts = managers
+        now = datetime.utcnow()
+        other.write_entries_detached([
+            self.record(AUTH_FAILURE, now - timedelta(seconds=700), ip_address='10.0.0.1')
+            for _ in range(4)
+        ])
+
+        first.write_entries_detached([self.record(AUTH_FAILURE, now, ip_address='10.0.0.1')])
+
+        assert alerts == []
+
+    def test_resource_history_is_seeded_from_daily_counts(self, managers):
+        (first, other), alerts = managers
+        now = datetime.utcnow()
+        other.write_entries_detached([
+            self.record(PHI_ACCESS, now - timedelta(days=2), user_id='u1', resource_type='note')
+            for _ in range(5)
+        ])
+
+        first.write_entries_detached([
+            self.record(PHI_ACCESS, now, user_id='u1', resource_type='note'),
+            self.record(PHI_ACCESS, now, user_id='u1', resource_type='journal')
+        ])
+
+        assert len(alerts) == 1
+        assert 'uncommon resource type journal' in alerts[0][1]
+
+    def test_other_workers_entries_are_counted(self, managers):
+        (first, other), alerts = managers
+        now = datetime.utcnow()
+        first.write_entries_detached([self.record(PERMISSION_DENIED, now, user_id='u1')])
+        other.write_entries_detached([self.record(PERMISSION_DENIED, now, user_id='u1')
+                                      for _ in range(3)])
+        assert alerts == []
+
+        first.write_entries_detached([self.record(PERMISSION_DENIED, now, user_id='u1')])
+
+        assert alerts.levels() == ['critical']
+        assert 'with 5 denied access attempts' in alerts[0][1]
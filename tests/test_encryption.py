@@ -0,0 +1,126 @@
+"""
+Unit tests for the encryption envelope formats and batch API.
+"""
+import base64
+import json
+import os
+
+import pytest
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from conftest import make_app
+from security.encryption import EncryptionManager
+
+MASTER_KEY = bytes(range(32))
+
+
+@pytest.fixture
+def manager(database_path):
+    """Encryption manager with a known master key."""
+    app = make_app(database_path, TESTING=True,
+                   ENCRYPTION_TEST_KEY=base64.b64encode(MASTER_KEY).decode('ascii'))
+    return EncryptionManager(app)
+
+
+def data_cipher(purpose):
+    """Cipher for a purpose, derived the way the first key version always was."""
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                info=f"inner-architect-{purpose}-key-v1".encode('utf-8'))
+    return AESGCM(hkdf.derive(MASTER_KEY))
+
+
+def legacy_envelope(plaintext, purpose):
+    """JSON envelope as written before the binary format."""
+    nonce = os.urandom(12)
+    return base64.b64encode(json.dumps({
+        'v': 1,
+        'p': purpose,
+        'n': base64.b64encode(nonce).decode('ascii'),
+        'd': base64.b64encode(data_cipher(purpose).encrypt(nonce, plaintext, None)).decode('ascii'),
+    }).encode('utf-8')).decode('ascii')
+
+
+def unversioned_envelope(plaintext, purpose):
+    """Binary envelope as written before the key ring."""
+    header = bytes((2, len(purpose))) + purpose.encode('utf-8')
+    nonce = os.urandom(12)
+    return base64.b64encode(header + nonce + data_cipher(purpose).encrypt(nonce, plaintext, header)).decode('ascii')
+
+
+class TestEarlierFormats:
+    """Tests for reading ciphertexts written by earlier versions."""
+
+    def test_legacy_json_envelope_decrypts(self, manager):
+        encrypted = legacy_envelope(b'journal entry', 'db-field')
+
+        assert manager.decrypt(encrypted) == b'journal entry'
+        assert manager.key_version_of(encrypted) == 1
+
+    def test_unversioned_envelope_decrypts(self, manager):
+        encrypted = unversioned_envelope(b'journal entry', 'db-field')
+
+        assert manager.decrypt(encrypted) == b'journal entry'
+        assert manager.key_version_of(encrypted) == 1
+
+    def test_earlier_formats_are_reencrypted(self, manager):
+        manager.rotate_master_key()
+        values = [legacy_envelope(b'first', 'api'), unversioned_envelope(b'second', 'db-field')]
+
+        reencrypted = manager.reencrypt_many(values)
+
+        assert [manager.key_version_of(value) for value in reencrypted] == [2, 2]
+        assert manager.decrypt_many(reencrypted) == [b'first', b'second']
+
+
+class TestEnvelope:
+    """Tests for the current binary envelope."""
+
+    def test_round_trip(self, manager):
+        encrypted = manager.encrypt("mood: anxious", 'db-field')
+
+        assert manager.decrypt(encrypted) == b"mood: anxious"
+        assert manager.key_version_of(encrypted) == manager.key_version
+
+    @pytest.mark.parametrize('offset', [0, 2, 4])
+    def test_tampered_header_is_rejected(self, manager, offset):
+        envelope = bytearray(base64.b64decode(manager.encrypt("mood: anxious", 'db-field')))
+        # Format version, key version and purpose are all authenticated
+        envelope[offset] ^= 0x01
+
+        with pytest.raises(ValueError):
+            manager.decrypt(base64.b64encode(bytes(envelope)).decode('ascii'))
+
+    def test_purpose_is_authenticated(self, manager):
+        envelope = base64.b64decode(manager.encrypt("mood: anxious", 'db-field'))
+        forged = envelope.replace(b'db-field', b'db-fielD', 1)
+
+        with pytest.raises(ValueError):
+            manager.decrypt(base64.b64encode(forged).decode('ascii'))
+
+
+class TestBatch:
+    """Tests for encrypt_many and decrypt_many."""
+
+    def test_round_trip_with_none_values(self, manager):
+        values = ["first", None, b"second", "", None]
+
+        encrypted = manager.encrypt_many(values, 'db-field')
+
+        assert encrypted[1] is None and encrypted[4] is None
+        assert len(set(value for value in encrypted if value)) == 3
+        assert manager.decrypt_many(encrypted) == [b"first", None, b"second", b"", None]
+
+    def test_mixed_formats_and_versions(self, manager):
+        old = manager.encrypt("old key", 'db-field')
+        manager.rotate_master_key()
+        values = [old, None, manager.encrypt("new key", 'api'), legacy_envelope(b'legacy', 'api')]
+
+        assert manager.decrypt_many(values) == [b"old key", None, b"new key", b"legacy"]
+
+    def test_invalid_value_fails_the_batch(self, manager):
+        values = [manager.encrypt("valid", 'db-field'), base64.b64encode(b'\x09garbage').decode('ascii')]
+
+        with pytest.raises(ValueError):
+            manager.decrypt_many(values)
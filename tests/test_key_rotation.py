@@ -0,0 +1,267 @@
+"""
+Unit tests for the versioned key ring and the re-encryption job.
+"""
+import base64
+
+import pytest
+from sqlalchemy import Column, Integer, Text, select, table, column
+
+from conftest import make_app
+from database import db
+from security import encryption as encryption_module
+from security.encryption import EncryptionManager, EncryptedField
+from security.key_rotation import KeyRotationProgress, ReencryptionJob, find_key_version_use
+
+ROWS = 23
+BATCH_SIZE = 5
+
+
+class EncryptedNote(db.Model):
+    """Table with an encrypted column for the re-encryption job."""
+    __tablename__ = 'test_encrypted_notes'
+
+    id = Column(Integer, primary_key=True)
+    body = Column(EncryptedField())
+
+
+# The stored ciphertexts, without decrypting them
+raw_notes = table('test_encrypted_notes', column('id', Integer), column('body', Text))
+
+
+@pytest.fixture
+def key_file(tmp_path):
+    return str(tmp_path / 'keys' / 'master.key')
+
+
+def key_file_manager(database_path, key_file):
+    """Encryption manager of a process using the shared key file."""
+    return EncryptionManager(make_app(database_path, ENCRYPTION_KEY_FILE=key_file))
+
+
+@pytest.fixture
+def manager(app):
+    """Encryption manager of the test app, with an in-memory key ring."""
+    app.config['TESTING'] = True
+    return EncryptionManager(app)
+
+
+@pytest.fixture
+def notes(manager):
+    """Notes encrypted with the first key version."""
+    db.session.add_all([EncryptedNote(id=number, body=f"note {number}") for number in range(1, ROWS + 1)])
+    db.session.commit()
+    return {number: f"note {number}" for number in range(1, ROWS + 1)}
+
+
+def stored_versions(manager):
+    """Key version of every stored note, by id."""
+    rows = db.session.execute(select(raw_notes.c.id, raw_notes.c.body)).all()
+    return {row.id: manager.key_version_of(row.body) for row in rows}
+
+
+def decrypted_notes():
+    """Every note decrypted through the model."""
+    db.session.expire_all()
+    return {note.id: note.body for note in EncryptedNote.query.all()}
+
+
+def make_job(manager, **options):
+    return ReencryptionJob(manager, batch_size=BATCH_SIZE, partitions=2, **options)
+
+
+class TestKeyRing:
+    """Tests for versioned master keys."""
+
+    def test_envelope_records_key_version(self, manager):
+        old = manager.encrypt("secret")
+        manager.rotate_master_key()
+        new = manager.encrypt("secret")
+
+        assert manager.key_version_of(old) == 1
+        assert manager.key_version_of(new) == 2
+        assert base64.b64decode(new)[:3] == bytes((3, 0, 2))
+        assert manager.decrypt(old) == manager.decrypt(new) == b"secret"
+
+    def test_key_file_keeps_every_version(self, database_path, key_file):
+        manager = key_file_manager(database_path, key_file)
+        old = manager.encrypt("secret")
+        manager.rotate_master_key()
+
+        restarted = key_file_manager(database_path, key_file)
+
+        assert sorted(restarted.master_keys) == [1, 2]
+        assert restarted.key_version == 2
+        assert restarted.decrypt(old) == b"secret"
+
+    def test_single_key_file_is_version_one(self, manager):
+        old = manager.encrypt("secret")
+        key = base64.b64encode(manager.master_key).decode('ascii')
+        other = EncryptionManager()
+
+        other.load_key_ring({'key': key, 'created': '2024-01-01T00:00:00'})
+
+        assert other.key_version == 1
+        assert other.decrypt(old) == b"secret"
+
+    def test_refresh_picks_up_rotation_by_another_process(self, database_path, key_file):
+        first = key_file_manager(database_path, key_file)
+        second = key_file_manager(database_path, key_file)
+        second.rotate_master_key()
+
+        assert first.refresh_key_ring() is True
+        assert first.key_version == 2
+        assert first.refresh_key_ring() is False
+        assert first.key_version_of(first.encrypt("secret")) == 2
+
+    def test_unknown_version_reloads_key_file(self, database_path, key_file):
+        first = key_file_manager(database_path, key_file)
+        second = key_file_manager(database_path, key_file)
+        second.rotate_master_key()
+
+        assert first.decrypt(second.encrypt("secret")) == b"secret"
+        assert first.key_version == 2
+
+    def test_rotations_by_two_processes_keep_both_versions(self, database_path, key_file):
+        first = key_file_manager(database_path, key_file)
+        second = key_file_manager(database_path, key_file)
+
+        first.rotate_master_key()
+        second.rotate_master_key()
+
+        assert sorted(key_file_manager(database_path, key_file).master_keys) == [1, 2, 3]
+
+
+class TestReencryptionJob:
+    """Tests for moving stored values to the current key version."""
+
+    def test_all_values_move_to_current_version(self, manager, notes):
+        manager.rotate_master_key()
+
+        report = make_job(manager).run()
+
+        assert report['complete'] is True
+        assert report['rows_scanned'] == report['rows_updated'] == ROWS
+        assert set(stored_versions(manager).values()) == {2}
+        assert decrypted_notes() == notes
+
+    def test_values_on_current_version_are_not_rewritten(self, manager, notes):
+        manager.rotate_master_key()
+        make_job(manager).run()
+
+        report = make_job(manager).run(restart=True)
+
+        assert report['rows_scanned'] == ROWS
+        assert report['rows_updated'] == 0
+
+    def test_interrupted_run_resumes_from_checkpoint(self, manager, notes, monkeypatch):
+        manager.rotate_master_key()
+        reencrypt_many = manager.reencrypt_many
+        batches = []
+
+        def fail_after_first_batch(values):
+            if batches:
+                raise RuntimeError("worker killed")
+            batches.append(values)
+            return reencrypt_many(values)
+
+        monkeypatch.setattr(manager, 'reencrypt_many', fail_after_first_batch)
+        interrupted = make_job(manager).run()
+        monkeypatch.undo()
+
+        assert interrupted['complete'] is False
+        assert interrupted['rows_updated'] == BATCH_SIZE
+        checkpoints = KeyRotationProgress.query.filter_by(key_version=2).all()
+        assert sum(progress.rows_scanned for progress in checkpoints) == BATCH_SIZE
+
+        resumed = make_job(manager).run()
+
+        assert resumed['complete'] is True
+        assert resumed['rows_scanned'] == ROWS - BATCH_SIZE
+        assert set(stored_versions(manager).values()) == {2}
+        assert decrypted_notes() == notes
+
+    def test_value_changed_during_batch_is_kept(self, manager, notes, monkeypatch):
+        manager.rotate_master_key()
+        reencrypt_many = manager.reencrypt_many
+
+        def concurrent_update(values):
+            # The application writes a note after the job read its batch
+            if not concurrent_update.done:
+                concurrent_update.done = True
+                with db.engine.begin() as connection:
+                    connection.execute(raw_notes.update().where(raw_notes.c.id == 1).values(
+                        body=manager.encrypt("edited note", 'db-field')))
+            return reencrypt_many(values)
+
+        concurrent_update.done = False
+        monkeypatch.setattr(manager, 'reencrypt_many', concurrent_update)
+
+        report = make_job(manager).run()
+
+        assert report['complete'] is True
+        assert report['rows_updated'] == ROWS - 1
+        assert decrypted_notes() == {**notes, 1: "edited note"}
+
+    def test_restart_picks_up_values_written_with_old_version(self, manager, notes):
+        manager.rotate_master_key()
+        make_job(manager).run()
+        # A worker that had not reloaded the key file yet
+        manager._use_master_key(1)
+        db.session.add(EncryptedNote(id=ROWS + 1, body="late note"))
+        db.session.commit()
+        manager._use_master_key(2)
+
+        assert make_job(manager).run()['rows_scanned'] == 0
+        assert stored_versions(manager)[ROWS + 1] == 1
+
+        report = make_job(manager).run(restart=True)
+
+        assert report['complete'] is True
+        assert report['rows_updated'] == 1
+        assert set(stored_versions(manager).values()) == {2}
+
+
+class TestRetireKey:
+    """Tests for removing key versions from the key ring."""
+
+    @pytest.fixture
+    def refreshed(self, monkeypatch):
+        """Treat every running process as having reloaded the key ring."""
+        monkeypatch.setattr(encryption_module, 'KEY_RING_REFRESH_INTERVAL', 0)
+
+    def test_retire_after_complete_run(self, manager, notes, refreshed):
+        manager.rotate_master_key()
+        make_job(manager).run()
+
+        manager.retire_key(1)
+
+        assert sorted(manager.master_keys) == [2]
+        assert decrypted_notes() == notes
+
+    def test_version_still_in_use_is_not_retired(self, manager, notes, refreshed):
+        manager.rotate_master_key()
+
+        assert find_key_version_use(manager, 1) == 'test_encrypted_notes.body'
+        with pytest.raises(ValueError, match="still used by test_encrypted_notes.body"):
+            manager.retire_key(1)
+        assert sorted(manager.master_keys) == [1, 2]
+
+    def test_not_retired_right_after_rotation(self, manager):
+        manager.rotate_master_key()
+
+        with pytest.raises(ValueError, match="running processes may still encrypt"):
+            manager.retire_key(1)
+        assert sorted(manager.master_keys) == [1, 2]
+
+    def test_current_version_is_not_retired(self, manager, refreshed):
+        with pytest.raises(ValueError, match="current key version"):
+            manager.retire_key(1)
+
+    def test_retirement_is_written_to_key_file(self, database_path, key_file, refreshed):
+        manager = key_file_manager(database_path, key_file)
+        manager.rotate_master_key()
+        with manager.app.app_context():
+            db.create_all()
+            manager.retire_key(1)
+
+        assert sorted(key_file_manager(database_path, key_file).master_keys) == [2]
@@ -0,0 +1,217 @@
+"""
+Unit tests for MinHash/LSH memory clustering and memory consolidation.
+"""
+import random
+
+import pytest
+
+from database import db
+from models import ConversationContext, ConversationMemoryItem
+import memory_clustering
+from memory_clustering import MinHashLSH, choose_bands, find_similar_clusters, jaccard, tokenize
+from conversation_context import consolidate_all_memories, consolidate_memory_items
+from memory_index import memory_indexes
+
+EXAMS = "i feel anxious about my exams next week at school"
+# Jaccard 9/11 with EXAMS
+EXAMS_UNIVERSITY = "i feel anxious about my exams next week at university"
+# Jaccard 10/12 with EXAMS_UNIVERSITY, 9/13 with EXAMS
+EXAMS_CAMPUS = "i feel anxious about my exams next week at university college campus"
+HIKING = "my sister visited last weekend and we went hiking together"
+COOKING = "cooking pasta in the evening helps me unwind after work"
+
+VOCABULARY = [f"word{number}" for number in range(400)]
+
+
+@pytest.fixture(params=['python', 'numpy'])
+def hashing(request, monkeypatch):
+    """Run a test with NumPy signatures and with the pure Python fallback."""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    monkeypatch.setattr(memory_clustering, 'NUMPY_AVAILABLE', request.param == 'numpy')
+    return request.param
+
+
+def crossing(bands, rows):
+    """Similarity at which a band layout finds half of the pairs."""
+    return (1.0 / bands) ** (1.0 / rows)
+
+
+class TestChooseBands:
+    """Tests for picking the LSH band layout."""
+
+    @pytest.mark.parametrize('threshold', [0.3, 0.5, 0.7, 0.8, 0.9])
+    def test_closest_layout_at_or_below_threshold(self, threshold):
+        bands, rows = choose_bands(64, threshold)
+
+        assert bands * rows == 64
+        assert crossing(bands, rows) <= threshold
+        for other_rows in (1, 2, 4, 8, 16, 32, 64):
+            other = crossing(64 // other_rows, other_rows)
+            assert other > threshold or other <= crossing(bands, rows)
+
+    def test_known_layouts(self):
+        assert choose_bands(64, 0.7) == (16, 4)
+        assert choose_bands(64, 0.8) == (8, 8)
+        assert choose_bands(128, 0.7) == (32, 4)
+
+    def test_threshold_below_every_layout(self):
+        assert choose_bands(64, 0.0) == (64, 1)
+
+
+class TestMinHashLSH:
+    """Tests for signatures and candidate pairs."""
+
+    def test_signatures_are_deterministic(self, hashing):
+        tokens = tokenize(EXAMS)
+
+        assert MinHashLSH().signature(tokens) == MinHashLSH().signature(tokenize(EXAMS.upper()))
+        assert MinHashLSH(seed=2).signature(tokens) != MinHashLSH().signature(tokens)
+
+    def test_numpy_and_python_signatures_agree(self, monkeypatch):
+        pytest.importorskip('numpy')
+        lsh = MinHashLSH()
+        with_numpy = lsh.signature(tokenize(EXAMS))
+
+        monkeypatch.setattr(memory_clustering, 'NUMPY_AVAILABLE', False)
+        assert lsh.signature(tokenize(EXAMS)) == with_numpy
+
+    def test_signature_agreement_estimates_jaccard(self, hashing):
+        rng = random.Random(4)
+        lsh = MinHashLSH(num_perm=256)
+        for _ in range(10):
+            first = frozenset(rng.sample(VOCABULARY, 40))
+            second = frozenset(rng.sample(sorted(first), 30) + rng.sample(VOCABULARY, 10))
+            agreement = sum(
+                a == b for a, b in zip(lsh.signature(first), lsh.signature(second))
+            ) / lsh.num_perm
+
+            assert agreement == pytest.approx(jaccard(first, second), abs=0.12)
+
+    def test_empty_text_has_constant_signature(self, hashing):
+        lsh = MinHashLSH()
+
+        assert lsh.signature(frozenset()) == lsh.signature(tokenize('   '))
+
+    def test_near_duplicates_share_a_bucket(self, hashing):
+        lsh = MinHashLSH()
+        texts = [EXAMS, HIKING, EXAMS_UNIVERSITY, COOKING]
+        signatures = [lsh.signature(tokenize(text)) for text in texts]
+
+        assert lsh.candidate_pairs(signatures) == {(0, 2)}
+
+    def test_distinct_texts_are_rarely_candidates(self, hashing):
+        rng = random.Random(7)
+        texts = [' '.join(rng.sample(VOCABULARY, 12)) for _ in range(200)]
+        lsh = MinHashLSH()
+
+        pairs = lsh.candidate_pairs([lsh.signature(tokenize(text)) for text in texts])
+
+        # Far fewer than the 19900 pairs a pairwise comparison checks
+        assert len(pairs) < 50
+
+
+class TestFindSimilarClusters:
+    """Tests for clustering texts above a Jaccard threshold."""
+
+    def test_near_duplicates_are_clustered(self, hashing):
+        assert find_similar_clusters([EXAMS, HIKING, EXAMS_UNIVERSITY, COOKING]) == [[0, 2]]
+
+    def test_clusters_are_merged_transitively(self, hashing):
+        texts = [EXAMS_CAMPUS, HIKING, EXAMS, COOKING, EXAMS_UNIVERSITY]
+
+        # EXAMS and EXAMS_CAMPUS are below the threshold but both link to EXAMS_UNIVERSITY
+        assert jaccard(tokenize(EXAMS), tokenize(EXAMS_CAMPUS)) < 0.7
+        assert find_similar_clusters(texts) == [[0, 2, 4]]
+
+    def test_candidates_are_confirmed_with_exact_jaccard(self, hashing):
+        assert find_similar_clusters([EXAMS, EXAMS_CAMPUS], threshold=0.7) == []
+        assert find_similar_clusters([EXAMS, EXAMS_CAMPUS], threshold=0.6) == [[0, 1]]
+
+    def test_identical_texts(self, hashing):
+        assert find_similar_clusters([HIKING, HIKING.upper(), HIKING]) == [[0, 1, 2]]
+
+    def test_fewer_than_two_texts(self):
+        assert find_similar_clusters([]) == []
+        assert find_similar_clusters([EXAMS]) == []
+
+
+@pytest.fixture
+def context(app):
+    memory_indexes.invalidate()
+    context = ConversationContext(session_id='session')
+    db.session.add(context)
+    db.session.commit()
+    yield context
+    memory_indexes.invalidate()
+
+
+def add_memories(context, memories):
+    items = [
+        ConversationMemoryItem(context_id=context.id, memory_type=memory_type, content=content,
+                               confidence=confidence, relevance=0.5)
+        for memory_type, content, confidence in memories
+    ]
+    db.session.add_all(items)
+    db.session.commit()
+    return items
+
+
+def stored(context_id):
+    db.session.expire_all()
+    return [(item.memory_type, item.content, item.confidence, item.relevance)
+            for item in ConversationMemoryItem.query.filter_by(context_id=context_id)
+            .order_by(ConversationMemoryItem.id)]
+
+
+class TestConsolidation:
+    """Tests for merging near-duplicate memory items."""
+
+    def test_merges_into_highest_confidence_item(self, context):
+        items = add_memories(context, [
+            ('concern', EXAMS, 0.6),
+            ('concern', HIKING, 0.9),
+            ('concern', EXAMS_UNIVERSITY, 0.8),
+        ])
+        index = memory_indexes.build(context.id)
+
+        assert consolidate_memory_items(items) == 1
+        assert stored(context.id) == [
+            ('concern', HIKING, 0.9, 0.5),
+            ('concern', EXAMS_UNIVERSITY, 0.8, 1.0),
+        ]
+        # The cached index follows the merge
+        assert sorted(index.positions) == [items[1].id, items[2].id]
+
+    def test_other_items_with_many_new_words_are_appended(self, context):
+        longer = EXAMS + " and really worried about grades"
+        items = add_memories(context, [('concern', EXAMS, 0.9), ('concern', longer, 0.5)])
+
+        assert consolidate_memory_items(items, threshold=0.6) == 1
+        assert stored(context.id) == [('concern', f"{EXAMS} {longer}", 0.9, 1.0)]
+
+    def test_memory_types_are_not_mixed(self, context):
+        items = add_memories(context, [
+            ('concern', EXAMS, 0.6),
+            ('goal', EXAMS_UNIVERSITY, 0.8),
+            ('goal', COOKING, 0.8),
+        ])
+
+        assert consolidate_memory_items(items) == 0
+        assert len(stored(context.id)) == 3
+
+    def test_all_contexts(self, context):
+        other = ConversationContext(session_id='other')
+        small = ConversationContext(session_id='small')
+        db.session.add_all([other, small])
+        db.session.commit()
+        add_memories(context, [
+            ('fact', EXAMS, 0.5), ('fact', EXAMS_UNIVERSITY, 0.6), ('fact', COOKING, 1.0)
+        ])
+        add_memories(other, [('fact', HIKING, 0.5), ('fact', HIKING, 0.5), ('fact', HIKING, 0.5)])
+        add_memories(small, [('fact', COOKING, 0.5), ('fact', COOKING, 0.5)])
+
+        stats = consolidate_all_memories(min_items=3, context_batch_size=1)
+
+        assert (stats['contexts_processed'], stats['memories_consolidated']) == (2, 3)
+        assert [len(stored(c.id)) for c in (context, other, small)] == [2, 1, 2]
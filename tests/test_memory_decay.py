@@ -0,0 +1,73 @@
+"""
+Unit tests for the bulk memory relevance decay job.
+"""
+import pytest
+
+from database import db
+from models import ConversationContext, ConversationMemoryItem
+import conversation_context
+from conversation_context import MEMORY_DECAY_FACTOR, bulk_decay_memory_relevance
+from memory_index import memory_indexes
+
+MEMORIES = 8
+
+
+@pytest.fixture
+def index(app):
+    """Cached index over stale memories of one context."""
+    memory_indexes.invalidate()
+    context = ConversationContext(session_id='session')
+    db.session.add(context)
+    db.session.commit()
+    db.session.add_all([
+        ConversationMemoryItem(id=number, context_id=context.id, memory_type='fact',
+                               content=f"memory {number}", relevance=1.0)
+        for number in range(1, MEMORIES + 1)
+    ])
+    db.session.commit()
+    yield memory_indexes.build(context.id)
+    memory_indexes.invalidate()
+
+
+def relevance(index):
+    """Relevance by ID in the database and in the cached index."""
+    db.session.expire_all()
+    stored = {item.id: item.relevance for item in ConversationMemoryItem.query.all()}
+    cached = {memory_id: index.to_dict(memory_id)['relevance'] for memory_id in stored}
+    return stored, cached
+
+
+def test_full_run_decays_index(index):
+    stats = bulk_decay_memory_relevance(batch_size=3)
+
+    stored, cached = relevance(index)
+    assert stats['rows_updated'] == MEMORIES
+    assert cached == stored
+    assert list(cached.values()) == [pytest.approx(MEMORY_DECAY_FACTOR)] * MEMORIES
+
+
+def test_resumed_run_decays_only_remaining_ids(index):
+    bulk_decay_memory_relevance(batch_size=3, start_after_id=5)
+
+    stored, cached = relevance(index)
+    assert cached == stored
+    assert [memory_id for memory_id, value in cached.items() if value == 1.0] == [1, 2, 3, 4, 5]
+
+
+def test_failed_batch_keeps_committed_decay(index, monkeypatch):
+    update = conversation_context.update
+    calls = []
+
+    def fail_third_batch(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 3:
+            raise RuntimeError("database went away")
+        return update(*args, **kwargs)
+
+    monkeypatch.setattr(conversation_context, 'update', fail_third_batch)
+    stats = bulk_decay_memory_relevance(batch_size=3)
+
+    stored, cached = relevance(index)
+    assert stats['last_id'] == 6
+    assert cached == stored
+    assert [memory_id for memory_id, value in cached.items() if value == 1.0] == [7, 8]
@@ -0,0 +1,247 @@
+"""
+Unit tests for the per-context memory scoring index.
+"""
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from database import db
+from models import ConversationContext, ConversationMemoryItem
+import memory_index
+from memory_index import ContextMemoryIndex, MemoryIndexRegistry
+
+NOW = datetime(2024, 6, 1, 12)
+
+PREFERENCE_WEIGHT = 1.5
+
+WORDS = ['work', 'sleep', 'family', 'anxious', 'anxiousness', 'calm', 'Anxious', 'running', 'exams']
+
+
+@pytest.fixture(params=['heap', 'numpy'])
+def scoring(request, monkeypatch):
+    """Run a test with the NumPy scoring path and with the heap fallback."""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    monkeypatch.setattr(memory_index, 'NUMPY_AVAILABLE', request.param == 'numpy')
+    return request.param
+
+
+def memory(memory_id, content='work', memory_type='fact', relevance=1.0, confidence=1.0,
+           days_old=0, context_id=1):
+    return ConversationMemoryItem(id=memory_id, context_id=context_id, memory_type=memory_type,
+                                  content=content, relevance=relevance, confidence=confidence,
+                                  created_at=NOW - timedelta(days=days_old))
+
+
+def random_memories(count, seed):
+    rng = random.Random(seed)
+    return [
+        memory(memory_id,
+               content=' '.join(rng.sample(WORDS, 3)),
+               memory_type=rng.choice(['fact', 'preference', 'concern', 'goal']),
+               relevance=rng.random(),
+               confidence=rng.random(),
+               days_old=rng.randrange(120))
+        for memory_id in range(1, count + 1)
+    ]
+
+
+def reference_ranking(items, limit, sentiment):
+    """The scoring loop get_relevant_memories ran over every item before the index."""
+    weighted = []
+    for item in items:
+        score = item.relevance * item.confidence
+        if item.memory_type == 'preference':
+            score *= PREFERENCE_WEIGHT
+        score *= max(0.5, 1.0 - (NOW - item.created_at).days * 0.01)
+        if sentiment and sentiment in item.content.lower():
+            score *= 1.25
+        weighted.append((item, score))
+    weighted.sort(key=lambda pair: pair[1], reverse=True)
+    return [item.id for item, _ in weighted[:limit]]
+
+
+def build(items):
+    index = ContextMemoryIndex(1, preference_weight=PREFERENCE_WEIGHT)
+    for item in items:
+        index.add(item)
+    return index
+
+
+class TestTopK:
+    """Tests for ContextMemoryIndex.top_k."""
+
+    @pytest.mark.parametrize('seed', range(5))
+    @pytest.mark.parametrize('sentiment', [None, 'anxious', 'calm', 'sad'])
+    def test_matches_reference_ranking(self, scoring, seed, sentiment):
+        items = random_memories(200, seed)
+        index = build(items)
+
+        for limit in (1, 10, 200, 500):
+            assert index.top_k(limit, sentiment=sentiment, now=NOW) == \
+                reference_ranking(items, limit, sentiment)
+
+    def test_recency_decays_by_whole_days_to_a_floor(self, scoring):
+        index = build([
+            memory(1, days_old=0.9),
+            memory(2, relevance=0.995, days_old=0),
+            memory(3, relevance=1.8, days_old=1000),
+            memory(4, relevance=1.9, days_old=40),
+        ])
+
+        # 1.0, 0.995, 1.8 * 0.5 = 0.9 and 1.9 * 0.6 = 1.14
+        assert index.top_k(4, now=NOW) == [4, 1, 2, 3]
+
+    def test_ties_keep_insertion_order(self, scoring):
+        index = build([memory(memory_id) for memory_id in (5, 3, 9, 1)])
+
+        assert index.top_k(3, now=NOW) == [5, 3, 9]
+
+    def test_preference_weight(self, scoring):
+        index = build([memory(1, relevance=1.4), memory(2, memory_type='preference')])
+
+        assert index.top_k(2, now=NOW) == [2, 1]
+
+    def test_removed_memories_are_not_ranked(self, scoring):
+        index = build([memory(memory_id, relevance=memory_id / 10) for memory_id in range(1, 9)])
+
+        index.remove([8, 6])
+        assert index.top_k(3, now=NOW) == [7, 5, 4]
+
+        # Compacted once most rows are removed
+        index.remove([7, 5, 4])
+        assert len(index.ids) == 3
+        assert index.top_k(5, now=NOW) == [3, 2, 1]
+
+    def test_replacing_a_memory(self, scoring):
+        index = build([memory(1, relevance=0.2), memory(2, relevance=0.5)])
+
+        index.add(memory(1, relevance=0.9))
+
+        assert index.top_k(2, now=NOW) == [1, 2]
+        assert len(index) == 2
+
+    def test_decay_mirrors_database_pass(self, scoring):
+        index = build([memory(1), memory(2, relevance=0.99), memory(3, relevance=0.98)])
+
+        index.apply_decay(0.5, 0.1, NOW, after_id=1, up_to_id=2)
+
+        assert index.top_k(3, now=NOW) == [1, 3, 2]
+        assert index.to_dict(2)['relevance'] == 0.495
+
+    def test_empty_and_zero_limit(self, scoring):
+        assert build([]).top_k(5, now=NOW) == []
+        assert build([memory(1)]).top_k(0, now=NOW) == []
+
+    def test_rankings_are_reused_until_the_index_changes(self, scoring, monkeypatch):
+        class FrozenDatetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return NOW
+
+        monkeypatch.setattr(memory_index, 'datetime', FrozenDatetime)
+        index = build([memory(1, relevance=0.5), memory(2, relevance=0.4)])
+        assert index.top_k(1) == [1]
+
+        index._relevance[0] = 0.1
+        assert index.top_k(1) == [1]
+
+        index.add(memory(3, relevance=0.3))
+        assert index.top_k(1) == [2]
+
+
+class TestSentimentFilter:
+    """Tests for matching the detected sentiment against memory content."""
+
+    def test_substring_of_any_token_case_insensitive(self):
+        index = build([
+            memory(1, 'Feeling ANXIOUS today'),
+            memory(2, 'a lot of anxiousness'),
+            memory(3, 'calm and rested'),
+            memory(4, 'not anxious-free'),
+        ])
+
+        assert index._positions_containing('anxious') == {0, 1, 3}
+        assert index._positions_containing('rest') == {2}
+        assert index._positions_containing('sad') == set()
+
+    def test_matching_memories_are_boosted(self, scoring):
+        index = build([memory(1, 'sleep'), memory(2, 'anxious about exams', relevance=0.85)])
+
+        assert index.top_k(2, now=NOW) == [1, 2]
+        assert index.top_k(2, sentiment='anxious', now=NOW) == [2, 1]
+
+    def test_matches_follow_additions_and_removals(self):
+        index = build([memory(1, 'anxious')])
+        assert index._positions_containing('anx') == {0}
+
+        index.add(memory(2, 'anxiety'))
+        assert index._positions_containing('anx') == {0, 1}
+
+        index.remove([1, 2])
+        assert index._positions_containing('anx') == set()
+
+
+class TestRegistry:
+    """Tests for validating cached indexes against the database."""
+
+    @pytest.fixture
+    def context(self, app):
+        context = ConversationContext(session_id='session')
+        db.session.add(context)
+        db.session.commit()
+        return context
+
+    def add(self, context, relevance=1.0):
+        item = ConversationMemoryItem(context_id=context.id, memory_type='fact', content='work',
+                                      relevance=relevance, confidence=1.0)
+        db.session.add(item)
+        db.session.commit()
+        return item
+
+    def test_current_index_is_reused(self, context):
+        self.add(context)
+        registry = MemoryIndexRegistry()
+        index = registry.get(context.id)
+
+        assert registry.get(context.id) is index
+        assert registry.get(context.id, stats=(1, index.max_id)) is index
+
+    def test_rows_written_elsewhere_trigger_a_rebuild(self, context):
+        first = self.add(context)
+        registry = MemoryIndexRegistry()
+        index = registry.get(context.id)
+
+        second = self.add(context, relevance=2.0)
+        rebuilt = registry.get(context.id)
+        assert rebuilt is not index
+        assert rebuilt.top_k(2, now=NOW) == [second.id, first.id]
+
+        db.session.delete(second)
+        db.session.commit()
+        assert registry.get(context.id).top_k(2, now=NOW) == [first.id]
+
+    def test_relevance_changes_elsewhere_wait_for_the_ttl(self, context, monkeypatch):
+        first, second = self.add(context, relevance=0.5), self.add(context, relevance=0.4)
+        registry = MemoryIndexRegistry(ttl=300)
+        built_at = registry.get(context.id).built_at
+
+        first.relevance = 0.1
+        db.session.commit()
+        assert registry.get(context.id).top_k(1, now=NOW) == [first.id]
+
+        monkeypatch.setattr(memory_index, 'time', SimpleNamespace(time=lambda: built_at + 300))
+        assert registry.get(context.id).top_k(1, now=NOW) == [second.id]
+
+    def test_least_recently_used_context_is_evicted(self, app):
+        registry = MemoryIndexRegistry(max_contexts=2)
+        for context_id in (1, 2):
+            registry.build(context_id)
+        registry.get(1)
+
+        registry.build(3)
+
+        cached = [registry.peek(context_id) is not None for context_id in (1, 2, 3)]
+        assert cached == [True, False, True]
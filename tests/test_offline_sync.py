@@ -0,0 +1,194 @@
+"""
+Unit tests for the offline sync API.
+"""
+import pytest
+
+from database import db
+from models import JournalEntry
+from api import offline_sync
+from api.offline_sync import offline_api
+
+
+@pytest.fixture
+def offline_app(app):
+    """App serving the offline API."""
+    app.register_blueprint(offline_api)
+    return app
+
+
+@pytest.fixture
+def client(offline_app):
+    return offline_app.test_client()
+
+
+class TestOfflineData:
+    """Tests for delta responses of /api/offline/data."""
+
+    def test_first_call_is_full(self, client):
+        body = client.get('/api/offline/data').get_json()
+
+        assert body['full'] is True
+        assert body['data']['reminders']
+        assert body['data']['user']['name'] == "Offline User"
+
+    def test_unchanged_data_returns_empty_delta(self, client):
+        cursor = client.get('/api/offline/data').get_json()['cursor']
+
+        body = client.get('/api/offline/data', query_string={'cursor': cursor}).get_json()
+
+        assert body['full'] is False
+        assert body['data'] == {'reminders': []}
+        assert body['deleted'] == {'reminders': []}
+
+    def test_changed_records_are_returned(self, client, monkeypatch):
+        cursor = client.get('/api/offline/data').get_json()['cursor']
+        reminders = offline_sync.get_reminders_data(None)
+        profile = offline_sync.get_user_data(None)
+        profile['streak_days'] += 1
+        monkeypatch.setattr(offline_sync, 'get_reminders_data', lambda user_id: reminders[1:])
+        monkeypatch.setattr(offline_sync, 'get_user_data', lambda user_id: profile)
+
+        body = client.get('/api/offline/data', query_string={'cursor': cursor}).get_json()
+
+        assert body['data'] == {'reminders': [], 'user': profile}
+        assert body['deleted'] == {'reminders': [reminders[0]['reminder_id']]}
+
+    def test_invalid_cursor_is_full(self, client):
+        body = client.get('/api/offline/data', query_string={'cursor': 'not-a-cursor'}).get_json()
+
+        assert body['full'] is True
+
+
+@pytest.fixture
+def applied(monkeypatch):
+    """Replace the reminder handler with one writing a journal entry per action."""
+    applied = []
+
+    def handle(action_type, data, action_id):
+        applied.append(action_id)
+        db.session.add(JournalEntry(content=f"{action_type} {action_id}"))
+        db.session.flush()
+        if data.get('fail') == 'raise':
+            raise RuntimeError("reminder service unavailable")
+        if data.get('fail') == 'result':
+            return {"id": action_id, "success": False, "error": "Rejected", "synced": False}
+        return {"id": action_id, "success": True, "synced": True}
+
+    monkeypatch.setitem(offline_sync.SYNC_HANDLERS, 'reminder', handle)
+    return applied
+
+
+def action(action_id, action_type='reminder/update', timestamp=1000, **data):
+    return {'id': action_id, 'type': action_type, 'timestamp': timestamp, 'data': data}
+
+
+def sync(client, *actions):
+    response = client.post('/api/offline/sync', json={'actions': list(actions)})
+    assert response.status_code == 200
+    return response.get_json()['results']
+
+
+def journal_entries():
+    db.session.expire_all()
+    return sorted(entry.content for entry in JournalEntry.query.all())
+
+
+def with_session(client, session_id):
+    with client.session_transaction() as session:
+        session['session_id'] = session_id
+    return client
+
+
+class TestSync:
+    """Tests for batched uploads to /api/offline/sync."""
+
+    def test_actions_are_applied_in_upload_order(self, client, applied):
+        results = sync(client, action('b', timestamp=2000), action('a', timestamp=1000))
+
+        assert [result['id'] for result in results] == ['b', 'a']
+        assert all(result['success'] for result in results)
+        assert applied == ['a', 'b']
+        assert journal_entries() == ['reminder/update a', 'reminder/update b']
+
+    def test_retried_upload_is_replayed(self, client, applied):
+        with_session(client, 'browser-1')
+        first = sync(client, action('a', reminder_id=1), action('b', reminder_id=2))
+
+        retried = sync(client, action('a', reminder_id=1), action('b', reminder_id=2))
+
+        assert retried == [dict(result, duplicate=True) for result in first]
+        assert applied == ['a', 'b']
+        assert len(journal_entries()) == 2
+
+    def test_action_repeated_in_batch_is_applied_once(self, client, applied):
+        results = sync(client, action('a'), action('a'))
+
+        assert results[1] == dict(results[0], duplicate=True)
+        assert applied == ['a']
+
+    def test_older_action_on_record_is_superseded(self, client, applied):
+        with_session(client, 'browser-1')
+        sync(client, action('newer', timestamp=2000, reminder_id=7))
+
+        results = sync(client, action('older', timestamp=1000, reminder_id=7),
+                       action('other', timestamp=1000, reminder_id=8))
+
+        assert results[0]['conflict'] == 'superseded'
+        assert results[0]['synced'] is True
+        assert 'conflict' not in results[1]
+        assert applied == ['newer', 'other']
+
+    def test_superseded_within_batch(self, client, applied):
+        results = sync(client, action('newer', timestamp=2000, reminder_id=7),
+                       action('older', timestamp=1000, reminder_id=7))
+
+        # Applied in client order, so the older action is not superseded
+        assert [result.get('conflict') for result in results] == [None, None]
+        assert applied == ['older', 'newer']
+
+    @pytest.mark.parametrize('failure', ['raise', 'result'])
+    def test_failed_action_is_rolled_back_alone(self, client, applied, failure):
+        with_session(client, 'browser-1')
+        results = sync(client, action('a', timestamp=1000), action('b', timestamp=2000, fail=failure),
+                       action('c', timestamp=3000))
+
+        assert [result['success'] for result in results] == [True, False, True]
+        assert journal_entries() == ['reminder/update a', 'reminder/update c']
+
+        # Failed actions are not recorded, so a retry applies them again
+        retried = sync(client, action('b', timestamp=2000))
+        assert 'duplicate' not in retried[0]
+        assert applied == ['a', 'b', 'c', 'b']
+
+    def test_clients_without_session_do_not_share_action_ids(self, offline_app, applied):
+        first = sync(offline_app.test_client(), action('a'))
+        second = sync(offline_app.test_client(), action('a'))
+
+        assert 'duplicate' not in first[0] and 'duplicate' not in second[0]
+        assert applied == ['a', 'a']
+
+    def test_clients_with_different_sessions_do_not_share_action_ids(self, offline_app, applied):
+        sync(with_session(offline_app.test_client(), 'browser-1'), action('a'))
+        results = sync(with_session(offline_app.test_client(), 'browser-2'), action('a'))
+
+        assert 'duplicate' not in results[0]
+        assert applied == ['a', 'a']
+
+    @pytest.mark.parametrize('invalid', [
+        action('x' * 101),
+        action('long-type', action_type='reminder/' + 'x' * 50),
+        action('long-record', reminder_id='x' * 150),
+        {'id': 'bad-data', 'type': 'reminder/update', 'data': ['not', 'a', 'dict']},
+    ])
+    def test_values_too_long_for_ledger_are_rejected(self, client, applied, invalid):
+        results = sync(client, invalid, action('a'))
+
+        assert results[0]['error'] == "Invalid action"
+        assert results[1]['success'] is True
+        assert applied == ['a']
+
+    def test_unknown_action_type_is_rejected(self, client, applied):
+        results = sync(client, action('a', action_type='calendar/create'))
+
+        assert results[0]['error'] == "Unknown action type"
+        assert applied == []
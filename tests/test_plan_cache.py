@@ -0,0 +1,219 @@
+"""
+Unit tests for cached plan resolution and its invalidation on subscription changes.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from database import db
+from models import Subscription, UsageQuota, User
+import subscription_manager
+from subscription_manager import (
+    SUBSCRIPTION_PLANS, cancel_subscription, handle_checkout_success, handle_webhook_event,
+    invalidate_plan_cache, resolve_plan
+)
+
+PERIOD_START = 1717200000
+PERIOD_END = PERIOD_START + 30 * 86400
+
+
+class FakeClock:
+    """Controllable replacement for time.monotonic."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def plans(app, monkeypatch):
+    """
+    A free user u1 with a Stripe subscription and a user u2 without a
+    subscription, with an empty plan cache and a counter of plan queries.
+    """
+    subscription_manager.init_models(User, Subscription, UsageQuota)
+    invalidate_plan_cache()
+    db.session.add_all([
+        User(id='u1', email='u1@example.com'),
+        User(id='u2', email='u2@example.com'),
+        Subscription(user_id='u1', plan_name='free', status='active',
+                     stripe_customer_id='cus_1', stripe_subscription_id='sub_1'),
+    ])
+    db.session.commit()
+
+    queries = []
+    get_subscription = subscription_manager.get_subscription
+
+    def counting_get_subscription(user_id):
+        queries.append(user_id)
+        return get_subscription(user_id)
+
+    monkeypatch.setattr(subscription_manager, 'get_subscription', counting_get_subscription)
+    yield queries
+    invalidate_plan_cache()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(subscription_manager, 'time', SimpleNamespace(monotonic=fake.monotonic))
+    return fake
+
+
+@pytest.fixture
+def stripe(monkeypatch):
+    """Stripe API stub recording modified subscriptions."""
+    modified = []
+    fake = SimpleNamespace(
+        checkout=SimpleNamespace(Session=SimpleNamespace(retrieve=lambda session_id: {
+            'metadata': {'user_id': 'u1', 'plan_name': 'premium'},
+            'subscription': 'sub_1',
+        })),
+        Subscription=SimpleNamespace(
+            retrieve=lambda subscription_id: {
+                'current_period_start': PERIOD_START,
+                'current_period_end': PERIOD_END,
+                'cancel_at_period_end': False,
+            },
+            modify=lambda subscription_id, **changes: modified.append((subscription_id, changes)),
+        ),
+    )
+    monkeypatch.setattr(subscription_manager, 'stripe', fake)
+    return modified
+
+
+def plan_in_new_request(app, user_id='u1'):
+    """Resolve a plan the way a later request in this process does."""
+    # A fresh app context, so flask.g is not shared with the test's
+    with app.app_context(), app.test_request_context():
+        return resolve_plan(user_id)
+
+
+def change_plan_elsewhere(plan_name):
+    """Change the plan without invalidating, as another process would."""
+    Subscription.query.filter_by(user_id='u1').update({'plan_name': plan_name})
+    db.session.commit()
+
+
+def subscription_event(event_type, **fields):
+    subscription_object = {
+        'id': 'sub_1',
+        'customer': 'cus_1',
+        'status': 'active',
+        'current_period_start': PERIOD_START,
+        'current_period_end': PERIOD_END,
+    }
+    subscription_object.update(fields)
+    return {'id': 'evt_1', 'type': event_type, 'data': {'object': subscription_object}}
+
+
+class TestResolvePlan:
+    """Tests for serving cached plan resolutions."""
+
+    def test_resolution(self, app, plans):
+        plan = plan_in_new_request(app)
+
+        assert (plan['exists'], plan['plan_name'], plan['status']) == (True, 'free', 'active')
+        assert plan['quotas'] == SUBSCRIPTION_PLANS['free']['quotas']
+
+    def test_one_query_per_request(self, app, plans):
+        with app.app_context(), app.test_request_context():
+            resolve_plan('u1')
+            resolve_plan('u1')
+            resolve_plan('u2')
+
+        assert plans == ['u1', 'u2']
+
+    def test_cached_plan_is_served_for_the_ttl(self, app, plans, clock):
+        assert plan_in_new_request(app)['plan_name'] == 'free'
+        change_plan_elsewhere('premium')
+
+        clock.now += subscription_manager.PLAN_CACHE_TTL - 1
+        assert plan_in_new_request(app)['plan_name'] == 'free'
+        assert plans == ['u1']
+
+        clock.now += 1
+        assert plan_in_new_request(app)['plan_name'] == 'premium'
+        assert plans == ['u1', 'u1']
+
+    def test_missing_subscription_is_cached(self, app, plans):
+        assert plan_in_new_request(app, 'u2')['exists'] is False
+        assert plan_in_new_request(app, 'u2')['exists'] is False
+
+        assert plans == ['u2']
+
+    def test_cache_is_bounded(self, app, plans, monkeypatch):
+        monkeypatch.setattr(subscription_manager, 'PLAN_CACHE_MAX_ENTRIES', 2)
+        for user_id in ('u1', 'u2', 'u3'):
+            plan_in_new_request(app, user_id)
+
+        assert list(subscription_manager._plan_cache) == ['u2', 'u3']
+
+    def test_invalidating_one_user(self, app, plans):
+        plan_in_new_request(app, 'u1')
+        plan_in_new_request(app, 'u2')
+        change_plan_elsewhere('premium')
+
+        invalidate_plan_cache('u1')
+
+        assert plan_in_new_request(app, 'u1')['plan_name'] == 'premium'
+        plan_in_new_request(app, 'u2')
+        assert plans == ['u1', 'u2', 'u1']
+
+
+class TestInvalidation:
+    """Tests that every path changing a subscription drops the cached plan."""
+
+    def test_upgrade_through_checkout(self, app, plans, stripe):
+        assert plan_in_new_request(app)['plan_name'] == 'free'
+
+        with app.app_context(), app.test_request_context():
+            assert resolve_plan('u1')['plan_name'] == 'free'
+            assert handle_checkout_success('cs_1') is True
+            # Also dropped from the current request
+            assert resolve_plan('u1')['plan_name'] == 'premium'
+
+        plan = plan_in_new_request(app)
+        assert plan['plan_name'] == 'premium'
+        assert plan['quotas'] == SUBSCRIPTION_PLANS['premium']['quotas']
+
+    def test_cancel(self, app, plans, stripe):
+        assert plan_in_new_request(app)['cancel_at_period_end'] is False
+
+        with app.app_context(), app.test_request_context():
+            assert cancel_subscription('u1') is True
+
+        assert stripe == [('sub_1', {'cancel_at_period_end': True})]
+        assert plan_in_new_request(app)['cancel_at_period_end'] is True
+
+    def test_plan_change_webhook(self, app, plans):
+        assert plan_in_new_request(app)['plan_name'] == 'free'
+
+        price_id = SUBSCRIPTION_PLANS['professional']['price_id']
+        event = subscription_event('customer.subscription.updated',
+                                   items={'data': [{'price': {'id': price_id}}]})
+        with app.app_context(), app.test_request_context():
+            assert handle_webhook_event(event) is True
+
+        assert plan_in_new_request(app)['plan_name'] == 'professional'
+
+    def test_status_change_webhook(self, app, plans):
+        assert plan_in_new_request(app)['status'] == 'active'
+
+        with app.app_context(), app.test_request_context():
+            assert handle_webhook_event(subscription_event('customer.subscription.updated',
+                                                           status='past_due')) is True
+
+        assert plan_in_new_request(app)['status'] == 'past_due'
+
+    def test_deletion_webhook(self, app, plans):
+        change_plan_elsewhere('premium')
+        assert plan_in_new_request(app)['plan_name'] == 'premium'
+
+        with app.app_context(), app.test_request_context():
+            assert handle_webhook_event(subscription_event('customer.subscription.deleted')) is True
+
+        plan = plan_in_new_request(app)
+        assert (plan['plan_name'], plan['status']) == ('free', 'canceled')
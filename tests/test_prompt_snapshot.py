@@ -0,0 +1,227 @@
+"""
+Unit tests for prompt snapshots and the queries of a warm chat turn.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from database import db
+from models import ChatHistory, ConversationContext, ConversationMemoryItem
+import conversation_context
+from conversation_context import add_message_to_context, enhance_prompt_with_context
+from context_packer import turn_entry
+from memory_index import memory_indexes
+from prompt_snapshot import (
+    PROMPT_HISTORY_TURNS, PromptSnapshot, PromptSnapshotRegistry, fetch_context_state,
+    prompt_snapshots
+)
+
+SYSTEM_PROMPT = "You are a supportive coach."
+
+STARTED = datetime(2024, 3, 1, 9)
+
+
+def message(message_id):
+    return {'id': message_id, 'user_message': f"Question {message_id}",
+            'ai_response': f"Answer {message_id}", 'mood': None}
+
+
+class TestPromptSnapshot:
+    """Tests for the ring buffer of recent turns."""
+
+    def test_oldest_turns_are_dropped(self):
+        snapshot = PromptSnapshot(1, [message(1), message(2)], max_turns=3)
+
+        for message_id in (3, 4, 5):
+            snapshot.add_turn(message(message_id))
+
+        assert [turn['id'] for turn in snapshot.turns] == [3, 4, 5]
+        assert snapshot.last_message_id == 5
+
+    def test_loaded_from_more_messages_than_fit(self):
+        snapshot = PromptSnapshot(1, [message(n) for n in range(1, 9)], max_turns=3)
+
+        assert [turn['id'] for turn in snapshot.turns] == [6, 7, 8]
+        assert snapshot.last_message_id == 8
+
+    def test_old_and_repeated_messages_are_ignored(self):
+        snapshot = PromptSnapshot(1, [message(4), message(5)])
+
+        snapshot.add_turn(message(5))
+        snapshot.add_turn(message(3))
+
+        assert [turn['id'] for turn in snapshot.turns] == [4, 5]
+
+    @pytest.mark.parametrize('loaded', [0, 1, 3])
+    def test_turn_entries_follow_the_buffer(self, loaded):
+        snapshot = PromptSnapshot(1, [message(n) for n in range(1, loaded + 1)], max_turns=3)
+        snapshot.turn_entries()
+
+        for message_id in range(loaded + 1, loaded + 6):
+            snapshot.add_turn(message(message_id))
+            assert snapshot.turn_entries() == [turn_entry(turn) for turn in snapshot.turns]
+
+    def test_turn_entries_are_built_once(self):
+        snapshot = PromptSnapshot(1, [message(1)])
+
+        assert snapshot.turn_entries() is snapshot.turn_entries()
+
+    def test_is_current(self):
+        assert PromptSnapshot(1, []).is_current(None)
+        assert PromptSnapshot(1, [message(7)]).is_current(7)
+        assert not PromptSnapshot(1, [message(7)]).is_current(8)
+
+
+class TestPromptSnapshotRegistry:
+    """Tests for the bounded snapshot registry."""
+
+    def test_least_recently_used_snapshot_is_evicted(self):
+        registry = PromptSnapshotRegistry(max_contexts=2)
+        registry.load(1, [])
+        registry.load(2, [])
+        registry.get(1)
+
+        registry.load(3, [])
+
+        cached = [registry.get(context_id) is not None for context_id in (1, 2, 3)]
+        assert cached == [True, False, True]
+
+    def test_reloading_replaces_the_snapshot(self):
+        registry = PromptSnapshotRegistry()
+        first = registry.load(1, [message(1)])
+
+        second = registry.load(1, [message(1), message(2)])
+
+        assert registry.get(1) is second is not first
+
+    def test_message_added_to_cached_snapshot_only(self):
+        registry = PromptSnapshotRegistry()
+        registry.load(1, [message(1)])
+
+        for context_id, message_id in ((1, 2), (2, 3)):
+            registry.message_added(context_id, ChatHistory(
+                id=message_id, user_message=f"Question {message_id}",
+                ai_response=f"Answer {message_id}", created_at=STARTED))
+
+        assert [turn['id'] for turn in registry.get(1).turns] == [1, 2]
+        assert registry.get(2) is None
+
+
+@pytest.fixture
+def chat(app, monkeypatch):
+    """An active context with three turns and two memories, with empty caches."""
+    prompt_snapshots.invalidate()
+    memory_indexes.invalidate()
+    # Topic switch detection asks the language model
+    monkeypatch.setattr(conversation_context, 'detect_context_switch', lambda *args: (False, None))
+
+    context = ConversationContext(session_id='session', is_active=True, summary="Work stress.")
+    db.session.add(context)
+    db.session.commit()
+    for number in range(1, 4):
+        add_chat(context.id, number)
+    db.session.add_all([
+        ConversationMemoryItem(context_id=context.id, memory_type=memory_type, content=content)
+        for memory_type, content in [('fact', "Works as a nurse"), ('preference', "Short answers")]
+    ])
+    db.session.commit()
+    yield context.id
+    prompt_snapshots.invalidate()
+    memory_indexes.invalidate()
+
+
+def add_chat(context_id, number):
+    """Write a chat message of the context without touching the caches."""
+    chat_message = ChatHistory(session_id='session', user_message=f"Question {number}",
+                               ai_response=f"Answer {number}", context_id=context_id,
+                               created_at=STARTED + timedelta(minutes=number))
+    db.session.add(chat_message)
+    db.session.commit()
+    return chat_message
+
+
+@pytest.fixture
+def statements():
+    """SQL statements executed while the fixture is active."""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def turn(user_message="How do I relax?"):
+    return enhance_prompt_with_context(None, 'session', user_message, SYSTEM_PROMPT)
+
+
+class TestWarmTurn:
+    """Tests for enhance_prompt_with_context on a cached context."""
+
+    def test_context_state(self, chat):
+        state = fetch_context_state(None, 'session')
+
+        assert (state.context_id, state.summary, state.memory_count) == (chat, "Work stress.", 2)
+        assert state.last_message_id == ChatHistory.query.order_by(ChatHistory.id.desc()).first().id
+        assert fetch_context_state(None, 'other') is None
+
+    def test_warm_turn_is_one_query(self, chat, statements):
+        cold_prompt, context_id = turn()
+        cold = len(statements)
+        statements.clear()
+
+        warm_prompt, _ = turn()
+
+        assert context_id == chat
+        assert cold > 1
+        assert len(statements) == 1
+        assert warm_prompt == cold_prompt
+        assert "Work stress." in warm_prompt and "Works as a nurse" in warm_prompt
+
+    def test_message_added_in_this_process_keeps_the_turn_warm(self, chat, statements):
+        turn()
+        new_message = add_chat(chat, 4)
+        add_message_to_context(chat, new_message.id, extract_memories=False)
+        statements.clear()
+
+        prompt, _ = turn()
+
+        assert len(statements) == 1
+        assert "Question 4" in prompt
+
+    def test_message_from_another_process_reloads_the_snapshot(self, chat, statements):
+        turn()
+        snapshot = prompt_snapshots.get(chat)
+        # Written without message_added, as another worker would
+        add_chat(chat, 4)
+        statements.clear()
+
+        prompt, _ = turn()
+
+        assert prompt_snapshots.get(chat) is not snapshot
+        assert "Question 4" in prompt
+        assert len(statements) == 2
+
+    def test_recent_turns_are_capped(self, chat):
+        for number in range(4, 10):
+            add_chat(chat, number)
+
+        prompt, _ = turn()
+
+        snapshot = prompt_snapshots.get(chat)
+        assert len(snapshot.turns) == PROMPT_HISTORY_TURNS
+        assert "Question 9" in prompt and "Question 4" not in prompt
+
+    def test_summary_change_is_picked_up_without_reload(self, chat):
+        turn()
+        snapshot = prompt_snapshots.get(chat)
+        ConversationContext.query.filter_by(id=chat).update({'summary': "Sleep trouble."})
+        db.session.commit()
+
+        prompt, _ = turn()
+
+        assert prompt_snapshots.get(chat) is snapshot
+        assert "Sleep trouble." in prompt and "Work stress." not in prompt
@@ -0,0 +1,263 @@
+"""
+Unit tests for the shared provider circuit breaker and limiter.
+"""
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import api_fallback
+import provider_guard as guard_module
+from provider_guard import (ProviderGuard, CLOSED, OPEN, HALF_OPEN,
+                            REJECTED_CIRCUIT_OPEN, REJECTED_OVERLOADED)
+
+
+class FakeClock:
+    """Controllable replacement for the time module."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freeze the guard's clock and disable cooldown jitter."""
+    fake = FakeClock()
+    monkeypatch.setattr(guard_module, 'time', SimpleNamespace(time=fake.time))
+    monkeypatch.setattr(guard_module, 'jittered', lambda seconds: seconds)
+    return fake
+
+
+@pytest.fixture
+def guard_path(tmp_path):
+    """Path of a fresh shared state file."""
+    return str(tmp_path / 'provider_guard.sqlite3')
+
+
+def make_guard(path, **limits):
+    return ProviderGuard(path=path, limits={'claude': limits})
+
+
+class TestCircuitBreaker:
+    """Tests for the circuit breaker."""
+
+    def test_opens_after_consecutive_failures(self, clock, guard_path):
+        guard = make_guard(guard_path, failure_threshold=3, cooldown=30)
+
+        for _ in range(3):
+            lease_id, rejected = guard.acquire('claude')
+            assert rejected is None
+            guard.release('claude', lease_id, success=False)
+
+        assert guard.status('claude')['state'] == OPEN
+        assert guard.acquire('claude') == (None, REJECTED_CIRCUIT_OPEN)
+        assert guard.allows('claude') is False
+
+    def test_success_resets_failure_count(self, clock, guard_path):
+        guard = make_guard(guard_path, failure_threshold=2)
+
+        lease_id, _ = guard.acquire('claude')
+        guard.release('claude', lease_id, success=False)
+        lease_id, _ = guard.acquire('claude')
+        guard.release('claude', lease_id, success=True)
+        lease_id, _ = guard.acquire('claude')
+        guard.release('claude', lease_id, success=False)
+
+        assert guard.status('claude')['state'] == CLOSED
+
+    def test_half_open_allows_single_probe(self, clock, guard_path):
+        guard = make_guard(guard_path, failure_threshold=1, cooldown=30)
+        lease_id, _ = guard.acquire('claude')
+        guard.release('claude', lease_id, success=False)
+
+        clock.now += 31
+        probe_id, rejected = guard.acquire('claude')
+        assert rejected is None
+        assert guard.status('claude')['state'] == HALF_OPEN
+        assert guard.acquire('claude') == (None, REJECTED_CIRCUIT_OPEN)
+
+        guard.release('claude', probe_id, success=True)
+        assert guard.status('claude')['state'] == CLOSED
+        assert guard.acquire('claude')[1] is None
+
+    def test_failed_probe_doubles_cooldown(self, clock, guard_path):
+        guard = make_guard(guard_path, failure_threshold=1, cooldown=30, max_cooldown=45)
+        lease_id, _ = guard.acquire('claude')
+        guard.release('claude', lease_id, success=False)
+
+        clock.now += 31
+        probe_id, _ = guard.acquire('claude')
+        guard.release('claude', probe_id, success=False)
+
+        status = guard.status('claude')
+        assert status['state'] == OPEN
+        # Doubled to 60s, capped at max_cooldown
+        assert status['open_until'] == pytest.approx(clock.now + 45)
+
+    def test_abandoned_probe_allows_next_probe(self, clock, guard_path):
+        guard = make_guard(guard_path, failure_threshold=1, cooldown=30)
+        lease_id, _ = guard.acquire('claude')
+        guard.release('claude', lease_id, success=False)
+
+        clock.now += 31
+        probe_id, _ = guard.acquire('claude')
+        # The client disconnected before the probe finished
+        assert guard.release('claude', probe_id, success=None) == HALF_OPEN
+
+        assert guard.acquire('claude')[1] is None
+        assert guard.status('claude')['failures'] == 1
+
+    def test_state_is_shared_between_guards(self, clock, guard_path):
+        """Guards in different worker processes share the state file."""
+        worker_a = make_guard(guard_path, failure_threshold=2)
+        worker_b = make_guard(guard_path, failure_threshold=2)
+
+        lease_id, _ = worker_a.acquire('claude')
+        worker_a.release('claude', lease_id, success=False)
+        lease_id, _ = worker_b.acquire('claude')
+        worker_b.release('claude', lease_id, success=False)
+
+        assert worker_a.acquire('claude') == (None, REJECTED_CIRCUIT_OPEN)
+        assert worker_b.allows('claude') is False
+
+
+class TestLimiter:
+    """Tests for the token bucket and in-flight limit."""
+
+    def test_token_bucket_sheds_when_empty(self, clock, guard_path):
+        guard = make_guard(guard_path, rate=2.0, burst=3, max_concurrent=100)
+
+        for _ in range(3):
+            lease_id, rejected = guard.acquire('claude')
+            assert rejected is None
+            guard.release('claude', lease_id, success=True)
+        assert guard.acquire('claude') == (None, REJECTED_OVERLOADED)
+
+        # Half a second refills one token
+        clock.now += 0.5
+        assert guard.acquire('claude')[1] is None
+        assert guard.acquire('claude') == (None, REJECTED_OVERLOADED)
+
+    def test_concurrency_limit(self, clock, guard_path):
+        guard = make_guard(guard_path, max_concurrent=2, burst=100)
+
+        first, _ = guard.acquire('claude')
+        guard.acquire('claude')
+        assert guard.acquire('claude') == (None, REJECTED_OVERLOADED)
+
+        guard.release('claude', first, success=True)
+        assert guard.acquire('claude')[1] is None
+
+    def test_abandoned_call_returns_permit(self, clock, guard_path):
+        guard = make_guard(guard_path, max_concurrent=1, burst=100, failure_threshold=1)
+
+        lease_id, _ = guard.acquire('claude')
+        guard.release('claude', lease_id, success=None)
+
+        status = guard.status('claude')
+        assert status['in_flight'] == 0
+        assert status['state'] == CLOSED
+        assert guard.acquire('claude')[1] is None
+
+    def test_expired_leases_are_reclaimed(self, clock, guard_path):
+        guard = make_guard(guard_path, max_concurrent=1, burst=100, lease_seconds=60)
+
+        guard.acquire('claude')
+        assert guard.acquire('claude') == (None, REJECTED_OVERLOADED)
+
+        # The worker holding the lease died without releasing it
+        clock.now += 61
+        assert guard.acquire('claude')[1] is None
+
+    def test_providers_are_independent(self, clock, guard_path):
+        guard = make_guard(guard_path, max_concurrent=1)
+
+        guard.acquire('claude')
+        assert guard.acquire('claude') == (None, REJECTED_OVERLOADED)
+        assert guard.acquire('openai')[1] is None
+
+    def test_unusable_state_file_allows_calls(self, tmp_path):
+        guard = ProviderGuard(path=str(tmp_path / 'missing' / 'guard.sqlite3'))
+
+        lease_id, rejected = guard.acquire('claude')
+        assert lease_id is not None
+        assert rejected is None
+        assert guard.allows('claude') is True
+
+    def test_removed_state_file_is_recreated(self, clock, guard_path):
+        first = make_guard(guard_path, failure_threshold=1)
+        second = make_guard(guard_path, failure_threshold=1)
+        first.acquire('claude')
+        second.allows('claude')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(guard_path + suffix):
+                os.remove(guard_path + suffix)
+
+        lease_id, rejected = first.acquire('claude')
+        first.release('claude', lease_id, success=False)
+
+        assert rejected is None
+        assert os.path.exists(guard_path)
+        # Both guards use the new file, so the open circuit is shared again
+        assert second.allows('claude') is False
+
+
+class TestRetryWithGuard:
+    """Tests for with_retry_and_timeout with the shared guard."""
+
+    @pytest.fixture
+    def guard(self, clock, guard_path, monkeypatch):
+        guard = make_guard(guard_path, failure_threshold=2, cooldown=30)
+        monkeypatch.setattr(api_fallback, 'provider_guard', guard)
+        monkeypatch.setattr(api_fallback.time, 'sleep', lambda seconds: None)
+        return guard
+
+    def test_stops_retrying_when_circuit_opens(self, guard):
+        calls = []
+
+        @api_fallback.with_retry_and_timeout(retries=5, provider='claude')
+        def call_provider(timeout=None):
+            calls.append(timeout)
+            raise RuntimeError("upstream error 503")
+
+        with pytest.raises(api_fallback.APIResponseError):
+            call_provider()
+        assert len(calls) == 2
+
+        # Later calls are shed without reaching the provider
+        with pytest.raises(api_fallback.APICircuitOpenError):
+            call_provider()
+        assert len(calls) == 2
+
+    def test_sheds_when_overloaded(self, guard):
+        guard.limits['claude']['max_concurrent'] = 0
+
+        @api_fallback.with_retry_and_timeout(provider='claude')
+        def call_provider(timeout=None):
+            return 'ok'
+
+        with pytest.raises(api_fallback.APIOverloadedError):
+            call_provider()
+
+    def test_client_errors_do_not_open_circuit(self, guard):
+        class BadRequest(Exception):
+            status_code = 400
+
+        @api_fallback.with_retry_and_timeout(retries=3, provider='claude')
+        def call_provider(timeout=None):
+            raise BadRequest("invalid request")
+
+        with pytest.raises(api_fallback.APIResponseError):
+            call_provider()
+        assert guard.status('claude')['state'] == CLOSED
+
+    def test_provider_keyword_takes_precedence(self, guard):
+        @api_fallback.with_retry_and_timeout(retries=0, provider='claude')
+        def call_provider(provider=None, timeout=None):
+            return provider
+
+        assert call_provider(provider='openai') == 'openai'
+        assert guard.status('openai')['tokens'] < guard.limits_for('openai')['burst']
@@ -0,0 +1,132 @@
+"""
+Unit tests for query cache keys built from SQLAlchemy structural cache keys.
+"""
+import pytest
+from sqlalchemy import JSON, Column, Integer, String, create_engine, text
+from sqlalchemy.exc import CompileError
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.types import TypeDecorator
+
+from performance.cache_manager import CacheManager
+from performance.query_cache import QUERY_KEY_PREFIX, QueryCache
+
+Base = declarative_base()
+
+
+class Tag(TypeDecorator):
+    """Column type SQLAlchemy cannot build structural cache keys for."""
+    impl = String
+    cache_ok = False
+
+
+class Post(Base):
+    __tablename__ = 'posts'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String(64))
+    data = Column(JSON)
+    tag = Column(Tag(30))
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture
+def query_cache():
+    return QueryCache(manager=CacheManager())
+
+
+def key(query_cache, query, prefix='', include_params=True):
+    return query_cache._generate_query_key(query, prefix, include_params)
+
+
+class TestQueryKeys:
+    """Tests for _generate_query_key."""
+
+    def test_same_query_gives_same_key(self, session, query_cache):
+        first = key(query_cache, session.query(Post).filter(Post.user_id == 'a'))
+        second = key(query_cache, session.query(Post).filter(Post.user_id == 'a'))
+
+        assert first == second
+        assert first.startswith(QUERY_KEY_PREFIX)
+
+    def test_key_is_stable_across_instances(self, session, query_cache):
+        """Keys are shared through the L2 tier, so they must not depend on process state."""
+        query = session.query(Post).filter(Post.user_id == 'a').limit(5)
+
+        assert key(query_cache, query) == key(QueryCache(manager=CacheManager()), query)
+
+    def test_bound_values_change_key(self, session, query_cache):
+        assert (key(query_cache, session.query(Post).filter(Post.user_id == 'a'))
+                != key(query_cache, session.query(Post).filter(Post.user_id == 'b')))
+
+    def test_in_list_length_changes_key(self, session, query_cache):
+        keys = {
+            key(query_cache, session.query(Post).filter(Post.id.in_(ids)))
+            for ids in ([1, 2], [1, 2, 3], [1, 2, 3, 4])
+        }
+
+        assert len(keys) == 3
+
+    def test_limit_and_offset_change_key(self, session, query_cache):
+        query = session.query(Post).order_by(Post.id)
+        keys = {
+            key(query_cache, query.limit(10)),
+            key(query_cache, query.limit(20)),
+            key(query_cache, query.limit(10).offset(10)),
+        }
+
+        assert len(keys) == 3
+
+    def test_statement_shape_changes_key(self, session, query_cache):
+        assert (key(query_cache, session.query(Post).filter(Post.user_id == 'a'))
+                != key(query_cache, session.query(Post).filter(Post.user_id != 'a')))
+
+    def test_params_change_key_when_included(self, session, query_cache):
+        query = session.query(Post).filter(text('user_id = :owner'))
+        first, second = query.params(owner='a'), query.params(owner='b')
+
+        assert key(query_cache, first) != key(query_cache, second)
+        assert (key(query_cache, first, include_params=False)
+                == key(query_cache, second, include_params=False))
+
+    def test_prefix_changes_key(self, session, query_cache):
+        query = session.query(Post)
+
+        assert key(query_cache, query, 'recent') != key(query_cache, query, 'other')
+
+    def test_json_comparison(self, session, query_cache):
+        first = session.query(Post).filter(Post.data == {'mood': 'calm'})
+        second = session.query(Post).filter(Post.data == {'mood': 'anxious'})
+        # The keys used to be built from SQL compiled with literal binds
+        with pytest.raises(CompileError):
+            first.statement.compile(compile_kwargs={'literal_binds': True})
+
+        assert key(query_cache, first) != key(query_cache, second)
+
+    def test_uncacheable_statement_uses_compiled_params(self, session, query_cache):
+        first = session.query(Post).filter(Post.tag == 'a')
+        assert first.statement._generate_cache_key() is None
+
+        assert key(query_cache, first) == key(query_cache, session.query(Post).filter(Post.tag == 'a'))
+        assert key(query_cache, first) != key(query_cache, session.query(Post).filter(Post.tag == 'b'))
+
+
+def test_cache_query_round_trip(session, query_cache):
+    session.add_all([Post(id=1, user_id='a'), Post(id=2, user_id='b')])
+    session.commit()
+    query = session.query(Post).filter(Post.user_id == 'a')
+
+    assert [post.id for post in query_cache.cache_query(query)] == [1]
+    session.add(Post(id=3, user_id='a'))
+    session.commit()
+
+    # Served from the cache until invalidated
+    assert [post.id for post in query_cache.cache_query(query)] == [1]
+    query_cache.invalidate_for_model('Post')
+    assert [post.id for post in query_cache.cache_query(query)] == [1, 3]
@@ -0,0 +1,66 @@
+"""
+Unit tests for atomic usage quota increments across worker processes.
+"""
+import multiprocessing
+
+from conftest import make_app
+from database import db
+from models import Subscription, UsageQuota, User
+import subscription_manager
+
+# 180 increments race for 100 units of quota
+WORKERS = 6
+ATTEMPTS_PER_WORKER = 30
+QUOTA_LIMIT = 100
+
+
+def make_quota_app(database_path):
+    """Minimal app with the subscription manager's models set up."""
+    app = make_app(database_path)
+    subscription_manager.init_models(User, Subscription, UsageQuota)
+    return app
+
+
+def increment_worker(database_path, usage_id, start, results):
+    """Try to increment the shared counter, reporting accepted increments."""
+    app = make_quota_app(database_path)
+    accepted = 0
+    with app.app_context():
+        start.wait()
+        for _ in range(ATTEMPTS_PER_WORKER):
+            incremented, _ = subscription_manager._atomic_increment(
+                usage_id, 'messages_used_today', 1, QUOTA_LIMIT)
+            if incremented:
+                accepted += 1
+    results.put(accepted)
+
+
+def test_concurrent_processes_stop_at_limit(database_path):
+    app = make_quota_app(database_path)
+    with app.app_context():
+        db.create_all()
+        usage = UsageQuota(browser_session_id='session', messages_used_today=0)
+        db.session.add(usage)
+        db.session.commit()
+        usage_id = usage.id
+        db.engine.dispose()
+
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    results = context.Queue()
+    workers = [context.Process(target=increment_worker, args=(database_path, usage_id, start, results))
+               for _ in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    start.set()
+
+    accepted = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    with app.app_context():
+        final = db.session.get(UsageQuota, usage_id).messages_used_today
+
+    assert sum(accepted) == QUOTA_LIMIT
+    assert final == QUOTA_LIMIT
@@ -0,0 +1,123 @@
+"""
+Unit tests for the shared LLM response cache.
+"""
+import os
+
+import pytest
+
+from response_cache import ResponseCache, content_signature, normalize_text
+
+ANALYSIS = {'category': 'relationships', 'potential_origin': 'Past experiences with men'}
+RECOMMENDATION = {'technique': 'reframing', 'confidence': 0.8, 'explanation': 'Work stress'}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Cache in a fresh file."""
+    return ResponseCache(path=str(tmp_path / 'response_cache.sqlite3'))
+
+
+class TestExactMatches:
+    """Tests for lookups by normalized input."""
+
+    def test_normalized_text_hits(self, cache):
+        cache.put('analyze_belief', "I'm not good enough.", ANALYSIS)
+
+        assert cache.get('analyze_belief', "  i’m NOT good   enough!") == ANALYSIS
+
+    def test_context_must_match(self, cache):
+        cache.put('recommend_technique', "I feel stuck at work", RECOMMENDATION, context='sad')
+
+        assert cache.get('recommend_technique', "I feel stuck at work", context='Sad') == RECOMMENDATION
+        assert cache.get('recommend_technique', "I feel stuck at work", context='happy') is None
+
+    def test_namespaces_are_separate(self, cache):
+        cache.put('detect_language', "Bonjour tout le monde", 'fr')
+
+        assert cache.get('detect_language', "Bonjour tout le monde") == 'fr'
+        assert cache.get('analyze_belief', "Bonjour tout le monde") is None
+
+
+class TestNearDuplicates:
+    """Tests for near-duplicate hits and near misses."""
+
+    def test_rewording_hits(self, cache):
+        cache.put('recommend_technique', "I feel stuck at work", RECOMMENDATION, context='sad')
+
+        assert cache.get('recommend_technique', "I feel stuck at my work", context='sad') == RECOMMENDATION
+        assert cache.stats()['namespaces']['recommend_technique']['similar_hits'] == 1
+
+    @pytest.mark.parametrize('stored, asked', [
+        ("I can never trust men", "I can never trust women"),
+        ("I am good enough", "I am not good enough"),
+        ("I feel stuck at work", "I feel stuck at home"),
+        ("I'm anxious about my exam", "I'm excited about my exam"),
+        ("I always fail at everything", "I always fail at all of everything"),
+    ])
+    def test_near_misses_do_not_hit(self, cache, stored, asked):
+        cache.put('recommend_technique', stored, RECOMMENDATION, context='sad')
+
+        assert cache.get('recommend_technique', asked, context='sad') is None
+
+    @pytest.mark.parametrize('stored, asked', [
+        ("I can never trust men", "I can never trust women"),
+        ("I never finish anything I start", "I never finish anything that I start"),
+    ])
+    def test_beliefs_only_hit_exactly(self, cache, stored, asked):
+        cache.put('analyze_belief', stored, ANALYSIS)
+
+        assert cache.get('analyze_belief', asked) is None
+        assert cache.get('analyze_belief', stored) == ANALYSIS
+
+    def test_content_signature_ignores_function_words(self):
+        assert content_signature(normalize_text("I'm stuck at my work")) == 'stuck work'
+        assert content_signature(normalize_text("I can't trust men")) == "can't men trust"
+
+
+class TestStorage:
+    """Tests for expiry, the byte bound and failures."""
+
+    def test_expired_entries_miss(self, tmp_path):
+        cache = ResponseCache(path=str(tmp_path / 'cache.sqlite3'),
+                              policies={'detect_language': {'ttl': -1, 'similarity': None}})
+        cache.put('detect_language', "Hola a todos", 'es')
+
+        assert cache.get('detect_language', "Hola a todos") is None
+
+    def test_least_recently_used_entries_are_evicted(self, tmp_path):
+        cache = ResponseCache(path=str(tmp_path / 'cache.sqlite3'), max_bytes=4000)
+        for number in range(50):
+            cache.put('detect_language', f"text number {number}", 'en')
+
+        assert cache.get('detect_language', "text number 49") == 'en'
+        assert cache.get('detect_language', "text number 0") is None
+        assert cache.stats()['evictions'] > 0
+
+    def test_unusable_file_misses(self, tmp_path):
+        cache = ResponseCache(path=str(tmp_path / 'missing' / 'cache.sqlite3'))
+        cache.put('detect_language', "Hallo zusammen", 'de')
+
+        assert cache.get('detect_language', "Hallo zusammen") is None
+        assert cache.stats()['namespaces']['detect_language']['errors'] == 1
+
+    def test_removed_file_is_recreated(self, tmp_path):
+        path = str(tmp_path / 'cache.sqlite3')
+        cache = ResponseCache(path=path)
+        cache.put('detect_language', "Hallo zusammen", 'de')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+        assert cache.get('detect_language', "Hallo zusammen") is None
+        cache.put('detect_language', "Hallo zusammen", 'de')
+
+        assert cache.get('detect_language', "Hallo zusammen") == 'de'
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        assert cache.stats()['namespaces']['detect_language']['errors'] == 0
+
+    def test_hit_rate(self, cache):
+        cache.put('detect_language', "Ciao a tutti", 'it')
+        cache.get('detect_language', "Ciao a tutti")
+        cache.get('detect_language', "Olá a todos")
+
+        assert cache.stats()['namespaces']['detect_language']['hit_rate'] == 0.5
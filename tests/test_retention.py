@@ -0,0 +1,123 @@
+"""
+Unit tests for retention cohorts computed from activity bitmaps.
+"""
+import datetime
+
+import pytest
+
+from database import db
+from models import User, ChatHistory, AnalyticsUserActivity
+from analytics import retention
+from analytics import rollups  # noqa: F401 - maintains the activity bitmaps
+from analytics.retention import get_retention_cohorts, invalidate_retention_cache, period_mask
+
+ORIGIN = datetime.date(2024, 3, 1)
+
+
+def day(offset):
+    """Day offset days after ORIGIN, at noon."""
+    return datetime.datetime.combine(ORIGIN, datetime.time(12)) + datetime.timedelta(days=offset)
+
+
+def cohorts(period, now_offset):
+    return get_retention_cohorts(day(0).replace(hour=0), period, now=day(now_offset))
+
+
+@pytest.fixture
+def activity(app):
+    """
+    Users by signup day with the days they chatted on:
+
+        a  signed up day 0, active on days 0 and 7
+        b  signed up day 0, active on day 0
+        c  signed up day 1, active on day 2
+        d  signed up day 4, never active
+        e  signed up day 8, active on day 15
+    """
+    invalidate_retention_cache()
+    signups = {'a': 0, 'b': 0, 'c': 1, 'd': 4, 'e': 8}
+    db.session.add_all([
+        User(id=user_id, email=f"{user_id}@example.com", created_at=day(offset))
+        for user_id, offset in signups.items()
+    ])
+    db.session.commit()
+    db.session.add_all([
+        ChatHistory(user_id=user_id, session_id=f"{user_id}-{offset}", user_message="Hello",
+                    ai_response="Hi", created_at=day(offset))
+        for user_id, offset in [('a', 0), ('a', 7), ('b', 0), ('c', 2), ('e', 15)]
+    ])
+    db.session.commit()
+    yield
+    invalidate_retention_cache()
+
+
+def test_period_masks():
+    assert period_mask(0, 1) == 0b1
+    assert period_mask(7, 1) == 1 << 7
+    assert period_mask(0, 7) == 0b1111111
+    assert period_mask(1, 7) == 0b1111111 << 7
+
+
+def test_activity_bitmaps(activity):
+    bits = {row.user_id: row.activity_bits for row in AnalyticsUserActivity.query.all()}
+
+    assert bits == {'a': 1 | 1 << 7, 'b': 1, 'c': 1 << 1, 'd': 0, 'e': 1 << 7}
+
+
+def test_daily_cohorts(activity):
+    result = cohorts('day', 20)
+
+    assert result['weeks'] == [f"Day {n}" for n in range(1, 9)]
+    assert result['cohorts'][:2] == ['Mar 01', 'Mar 02']
+    assert result['sizes'] == [2, 1, 0, 0, 1, 0, 0, 0]
+    # a and b on day 1, only a on day 8
+    assert result['data'][0] == [100.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 50.0]
+    # c signed up the day before being active
+    assert result['data'][1] == [0.0, 100.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    assert result['data'][4] == [0.0] * 8
+    assert result['data'][2] == ['-'] * 8
+
+
+def test_weekly_cohorts(activity):
+    result = cohorts('week', 20)
+
+    assert result['weeks'] == ['Week 1', 'Week 2']
+    assert result['sizes'] == [4, 1]
+    # a, b and c in their first week, only a in the second
+    assert result['data'][0] == [75.0, 25.0]
+    # e signed up on day 8 and came back a week later
+    assert result['data'][1] == [0.0, 100.0]
+
+
+def test_periods_not_started_are_dashes(activity):
+    result = cohorts('day', 5)
+
+    assert len(result['weeks']) == 5
+    assert result['data'][0] == [100.0, 0.0, 0.0, 0.0, 0.0]
+    # Day 4 signups have only had their first two days
+    assert result['data'][4] == [0.0, 0.0, '-', '-', '-']
+
+
+def test_final_cohorts_are_reused_on_refresh(activity, monkeypatch):
+    monkeypatch.setattr(retention, 'RETENTION_REFRESH_SECONDS', 0)
+    first = cohorts('day', 11)
+
+    # Rewrite the bitmaps behind the cache: b (day 0, final) and d (day 4, still open)
+    for user_id in ('b', 'd'):
+        AnalyticsUserActivity.query.filter_by(user_id=user_id).update({'activity_bits': 1 << 1})
+    db.session.commit()
+    refreshed = cohorts('day', 11)
+
+    assert refreshed['data'][0] == first['data'][0]
+    assert refreshed['data'][4][:2] == [0.0, 100.0]
+
+    invalidate_retention_cache()
+    assert cohorts('day', 11)['data'][0][:2] == [50.0, 50.0]
+
+
+def test_cached_table_is_served_until_refresh_interval(activity):
+    first = cohorts('day', 20)
+    AnalyticsUserActivity.query.filter_by(user_id='d').update({'activity_bits': 1})
+    db.session.commit()
+
+    assert cohorts('day', 20) == first
@@ -0,0 +1,168 @@
+"""
+Unit tests for the analytics rollup hooks and their backfill.
+"""
+import datetime
+
+import pytest
+
+from database import db
+from models import (
+    User, ChatHistory, TechniqueEffectiveness,
+    AnalyticsDailyActivity, AnalyticsUserDay, AnalyticsUserActivity, AnalyticsSessionRollup,
+    AnalyticsTechniqueDaily, AnalyticsRatingDaily
+)
+from analytics.rollups import backfill_rollups
+
+DAY_1 = datetime.date(2024, 3, 1)
+DAY_2 = datetime.date(2024, 3, 2)
+
+
+def at(day, hour, minute=0):
+    return datetime.datetime.combine(day, datetime.time(hour, minute))
+
+
+def chat(session_id, created_at, user_id=None, technique=None, mood=None):
+    return ChatHistory(user_id=user_id, session_id=session_id, user_message="Hello",
+                       ai_response="Hi", created_at=created_at, nlp_technique=technique, mood=mood)
+
+
+def rating(technique, value, entry_date):
+    return TechniqueEffectiveness(session_id='rated', technique=technique, rating=value,
+                                  entry_date=entry_date)
+
+
+@pytest.fixture
+def history(app):
+    """Two users chatting over two days, one anonymous session and a few ratings."""
+    db.session.add_all([
+        User(id='u1', email='u1@example.com', created_at=at(DAY_1, 9)),
+        User(id='u2', email='u2@example.com', created_at=at(DAY_2, 7)),
+    ])
+    db.session.commit()
+    db.session.add_all([
+        chat('s1', at(DAY_1, 10), 'u1', 'reframing', 'anxious'),
+        chat('s1', at(DAY_1, 10, 5), 'u1'),
+        chat('s2', at(DAY_2, 8), 'u1', 'reframing'),
+        chat('s3', at(DAY_2, 9), 'u2', 'anchoring', 'calm'),
+        chat('s4', at(DAY_2, 12)),
+        rating('reframing', 4, at(DAY_1, 11)),
+        rating('reframing', 4, at(DAY_1, 12)),
+        rating('anchoring', 2, at(DAY_2, 10)),
+    ])
+    db.session.commit()
+
+
+def snapshot():
+    """Every rollup row, as comparable tuples."""
+    db.session.expire_all()
+    return {
+        'daily': {
+            row.day: (row.messages, row.sessions_started, row.active_users, row.new_users)
+            for row in AnalyticsDailyActivity.query.all()
+        },
+        'user_days': {(row.day, row.user_id) for row in AnalyticsUserDay.query.all()},
+        'activity': {
+            row.user_id: (row.signup_day, row.activity_bits)
+            for row in AnalyticsUserActivity.query.all()
+        },
+        'sessions': {
+            row.session_id: (row.user_id, row.started_at, row.last_message_at, row.messages)
+            for row in AnalyticsSessionRollup.query.all()
+        },
+        'techniques': {
+            (row.day, row.technique, row.mood): row.uses for row in AnalyticsTechniqueDaily.query.all()
+        },
+        'ratings': {
+            (row.day, row.technique, row.rating): row.ratings for row in AnalyticsRatingDaily.query.all()
+        },
+    }
+
+
+def clear_rollups():
+    for model in (AnalyticsDailyActivity, AnalyticsUserDay, AnalyticsUserActivity,
+                  AnalyticsSessionRollup, AnalyticsTechniqueDaily, AnalyticsRatingDaily):
+        model.query.delete()
+    db.session.commit()
+
+
+class TestHooks:
+    """Tests for the rollups written alongside chat, rating and user rows."""
+
+    def test_daily_activity(self, history):
+        # (messages, sessions started, active users, new users)
+        assert snapshot()['daily'] == {
+            DAY_1: (2, 1, 1, 1),
+            DAY_2: (3, 3, 2, 1),
+        }
+
+    def test_sessions(self, history):
+        sessions = snapshot()['sessions']
+
+        assert sessions['s1'] == ('u1', at(DAY_1, 10), at(DAY_1, 10, 5), 2)
+        assert sessions['s4'] == (None, at(DAY_2, 12), at(DAY_2, 12), 1)
+        assert len(sessions) == 4
+
+    def test_techniques_and_ratings(self, history):
+        rollups = snapshot()
+
+        assert rollups['techniques'] == {
+            (DAY_1, 'reframing', 'anxious'): 1,
+            (DAY_2, 'reframing', ''): 1,
+            (DAY_2, 'anchoring', 'calm'): 1,
+        }
+        assert rollups['ratings'] == {
+            (DAY_1, 'reframing', 4): 2,
+            (DAY_2, 'anchoring', 2): 1,
+        }
+
+    def test_user_days_and_activity_bitmaps(self, history):
+        rollups = snapshot()
+
+        assert rollups['user_days'] == {(DAY_1, 'u1'), (DAY_2, 'u1'), (DAY_2, 'u2')}
+        assert rollups['activity'] == {'u1': (DAY_1, 0b11), 'u2': (DAY_2, 0b1)}
+
+    def test_late_message_moves_session_start(self, history):
+        db.session.add(chat('s1', at(DAY_1, 9, 30), 'u1'))
+        db.session.commit()
+
+        assert snapshot()['sessions']['s1'] == ('u1', at(DAY_1, 9, 30), at(DAY_1, 10, 5), 3)
+
+    def test_rolled_back_write_leaves_rollups_unchanged(self, history):
+        before = snapshot()
+        db.session.add(chat('s5', at(DAY_2, 13), 'u2', 'reframing'))
+        db.session.flush()
+        db.session.rollback()
+
+        assert snapshot() == before
+
+
+class TestBackfill:
+    """Tests for rebuilding the rollups from the source tables."""
+
+    def test_reproduces_incremental_rollups(self, history):
+        incremental = snapshot()
+        clear_rollups()
+
+        stats = backfill_rollups(DAY_1, DAY_2)
+
+        assert stats['days'] == 2
+        assert stats['sessions'] == 4
+        assert stats['users'] == 2
+        assert snapshot() == incremental
+
+    def test_is_idempotent(self, history):
+        incremental = snapshot()
+
+        backfill_rollups(DAY_1, DAY_2)
+        backfill_rollups(DAY_1, DAY_2)
+
+        assert snapshot() == incremental
+
+    def test_rebuilds_one_day_only(self, history):
+        incremental = snapshot()
+        AnalyticsDailyActivity.query.delete()
+        db.session.commit()
+
+        backfill_rollups(DAY_2, DAY_2)
+
+        assert snapshot()['daily'] == {DAY_2: incremental['daily'][DAY_2]}